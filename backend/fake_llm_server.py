@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+离线LLM服务启动脚本
+兼容OpenAI chat completions接口，用于压测和无网络环境；支持录制真实流量并确定性回放
+
+把config.json中某个llm提供商的url改为 http://127.0.0.1:8010/v1 即可让后端使用本服务
+"""
+import sys
+import os
+import json
+import argparse
+import uvicorn
+
+# 添加backend目录到路径
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(SCRIPT_DIR)
+
+from src.utils.fake_llm_server import create_app, MODE_FAKE, MODE_RECORD, MODE_REPLAY
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="离线LLM服务（OpenAI兼容）")
+    parser.add_argument("--mode", choices=[MODE_FAKE, MODE_RECORD, MODE_REPLAY], default=MODE_FAKE,
+                        help="fake: 生成模拟响应; record: 转发到上游并录制; replay: 回放录制文件")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--tape", help="录制文件路径（JSONL，record和replay模式必填）")
+    parser.add_argument("--upstream", help="record模式的上游地址，如 https://api.openai.com/v1")
+    parser.add_argument("--upstream-key", default=os.environ.get("UPSTREAM_API_KEY"), help="上游API Key（默认读取UPSTREAM_API_KEY）")
+    parser.add_argument("--latency-config", help="延迟分布配置文件（JSON，任务名 -> 分布）")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="延迟缩放系数，0表示不等待")
+    parser.add_argument("--seed", type=int, help="随机种子，固定后延迟序列可复现")
+    parser.add_argument("--no-replay-latency", action="store_true", help="replay模式不按录制时的延迟等待")
+    return parser.parse_args()
+
+
+def main():
+    """主函数 - 启动离线LLM服务"""
+    args = parse_args()
+    
+    latency = None
+    if args.latency_config:
+        with open(args.latency_config, "r", encoding="utf-8") as f:
+            latency = json.load(f)
+    
+    try:
+        app = create_app(
+            mode=args.mode,
+            tape_path=args.tape,
+            upstream_url=args.upstream,
+            upstream_api_key=args.upstream_key,
+            latency=latency,
+            latency_scale=args.latency_scale,
+            seed=args.seed,
+            replay_latency=not args.no_replay_latency
+        )
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    
+    print("=" * 60)
+    print(f"🤖 离线LLM服务 - 模式: {args.mode}")
+    print(f"🌐 接口地址: http://{args.host}:{args.port}/v1")
+    if args.tape:
+        print(f"📼 录制文件: {args.tape}")
+    print("=" * 60)
+    
+    try:
+        uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    except KeyboardInterrupt:
+        print("\n👋 离线LLM服务已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -88,6 +88,24 @@ def create_app() -> FastAPI:
             logger.error(f"❌ 数据迁移异常: {migration_error}")
             logger.warning("⚠️ 应用将继续运行")
         
+        # 启动后台任务工作协程（上次退出时未完成的任务会重新执行）
+        try:
+            from .services.background_job_service import background_job_service
+            if background_job_service.enabled:
+                background_job_service.start()
+                logger.info("✅ 后台任务队列已启动")
+        except Exception as e:
+            logger.error(f"❌ 启动后台任务队列失败: {e}")
+        
+        # 启动消息日志的后台刷写（写后模式，重放上次退出时未写入的消息）
+        try:
+            from .services.message_journal import message_journal
+            if message_journal.enabled:
+                message_journal.start()
+                logger.info("✅ 消息日志写后模式已启动")
+        except Exception as e:
+            logger.error(f"❌ 启动消息日志失败: {e}")
+        
         logger.info("✅ 应用启动事件完成")
     
     # 应用关闭事件
@@ -96,6 +114,15 @@ def create_app() -> FastAPI:
         """应用关闭时的清理任务"""
         logger.info("👋 应用正在关闭...")
         # 这里可以添加数据库连接池关闭等清理操作
+        from .services.background_job_service import background_job_service
+        await background_job_service.stop()
+        from .services.message_journal import message_journal
+        await message_journal.stop()
+        from .utils.llm_gateway import llm_gateway
+        await llm_gateway.aclose()
+        # 消息写后队列刷写完成后再关闭异步引擎的连接池
+        from .database.config import dispose_async_engine
+        await dispose_async_engine()
         logger.info("✅ 应用关闭事件完成")
     
     # CORS配置
@@ -19,8 +19,8 @@ class DebugController:
     
     def __init__(self):
         self.state_service = StateService()
-        from ..services.npc_service import NPCService
-        self.npc_service = NPCService()
+        from ..services.npc_service import npc_service
+        self.npc_service = npc_service
     
     def get_workflow_info(self) -> Dict[str, Any]:
         """
@@ -75,8 +75,7 @@ class DebugController:
             位置信息
         """
         try:
-            from ..services.location_db_service import LocationDBService
-            location_db_service = LocationDBService()
+            from ..services.location_db_service import location_db_service
             
             result = location_db_service.get_locations_by_story(story_id)
             if result.get("success"):
@@ -255,7 +254,7 @@ class DebugController:
     
     def reset_session(self, session_id: str = "default") -> Dict[str, str]:
         """
-        重置会话 - 缓存功能已移除
+        重置会话 - 清除会话状态缓存，下次请求时从数据库恢复
         
         Args:
             session_id: 会话ID
@@ -265,7 +264,7 @@ class DebugController:
         """
         try:
             self.state_service.clear_session(session_id)
-            return {"message": f"重置会话请求已处理 (缓存功能已移除，如需清除数据请操作数据库)"}
+            return {"message": f"会话 {session_id} 的状态缓存已清除，下次请求时从数据库恢复"}
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"重置会话失败: {str(e)}")
     
@@ -282,4 +281,43 @@ class DebugController:
                 "note": "系统现在完全依赖数据库存储，不再维护内存缓存"
             }
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"获取所有会话失败: {str(e)}") 
\ No newline at end of file
+            raise HTTPException(status_code=500, detail=f"获取所有会话失败: {str(e)}")
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        获取运行时性能统计
+        
+        Returns:
+            各子系统的统计信息
+        """
+        try:
+            from ..services.action_router_service import ActionRouterService
+            from ..utils.llm_cache import llm_cache
+            from ..utils.llm_gateway import llm_gateway
+            from ..services.dialogue_summary_service import dialogue_summary_service
+            from ..utils.time_estimator import time_estimator
+            from ..services.destination_resolver import destination_resolver
+            from ..utils.llm_telemetry import llm_telemetry
+            from ..services.arrival_prefetcher import arrival_prefetcher
+            from ..services.background_job_service import background_job_service
+            from ..services.message_journal import message_journal
+            from ..services.entity_id_cache import entity_id_cache
+            return {
+                "routing": ActionRouterService.get_routing_metrics(),
+                "llm_cache": llm_cache.get_stats(),
+                "llm_gateway": llm_gateway.get_stats(),
+                "llm_providers": llm_gateway.pool.get_stats(),
+                "dialogue_summary": dialogue_summary_service.get_stats(),
+                "time_estimation": time_estimator.get_stats(),
+                "destination_resolver": destination_resolver.get_stats(),
+                "llm_telemetry": llm_telemetry.get_stats(recent=0),
+                "arrival_prefetch": arrival_prefetcher.get_stats(),
+                "background_jobs": background_job_service.get_stats(),
+                "state_cache": self.state_service.get_cache_stats(),
+                "session_snapshots": self.state_service.snapshot_service.get_stats(),
+                "message_journal": message_journal.get_stats(),
+                "entity_id_cache": entity_id_cache.get_stats(),
+                "timestamp": datetime.now().isoformat()
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"获取性能统计失败: {str(e)}")
@@ -1,11 +1,23 @@
 """
 游戏控制器 - 处理游戏相关的HTTP请求
 """
+import math
 from typing import Dict, Any, List
 from fastapi import HTTPException
 from fastapi.responses import StreamingResponse
 
 from ..services.game_service import GameService
+from ..utils.llm_admission import LLMOverloadedError
+from ..utils.llm_telemetry import llm_telemetry
+
+
+def overloaded_exception(error: LLMOverloadedError) -> HTTPException:
+    """LLM过载时返回503，并通过Retry-After告知客户端何时重试"""
+    return HTTPException(
+        status_code=503,
+        detail=str(error),
+        headers={"Retry-After": str(math.ceil(error.retry_after))}
+    )
 
 
 class GameController:
@@ -48,7 +60,13 @@ class GameController:
             print(f"  🆔 会话ID: {session_id}")
             print(f"  📚 故事ID: {story_id}")
             
-            result = await self.game_service.process_action(action, session_id, story_id)
+            if llm_telemetry.debug:
+                # 调试模式下附带本次行动的LLM调用明细
+                with llm_telemetry.capture() as llm_calls:
+                    result = await self.game_service.process_action(action, session_id, story_id)
+                result["llm_calls"] = llm_telemetry.summarize_calls(llm_calls)
+            else:
+                result = await self.game_service.process_action(action, session_id, story_id)
             
             print(f"✅ [后端] 行动处理完成:")
             print(f"  📊 返回结果: {result}")
@@ -56,35 +74,45 @@ class GameController:
             print(f"  💬 对话历史内容: {result.get('dialogue_history', [])}")
             
             return result
+        except LLMOverloadedError as e:
+            print(f"🚦 [后端] LLM服务过载，拒绝行动: {e}")
+            raise overloaded_exception(e)
         except Exception as e:
             print(f"❌ [后端] 处理行动时出错: {e}")
             return {"error": str(e)}
     
-    async def stream_action(self, action: str, session_id: str = "default") -> StreamingResponse:
+    async def stream_action(self, action: str, session_id: str = "default", story_id: int = None) -> StreamingResponse:
         """
-        流式处理玩家行动
+        流式处理玩家行动（SSE）
         
         Args:
             action: 玩家行动
             session_id: 会话ID
+            story_id: 故事ID
             
         Returns:
             流式响应
         """
         try:
+            # 过载时在建立流之前返回503，而不是推送error事件
+            self.game_service.check_capacity()
+            
             async def generate_stream():
-                async for chunk in self.game_service.stream_action(action, session_id):
+                async for chunk in self.game_service.stream_action(action, session_id, story_id):
                     yield chunk
             
             return StreamingResponse(
                 generate_stream(),
-                media_type="text/plain",
+                media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
                     "Connection": "keep-alive",
-                    "Content-Type": "text/event-stream"
+                    # 关闭反向代理缓冲，保证事件逐条送达
+                    "X-Accel-Buffering": "no"
                 }
             )
+        except LLMOverloadedError as e:
+            raise overloaded_exception(e)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"流式处理失败: {str(e)}")
     
@@ -142,7 +170,11 @@ class GameController:
         story_id: int, 
         session_id: str = None,
         limit: int = 100,
-        offset: int = 0
+        offset: int = 0,
+        after: str = None,
+        before: str = None,
+        latest: bool = False,
+        include_total: bool = True
     ) -> Dict[str, Any]:
         """
         获取故事的消息历史
@@ -153,33 +185,42 @@ class GameController:
             session_id: 会话ID（可选）
             limit: 限制返回数量
             offset: 偏移量
+            after: 游标，获取该游标之后的消息
+            before: 游标，获取该游标之前的消息
+            latest: 不指定游标时从最新的消息开始向前分页
+            include_total: 是否返回总数
             
         Returns:
             消息历史数据
+        
+        Raises:
+            HTTPException: 游标无效时为400，查询失败时为500
         """
         try:
             print(f"🔍 [GameController] 获取故事消息历史 - 用户ID: {user_id}, 故事ID: {story_id}, 会话: {session_id or 'ALL'}")
             
-            # 调用MessageService获取消息
-            from ..services.message_service import MessageService
-            message_service = MessageService()
+            # 调用MessageService获取消息（写后模式下先写入队列中的消息，保证读到最新记录）
+            # 使用全局实例，消息总数缓存在请求之间共享
+            from ..services.message_service import message_service
+            from ..services.message_journal import message_journal
+            if message_journal.enabled:
+                await message_journal.flush()
             
             result = await message_service.get_story_messages(
                 user_id=user_id,
                 story_id=story_id,
                 session_id=session_id,
                 limit=limit,
-                offset=offset
+                offset=offset,
+                after=after,
+                before=before,
+                latest=latest,
+                include_total=include_total
             )
             
             if "error" in result:
                 print(f"❌ [GameController] 获取故事消息失败: {result['error']}")
-                return {
-                    "success": False,
-                    "error": result["error"],
-                    "messages": [],
-                    "total_count": 0
-                }
+                raise HTTPException(status_code=500, detail=f"获取故事消息失败: {result['error']}")
             
             print(f"✅ [GameController] 获取故事消息成功 - 消息数: {len(result['messages'])}, 总数: {result['total_count']}")
             
@@ -188,11 +229,12 @@ class GameController:
                 "data": result
             }
             
+        except HTTPException:
+            raise
+        except ValueError as e:
+            # 游标无效属于请求参数错误
+            print(f"⚠️ [GameController] 获取故事消息参数无效: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
         except Exception as e:
             print(f"❌ [GameController] 获取故事消息异常: {e}")
-            return {
-                "success": False,
-                "error": f"获取故事消息失败: {str(e)}",
-                "messages": [],
-                "total_count": 0
-            } 
\ No newline at end of file
+            raise HTTPException(status_code=500, detail=f"获取故事消息失败: {str(e)}") 
\ No newline at end of file
@@ -4,14 +4,14 @@ LLM控制器 - 处理LLM相关的HTTP请求
 from typing import Dict, Any
 from fastapi import HTTPException
 
-from ..services.llm_service import LLMService
+from ..services.llm_service import llm_service
 
 
 class LLMController:
     """LLM控制器类"""
     
     def __init__(self):
-        self.llm_service = LLMService()
+        self.llm_service = llm_service
     
     def get_available_models(self) -> Dict[str, Dict[str, str]]:
         """
@@ -70,6 +70,76 @@ class LLMController:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"重置LLM实例失败: {str(e)}")
     
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """
+        获取LLM响应缓存统计
+        
+        Returns:
+            缓存统计
+        """
+        try:
+            from ..utils.llm_cache import llm_cache
+            return llm_cache.get_stats()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"获取缓存统计失败: {str(e)}")
+    
+    def clear_cache(self) -> Dict[str, str]:
+        """
+        清空LLM响应缓存
+        
+        Returns:
+            清空结果
+        """
+        try:
+            from ..utils.llm_cache import llm_cache
+            llm_cache.clear()
+            return {"message": "LLM响应缓存已清空"}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"清空缓存失败: {str(e)}")
+    
+    def get_metrics(self, recent: int = 20) -> Dict[str, Any]:
+        """
+        获取LLM调用遥测
+        
+        Args:
+            recent: 附带的最近调用条数
+            
+        Returns:
+            按提示词模板、模型和提供商汇总的延迟、排队时间、token用量和调用结果
+        """
+        try:
+            from ..utils.llm_telemetry import llm_telemetry
+            return llm_telemetry.get_stats(recent)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"获取LLM调用遥测失败: {str(e)}")
+    
+    def reset_metrics(self) -> Dict[str, str]:
+        """
+        清空LLM调用遥测
+        
+        Returns:
+            清空结果
+        """
+        try:
+            from ..utils.llm_telemetry import llm_telemetry
+            llm_telemetry.reset()
+            return {"message": "LLM调用遥测已清空"}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"清空LLM调用遥测失败: {str(e)}")
+    
+    def get_provider_stats(self) -> Dict[str, Any]:
+        """
+        获取LLM提供商池统计
+        
+        Returns:
+            各提供商的延迟、错误率和熔断状态
+        """
+        try:
+            from ..utils.llm_gateway import llm_gateway
+            return llm_gateway.pool.get_stats()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"获取提供商统计失败: {str(e)}")
+    
     def get_llm_config(self, model_name: str = "gemini") -> Dict[str, str]:
         """
         获取LLM配置
@@ -3,7 +3,10 @@
 """
 import json
 import os
-from typing import Dict, Any
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, TypeVar
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
@@ -26,6 +29,10 @@ def get_database_url() -> str:
     
     return f"postgresql://{db_config.get('user', 'charlie')}:{db_config.get('password', '123456')}@{db_config.get('host', 'localhost')}:{db_config.get('port', 5432)}/{db_config.get('database', 'role_play')}"
 
+def get_async_database_url() -> str:
+    """获取异步数据库连接URL（asyncpg驱动）"""
+    return get_database_url().replace("postgresql://", "postgresql+asyncpg://", 1)
+
 # 加载配置
 config = load_config()
 db_config = config.get("db", {})
@@ -47,6 +54,16 @@ engine = create_engine(
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 异步数据库引擎和会话工厂（首次使用时创建，供async代码路径使用）
+_async_engine = None
+_AsyncSessionLocal = None
+
+# 仍需使用同步引擎的调用放到有界线程池中执行，避免阻塞事件循环
+DB_THREAD_POOL_SIZE = int(db_config.get("thread_pool_size", 8))
+_db_executor = ThreadPoolExecutor(max_workers=DB_THREAD_POOL_SIZE, thread_name_prefix="db")
+
+T = TypeVar("T")
+
 # 创建ORM基类
 Base = declarative_base()
 
@@ -66,6 +83,51 @@ def get_engine():
     """获取数据库引擎"""
     return engine
 
+def get_async_engine():
+    """获取异步数据库引擎（首次调用时创建，连接池参数与同步引擎一致）"""
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        _async_engine = create_async_engine(
+            get_async_database_url(),
+            pool_size=10,
+            max_overflow=20,
+            pool_pre_ping=True,
+            echo=False
+        )
+    return _async_engine
+
+async def dispose_async_engine():
+    """关闭异步引擎的连接池（应用关闭时调用，未创建过引擎时不做任何事）"""
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        _AsyncSessionLocal = None
+
+def get_async_session():
+    """获取异步数据库会话（用于服务层在async代码中直接调用）"""
+    global _AsyncSessionLocal
+    if _AsyncSessionLocal is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        _AsyncSessionLocal = async_sessionmaker(bind=get_async_engine(), autoflush=False, expire_on_commit=False)
+    return _AsyncSessionLocal()
+
+async def run_in_db_thread(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    在数据库线程池中执行同步数据库调用
+    
+    Args:
+        func: 同步函数
+        *args: 位置参数
+        **kwargs: 关键字参数
+        
+    Returns:
+        函数返回值
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+
 def test_connection():
     """测试数据库连接"""
     try:
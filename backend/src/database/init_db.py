@@ -293,7 +293,7 @@ def validate_table_structure(engine):
         inspector = inspect(engine)
         
         # 验证每个表的字段和索引
-        tables_to_verify = ['users', 'stories', 'locations', 'npcs', 'message_types', 'entity_types', 'entities', 'messages']
+        tables_to_verify = ['users', 'stories', 'locations', 'npcs', 'message_types', 'entity_types', 'entities', 'messages', 'dialogue_summaries', 'background_jobs', 'game_sessions']
         
         for table_name in tables_to_verify:
             if table_name in inspector.get_table_names():
@@ -318,6 +318,31 @@ def validate_table_structure(engine):
     except Exception as e:
         print(f"❌ 表结构验证失败: {e}")
 
+def ensure_indexes(engine):
+    """
+    为已存在的表补建模型中新增的索引（create_all只为新建的表创建索引，
+    如消息表的游标分页索引 idx_messages_user_story_created、idx_messages_session_created）
+    
+    Returns:
+        int: 本次创建的索引数
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = 0
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables or not table.indexes:
+            continue
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing_indexes:
+                continue
+            print(f"🔄 为表 {table.name} 创建索引 {index.name}...")
+            index.create(bind=engine, checkfirst=True)
+            created += 1
+    if created:
+        print(f"✅ 补建索引完成: {created}个")
+    return created
+
 def init_database(drop_existing=False):
     """
     初始化数据库，创建表并验证结构
@@ -366,6 +391,9 @@ def init_database(drop_existing=False):
         
         print("✅ 数据库表结构同步完成")
         
+        # 已存在的表补建新增的索引
+        ensure_indexes(engine)
+        
         # 初始化基础数据
         init_basic_data(engine)
         
@@ -376,6 +376,9 @@ class Message(Base):
         Index('idx_messages_user_type_time', 'user_id', 'message_type', 'created_at'),
         Index('idx_messages_session_time', 'session_id', 'game_time'),
         Index('idx_messages_game_time', 'game_time'),
+        # 消息历史按(created_at, id)游标分页
+        Index('idx_messages_user_story_created', 'user_id', 'story_id', 'created_at', 'id'),
+        Index('idx_messages_session_created', 'session_id', 'created_at', 'id'),
         # 检查约束
         CheckConstraint('message_type BETWEEN 1 AND 6'),  # 限制message_type范围
     )
@@ -399,4 +402,182 @@ class Message(Base):
             "game_time": self.game_time.isoformat() if self.game_time else None,
             "metadata": self.message_metadata or {},
             "created_at": self.created_at.isoformat() if self.created_at else None,
-        } 
\ No newline at end of file
+        } 
+
+class DialogueSummary(Base):
+    """NPC对话摘要表模型（每个会话的每个NPC一条，滚动合并移出最近窗口的对话）"""
+    __tablename__ = "dialogue_summaries"
+    
+    # 主键，自增序列
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    
+    # 会话和故事关联
+    session_id = Column(String(100), nullable=False)
+    story_id = Column(Integer, ForeignKey("stories.id"), nullable=True)
+    npc_name = Column(String(100), nullable=False)
+    
+    # 摘要内容
+    summary = Column(Text, nullable=False, default="")
+    
+    # 已并入摘要的对话条数
+    summarized_entries = Column(Integer, nullable=False, default=0)
+    
+    # 创建时间，默认当前时间
+    created_at = Column(
+        DateTime(timezone=True), 
+        server_default=func.now(),
+        nullable=False
+    )
+    
+    # 更新时间，可空
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+    
+    # 表约束：同一会话内每个NPC只有一条摘要
+    __table_args__ = (
+        UniqueConstraint('session_id', 'story_id', 'npc_name', name='uq_dialogue_summary_session_npc'),
+        Index('idx_dialogue_summary_session_npc', 'session_id', 'story_id', 'npc_name'),
+    )
+    
+    def __repr__(self):
+        return f"<DialogueSummary(id={self.id}, session_id='{self.session_id}', npc_name='{self.npc_name}')>"
+    
+    def to_dict(self):
+        """转换为字典"""
+        return {
+            "id": self.id,
+            "session_id": self.session_id,
+            "story_id": self.story_id,
+            "npc_name": self.npc_name,
+            "summary": self.summary or "",
+            "summarized_entries": self.summarized_entries or 0,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
+class BackgroundJob(Base):
+    """后台任务表模型（任务先写入本表再由进程内的工作协程执行，执行结果在下一回合投递给玩家）"""
+    __tablename__ = "background_jobs"
+    
+    # 主键，自增序列
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    
+    # 任务类型和参数
+    job_type = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+    
+    # 会话和故事关联（用于投递结果）
+    session_id = Column(String(100), nullable=True)
+    story_id = Column(Integer, ForeignKey("stories.id"), nullable=True)
+    
+    # 状态：pending / running / done / failed
+    status = Column(String(20), nullable=False, default="pending")
+    
+    # 已尝试次数和最大尝试次数
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    
+    # 下次可执行时间（失败重试时推迟）
+    next_run_at = Column(DateTime(timezone=True), nullable=False, default=datetime.now)
+    
+    # 执行结果（需要投递给玩家的消息）和最后一次错误
+    result = Column(JSON, nullable=True)
+    last_error = Column(Text, nullable=True)
+    
+    # 结果投递时间，为空表示尚未投递
+    delivered_at = Column(DateTime(timezone=True), nullable=True)
+    
+    # 创建时间，默认当前时间
+    created_at = Column(
+        DateTime(timezone=True), 
+        server_default=func.now(),
+        nullable=False
+    )
+    
+    # 更新时间，可空
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+    
+    # 表约束
+    __table_args__ = (
+        CheckConstraint("status IN ('pending', 'running', 'done', 'failed')", name='check_background_job_status'),
+        Index('idx_background_job_status_next_run', 'status', 'next_run_at'),
+        Index('idx_background_job_session', 'session_id', 'story_id', 'status'),
+    )
+    
+    def __repr__(self):
+        return f"<BackgroundJob(id={self.id}, job_type='{self.job_type}', status='{self.status}')>"
+    
+    def to_dict(self):
+        """转换为字典"""
+        return {
+            "id": self.id,
+            "job_type": self.job_type,
+            "payload": self.payload or {},
+            "session_id": self.session_id,
+            "story_id": self.story_id,
+            "status": self.status,
+            "attempts": self.attempts or 0,
+            "max_attempts": self.max_attempts or 0,
+            "next_run_at": self.next_run_at.isoformat() if self.next_run_at else None,
+            "result": self.result,
+            "last_error": self.last_error,
+            "delivered_at": self.delivered_at.isoformat() if self.delivered_at else None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
+class GameSession(Base):
+    """游戏会话快照表模型（每个用户、故事、会话一条，保存序列化的游戏状态，每回合更新一次）"""
+    __tablename__ = "game_sessions"
+    
+    # 主键，自增序列
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    
+    # 用户、故事和会话关联
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    story_id = Column(Integer, ForeignKey("stories.id"), nullable=False)
+    session_id = Column(String(100), nullable=False)
+    
+    # 序列化的游戏状态（GameStateModel.to_dict）
+    state = Column(JSON, nullable=False, default=dict)
+    
+    # 版本号，每次写入加1，用于发现并发写入
+    version = Column(Integer, nullable=False, default=1)
+    
+    # 当前游戏时间和玩家位置（冗余字段，便于查询）
+    current_time = Column(String(20), nullable=True)
+    player_location = Column(String(100), nullable=True)
+    
+    # 创建时间，默认当前时间
+    created_at = Column(
+        DateTime(timezone=True), 
+        server_default=func.now(),
+        nullable=False
+    )
+    
+    # 更新时间，可空
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+    
+    # 表约束：每个用户的每个故事会话只有一条快照
+    __table_args__ = (
+        UniqueConstraint('user_id', 'story_id', 'session_id', name='uq_game_session_user_story_session'),
+    )
+    
+    def __repr__(self):
+        return f"<GameSession(id={self.id}, user_id={self.user_id}, story_id={self.story_id}, session_id='{self.session_id}', version={self.version})>"
+    
+    def to_dict(self):
+        """转换为字典"""
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "story_id": self.story_id,
+            "session_id": self.session_id,
+            "state": self.state or {},
+            "version": self.version or 0,
+            "current_time": self.current_time,
+            "player_location": self.player_location,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
@@ -35,6 +35,7 @@ class GameStateModel:
         self.compound_actions: Optional[List[Any]] = None
         self.last_update_time = TimeUtils.get_current_timestamp()
         self.next_node: Optional[str] = None
+        self.version = 0  # 会话快照版本号（game_sessions表），0表示尚未保存过快照
     
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典格式"""
@@ -55,7 +56,8 @@ class GameStateModel:
             "action_target": self.action_target,
             "compound_actions": self.compound_actions,
             "last_update_time": self.last_update_time,
-            "next_node": self.next_node
+            "next_node": self.next_node,
+            "version": self.version
         }
     
     @classmethod
@@ -80,6 +82,7 @@ class GameStateModel:
         instance.compound_actions = data.get("compound_actions")
         instance.last_update_time = data.get("last_update_time", TimeUtils.get_current_timestamp())
         instance.next_node = data.get("next_node")
+        instance.version = data.get("version", 0)
         return instance
     
     def add_message(self, speaker: str, message: str, message_type: str = "normal"):
@@ -16,6 +16,18 @@ class PromptTemplates:
                                           current_time=current_time,
                                           player_personality=player_personality)
     
+    @staticmethod
+    def get_turn_planner_prompt(player_name: str, player_location: str, current_time: str,
+                                player_personality: str, location_info: str, npc_info: str) -> str:
+        """获取回合规划提示词"""
+        return prompt_manager.render_prompt('turn_planner',
+                                          player_name=player_name,
+                                          player_location=player_location,
+                                          current_time=current_time,
+                                          player_personality=player_personality,
+                                          location_info=location_info,
+                                          npc_info=npc_info)
+    
     @staticmethod
     def get_npc_dialogue_prompt(npc_name: str, personality: str, background: str, relations: str, 
                                mood: str, npc_location: str, npc_event: str, player_name: str,
@@ -106,4 +118,14 @@ class PromptTemplates:
         """获取时间估算提示词"""
         return prompt_manager.render_prompt('time_estimation',
                                           action=action,
-                                          personality=personality) 
\ No newline at end of file
+                                          personality=personality)
+    
+    @staticmethod
+    def get_dialogue_summary_prompt(npc_name: str, player_name: str,
+                                    previous_summary: str, dialogue_lines: str) -> str:
+        """获取对话摘要提示词"""
+        return prompt_manager.render_prompt('dialogue_summary',
+                                          npc_name=npc_name,
+                                          player_name=player_name,
+                                          previous_summary=previous_summary,
+                                          dialogue_lines=dialogue_lines)
\ No newline at end of file
@@ -184,4 +184,15 @@ async def debug_messages(
     Returns:
         消息历史
     """
-    return await debug_controller.get_messages(session_id, user_id, story_id) 
\ No newline at end of file
+    return await debug_controller.get_messages(session_id, user_id, story_id) 
+
+
+@debug_router.get("/metrics")
+async def debug_metrics():
+    """
+    获取运行时性能统计（行动路由等）
+    
+    Returns:
+        性能统计
+    """
+    return debug_controller.get_metrics()
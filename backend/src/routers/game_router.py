@@ -81,7 +81,7 @@ async def stream_player_action(request: ActionRequest):
     Returns:
         流式响应
     """
-    return await game_controller.stream_action(request.action, request.session_id)
+    return await game_controller.stream_action(request.action, request.session_id, request.story_id)
 
 
 @game_router.post("/initialize_game")
@@ -141,7 +141,11 @@ async def get_story_messages(
     story_id: int,
     session_id: str = Query(default=None, description="会话ID（可选）"),
     limit: int = Query(default=100, description="限制返回数量"),
-    offset: int = Query(default=0, description="偏移量"),
+    offset: int = Query(default=0, description="偏移量（使用游标时忽略）"),
+    after: str = Query(default=None, description="游标，获取该游标之后（更新）的消息"),
+    before: str = Query(default=None, description="游标，获取该游标之前（更早）的消息"),
+    latest: bool = Query(default=False, description="不指定游标时从最新的消息开始向前分页"),
+    include_total: bool = Query(default=True, description="是否返回消息总数"),
     current_user: Dict = Depends(auth_service.get_current_user)
 ):
     """
@@ -152,6 +156,10 @@ async def get_story_messages(
         session_id: 会话ID（可选，为None时获取所有会话）
         limit: 限制返回数量
         offset: 偏移量
+        after: 游标（上一页的next_cursor），获取更新的消息
+        before: 游标（上一页的prev_cursor），获取更早的消息
+        latest: 不指定游标时从最新的消息开始向前分页
+        include_total: 是否返回消息总数（按会话缓存）
         current_user: 当前用户信息
         
     Returns:
@@ -162,11 +170,11 @@ async def get_story_messages(
         story_id=story_id,
         session_id=session_id,
         limit=limit,
-        offset=offset
+        offset=offset,
+        after=after,
+        before=before,
+        latest=latest,
+        include_total=include_total
     )
     
-    if not result["success"]:
-        from fastapi import HTTPException
-        raise HTTPException(status_code=400, detail=result["error"])
-    
     return result["data"] 
\ No newline at end of file
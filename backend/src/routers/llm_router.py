@@ -71,6 +71,64 @@ async def reset_llm_instance():
     return llm_controller.reset_llm_instance()
 
 
+@llm_router.get("/cache")
+async def get_llm_cache_stats():
+    """
+    获取LLM响应缓存统计
+    
+    Returns:
+        命中、未命中、淘汰等计数
+    """
+    return llm_controller.get_cache_stats()
+
+
+@llm_router.post("/cache/clear")
+async def clear_llm_cache():
+    """
+    清空LLM响应缓存（内存层和本地层）
+    
+    Returns:
+        清空结果
+    """
+    return llm_controller.clear_cache()
+
+
+@llm_router.get("/metrics")
+async def get_llm_metrics(recent: int = Query(default=20, ge=0, le=200, description="附带的最近调用条数")):
+    """
+    获取LLM调用遥测
+    
+    Args:
+        recent: 附带的最近调用条数
+        
+    Returns:
+        按提示词模板、模型和提供商汇总的延迟、排队时间、token用量和调用结果
+    """
+    return llm_controller.get_metrics(recent)
+
+
+@llm_router.post("/metrics/reset")
+async def reset_llm_metrics():
+    """
+    清空LLM调用遥测
+    
+    Returns:
+        清空结果
+    """
+    return llm_controller.reset_metrics()
+
+
+@llm_router.get("/providers")
+async def get_llm_provider_stats():
+    """
+    获取LLM提供商池统计
+    
+    Returns:
+        各提供商的延迟、错误率、熔断状态和故障转移次数
+    """
+    return llm_controller.get_provider_stats()
+
+
 @llm_router.get("/config/{model_name}")
 async def get_llm_config(model_name: str):
     """
@@ -3,6 +3,7 @@
 """
 import sys
 import os
+import re
 from typing import Dict, Any, List, Optional, Literal
 from pydantic import BaseModel, Field
 from langchain_core.messages import SystemMessage, HumanMessage
@@ -14,9 +15,33 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(SRC_DIR))
 sys.path.append(PROJECT_ROOT)
 sys.path.append(SRC_DIR)
 
-from .llm_service import LLMService
+from .llm_service import llm_service
+from .dialogue_service import DIALOGUE_PATTERNS
+from .location_db_service import location_db_service
+from ..database.config import run_in_db_thread
 from ..models.game_state_model import GameStateModel
 from ..prompts.prompt_templates import PromptTemplates
+from ..utils.config_loader import get_config_section, get_user_name
+from ..utils.llm_admission import LLMOverloadedError
+
+
+# 规则快速路由的默认置信度阈值（config.json 中 action_router.fast_path_threshold 可覆盖）
+DEFAULT_FAST_PATH_THRESHOLD = 0.9
+
+# 出现这些连接词时通常是复合指令，交给LLM拆分
+COMPOUND_MARKERS = ["然后", "接着", "之后", "再去", "再和", "顺便", "并且", "同时", "；", ";"]
+
+# 移动指令：可选主语 + 移动动词 + 目的地
+MOVEMENT_PATTERN = re.compile(r"^(?:我要|我想|我)?(?:回到|前往|移动到|走到|去到|去|回|到)(.+?)[。！!]*$")
+
+# 探索指令：以观察类动词开头
+EXPLORATION_PATTERN = re.compile(r"^(?:仔细|快速|随便)?(?:看看|看一看|环顾|观察|检查|探索|四处看看|四处|查看|寻找|打量)")
+
+# 指代玩家自己房间的说法
+PLAYER_ROOM_ALIASES = ["我的房间", "自己的房间", "自己房间", "房间", "我家", "家"]
+
+# 回合规划给出的耗时上限（分钟），超出视为无效
+MAX_PLANNED_MINUTES = 24 * 60
 
 
 class SubAction(BaseModel):
@@ -27,6 +52,14 @@ class SubAction(BaseModel):
     action: str = Field(description="具体行动描述")
 
 
+class PlannedAction(SubAction):
+    """回合规划中的单个行动，附带处理所需的参数"""
+    destination_key: Optional[str] = Field(default=None, description="move的目的地key，必须来自可选地点")
+    target_npc: Optional[str] = Field(default=None, description="talk的对话对象")
+    message: Optional[str] = Field(default=None, description="talk时玩家对NPC说的话")
+    estimated_minutes: Optional[int] = Field(default=None, description="explore的预计耗时（分钟）")
+
+
 class ActionRouter(BaseModel):
     """行动路由器的结构化输出"""
     action_type: Literal["move", "talk", "explore", "general", "compound"] = Field(
@@ -40,11 +73,41 @@ class ActionRouter(BaseModel):
     )
 
 
+class TurnPlan(ActionRouter):
+    """回合规划器的结构化输出：在路由结果上附带各行动的处理参数"""
+    sub_actions: Optional[List[PlannedAction]] = Field(
+        default=None,
+        description="复合指令的子行动列表"
+    )
+    destination_key: Optional[str] = Field(default=None, description="move的目的地key，必须来自可选地点")
+    target_npc: Optional[str] = Field(default=None, description="talk的对话对象")
+    message: Optional[str] = Field(default=None, description="talk时玩家对NPC说的话")
+    estimated_minutes: Optional[int] = Field(default=None, description="explore的预计耗时（分钟）")
+
+
 class ActionRouterService:
     """行动路由服务类"""
     
-    def __init__(self):
-        self.llm_service = LLMService()
+    # 路由统计（所有实例共享）
+    _metrics: Dict[str, Any] = {
+        "total": 0,
+        "fast_path": 0,
+        "llm": 0,
+        "llm_errors": 0,
+        "planner": 0,
+        "planner_invalid": 0,
+        "fast_path_by_type": {},
+        "llm_by_type": {},
+        "planner_by_type": {}
+    }
+    
+    def __init__(self, location_service=location_db_service):
+        self.llm_service = llm_service
+        self.location_service = location_service
+        router_config = get_config_section("action_router")
+        self.fast_path_enabled = router_config.get("fast_path_enabled", True)
+        self.fast_path_threshold = float(router_config.get("fast_path_threshold", DEFAULT_FAST_PATH_THRESHOLD))
+        self.planner_enabled = router_config.get("planner_enabled", False)
     
     async def route_action(self, action: str, game_state: GameStateModel) -> Dict[str, Any]:
         """
@@ -65,10 +128,27 @@ class ActionRouterService:
                 "action_type": "general",
                 "confidence": 1.0,
                 "reason": "空输入",
-                "sub_actions": None
+                "sub_actions": None,
+                "source": "rule"
             }
         
-        llm = self.llm_service.get_llm_instance()
+        self._metrics["total"] += 1
+        
+        # 规则快速路径：置信度足够高时直接返回，跳过LLM
+        if self.fast_path_enabled:
+            rule_result = await self.pre_classify(action, game_state)
+            if rule_result["confidence"] >= self.fast_path_threshold:
+                print(f"⚡ 规则快速路由命中: {rule_result['action_type']} (置信度 {rule_result['confidence']})")
+                self._record_route("fast_path", rule_result["action_type"])
+                return rule_result
+            print(f"  ↪️ 规则置信度 {rule_result['confidence']} 低于阈值 {self.fast_path_threshold}，使用LLM路由")
+        
+        # 回合规划：一次调用同时得到行动类型和处理参数，规划无效时回退到逐步调用
+        if self.planner_enabled:
+            plan_result = await self.plan_turn(action, game_state)
+            if plan_result:
+                self._record_route("planner", plan_result["action_type"])
+                return plan_result
         
         # 使用prompt_manager获取系统提示
         system_prompt = PromptTemplates.get_action_router_prompt(
@@ -87,12 +167,11 @@ class ActionRouterService:
         print(f"📤 输入 (Human): {user_input}")
         
         # 使用LLM进行路由决策
-        router = llm.with_structured_output(ActionRouter)
         try:
-            result = await router.ainvoke([
+            result = await self.llm_service.ainvoke_structured([
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=user_input)
-            ])
+            ], ActionRouter, task="action_router")
             
             print(f"📥 LLM输出:")
             print(f"  🎯 行动类型: {result.action_type}")
@@ -112,23 +191,229 @@ class ActionRouterService:
                         action_text = sub_action.get('action', '')
                     print(f"    {i+1}. {action_type}: {action_text}")
             
+            self._record_route("llm", result.action_type)
             return {
                 "action_type": result.action_type,
                 "confidence": result.confidence,
                 "reason": result.reason,
-                "sub_actions": result.sub_actions
+                "sub_actions": result.sub_actions,
+                "source": "llm"
             }
             
+        except LLMOverloadedError:
+            # 过载时不降级，由上层直接返回503
+            raise
         except Exception as e:
             print(f"❌ LLM调用失败: {e}")
             print(f"  ➡️ 降级到类型: general")
+            self._metrics["llm_errors"] += 1
+            self._record_route("llm", "general")
             return {
                 "action_type": "general",
                 "confidence": 0.5,
                 "reason": f"LLM调用失败，降级处理: {str(e)}",
-                "sub_actions": None
+                "sub_actions": None,
+                "source": "llm"
             }
     
+    async def plan_turn(self, action: str, game_state: GameStateModel) -> Optional[Dict[str, Any]]:
+        """
+        用一次结构化输出调用规划整个回合（行动类型、子行动、目的地、对话对象和耗时）
+        
+        Args:
+            action: 玩家行动
+            game_state: 游戏状态
+            
+        Returns:
+            带plan字段的路由结果，调用失败或规划未通过校验时返回None
+        """
+        from .destination_resolver import destination_resolver
+        from .location_service import location_service
+        
+        locations_result = await self.location_service.aget_locations_by_story(game_state.story_id)
+        story_locations = locations_result.get("data", []) if locations_result.get("success") else []
+        location_info = ""
+        location_keys = set()
+        if story_locations:
+            # 只提供与行动最相关的候选地点和相邻地点，避免地点过多时提示词过长
+            index = destination_resolver.get_index(game_state.story_id, story_locations)
+            resolved = destination_resolver.resolve(action, index)
+            candidate_keys = destination_resolver.candidate_keys(index, resolved["matches"], game_state.player_location)
+            location_keys = set(index.locations)
+            location_info = "\n".join(
+                f"- {index.locations[key]['key']}: {index.locations[key]['name']}" for key in candidate_keys
+            )
+        
+        present_npcs = [npc["name"] for npc in await run_in_db_thread(
+            location_service.get_npcs_at_location,
+            game_state.player_location, game_state.npc_locations, game_state.current_time, game_state
+        )]
+        
+        system_prompt = PromptTemplates.get_turn_planner_prompt(
+            player_name=get_user_name(),
+            player_location=game_state.player_location,
+            current_time=game_state.current_time,
+            player_personality=game_state.player_personality,
+            location_info=location_info or "无",
+            npc_info="、".join(present_npcs) or "无"
+        )
+        
+        print(f"\n🤖 LLM调用 - 回合规划")
+        print(f"  候选地点数量: {len(location_info.splitlines())}个, 当前位置NPC: {present_npcs}")
+        
+        try:
+            plan = await self.llm_service.ainvoke_structured([
+                SystemMessage(content=system_prompt),
+                HumanMessage(content=f"玩家行动：{action}")
+            ], TurnPlan, task="turn_planner")
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            print(f"❌ 回合规划调用失败: {e}")
+            self._metrics["planner_invalid"] += 1
+            return None
+        
+        known_npcs = set(game_state.npc_locations or {}) | set(present_npcs)
+        error = self.validate_plan(plan, location_keys, known_npcs)
+        if error:
+            print(f"⚠️ 回合规划未通过校验，回退到逐步调用: {error}")
+            self._metrics["planner_invalid"] += 1
+            return None
+        
+        print(f"📥 回合规划: {plan.action_type}, 目的地={plan.destination_key}, 对象={plan.target_npc}, 耗时={plan.estimated_minutes}")
+        return {
+            "action_type": plan.action_type,
+            "confidence": plan.confidence,
+            "reason": plan.reason,
+            "sub_actions": plan.sub_actions,
+            "plan": plan,
+            "source": "planner"
+        }
+    
+    @staticmethod
+    def validate_plan(plan: TurnPlan, location_keys: set, known_npcs: set) -> Optional[str]:
+        """
+        校验回合规划，处理参数缺失或不存在时返回错误原因
+        
+        Args:
+            plan: 回合规划
+            location_keys: 故事中所有位置的key
+            known_npcs: 已知NPC名称
+            
+        Returns:
+            错误原因，校验通过时为None
+        """
+        if plan.action_type == "compound":
+            if not plan.sub_actions:
+                return "复合指令缺少子行动"
+            steps = plan.sub_actions
+        else:
+            steps = [plan]
+        
+        for step in steps:
+            step_type = step.action_type if isinstance(step, TurnPlan) else step.type
+            if step_type == "move" and step.destination_key not in location_keys:
+                return f"无效的目的地: {step.destination_key}"
+            if step_type == "talk" and (step.target_npc not in known_npcs or not step.message):
+                return f"无效的对话对象或内容: {step.target_npc}"
+            if step.estimated_minutes is not None and not 0 < step.estimated_minutes <= MAX_PLANNED_MINUTES:
+                # 耗时不合理时只丢弃该字段，由本地估算器重新估算
+                step.estimated_minutes = None
+        return None
+    
+    async def pre_classify(self, action: str, game_state: GameStateModel) -> Dict[str, Any]:
+        """
+        基于规则的行动预分类，不调用LLM
+        
+        Args:
+            action: 玩家行动
+            game_state: 游戏状态
+            
+        Returns:
+            路由结果，confidence为规则判断的置信度（0表示无法判断）
+        """
+        text = action.strip()
+        
+        # 含有连接词时可能是复合指令（先于对话判断，否则“跟X说…然后去Y”会丢掉后一个行动）
+        if any(marker in text for marker in COMPOUND_MARKERS):
+            return self._rule_result("general", 0.0, "可能是复合指令")
+        
+        # 对话：格式明确且从句首开始
+        for pattern in DIALOGUE_PATTERNS:
+            match = re.match(pattern, text)
+            if match:
+                npc_name = match.group(1).strip()
+                if npc_name in (game_state.npc_locations or {}):
+                    return self._rule_result("talk", 0.95, f"对话格式匹配，对象为已知NPC: {npc_name}")
+                return self._rule_result("talk", 0.8, f"对话格式匹配，但对象未知: {npc_name}")
+        
+        # 移动：目的地必须能精确对应到故事中的位置
+        match = MOVEMENT_PATTERN.match(text)
+        if match:
+            destination = match.group(1).strip()
+            if await self._is_known_destination(destination, game_state):
+                return self._rule_result("move", 0.95, f"移动格式匹配，目的地明确: {destination}")
+            return self._rule_result("move", 0.6, f"移动格式匹配，但目的地不明确: {destination}")
+        
+        # 探索：观察类动词开头，且不包含对话或移动意图
+        if EXPLORATION_PATTERN.match(text) and not self.is_dialogue_action(text):
+            if len(text) <= 20:
+                return self._rule_result("explore", 0.9, "探索格式匹配")
+            return self._rule_result("explore", 0.7, "探索格式匹配，但描述较长")
+        
+        return self._rule_result("general", 0.0, "规则无法判断")
+    
+    async def _is_known_destination(self, destination: str, game_state: GameStateModel) -> bool:
+        """检查目的地文本是否精确对应故事中的某个位置"""
+        destination = destination.rstrip("吧呀啊了")
+        if not destination or not game_state.story_id:
+            return False
+        
+        locations_result = await self.location_service.aget_locations_by_story(game_state.story_id)
+        if not locations_result.get("success"):
+            return False
+        
+        if destination in PLAYER_ROOM_ALIASES:
+            destination = f"{get_user_name()}房间"
+        
+        for location in locations_result.get("data", []):
+            if destination in (location.get("key"), location.get("name"), location.get("en_name")):
+                return True
+        return False
+    
+    def _rule_result(self, action_type: str, confidence: float, reason: str) -> Dict[str, Any]:
+        """构建规则路由结果"""
+        return {
+            "action_type": action_type,
+            "confidence": confidence,
+            "reason": f"规则路由: {reason}",
+            "sub_actions": None,
+            "source": "rule"
+        }
+    
+    @classmethod
+    def _record_route(cls, source: str, action_type: str):
+        """记录一次路由决策"""
+        cls._metrics[source] += 1
+        by_type = cls._metrics[f"{source}_by_type"]
+        by_type[action_type] = by_type.get(action_type, 0) + 1
+    
+    @classmethod
+    def get_routing_metrics(cls) -> Dict[str, Any]:
+        """
+        获取路由统计
+        
+        Returns:
+            路由统计，包括跳过LLM的比例
+        """
+        metrics = dict(cls._metrics)
+        metrics["fast_path_by_type"] = dict(cls._metrics["fast_path_by_type"])
+        metrics["llm_by_type"] = dict(cls._metrics["llm_by_type"])
+        metrics["planner_by_type"] = dict(cls._metrics["planner_by_type"])
+        decided = metrics["fast_path"] + metrics["llm"] + metrics["planner"]
+        metrics["llm_skip_rate"] = round(metrics["fast_path"] / decided, 4) if decided else 0.0
+        return metrics
+    
     def is_dialogue_action(self, action: str) -> bool:
         """简单的对话行动检测"""
         dialogue_patterns = [
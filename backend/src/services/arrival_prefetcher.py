@@ -0,0 +1,278 @@
+"""
+到达反馈预取 - 回合结束后在后台为玩家最可能前往的位置预先生成到达时的五感反馈
+"""
+import time
+import asyncio
+import hashlib
+import logging
+from collections import deque, OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from .location_service import location_service
+from .location_db_service import location_db_service
+from ..models.game_state_model import GameStateModel
+from ..utils.config_loader import get_config_section
+from ..utils.llm_cache import TTLLRUCache
+from ..utils.time_utils import TimeUtils
+
+logger = logging.getLogger(__name__)
+
+# 每回合预取的位置数量
+DEFAULT_TOP_K = 2
+# 按游戏时间分桶，同一桶内的到达反馈可以复用
+DEFAULT_TIME_BUCKET_MINUTES = 30
+# 每个会话在预算窗口内最多发起的预取调用次数
+DEFAULT_SESSION_BUDGET = 20
+DEFAULT_BUDGET_WINDOW_SECONDS = 3600
+DEFAULT_TTL_SECONDS = 600
+DEFAULT_MAX_ENTRIES = 256
+# 到达时等待进行中预取的最长时间，超时后取消预取、按正常优先级生成
+DEFAULT_JOIN_TIMEOUT_MS = 300
+# 最多记录的(故事, 位置)移动历史和会话预算条数，超出时淘汰最久未使用的
+DEFAULT_MAX_TRANSITIONS = 1024
+DEFAULT_MAX_SESSIONS = 1024
+# 预取时假定的单步移动耗时（与MovementService的基础步行时间一致）
+DEFAULT_STEP_MINUTES = 3
+# 预取调用的任务名（排队优先级最低，遥测中与正常的五感反馈分开统计）
+PREFETCH_TASK = "sensory_prefetch"
+
+
+class ArrivalPrefetcher:
+    """到达反馈预取器 - 按移动历史预测下一个位置，在会话预算内预先生成到达反馈"""
+    
+    def __init__(self):
+        prefetch_config = get_config_section("arrival_prefetch")
+        self.enabled = prefetch_config.get("enabled", False)
+        self.top_k = int(prefetch_config.get("top_k", DEFAULT_TOP_K))
+        self.time_bucket_minutes = max(int(prefetch_config.get("time_bucket_minutes", DEFAULT_TIME_BUCKET_MINUTES)), 1)
+        self.session_budget = int(prefetch_config.get("session_budget", DEFAULT_SESSION_BUDGET))
+        self.budget_window = float(prefetch_config.get("budget_window_seconds", DEFAULT_BUDGET_WINDOW_SECONDS))
+        self.ttl = float(prefetch_config.get("ttl_seconds", DEFAULT_TTL_SECONDS))
+        self.join_timeout = float(prefetch_config.get("join_timeout_ms", DEFAULT_JOIN_TIMEOUT_MS)) / 1000
+        self.max_transitions = int(prefetch_config.get("max_transitions", DEFAULT_MAX_TRANSITIONS))
+        self.max_sessions = int(prefetch_config.get("max_sessions", DEFAULT_MAX_SESSIONS))
+        self.location_service = location_service
+        self.location_db_service = location_db_service
+        
+        self._cache = TTLLRUCache(int(prefetch_config.get("max_entries", DEFAULT_MAX_ENTRIES)))
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        # 按最近使用排序，超出上限时淘汰最久未使用的条目
+        self._transitions: "OrderedDict[Tuple[Any, str], Dict[str, int]]" = OrderedDict()
+        self._spent: "OrderedDict[str, deque]" = OrderedDict()
+        self._tasks: set = set()
+        self._stats = {
+            "scheduled": 0, "generated": 0, "failed": 0, "hits": 0, "joined": 0, "join_timeouts": 0,
+            "misses": 0, "budget_exhausted": 0
+        }
+    
+    def make_key(self, story_id: Any, location_key: str, game_time: str, personality: str) -> str:
+        """缓存键：故事 + 位置 + 游戏时间桶 + 玩家性格（反馈文本随性格变化）"""
+        try:
+            parsed = TimeUtils.parse_game_time(game_time)
+            minutes = parsed.hour * 60 + parsed.minute
+            bucket = f"{parsed.date().isoformat()}#{minutes // self.time_bucket_minutes}"
+        except Exception:
+            bucket = str(game_time)
+        personality_hash = hashlib.sha1((personality or "").encode("utf-8")).hexdigest()[:12]
+        return f"{story_id}:{location_key}:{bucket}:{personality_hash}"
+    
+    def record_move(self, story_id: Any, from_location: str, to_location: str):
+        """记录一次移动，用于预测下一个位置"""
+        if from_location == to_location:
+            return
+        key = (story_id, from_location)
+        counts = self._transitions.setdefault(key, {})
+        counts[to_location] = counts.get(to_location, 0) + 1
+        self._transitions.move_to_end(key)
+        while len(self._transitions) > self.max_transitions:
+            self._transitions.popitem(last=False)
+    
+    def predict(self, story_id: Any, location_key: str, connections: List[str]) -> List[str]:
+        """
+        预测下一个位置
+        
+        Args:
+            story_id: 故事ID
+            location_key: 当前位置
+            connections: 当前位置的相邻位置
+        
+        Returns:
+            按可能性从高到低排列的位置key（历史去过的优先，其次按相邻位置的顺序），最多top_k个
+        """
+        counts = self._transitions.get((story_id, location_key), {})
+        candidates = list(dict.fromkeys([*counts, *connections]))
+        order = {key: i for i, key in enumerate(connections)}
+        candidates.sort(key=lambda key: (-counts.get(key, 0), order.get(key, len(order))))
+        return [key for key in candidates if key != location_key][:self.top_k]
+    
+    def _consume_budget(self, session_id: str) -> bool:
+        """在会话预算内占用一次预取调用"""
+        now = time.time()
+        spent = self._spent.setdefault(session_id, deque())
+        self._spent.move_to_end(session_id)
+        while spent and spent[0] < now - self.budget_window:
+            spent.popleft()
+        if len(spent) >= self.session_budget:
+            self._stats["budget_exhausted"] += 1
+            return False
+        spent.append(now)
+        self._evict_sessions(now)
+        return True
+    
+    def _evict_sessions(self, now: float):
+        """移除预算窗口内没有预取记录的会话，仍超出上限时淘汰最久未使用的会话"""
+        while self._spent:
+            oldest = next(iter(self._spent.values()))
+            if len(self._spent) > self.max_sessions or not oldest or oldest[-1] < now - self.budget_window:
+                self._spent.popitem(last=False)
+            else:
+                break
+    
+    def schedule(self, session_id: str, game_state: GameStateModel) -> Optional[asyncio.Task]:
+        """
+        在后台预取玩家最可能前往的位置的到达反馈，不阻塞当前响应（位置查询也在后台任务中进行）
+        
+        Args:
+            session_id: 会话ID
+            game_state: 回合结束后的游戏状态
+        
+        Returns:
+            预取调度任务，不预取时为None
+        """
+        if not self.enabled:
+            return None
+        
+        task = asyncio.ensure_future(self.prefetch(session_id, game_state))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    async def prefetch(self, session_id: str, game_state: GameStateModel) -> List[asyncio.Task]:
+        """
+        查询当前位置的相邻位置并发起预取
+        
+        Args:
+            session_id: 会话ID
+            game_state: 回合结束后的游戏状态
+        
+        Returns:
+            新建的预取任务
+        """
+        if not self.enabled:
+            return []
+        
+        from ..utils.llm_gateway import llm_gateway
+        if llm_gateway.is_overloaded():
+            # LLM已经过载时不做投机调用
+            return []
+        
+        story_id = game_state.story_id
+        current_result = await self.location_db_service.aget_location_by_key(story_id, game_state.player_location)
+        connections = []
+        if current_result.get("success"):
+            connections = current_result.get("data", {}).get("connections") or []
+        arrival_time = TimeUtils.add_minutes(game_state.current_time, DEFAULT_STEP_MINUTES)
+        personality = game_state.player_personality
+        
+        tasks = []
+        for location_key in self.predict(story_id, game_state.player_location, connections):
+            key = self.make_key(story_id, location_key, arrival_time, personality)
+            if key in self._in_flight or self._cache.get(key)[0]:
+                continue
+            if not self._consume_budget(session_id):
+                break
+            task = asyncio.ensure_future(self._generate(key, story_id, location_key, arrival_time, personality))
+            self._in_flight[key] = task
+            self._tasks.add(task)
+            task.add_done_callback(lambda done, key=key: self._on_done(key, done))
+            self._stats["scheduled"] += 1
+            tasks.append(task)
+        return tasks
+    
+    def _on_done(self, key: str, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+    
+    async def _generate(self, key: str, story_id: Any, location_key: str, arrival_time: str,
+                        personality: str) -> Optional[str]:
+        """生成到达反馈并写入缓存，失败时不缓存（参数与MovementService生成到达反馈时一致）"""
+        location_result = await self.location_db_service.aget_location_by_key(story_id, location_key)
+        location_data = location_result.get("data", {}) if location_result.get("success") else {}
+        location_info = {
+            "name": location_data.get("name", location_key),
+            "description": location_data.get("description", "无描述")
+        }
+        try:
+            feedback = await self.location_service.generate_sensory_feedback(
+                f"到达{location_info['name']}", location_info, [], arrival_time, personality,
+                task=PREFETCH_TASK, fallback=False
+            )
+        except Exception as e:
+            self._stats["failed"] += 1
+            logger.warning(f"⚠️ [ArrivalPrefetcher] 预取到达反馈失败 {location_key}: {e}")
+            return None
+        self._cache.set(key, feedback, self.ttl)
+        self._stats["generated"] += 1
+        return feedback
+    
+    async def get(self, story_id: Any, location_key: str, game_time: str, personality: str) -> Optional[str]:
+        """
+        获取预取的到达反馈（预取仍在进行时最多等待join_timeout），取出后从缓存中删除
+        
+        Args:
+            story_id: 故事ID
+            location_key: 到达的位置
+            game_time: 到达时的游戏时间
+            personality: 玩家性格
+        
+        Returns:
+            到达反馈，没有预取结果时为None
+        """
+        if not self.enabled:
+            return None
+        key = self.make_key(story_id, location_key, game_time, personality)
+        hit, feedback = self._cache.get(key)
+        if hit:
+            self._cache.delete(key)
+            self._stats["hits"] += 1
+            return feedback
+        
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            try:
+                feedback = await asyncio.wait_for(asyncio.shield(in_flight), timeout=self.join_timeout)
+            except asyncio.TimeoutError:
+                # 预取的排队优先级最低，负载高时可能迟迟拿不到名额：取消预取，由调用方按正常优先级生成
+                in_flight.cancel()
+                feedback = None
+                self._stats["join_timeouts"] += 1
+            if feedback is not None:
+                self._cache.delete(key)
+                self._stats["joined"] += 1
+                return feedback
+        self._stats["misses"] += 1
+        return None
+    
+    async def drain(self):
+        """等待所有预取任务完成（包括调度任务中新建的预取）"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取预取统计"""
+        served = self._stats["hits"] + self._stats["joined"]
+        lookups = served + self._stats["misses"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "hit_rate": round(served / lookups, 4) if lookups else 0.0,
+            "cached": len(self._cache),
+            "in_flight": len(self._in_flight),
+            "sessions": len(self._spent),
+            "transitions": len(self._transitions)
+        }
+
+
+# 创建全局到达反馈预取器实例
+arrival_prefetcher = ArrivalPrefetcher()
@@ -0,0 +1,367 @@
+"""
+后台任务服务 - 持久化的进程内任务队列，把不影响本回合回复的LLM调用移出响应路径
+"""
+import time
+import threading
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import sessionmaker
+
+from ..database.config import get_engine, run_in_db_thread
+from ..database.models import BackgroundJob
+from ..utils.config_loader import get_config_section
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_ATTEMPTS = 3
+# 第n次失败后等待 retry_backoff * 2^(n-1) 秒再重试
+DEFAULT_RETRY_BACKOFF = 2.0
+DEFAULT_JOB_TIMEOUT = 60.0
+# 没有新任务时检查到期重试任务的间隔
+DEFAULT_POLL_INTERVAL = 5.0
+# running状态的租约：领取（updated_at）超过该秒数仍未完成的任务视为执行它的进程已退出，可以重新领取。
+# 任务执行时间不超过job_timeout，默认取job_timeout的两倍
+DEFAULT_LEASE_FACTOR = 2
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# 任务处理函数：接收任务参数，返回需要投递给玩家的结果（{"messages": [...]}）或None
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class BackgroundJobService:
+    """后台任务服务 - 任务先写入数据库，由工作协程按序执行，失败按指数退避重试，结果在下一回合投递"""
+    
+    def __init__(self, engine=None):
+        self.engine = engine or get_engine()
+        self.Session = sessionmaker(bind=self.engine)
+        
+        jobs_config = get_config_section("background_jobs")
+        self.enabled = jobs_config.get("enabled", True)
+        self.workers = max(int(jobs_config.get("workers", DEFAULT_WORKERS)), 1)
+        self.max_attempts = max(int(jobs_config.get("max_attempts", DEFAULT_MAX_ATTEMPTS)), 1)
+        self.retry_backoff = float(jobs_config.get("retry_backoff", DEFAULT_RETRY_BACKOFF))
+        self.job_timeout = float(jobs_config.get("job_timeout", DEFAULT_JOB_TIMEOUT))
+        self.poll_interval = float(jobs_config.get("poll_interval", DEFAULT_POLL_INTERVAL))
+        self.lease_seconds = float(jobs_config.get("lease_seconds", self.job_timeout * DEFAULT_LEASE_FACTOR))
+        
+        self._handlers: Dict[str, JobHandler] = {}
+        self._worker_tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._active = 0
+        # 已随某个回合的消息进入写入队列、等待写入数据库的任务（不再返回给之后的回合，避免重复投递）
+        self._reserved: set = set()
+        self._reserved_lock = threading.Lock()
+        self._stats = {"enqueued": 0, "succeeded": 0, "retried": 0, "failed": 0, "delivered": 0, "reclaimed": 0}
+    
+    def register(self, job_type: str, handler: JobHandler):
+        """注册任务处理函数"""
+        self._handlers[job_type] = handler
+    
+    async def enqueue(self, job_type: str, payload: Dict[str, Any], session_id: Optional[str] = None,
+                      story_id: Optional[int] = None, max_attempts: Optional[int] = None) -> Optional[int]:
+        """
+        写入一个后台任务并唤醒工作协程（写入在数据库线程池中执行）
+        
+        Args:
+            job_type: 任务类型（需已注册处理函数）
+            payload: 任务参数（需可JSON序列化）
+            session_id: 会话ID，任务结果投递到该会话
+            story_id: 故事ID
+            max_attempts: 最大尝试次数，默认使用配置值
+        
+        Returns:
+            任务ID，写入失败时为None
+        """
+        if job_type not in self._handlers:
+            raise ValueError(f"未注册的后台任务类型: {job_type}")
+        
+        try:
+            job_id = await run_in_db_thread(
+                self._insert_job, job_type, payload, session_id, story_id, max_attempts or self.max_attempts
+            )
+        except Exception as e:
+            logger.error(f"❌ [BackgroundJobService] 写入后台任务失败: {job_type}, {e}")
+            return None
+        
+        self._stats["enqueued"] += 1
+        self.start()
+        self._wakeup.set()
+        logger.info(f"📥 [BackgroundJobService] 已加入后台任务: {job_type}#{job_id}")
+        return job_id
+    
+    def _insert_job(self, job_type: str, payload: Dict[str, Any], session_id: Optional[str],
+                    story_id: Optional[int], max_attempts: int) -> int:
+        """写入任务记录"""
+        session = self.Session()
+        try:
+            job = BackgroundJob(
+                job_type=job_type,
+                payload=payload,
+                session_id=session_id,
+                story_id=story_id,
+                status=STATUS_PENDING,
+                attempts=0,
+                max_attempts=max_attempts,
+                next_run_at=datetime.now()
+            )
+            session.add(job)
+            session.commit()
+            return job.id
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    def start(self):
+        """启动工作协程（已启动时不重复启动）"""
+        self._worker_tasks = [task for task in self._worker_tasks if not task.done()]
+        if self._worker_tasks:
+            return
+        
+        self._wakeup = asyncio.Event()
+        self._worker_tasks = [asyncio.ensure_future(self._worker_loop(i)) for i in range(self.workers)]
+    
+    async def stop(self):
+        """停止工作协程（正在执行的任务保持running状态，租约过期后由任一进程重新领取）"""
+        for task in self._worker_tasks:
+            task.cancel()
+        if self._worker_tasks:
+            await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+    
+    async def drain(self, timeout: float = 30.0):
+        """等待所有已到期的任务执行完成"""
+        deadline = time.monotonic() + timeout
+        # 先查询再检查活跃数：查询期间被领取的任务已计入活跃数
+        while await run_in_db_thread(self._has_due_jobs) or self._active:
+            if time.monotonic() > deadline:
+                raise asyncio.TimeoutError("等待后台任务完成超时")
+            await asyncio.sleep(0.01)
+    
+    async def _worker_loop(self, worker_id: int):
+        """工作协程：不断领取到期任务执行，没有任务时等待唤醒或轮询"""
+        while True:
+            # 领取前清除唤醒标记，领取期间写入的任务不会错过唤醒；领取中也计入活跃数，drain不会提前返回
+            self._wakeup.clear()
+            self._active += 1
+            try:
+                try:
+                    job = await run_in_db_thread(self._claim_next)
+                except Exception as e:
+                    logger.error(f"❌ [BackgroundJobService] 领取后台任务失败: {e}")
+                    job = None
+                if job is not None:
+                    await self._run_job(job)
+            finally:
+                self._active -= 1
+            
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+    
+    async def _run_job(self, job: Dict[str, Any]):
+        """执行单个任务并记录结果"""
+        handler = self._handlers.get(job["job_type"])
+        try:
+            if handler is None:
+                raise ValueError(f"未注册的后台任务类型: {job['job_type']}")
+            result = await asyncio.wait_for(handler(job["payload"]), timeout=self.job_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            await self._record_failure(job, error)
+            return
+        
+        await run_in_db_thread(self._update_job, job["id"], status=STATUS_DONE, result=result, last_error=None)
+        self._stats["succeeded"] += 1
+        logger.info(f"✅ [BackgroundJobService] 后台任务完成: {job['job_type']}#{job['id']}")
+    
+    async def _record_failure(self, job: Dict[str, Any], error: str):
+        """任务失败：未达到最大尝试次数时按指数退避重新排队"""
+        if job["attempts"] < job["max_attempts"]:
+            delay = self.retry_backoff * (2 ** (job["attempts"] - 1))
+            await run_in_db_thread(self._update_job, job["id"], status=STATUS_PENDING, last_error=error,
+                                   next_run_at=datetime.now() + timedelta(seconds=delay))
+            self._stats["retried"] += 1
+            logger.warning(f"⚠️ [BackgroundJobService] 后台任务失败，{delay:.1f}秒后重试: "
+                           f"{job['job_type']}#{job['id']} ({job['attempts']}/{job['max_attempts']}), {error}")
+        else:
+            await run_in_db_thread(self._update_job, job["id"], status=STATUS_FAILED, last_error=error)
+            self._stats["failed"] += 1
+            logger.error(f"❌ [BackgroundJobService] 后台任务最终失败: {job['job_type']}#{job['id']}, {error}")
+    
+    def _claimable(self, now: datetime):
+        """可领取的任务：到期的pending任务，以及租约已过期的running任务（执行它的进程已退出）"""
+        return or_(
+            and_(BackgroundJob.status == STATUS_PENDING, BackgroundJob.next_run_at <= now),
+            and_(BackgroundJob.status == STATUS_RUNNING,
+                 BackgroundJob.updated_at < now - timedelta(seconds=self.lease_seconds))
+        )
+    
+    def _claim_next(self) -> Optional[Dict[str, Any]]:
+        """
+        领取一个可执行的任务并标记为running，updated_at记为租约开始时间
+        （行锁避免多进程重复领取，按可领取条件更新避免线程间重复领取；其他进程仍在执行的任务租约未过期，不会被领取）
+        """
+        session = self.Session()
+        try:
+            while True:
+                now = datetime.now()
+                job = session.query(BackgroundJob).filter(self._claimable(now)).order_by(
+                    BackgroundJob.next_run_at, BackgroundJob.id
+                ).with_for_update(skip_locked=True).first()
+                if job is None:
+                    session.commit()
+                    return None
+                
+                attempts = (job.attempts or 0) + 1
+                reclaimed = job.status == STATUS_RUNNING
+                claimed = session.query(BackgroundJob).filter(
+                    BackgroundJob.id == job.id,
+                    self._claimable(now)
+                ).update({"status": STATUS_RUNNING, "attempts": attempts, "updated_at": datetime.now()},
+                         synchronize_session=False)
+                session.commit()
+                if claimed:
+                    if reclaimed:
+                        self._stats["reclaimed"] += 1
+                        logger.info(f"🔄 [BackgroundJobService] 重新领取租约过期的后台任务: {job.job_type}#{job.id}")
+                    return {
+                        "id": job.id,
+                        "job_type": job.job_type,
+                        "payload": job.payload or {},
+                        "attempts": attempts,
+                        "max_attempts": job.max_attempts
+                    }
+                # 已被其他工作线程领取，重新查找
+                session.expire_all()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    def _update_job(self, job_id: int, **fields):
+        """更新任务记录"""
+        try:
+            session = self.Session()
+            try:
+                session.query(BackgroundJob).filter(BackgroundJob.id == job_id).update(
+                    {**fields, "updated_at": datetime.now()}, synchronize_session=False
+                )
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+        except Exception as e:
+            logger.error(f"❌ [BackgroundJobService] 更新后台任务失败: #{job_id}, {e}")
+    
+    def _has_due_jobs(self) -> bool:
+        """是否还有可领取的任务（到期的pending任务或租约过期的running任务）"""
+        session = self.Session()
+        try:
+            return session.query(BackgroundJob.id).filter(self._claimable(datetime.now())).first() is not None
+        finally:
+            session.close()
+    
+    def pending_notifications(self, session_id: str, story_id: Optional[int] = None,
+                              reserve: bool = False) -> List[Dict[str, Any]]:
+        """
+        读取会话中已完成但尚未投递的任务结果（不标记为已投递，消息保存成功后再调用mark_delivered）
+        
+        Args:
+            session_id: 会话ID
+            story_id: 故事ID
+            reserve: 是否预留返回的任务：写入数据库前不再返回给之后的回合，写入失败时调用release释放
+        
+        Returns:
+            按任务完成顺序排列的 {"job_id": 任务ID, "messages": 消息列表}
+        """
+        try:
+            session = self.Session()
+            try:
+                jobs = session.query(BackgroundJob).filter(
+                    BackgroundJob.session_id == session_id,
+                    BackgroundJob.story_id == story_id,
+                    BackgroundJob.status == STATUS_DONE,
+                    BackgroundJob.delivered_at.is_(None)
+                ).order_by(BackgroundJob.updated_at, BackgroundJob.id).all()
+                with self._reserved_lock:
+                    jobs = [job for job in jobs if job.id not in self._reserved]
+                    if reserve:
+                        self._reserved.update(job.id for job in jobs)
+                return [
+                    {"job_id": job.id, "messages": (job.result or {}).get("messages", [])}
+                    for job in jobs
+                ]
+            finally:
+                session.close()
+        except Exception as e:
+            logger.error(f"❌ [BackgroundJobService] 读取后台任务结果失败: {e}")
+            return []
+    
+    def mark_delivered(self, job_ids: List[int]) -> int:
+        """
+        把任务结果标记为已投递
+        
+        Args:
+            job_ids: 任务ID列表
+        
+        Returns:
+            本次标记的任务数（已投递过的不重复计数）
+        """
+        if not job_ids:
+            return 0
+        try:
+            session = self.Session()
+            try:
+                count = session.query(BackgroundJob).filter(
+                    BackgroundJob.id.in_(job_ids),
+                    BackgroundJob.delivered_at.is_(None)
+                ).update({"delivered_at": datetime.now()}, synchronize_session=False)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+        except Exception as e:
+            logger.error(f"❌ [BackgroundJobService] 标记后台任务已投递失败: {job_ids}, {e}")
+            self.release(job_ids)
+            return 0
+        
+        self.release(job_ids)
+        self._stats["delivered"] += count
+        return count
+    
+    def release(self, job_ids: List[int]):
+        """释放预留的任务（随之保存的回合消息没有写入数据库），之后的回合重新投递"""
+        with self._reserved_lock:
+            self._reserved.difference_update(job_ids)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取后台任务统计"""
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "workers": len([task for task in self._worker_tasks if not task.done()]),
+            "active": self._active
+        }
+
+
+# 创建全局后台任务服务实例
+background_job_service = BackgroundJobService()
@@ -0,0 +1,228 @@
+"""
+目的地解析 - 按故事建立位置索引，在本地解析移动目的地，必要时为LLM筛选候选位置
+"""
+import re
+import hashlib
+import json
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from .action_router_service import MOVEMENT_PATTERN, PLAYER_ROOM_ALIASES
+from ..utils.config_loader import get_config_section, get_user_name
+
+# 本地直接采用匹配结果的最低分数
+DEFAULT_CONFIDENCE_THRESHOLD = 0.85
+# 最高分需要领先第二名（不同位置）的分数
+DEFAULT_MIN_MARGIN = 0.1
+# 交给LLM的候选位置数量
+DEFAULT_TOP_K = 8
+
+# 目的地末尾常见的语气词和附加动作
+TRAILING_PATTERN = re.compile(r"(?:看看|看一看|一下|一趟|吧|呀|啊|了|呢|去)+$")
+PUNCTUATION_PATTERN = re.compile(r"[\s,，。.!！?？、:：;；\"'“”‘’()（）]+")
+
+
+def normalize_text(text: str) -> str:
+    """归一化：去掉空白和标点，英文转小写"""
+    return PUNCTUATION_PATTERN.sub("", text or "").lower()
+
+
+def char_ngrams(text: str) -> Set[str]:
+    """字符一元和二元组（中文没有分词，按字符n-gram做模糊匹配）"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def extract_destination_text(action: str) -> str:
+    """从移动指令中提取目的地文本，如“我要去客厅看看” -> “客厅”"""
+    text = (action or "").strip()
+    match = MOVEMENT_PATTERN.match(text)
+    if match:
+        text = match.group(1)
+    return TRAILING_PATTERN.sub("", normalize_text(text)) or normalize_text(text)
+
+
+class LocationIndex:
+    """单个故事的位置索引：精确匹配表 + n-gram倒排索引"""
+    
+    def __init__(self, locations: List[Dict[str, Any]], aliases: Optional[Dict[str, List[str]]] = None):
+        """
+        Args:
+            locations: 位置列表（含key、name、en_name、connections）
+            aliases: 位置key -> 别名列表
+        """
+        aliases = aliases or {}
+        self.locations: Dict[str, Dict[str, Any]] = {location["key"]: location for location in locations}
+        self.terms: Dict[str, List[str]] = {}
+        self.exact: Dict[str, str] = {}
+        self.postings: Dict[str, Set[str]] = {}
+        
+        for key, location in self.locations.items():
+            terms = [key, location.get("name"), location.get("en_name"), *aliases.get(key, [])]
+            name = location.get("name") or ""
+            # “林凯房间”也可以说成“林凯的房间”
+            if name.endswith("房间") and len(name) > 2:
+                terms.append(name[:-2] + "的房间")
+            normalized_terms = []
+            for term in terms:
+                term = normalize_text(term)
+                if term and term not in normalized_terms:
+                    normalized_terms.append(term)
+                    self.exact.setdefault(term, key)
+                    for gram in char_ngrams(term):
+                        self.postings.setdefault(gram, set()).add(key)
+            self.terms[key] = normalized_terms
+    
+    def score(self, query: str, key: str) -> float:
+        """计算查询文本与位置的匹配分数（0-1）"""
+        best = 0.0
+        query_grams = char_ngrams(query)
+        for term in self.terms.get(key, []):
+            if term == query:
+                return 1.0
+            if term in query:
+                # 位置名包含在目的地文本中，如“客厅的沙发”中的“客厅”
+                score = 0.85 + 0.1 * len(term) / len(query)
+            elif query in term:
+                # 目的地文本是位置名的一部分，如“厨”之于“厨房”
+                score = 0.5 + 0.35 * len(query) / len(term)
+            else:
+                term_grams = char_ngrams(term)
+                score = 0.8 * 2 * len(query_grams & term_grams) / (len(query_grams) + len(term_grams))
+            best = max(best, score)
+        return best
+    
+    def search(self, query: str, limit: int = DEFAULT_TOP_K) -> List[Tuple[str, float]]:
+        """
+        查找最匹配的位置
+        
+        Args:
+            query: 归一化后的目的地文本
+            limit: 返回数量
+        
+        Returns:
+            [(位置key, 分数)]，按分数从高到低排列
+        """
+        if not query:
+            return []
+        if query in self.exact:
+            matches = [(self.exact[query], 1.0)]
+            limit -= 1
+        else:
+            matches = []
+        
+        candidates: Set[str] = set()
+        for gram in char_ngrams(query):
+            candidates.update(self.postings.get(gram, ()))
+        seen = {key for key, _ in matches}
+        scored = [(key, self.score(query, key)) for key in candidates if key not in seen]
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return matches + [item for item in scored[:max(limit, 0)] if item[1] > 0]
+    
+    def neighbours(self, key: str) -> List[str]:
+        """与位置直接相连的位置"""
+        location = self.locations.get(key) or {}
+        return [neighbour for neighbour in (location.get("connections") or []) if neighbour in self.locations]
+
+
+class DestinationResolver:
+    """目的地解析器 - 缓存各故事的位置索引，位置数据变化时自动重建"""
+    
+    def __init__(self):
+        resolver_config = get_config_section("destination_resolver")
+        self.enabled = resolver_config.get("enabled", True)
+        self.confidence_threshold = float(resolver_config.get("confidence_threshold", DEFAULT_CONFIDENCE_THRESHOLD))
+        self.min_margin = float(resolver_config.get("min_margin", DEFAULT_MIN_MARGIN))
+        self.top_k = int(resolver_config.get("top_k", DEFAULT_TOP_K))
+        self.aliases: Dict[str, List[str]] = resolver_config.get("aliases", {})
+        self._indexes: Dict[Any, Tuple[str, LocationIndex]] = {}
+        self._stats = {"resolved_locally": 0, "llm_fallbacks": 0, "index_builds": 0}
+    
+    def get_index(self, story_id: int, locations: List[Dict[str, Any]]) -> LocationIndex:
+        """
+        获取故事的位置索引（位置数据未变化时复用已构建的索引）
+        
+        Args:
+            story_id: 故事ID
+            locations: 故事的位置列表，由调用方通过 aget_locations_by_story 异步读取
+        
+        Returns:
+            位置索引
+        """
+        fingerprint = self._fingerprint(locations)
+        cached = self._indexes.get(story_id)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+        
+        index = LocationIndex(locations, self._story_aliases(locations))
+        self._indexes[story_id] = (fingerprint, index)
+        self._stats["index_builds"] += 1
+        return index
+    
+    def _story_aliases(self, locations: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        """配置的别名，加上玩家房间的指代说法"""
+        aliases = {key: list(values) for key, values in self.aliases.items()}
+        player_room = f"{get_user_name()}房间"
+        for location in locations:
+            if location.get("name") == player_room:
+                aliases.setdefault(location["key"], []).extend(PLAYER_ROOM_ALIASES)
+        return aliases
+    
+    @staticmethod
+    def _fingerprint(locations: List[Dict[str, Any]]) -> str:
+        raw = json.dumps([
+            (location.get("key"), location.get("name"), location.get("en_name"), location.get("connections"))
+            for location in locations
+        ], ensure_ascii=False, sort_keys=True)
+        return hashlib.md5(raw.encode("utf-8")).hexdigest()
+    
+    def resolve(self, action: str, index: LocationIndex) -> Dict[str, Any]:
+        """
+        在本地解析目的地
+        
+        Args:
+            action: 玩家行动
+            index: 位置索引
+        
+        Returns:
+            {"destination_key": 置信时的位置key否则为None, "matches": [(位置key, 分数)]}
+        """
+        query = extract_destination_text(action)
+        matches = index.search(query, self.top_k)
+        destination_key = None
+        if self.enabled and matches and matches[0][1] >= self.confidence_threshold:
+            runner_up = matches[1][1] if len(matches) > 1 else 0.0
+            if matches[0][1] - runner_up >= self.min_margin:
+                destination_key = matches[0][0]
+        
+        if destination_key:
+            self._stats["resolved_locally"] += 1
+        else:
+            self._stats["llm_fallbacks"] += 1
+        return {"query": query, "destination_key": destination_key, "matches": matches}
+    
+    def candidate_keys(self, index: LocationIndex, matches: List[Tuple[str, float]], current_location: str) -> List[str]:
+        """
+        交给LLM的候选位置：匹配度最高的top_k个，加上当前位置和最佳匹配的相邻位置
+        
+        Args:
+            index: 位置索引
+            matches: 本地匹配结果
+            current_location: 玩家当前位置key
+        
+        Returns:
+            去重后的候选位置key
+        """
+        keys = [key for key, _ in matches[:self.top_k]]
+        keys += index.neighbours(current_location)
+        if matches:
+            keys += index.neighbours(matches[0][0])
+        return list(dict.fromkeys(key for key in keys if key != current_location))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取解析统计"""
+        return {**self._stats, "indexed_stories": len(self._indexes)}
+
+
+# 创建全局目的地解析器实例
+destination_resolver = DestinationResolver()
@@ -4,32 +4,62 @@
 import re
 import json
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable, Awaitable
 from datetime import datetime, timedelta
 from langchain_core.output_parsers import JsonOutputParser
 
 from ..models.game_state_model import GameStateModel
 from ..prompts.prompt_templates import PromptTemplates
-from ..utils.llm_client import LLMClient
+from ..utils.llm_client import llm_client
+from ..utils.llm_gateway import llm_gateway
+from .dialogue_summary_service import dialogue_summary_service
+from .background_job_service import background_job_service
+from .state_service import StateService
+from ..utils.async_dag import AsyncDAGExecutor
+from ..database.config import run_in_db_thread
+from ..utils.llm_admission import LLMOverloadedError
+from ..utils.stream_events import EventCallback, emit_event, EVENT_TOKEN, EVENT_MESSAGE
 
 logger = logging.getLogger(__name__)
 
+# 支持的对话格式（行动路由的规则快速路径也复用这些正则）
+DIALOGUE_PATTERNS = [
+    r"和(.+?)说话?[:：](.+)",  # "和林若曦说话：一会来我房间陪我打会游戏呗"
+    r"对(.+?)说[:：](.+)",    # "对林若曦说：你好"
+    r"跟(.+?)说[:：](.+)",    # "跟林若曦说：你好"
+    r"告诉(.+?)[:：](.+)",    # "告诉林若曦：你好"
+]
+
+# 对话后的计划表分析在后台任务中执行，结果在下一回合投递
+SCHEDULE_UPDATE_JOB = "schedule_update"
+
 
 class DialogueService:
     """对话服务类"""
     
     def __init__(self):
-        self.llm_client = LLMClient()
+        self.llm_client = llm_client
+        self.llm_gateway = llm_gateway
+        self.summary_service = dialogue_summary_service
         self.prompt_templates = PromptTemplates()
         self.json_parser = JsonOutputParser()
+        self.job_service = background_job_service
+        self.state_service = StateService()
+        self.job_service.register(SCHEDULE_UPDATE_JOB, self.run_schedule_update_job)
     
-    async def process_dialogue(self, action: str, game_state: GameStateModel) -> Dict[str, Any]:
+    async def process_dialogue(self, action: str, game_state: GameStateModel,
+                               on_event: EventCallback = None, target_npc: Optional[str] = None,
+                               message: Optional[str] = None, user_id: Optional[int] = None) -> Dict[str, Any]:
         """
         处理对话行动的主入口方法
         
         Args:
             action: 玩家的对话行动
             game_state: 游戏状态
+            on_event: 流式事件回调（可选），NPC回复按增量文本推送
+            target_npc: 回合规划给出的对话对象（可选）
+            message: 回合规划给出的对话内容（可选），与target_npc同时提供时不再解析行动文本
+            user_id: 用户ID，后台计划表任务据此读写该会话的游戏状态
             
         Returns:
             处理结果
@@ -38,7 +68,10 @@ class DialogueService:
             print(f"\n💬 [DialogueService] 处理对话行动: {action}")
             
             # 解析对话行动
-            dialogue_info = self.parse_dialogue_action(action)
+            if target_npc and message:
+                dialogue_info = {"npc": target_npc, "message": message}
+            else:
+                dialogue_info = self.parse_dialogue_action(action)
             if not dialogue_info:
                 return {
                     "success": False,
@@ -53,7 +86,7 @@ class DialogueService:
             print(f"  💭 玩家消息: {player_message}")
             
             # 检查NPC是否在当前位置
-            current_npcs = self._get_npcs_at_current_location(game_state)
+            current_npcs = await run_in_db_thread(self._get_npcs_at_current_location, game_state)
             if npc_name not in current_npcs:
                 return {
                     "success": False,
@@ -61,23 +94,71 @@ class DialogueService:
                     "messages": []
                 }
             
-            # 生成NPC对话响应
-            npc_response = await self.generate_npc_dialogue(npc_name, player_message, game_state)
-            
-            # 生成对话场景的五感反馈
-            dialogue_sensory_feedback = await self.generate_dialogue_sensory_feedback(
-                npc_name, player_message, npc_response, game_state
+            async def on_token(delta: str):
+                await emit_event(on_event, EVENT_TOKEN, speaker=npc_name, delta=delta)
+            
+            async def sensory_feedback_step(npc_response: str) -> Optional[str]:
+                feedback = await self.generate_dialogue_sensory_feedback(
+                    npc_name, player_message, npc_response, game_state
+                )
+                if feedback:
+                    await emit_event(on_event, EVENT_MESSAGE, message={
+                        "speaker": "系统", "message": feedback, "type": "sensory_feedback"
+                    })
+                return feedback
+            
+            # NPC回复生成后，五感反馈和计划表分析互不依赖，并发执行
+            # （启用后台任务时计划表分析不在本回合执行，回复返回前只写入任务）
+            dag = AsyncDAGExecutor("dialogue")
+            dag.add_step(
+                "npc_response",
+                lambda: self.generate_npc_dialogue(
+                    npc_name, player_message, game_state, on_token=on_token if on_event else None
+                ),
+                default=f"抱歉，{npc_name}现在无法回应。",
+                required=True
             )
-            
-            # 尝试更新NPC计划表
-            schedule_updated = await self.analyze_and_update_schedule(
-                npc_name, player_message, npc_response, game_state
+            dag.add_step(
+                "sensory_feedback",
+                sensory_feedback_step,
+                depends_on=["npc_response"],
+                default=None
             )
+            if not self.job_service.enabled:
+                dag.add_step(
+                    "schedule_updated",
+                    lambda npc_response: self.analyze_and_update_schedule(
+                        npc_name, player_message, npc_response, game_state
+                    ),
+                    depends_on=["npc_response"],
+                    default=False
+                )
+            dag_result = await dag.run()
+            # LLM过载时不使用兜底回复，由上层返回503
+            if isinstance(dag_result.exceptions.get("npc_response"), LLMOverloadedError):
+                raise dag_result.exceptions["npc_response"]
+            
+            npc_response = dag_result.get("npc_response")
+            dialogue_sensory_feedback = dag_result.get("sensory_feedback")
+            schedule_updated = dag_result.get("schedule_updated", False)
             
             # 计算对话耗时
             time_cost = self._calculate_dialogue_time(player_message, npc_response)
             new_time = self._advance_game_time(game_state.current_time, time_cost)
             
+            schedule_job_id = None
+            if self.job_service.enabled:
+                schedule_job_id = await self.job_service.enqueue(SCHEDULE_UPDATE_JOB, {
+                    "session_id": game_state.session_id,
+                    "story_id": game_state.story_id,
+                    "user_id": user_id,
+                    "npc_name": npc_name,
+                    "player_message": player_message,
+                    "npc_response": npc_response,
+                    "current_time": game_state.current_time,
+                    "message_time": new_time
+                }, session_id=game_state.session_id, story_id=game_state.story_id)
+            
             messages = [
                 {"speaker": npc_name, "message": npc_response, "type": "dialogue", "timestamp": new_time}
             ]
@@ -106,9 +187,12 @@ class DialogueService:
                 "time_cost": time_cost,
                 "npc_name": npc_name,
                 "schedule_updated": schedule_updated,
+                "schedule_job_id": schedule_job_id,
                 "dialogue_sensory_feedback": dialogue_sensory_feedback
             }
             
+        except LLMOverloadedError:
+            raise
         except Exception as e:
             logger.error(f"❌ 对话处理失败: {e}")
             import traceback
@@ -122,8 +206,7 @@ class DialogueService:
     def _get_npcs_at_current_location(self, game_state: GameStateModel) -> List[str]:
         """获取当前位置的NPC列表"""
         try:
-            from .location_service import LocationService
-            location_service = LocationService()
+            from .location_service import location_service
             npc_objects = location_service.get_npcs_at_location(
                 game_state.player_location,
                 game_state.npc_locations,
@@ -170,15 +253,7 @@ class DialogueService:
             解析结果字典，包含npc和message字段，如果不是对话行动则返回None
         """
         try:
-            # 支持多种对话格式
-            patterns = [
-                r"和(.+?)说话?[:：](.+)",  # "和林若曦说话：一会来我房间陪我打会游戏呗"
-                r"对(.+?)说[:：](.+)",    # "对林若曦说：你好"
-                r"跟(.+?)说[:：](.+)",    # "跟林若曦说：你好"
-                r"告诉(.+?)[:：](.+)",    # "告诉林若曦：你好"
-            ]
-            
-            for pattern in patterns:
+            for pattern in DIALOGUE_PATTERNS:
                 match = re.search(pattern, action)
                 if match:
                     npc_name = match.group(1).strip()
@@ -198,7 +273,8 @@ class DialogueService:
             return None
     
     async def generate_npc_dialogue(self, npc_name: str, player_message: str, 
-                                  game_state: GameStateModel) -> str:
+                                  game_state: GameStateModel,
+                                  on_token: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
         """
         生成NPC对话响应
         
@@ -206,27 +282,28 @@ class DialogueService:
             npc_name: NPC名称
             player_message: 玩家消息
             game_state: 游戏状态
+            on_token: 增量文本回调（可选）
             
         Returns:
             NPC的对话响应
         """
         try:
             # 获取NPC信息 - 从数据库获取
-            from .npc_service import NPCService
-            npc_service = NPCService()
-            npc_info = npc_service.get_npc_by_name(npc_name, game_state.story_id)
+            from .npc_service import npc_service
+            npc_info = await run_in_db_thread(npc_service.get_npc_by_name, npc_name, game_state.story_id)
             
             if not npc_info:
                 return f"抱歉，我不知道{npc_name}是谁。"
             
             # 获取NPC当前状态和事件
-            current_location, current_event = npc_service.get_npc_current_location_and_event(
-                npc_name, game_state.current_time, game_state
+            current_location, current_event = await run_in_db_thread(
+                npc_service.get_npc_current_location_and_event, npc_name, game_state.current_time, game_state
             )
             
-            # 获取对话历史
+            # 获取最近的对话和更早对话的摘要
             dialogue_history = game_state.npc_dialogue_histories.get(npc_name, [])
-            recent_history = dialogue_history[-5:] if dialogue_history else []
+            recent_history = dialogue_history[-self.summary_service.recent_entries:] if dialogue_history else []
+            dialogue_summary = await self.summary_service.get_summary(game_state.session_id, game_state.story_id, npc_name)
             
             # 构建提示词
             prompt = self.prompt_templates.get_npc_dialogue_prompt(
@@ -244,7 +321,7 @@ class DialogueService:
                 other_npcs_info="",  # 可以后续补充
                 player_personality=game_state.player_personality,
                 history_str=str(recent_history),
-                dialogue_summary="",  # 可以后续补充
+                dialogue_summary=self.summary_service.format_for_prompt(dialogue_summary),
                 message=player_message
             )
             
@@ -252,7 +329,7 @@ class DialogueService:
             logger.info(f"📝 输入提示词:\n{prompt}")
             
             # 调用LLM生成对话
-            response = await self.llm_client.chat_completion(prompt)
+            response = await self.llm_client.chat_completion(prompt, task="npc_dialogue", on_token=on_token)
             
             logger.info(f"🤖 LLM原始响应:\n{response}")
             
@@ -260,10 +337,16 @@ class DialogueService:
             if npc_name not in game_state.npc_dialogue_histories:
                 game_state.npc_dialogue_histories[npc_name] = []
             
-            game_state.npc_dialogue_histories[npc_name].extend([
+            new_entries = [
                 {"speaker": "玩家", "message": player_message},
                 {"speaker": npc_name, "message": response}
-            ])
+            ]
+            game_state.npc_dialogue_histories[npc_name].extend(new_entries)
+            
+            # 移出最近窗口的对话在后台并入摘要
+            evicted = self.summary_service.split_history(game_state.npc_dialogue_histories[npc_name], len(new_entries))
+            self.summary_service.schedule_fold(game_state.session_id, game_state.story_id, npc_name, evicted,
+                                               player_name="林凯")
             
             # 保持对话历史不超过20条
             if len(game_state.npc_dialogue_histories[npc_name]) > 20:
@@ -273,31 +356,67 @@ class DialogueService:
             logger.info(f"✅ NPC对话生成成功: {npc_name} -> {response[:50]}...")
             return response
             
+        except LLMOverloadedError:
+            raise
         except Exception as e:
             logger.error(f"❌ NPC对话生成失败: {e}")
             import traceback
             traceback.print_exc()
             return f"抱歉，{npc_name}现在无法回应。"
     
+    async def run_schedule_update_job(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        后台任务：分析对话并更新该会话中NPC的计划表，LLM调用、解析或保存失败时抛出异常以便重试
+        
+        Args:
+            payload: 任务参数（session_id、story_id、user_id、npc_name、player_message、npc_response、current_time、message_time）
+            
+        Returns:
+            计划表有变化时返回需要在下一回合投递给玩家的消息
+        """
+        npc_name = payload["npc_name"]
+        session_id = payload.get("session_id", "default")
+        story_id = payload.get("story_id")
+        user_id = payload.get("user_id")
+        # 读取会话的游戏状态，与同时进行的回合并发写入时合并后保存
+        game_state = await self.state_service.get_game_state(session_id, user_id, story_id)
+        base_state = self.state_service.capture(game_state)
+        updated = await self.analyze_and_update_schedule(
+            npc_name, payload["player_message"], payload["npc_response"], game_state,
+            raise_errors=True, current_time=payload["current_time"]
+        )
+        if not updated:
+            return None
+        if not await self.state_service.save_merged(session_id, game_state, base_state, story_id, user_id):
+            raise RuntimeError(f"保存{npc_name}的计划表失败")
+        return {"messages": [{
+            "speaker": "系统",
+            "message": f"{npc_name}的计划发生了变化。",
+            "type": "system",
+            "timestamp": payload.get("message_time", payload["current_time"])
+        }]}
+    
     async def analyze_and_update_schedule(self, npc_name: str, player_message: str, 
-                                        npc_response: str, game_state: GameStateModel) -> bool:
+                                        npc_response: str, game_state: GameStateModel,
+                                        raise_errors: bool = False, current_time: Optional[str] = None) -> bool:
         """
-        分析对话内容并更新NPC计划表
+        分析对话内容并更新NPC计划表（更新game_state中的动态计划表并写入数据库）
         
         Args:
             npc_name: NPC名称
             player_message: 玩家消息
             npc_response: NPC响应
             game_state: 游戏状态
+            raise_errors: LLM调用失败、响应无法解析等异常是否抛出（后台任务据此重试），默认记录日志后返回False
+            current_time: 对话发生时的游戏时间，默认为game_state的当前时间
             
         Returns:
             是否更新了计划表
         """
         try:
-            # 获取NPC当前计划表
-            from .npc_service import NPCService
-            npc_service = NPCService()
-            current_schedule = npc_service.get_npc_schedule(npc_name)
+            # 获取NPC当前有效的计划表（优先动态计划表）
+            from .npc_service import npc_service
+            current_schedule = await run_in_db_thread(npc_service.get_npc_current_schedule, npc_name, game_state)
             
             if not current_schedule:
                 logger.warning(f"未找到{npc_name}的计划表")
@@ -313,15 +432,15 @@ class DialogueService:
                 npc_name=npc_name,
                 player_message=player_message,
                 npc_reply=npc_response,
-                current_time=game_state.current_time,
+                current_time=current_time or game_state.current_time,
                 current_schedule=str(current_schedule)
             )
             
             logger.info(f"🤖 [DialogueService] 调用LLM分析计划表更新")
             logger.info(f"📝 输入提示词:\n{prompt}")
             
-            # 调用LLM分析
-            response = await self.llm_client.chat_completion(prompt)
+            # 直接调用网关，LLM失败时抛出异常而不是返回兜底文本
+            response = await self.llm_gateway.ainvoke(prompt, task="schedule_update")
             
             logger.info(f"🤖 LLM原始响应:\n{response}")
             
@@ -339,7 +458,7 @@ class DialogueService:
                     
                     if new_schedule and isinstance(new_schedule, list):
                         # 更新完整计划表
-                        npc_service.replace_npc_complete_schedule(npc_name, new_schedule, game_state)
+                        await run_in_db_thread(npc_service.replace_npc_complete_schedule, npc_name, new_schedule, game_state)
                         
                         logger.info(f"✅ 已更新{npc_name}的完整计划表")
                         logger.info(f"📋 新计划表: {new_schedule}")
@@ -354,10 +473,14 @@ class DialogueService:
             except Exception as parse_error:
                 logger.error(f"解析LLM响应失败: {parse_error}")
                 logger.error(f"原始响应: {response}")
+                if raise_errors:
+                    raise
                 return False
                 
         except Exception as e:
             logger.error(f"❌ 计划表更新分析失败: {e}")
+            if raise_errors:
+                raise
             import traceback
             traceback.print_exc()
             return False
@@ -380,17 +503,16 @@ class DialogueService:
             logger.info(f"🌟 [DialogueService] 生成对话五感反馈: {npc_name}")
             
             # 获取NPC信息 - 从数据库获取
-            from .npc_service import NPCService
-            npc_service = NPCService()
-            npc_info = npc_service.get_npc_by_name(npc_name, game_state.story_id)
+            from .npc_service import npc_service
+            npc_info = await run_in_db_thread(npc_service.get_npc_by_name, npc_name, game_state.story_id)
             
             # 获取当前位置信息
             from data.locations import all_locations_data
             location_data = all_locations_data.get(game_state.player_location, {})
             
             # 获取NPC当前状态和事件
-            current_location, current_event = npc_service.get_npc_current_location_and_event(
-                npc_name, game_state.current_time, game_state
+            current_location, current_event = await run_in_db_thread(
+                npc_service.get_npc_current_location_and_event, npc_name, game_state.current_time, game_state
             )
             
             # 构建对话五感反馈提示词
@@ -409,7 +531,7 @@ class DialogueService:
             logger.info(f"📝 对话五感反馈提示词:\n{prompt}")
             
             # 调用LLM生成五感反馈
-            response = await self.llm_client.chat_completion(prompt)
+            response = await self.llm_client.chat_completion(prompt, task="dialogue_sensory_feedback")
             
             logger.info(f"🤖 对话五感反馈LLM响应:\n{response}")
             
@@ -0,0 +1,250 @@
+"""
+对话摘要服务 - 把移出最近窗口的NPC对话滚动合并为摘要，保持对话提示词长度稳定
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime
+from sqlalchemy.orm import sessionmaker
+
+from ..database.config import get_engine, run_in_db_thread
+from ..database.models import DialogueSummary
+from ..prompts.prompt_templates import PromptTemplates
+from ..utils.llm_gateway import llm_gateway
+from ..utils.config_loader import get_config_section
+
+logger = logging.getLogger(__name__)
+
+# 对话提示词中保留的最近对话条数（玩家和NPC各算一条）
+DEFAULT_RECENT_ENTRIES = 6
+# 摘要最大字符数，超出时截断，防止摘要本身无限增长
+DEFAULT_MAX_SUMMARY_CHARS = 600
+# 内存中保留摘要的(会话, 故事, NPC)数量上限，超出时淘汰最久未使用的，下次使用时从数据库重新读取
+DEFAULT_MAX_ENTRIES = 1000
+# 摘要生成失败后每个NPC保留等待下次合并的对话条数上限
+DEFAULT_MAX_PENDING_ENTRIES = 40
+
+SummaryKey = Tuple[str, Optional[int], str]
+
+
+class DialogueSummaryService:
+    """对话摘要服务 - 按(会话, 故事, NPC)维护滚动摘要并持久化到数据库"""
+    
+    def __init__(self, engine=None):
+        self.engine = engine or get_engine()
+        self.Session = sessionmaker(bind=self.engine)
+        self.llm_gateway = llm_gateway
+        self.prompt_templates = PromptTemplates()
+        
+        summary_config = get_config_section("dialogue_summary")
+        self.enabled = summary_config.get("enabled", True)
+        self.recent_entries = max(int(summary_config.get("recent_entries", DEFAULT_RECENT_ENTRIES)), 2)
+        self.max_summary_chars = int(summary_config.get("max_summary_chars", DEFAULT_MAX_SUMMARY_CHARS))
+        self.max_entries = max(int(summary_config.get("max_entries", DEFAULT_MAX_ENTRIES)), 1)
+        self.max_pending_entries = int(summary_config.get("max_pending_entries", DEFAULT_MAX_PENDING_ENTRIES))
+        
+        # 按最近使用排序，超出上限时淘汰最久未使用的条目
+        self._summaries: "OrderedDict[SummaryKey, str]" = OrderedDict()
+        self._locks: Dict[SummaryKey, asyncio.Lock] = {}
+        # 摘要生成失败时移出窗口的对话留到下次合并
+        self._pending: Dict[SummaryKey, List[Dict[str, str]]] = {}
+        self._tasks: set = set()
+        self._stats = {"scheduled": 0, "folded": 0, "failed": 0, "evicted": 0, "dropped_entries": 0}
+    
+    async def get_summary(self, session_id: str, story_id: Optional[int], npc_name: str) -> str:
+        """
+        获取NPC对话摘要（先查内存，未命中时在数据库线程池中读取）
+        
+        Args:
+            session_id: 会话ID
+            story_id: 故事ID
+            npc_name: NPC名称
+        
+        Returns:
+            摘要文本，没有摘要时为空字符串
+        """
+        key = (session_id, story_id, npc_name)
+        if key not in self._summaries:
+            record = await run_in_db_thread(self._load_record, key)
+            # 读取期间合并完成的摘要更新，不用数据库中的旧值覆盖
+            self._summaries.setdefault(key, record.summary if record else "")
+        self._summaries.move_to_end(key)
+        summary = self._summaries[key]
+        self._evict()
+        return summary
+    
+    def format_for_prompt(self, summary: str) -> str:
+        """把摘要包装为对话提示词中的片段，没有摘要时返回空字符串"""
+        if not summary:
+            return ""
+        return f"<较早的对话摘要>\n{summary}\n</较早的对话摘要>"
+    
+    def split_history(self, history: List[Dict[str, str]], new_count: int) -> List[Dict[str, str]]:
+        """
+        计算本轮新增对话后移出最近窗口的对话
+        
+        Args:
+            history: 已追加新对话的完整历史
+            new_count: 本轮新增的条数
+        
+        Returns:
+            刚移出最近窗口、需要并入摘要的对话
+        """
+        return history[-(self.recent_entries + new_count):-self.recent_entries]
+    
+    def schedule_fold(self, session_id: str, story_id: Optional[int], npc_name: str,
+                      evicted: List[Dict[str, str]], player_name: str = "玩家") -> Optional[asyncio.Task]:
+        """
+        在后台把移出窗口的对话并入摘要，不阻塞当前对话的响应
+        
+        Args:
+            session_id: 会话ID
+            story_id: 故事ID
+            npc_name: NPC名称
+            evicted: 需要并入摘要的对话
+            player_name: 玩家名称
+        
+        Returns:
+            后台任务，没有需要合并的对话时为None
+        """
+        if not self.enabled or not evicted:
+            return None
+        
+        task = asyncio.ensure_future(self.fold(session_id, story_id, npc_name, evicted, player_name))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self._stats["scheduled"] += 1
+        return task
+    
+    async def fold(self, session_id: str, story_id: Optional[int], npc_name: str,
+                   evicted: List[Dict[str, str]], player_name: str = "玩家") -> str:
+        """
+        把对话并入摘要并保存（同一NPC的合并按顺序执行）
+        
+        Args:
+            session_id: 会话ID
+            story_id: 故事ID
+            npc_name: NPC名称
+            evicted: 需要并入摘要的对话
+            player_name: 玩家名称
+        
+        Returns:
+            新摘要，失败时返回原摘要（对话留到下次合并）
+        """
+        key = (session_id, story_id, npc_name)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            previous = await self.get_summary(session_id, story_id, npc_name)
+            entries = self._pending.pop(key, []) + list(evicted)
+            dialogue_lines = "\n".join(
+                f"{entry.get('speaker', '')}：{entry.get('message', '')}" for entry in entries
+            )
+            try:
+                prompt = self.prompt_templates.get_dialogue_summary_prompt(
+                    npc_name=npc_name,
+                    player_name=player_name,
+                    previous_summary=previous or "（暂无）",
+                    dialogue_lines=dialogue_lines
+                )
+                # 直接调用网关，LLM失败时抛出异常而不是返回兜底文本
+                summary = str(await self.llm_gateway.ainvoke(prompt, task="dialogue_summary")).strip()
+                if not summary:
+                    raise ValueError("摘要为空")
+            except Exception as e:
+                self._stats["failed"] += 1
+                self._keep_pending(key, entries)
+                logger.error(f"❌ [DialogueSummaryService] 生成对话摘要失败: {npc_name}, {e}")
+                return previous
+            
+            summary = summary[:self.max_summary_chars]
+            self._summaries[key] = summary
+            await run_in_db_thread(self._save_record, key, summary, len(entries))
+            self._stats["folded"] += 1
+            logger.info(f"📝 [DialogueSummaryService] 更新对话摘要: {npc_name}, 并入{len(entries)}条, 摘要{len(summary)}字")
+            return summary
+    
+    def _keep_pending(self, key: SummaryKey, entries: List[Dict[str, str]]):
+        """保留未能并入摘要的对话，超出上限时丢弃最早的"""
+        dropped = max(len(entries) - self.max_pending_entries, 0)
+        if dropped:
+            self._stats["dropped_entries"] += dropped
+            logger.warning(f"⚠️ [DialogueSummaryService] 待合并对话超出上限，丢弃最早的{dropped}条: {key[2]}")
+        if entries[dropped:]:
+            self._pending[key] = entries[dropped:]
+    
+    def _evict(self):
+        """超出上限时淘汰最久未使用的摘要，正在合并的跳过"""
+        for key in list(self._summaries):
+            if len(self._summaries) <= self.max_entries:
+                break
+            lock = self._locks.get(key)
+            if lock is not None and lock.locked():
+                continue
+            del self._summaries[key]
+            self._locks.pop(key, None)
+            self._stats["dropped_entries"] += len(self._pending.pop(key, []))
+            self._stats["evicted"] += 1
+    
+    async def drain(self):
+        """等待所有后台摘要任务完成"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+    
+    def _load_record(self, key: SummaryKey) -> Optional[DialogueSummary]:
+        """从数据库读取摘要记录"""
+        session_id, story_id, npc_name = key
+        try:
+            session = self.Session()
+            try:
+                return session.query(DialogueSummary).filter(
+                    DialogueSummary.session_id == session_id,
+                    DialogueSummary.story_id == story_id,
+                    DialogueSummary.npc_name == npc_name
+                ).first()
+            finally:
+                session.close()
+        except Exception as e:
+            logger.error(f"❌ [DialogueSummaryService] 读取对话摘要失败: {e}")
+            return None
+    
+    def _save_record(self, key: SummaryKey, summary: str, entries: int):
+        """保存摘要记录（不存在时创建）"""
+        session_id, story_id, npc_name = key
+        try:
+            session = self.Session()
+            try:
+                record = session.query(DialogueSummary).filter(
+                    DialogueSummary.session_id == session_id,
+                    DialogueSummary.story_id == story_id,
+                    DialogueSummary.npc_name == npc_name
+                ).first()
+                if record is None:
+                    record = DialogueSummary(session_id=session_id, story_id=story_id, npc_name=npc_name,
+                                             summarized_entries=0)
+                    session.add(record)
+                record.summary = summary
+                record.summarized_entries = (record.summarized_entries or 0) + entries
+                record.updated_at = datetime.now()
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+        except Exception as e:
+            logger.error(f"❌ [DialogueSummaryService] 保存对话摘要失败: {e}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取摘要统计"""
+        return {
+            **self._stats,
+            "pending": len(self._tasks),
+            "cached": len(self._summaries),
+            "pending_entries": sum(len(entries) for entries in self._pending.values()),
+            "recent_entries": self.recent_entries
+        }
+
+
+# 创建全局对话摘要服务实例
+dialogue_summary_service = DialogueSummaryService()
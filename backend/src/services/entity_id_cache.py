@@ -0,0 +1,102 @@
+"""
+实体ID缓存 - 按故事缓存位置键名和NPC名称到entities表ID的映射，保存消息时不再逐条查询实体
+"""
+import logging
+from typing import Dict, Any, Optional
+
+from sqlalchemy import select
+
+from ..database.models import Entity
+from ..utils.config_loader import get_config_section
+from ..utils.llm_cache import TTLLRUCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_STORIES = 64
+# 兜底过期时间：不经过LocationDBService/NPCDBService修改的实体（如数据迁移）最多延迟这么久生效
+DEFAULT_TTL_SECONDS = 3600
+
+EntityIds = Dict[str, Dict[str, int]]
+
+
+class EntityIdCache:
+    """实体ID缓存 - 首次使用时用一次查询加载整个故事的映射，位置或NPC增删改时按故事失效"""
+    
+    def __init__(self):
+        cache_config = get_config_section("entity_id_cache")
+        self.enabled = cache_config.get("enabled", True)
+        self.ttl = float(cache_config.get("ttl_seconds", DEFAULT_TTL_SECONDS))
+        self._cache = TTLLRUCache(int(cache_config.get("max_stories", DEFAULT_MAX_STORIES)))
+        # 每个故事的失效次数，加载期间发生失效时不缓存加载结果
+        self._generations: Dict[Any, int] = {}
+        self._stats = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0}
+    
+    async def get_story_ids(self, session, story_id: int) -> EntityIds:
+        """
+        获取故事的实体ID映射（未缓存时从数据库加载）
+        
+        Args:
+            session: 异步数据库会话
+            story_id: 故事ID
+        
+        Returns:
+            {"locations": {位置键名: 实体ID}, "npcs": {NPC名称: 实体ID}}，同名时取最早创建的实体
+        """
+        key = str(story_id)
+        hit, ids = self._cache.get(key)
+        if hit:
+            self._stats["hits"] += 1
+            return ids
+        
+        self._stats["misses"] += 1
+        generation = self._generations.get(story_id, 0)
+        rows = await session.execute(
+            select(Entity.entity_type, Entity.key_name, Entity.name, Entity.id).where(
+                Entity.story_id == story_id,
+                Entity.entity_type.in_((1, 2))  # npc, location
+            ).order_by(Entity.id)
+        )
+        ids = {"locations": {}, "npcs": {}}
+        for entity_type, key_name, name, entity_id in rows:
+            if entity_type == 2 and key_name:
+                ids["locations"].setdefault(key_name, entity_id)
+            elif entity_type == 1:
+                ids["npcs"].setdefault(name, entity_id)
+        self._stats["loads"] += 1
+        
+        if self._generations.get(story_id, 0) == generation:
+            self._cache.set(key, ids, self.ttl)
+        return ids
+    
+    async def get_location_id(self, session, story_id: int, location_key: Optional[str]) -> Optional[int]:
+        """获取位置实体ID"""
+        if not location_key:
+            return None
+        return (await self.get_story_ids(session, story_id))["locations"].get(location_key)
+    
+    async def get_npc_id(self, session, story_id: int, npc_name: Optional[str]) -> Optional[int]:
+        """获取NPC实体ID"""
+        if not npc_name:
+            return None
+        return (await self.get_story_ids(session, story_id))["npcs"].get(npc_name)
+    
+    def invalidate(self, story_id: int):
+        """故事的位置或NPC发生变化时清除该故事的映射"""
+        self._generations[story_id] = self._generations.get(story_id, 0) + 1
+        self._cache.delete(str(story_id))
+        self._stats["invalidations"] += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取实体ID缓存统计"""
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            "stories": len(self._cache),
+            "entries": sum(len(ids["locations"]) + len(ids["npcs"]) for ids in self._cache.values())
+        }
+
+
+# 创建全局实体ID缓存实例
+entity_id_cache = EntityIdCache()
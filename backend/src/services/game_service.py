@@ -3,8 +3,10 @@
 """
 import sys
 import os
+import copy
+import asyncio
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
 # 添加路径
@@ -25,11 +27,24 @@ from .state_service import StateService
 from .action_router_service import ActionRouterService
 from .dialogue_service import DialogueService
 from .movement_service import MovementService
-from .location_service import LocationService
-from .npc_service import NPCService
-from .llm_service import LLMService
+from .location_service import location_service
+from .npc_service import npc_service
+from .llm_service import llm_service
 from ..prompts.prompt_templates import PromptTemplates
 from .message_service import message_service
+from .message_journal import message_journal, SavedCallback
+from .arrival_prefetcher import arrival_prefetcher
+from .background_job_service import background_job_service
+from ..utils.async_dag import AsyncDAGExecutor
+from ..database.config import run_in_db_thread
+from ..utils.compound_planner import plan_stages, get_access, NPC_STATE_FIELDS
+from ..utils.time_estimator import time_estimator
+from ..utils.llm_gateway import llm_gateway
+from ..utils.llm_admission import LLMOverloadedError
+from ..utils.stream_events import (
+    EventCallback, emit_event, encode_sse, OrderedEventRelay,
+    EVENT_ROUTE, EVENT_STATE, EVENT_ERROR, EVENT_DONE
+)
 
 
 class GameService:
@@ -41,12 +56,29 @@ class GameService:
         self.action_router_service = ActionRouterService()
         self.dialogue_service = DialogueService()
         self.movement_service = MovementService()
-        self.location_service = LocationService()
-        self.npc_service = NPCService()
-        self.llm_service = LLMService()
+        self.location_service = location_service
+        self.npc_service = npc_service
+        self.llm_service = llm_service
         self.message_service = message_service
+        self.message_journal = message_journal
+        self.time_estimator = time_estimator
+        self.job_service = background_job_service
+        self._shadow_tasks: set = set()
+        # 流式连接断开后仍在后台处理的行动（持有引用，避免任务被回收）
+        self._stream_tasks: set = set()
     
-    async def process_action(self, action: str, session_id: str = "default", story_id: int = None) -> Dict[str, Any]:
+    def check_capacity(self):
+        """
+        入口准入检查：所有LLM提供商的并发名额和等待队列都已用完时直接拒绝新行动
+        
+        Raises:
+            LLMOverloadedError: LLM服务过载，retry_after为建议的重试等待秒数
+        """
+        if llm_gateway.is_overloaded():
+            raise LLMOverloadedError("LLM服务繁忙，请稍后重试", llm_gateway.pool.retry_after())
+    
+    async def process_action(self, action: str, session_id: str = "default", story_id: int = None,
+                             on_event: EventCallback = None) -> Dict[str, Any]:
         """
         处理玩家行动
         
@@ -54,10 +86,17 @@ class GameService:
             action: 玩家行动描述
             session_id: 会话ID
             story_id: 故事ID
+            on_event: 流式事件回调（可选），用于推送路由结果、移动步骤和NPC回复文本
             
         Returns:
             处理结果
+        
+        Raises:
+            LLMOverloadedError: LLM服务过载（入口检查或行动路由时排队已满）
         """
+        self.check_capacity()
+        # 尚未持久化的用户输入（回合中途出错时单独保存）
+        user_input = None
         try:
             print(f"\n🔍 [GameService] 开始处理行动:")
             print(f"  📝 行动内容: '{action}'")
@@ -68,6 +107,8 @@ class GameService:
             
             # 获取当前游戏状态（现在支持从数据库恢复）
             game_state = await self.state_service.get_game_state(session_id, user_id, story_id)
+            # 读取时的状态，保存时发现并发写入（如后台任务更新了计划表）据此合并
+            base_state = self.state_service.capture(game_state)
             print(f"  📊 当前状态:")
             print(f"    📍 位置: {game_state.player_location}")
             print(f"    ⏰ 时间: {game_state.current_time}")
@@ -77,21 +118,8 @@ class GameService:
             game_state.add_message("玩家", action, "player_action")
             print(f"  📝 已记录玩家输入到内存: {action}")
             
-            # 持久化用户输入到数据库
-            try:
-                game_time = datetime.fromisoformat(game_state.current_time.replace('Z', '+00:00')) if isinstance(game_state.current_time, str) else game_state.current_time
-                
-                await self.message_service.save_user_input(
-                    user_id=user_id,
-                    story_id=story_id,
-                    session_id=session_id,
-                    content=action,
-                    location=game_state.player_location,
-                    game_time=game_time
-                )
-            except Exception as e:
-                print(f"⚠️ [GameService] 用户输入持久化失败: {e}")
-                # 持久化失败不影响游戏流程
+            # 用户输入与本回合结果在回合结束时一起持久化到数据库
+            user_input = self._user_input_message(action, game_state)
             
             # 使用行动路由服务分析行动
             route_result = await self.action_router_service.route_action(action, game_state)
@@ -101,50 +129,82 @@ class GameService:
             print(f"  📊 置信度: {route_result['confidence']}")
             print(f"  💭 判断理由: {route_result['reason']}")
             
-            # 根据行动类型分发处理
+            await emit_event(
+                on_event, EVENT_ROUTE,
+                action_type=action_type,
+                confidence=route_result.get("confidence"),
+                reason=route_result.get("reason"),
+                source=route_result.get("source")
+            )
+            
+            # 根据行动类型分发处理（有回合规划时直接使用规划给出的参数）
+            plan = route_result.get("plan")
             if action_type == "talk":
-                result = await self.dialogue_service.process_dialogue(action, game_state)
+                result = await self.dialogue_service.process_dialogue(
+                    action, game_state, on_event,
+                    target_npc=self._planned(plan, "target_npc"), message=self._planned(plan, "message"),
+                    user_id=user_id
+                )
             elif action_type == "move":
-                result = await self.movement_service.process_movement(action, game_state)
+                result = await self.movement_service.process_movement(
+                    action, game_state, on_event, destination_key=self._planned(plan, "destination_key")
+                )
             elif action_type == "explore":
-                result = await self._process_exploration(action, game_state)
+                result = await self._process_exploration(
+                    action, game_state, estimated_minutes=self._planned(plan, "estimated_minutes")
+                )
             elif action_type == "compound":
-                result = await self._process_compound_action(action, route_result, game_state)
+                result = await self._process_compound_action(action, route_result, game_state, on_event, user_id)
             else:  # general
                 result = await self._process_general_action(action, game_state)
             
             print(f"  📤 处理结果: {result}")
             
             if result["success"]:
-                # 持久化处理结果
-                await self._save_action_result(action_type, result, game_state, session_id, user_id, story_id)
+                # 持久化用户输入和处理结果，上一回合之后完成的后台任务结果（如对话后的计划表变化）一起写入
+                pending_jobs = await run_in_db_thread(
+                    self.job_service.pending_notifications, game_state.session_id, game_state.story_id, reserve=True
+                )
+                notifications = [msg for job in pending_jobs for msg in job["messages"]]
+                saved = await self._save_action_result(
+                    action_type, result, game_state, session_id, user_id, story_id, user_input, notifications,
+                    on_saved=self._job_delivery_callback(pending_jobs)
+                )
+                user_input = None
+                notifications = await self._deliver_job_notifications(pending_jobs, saved)
                 
-                # 更新游戏状态
+                # 更新游戏状态（本回合结果已写入数据库，同步写入会话状态缓存）
                 await self._update_game_state(result, game_state, session_id)
+                await self.state_service.save_merged(session_id, game_state, base_state, story_id, user_id)
                 
                 # 返回格式化响应，只包含新消息
                 updated_game_state = await self.state_service.get_game_state(session_id, user_id, story_id)
-                new_messages = result.get("messages", [])
-                return self._format_game_response(updated_game_state, new_messages=new_messages)
+                # 在后台预取下一步最可能到达位置的五感反馈（默认关闭）
+                arrival_prefetcher.schedule(session_id, updated_game_state)
+                new_messages = notifications + result.get("messages", [])
+                return await run_in_db_thread(self._format_game_response, updated_game_state, new_messages=new_messages)
             else:
-                # 处理失败，保存错误消息
+                # 处理失败，保存用户输入和错误消息
                 try:
-                    game_time = datetime.fromisoformat(game_state.current_time.replace('Z', '+00:00')) if isinstance(game_state.current_time, str) else game_state.current_time
-                    
-                    await self.message_service.save_error_message(
-                        user_id=user_id,
-                        story_id=story_id,
-                        session_id=session_id,
-                        error=result.get("error", "未知错误"),
-                        location=game_state.player_location,
-                        game_time=game_time
-                    )
+                    await self.message_journal.save_turn(user_id, story_id, session_id, [
+                        user_input,
+                        {
+                            "message_type": 6,  # error_message
+                            "sub_type": "error",
+                            "content": result.get("error", "未知错误"),
+                            "location": game_state.player_location,
+                            "game_time": user_input["game_time"]
+                        }
+                    ])
                 except Exception as e:
                     print(f"⚠️ [GameService] 错误消息持久化失败: {e}")
+                user_input = None
                 
                 # 返回错误信息
-                return self._format_game_response(game_state, error=result.get("error"))
+                return await run_in_db_thread(self._format_game_response, game_state, error=result.get("error"))
                 
+        except LLMOverloadedError:
+            raise
         except Exception as e:
             print(f"❌ [GameService] 处理行动错误: {e}")
             import traceback
@@ -153,35 +213,59 @@ class GameService:
             # 尝试获取用户信息，如果失败则使用默认值
             try:
                 user_id, story_id = self._get_user_and_story_info(session_id, story_id)
+                if user_input:
+                    await self.message_journal.save_turn(user_id, story_id, session_id, [user_input])
                 game_state = await self.state_service.get_game_state(session_id, user_id, story_id)
             except:
                 game_state = await self.state_service.get_game_state(session_id)
                 
-            return self._format_game_response(game_state, error=str(e))
+            return await run_in_db_thread(self._format_game_response, game_state, error=str(e))
+    
+    @staticmethod
+    def _planned(plan: Any, field: str) -> Any:
+        """读取回合规划中的处理参数，没有规划时为None"""
+        return getattr(plan, field, None) if plan is not None else None
     
-    async def _process_exploration(self, action: str, game_state: GameStateModel) -> Dict[str, Any]:
-        """处理探索行动"""
+    async def _process_exploration(self, action: str, game_state: GameStateModel,
+                                   estimated_minutes: Optional[int] = None) -> Dict[str, Any]:
+        """处理探索行动（estimated_minutes为回合规划给出的耗时，提供时不再估算）"""
         print(f"\n🔍 [GameService] 处理探索行动: {action}")
         
         try:
             # 获取当前位置信息
-            current_npcs = self.location_service.get_npcs_at_location(
+            current_npcs = await run_in_db_thread(
+                self.location_service.get_npcs_at_location,
                 game_state.player_location,
                 game_state.npc_locations,
                 game_state.current_time
             )
             
-            # 生成探索反馈
-            sensory_feedback = await self.location_service.generate_sensory_feedback(
-                action,
-                {"name": game_state.player_location, "description": ""},
-                current_npcs,
-                game_state.current_time,
-                game_state.player_personality
+            # 探索反馈和耗时估算互不依赖，并发执行
+            dag = AsyncDAGExecutor("exploration")
+            dag.add_step(
+                "sensory_feedback",
+                lambda: self.location_service.generate_sensory_feedback(
+                    action,
+                    {"name": game_state.player_location, "description": ""},
+                    current_npcs,
+                    game_state.current_time,
+                    game_state.player_personality
+                ),
+                default=f"你在{game_state.player_location}进行了行动：{action}"
             )
+            if estimated_minutes:
+                self.time_estimator.record_sample(action, game_state.player_personality, estimated_minutes,
+                                                  source="planner")
+            else:
+                dag.add_step(
+                    "time_cost",
+                    lambda: self._calculate_exploration_time(action, game_state.player_personality),
+                    default=3
+                )
+            dag_result = await dag.run()
             
-            # 计算探索耗时
-            time_cost = await self._calculate_exploration_time(action, game_state.player_personality)
+            sensory_feedback = dag_result.get("sensory_feedback")
+            time_cost = estimated_minutes or dag_result.get("time_cost")
             new_time = self._advance_game_time(game_state.current_time, time_cost)
             
             return {
@@ -206,9 +290,6 @@ class GameService:
         print(f"\n⚙️ [GameService] 处理一般行动: {action}")
         
         try:
-            # 使用LLM生成响应
-            llm = self.llm_service.get_llm_instance()
-            
             from langchain_core.messages import SystemMessage, HumanMessage
             
             # 使用prompt_manager获取通用响应提示词
@@ -226,12 +307,12 @@ class GameService:
             print(f"  玩家性格: {game_state.player_personality}")
             print(f"📤 输入 (Human): 玩家行动：{action}")
             
-            response = await llm.ainvoke([
+            response_content = await self.llm_service.ainvoke_messages([
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=f"玩家行动：{action}")
-            ])
+            ], task="general_response")
             
-            print(f"📥 LLM输出: {response.content}")
+            print(f"📥 LLM输出: {response_content}")
             
             # 计算行动耗时
             time_cost = self._calculate_general_action_time(action, game_state.player_personality)
@@ -241,11 +322,13 @@ class GameService:
                 "success": True,
                 "current_time": new_time,
                 "messages": [
-                    {"speaker": "系统", "message": response.content, "type": "general", "timestamp": new_time}
+                    {"speaker": "系统", "message": response_content, "type": "general", "timestamp": new_time}
                 ],
                 "time_cost": time_cost
             }
             
+        except LLMOverloadedError:
+            raise
         except Exception as e:
             print(f"❌ 一般行动处理失败: {e}")
             return {
@@ -254,61 +337,91 @@ class GameService:
                 "messages": []
             }
     
-    async def _process_compound_action(self, action: str, route_result: Dict, game_state: GameStateModel) -> Dict[str, Any]:
-        """处理复合行动"""
+    async def _process_compound_action(self, action: str, route_result: Dict, game_state: GameStateModel,
+                                       on_event: EventCallback = None, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        处理复合行动
+        
+        子行动按读写的游戏状态划分为阶段：阶段之间顺序执行，阶段内互不依赖的子行动
+        在各自的状态副本上并发执行，状态、消息、耗时和时间戳按原始顺序合并；按原始顺序第一个失败的子行动
+        之后的结果全部丢弃，与逐个执行的结果一致
+        """
         print(f"\n🔀 [GameService] 处理复合行动: {action}")
         
         sub_actions = route_result.get("sub_actions", [])
         if not sub_actions:
             return await self._process_general_action(action, game_state)
         
+        specs = [self._sub_action_spec(sub_action) for sub_action in sub_actions]
+        stages = plan_stages([get_access(sub_type, npc_name) for sub_type, _, npc_name in specs])
+        
         all_messages = []
         total_time_cost = 0
         current_state = game_state
         
         try:
-            for i, sub_action in enumerate(sub_actions):
-                print(f"  🔄 处理子行动 {i+1}/{len(sub_actions)}: {sub_action}")
+            for stage in stages:
+                print(f"  🔄 处理子行动 {', '.join(f'{i+1}/{len(sub_actions)}: {specs[i][1]}' for i in stage)}")
                 
-                # 获取子行动的类型和内容
-                if hasattr(sub_action, 'type') and hasattr(sub_action, 'action'):
-                    sub_type = sub_action.type
-                    sub_action_text = sub_action.action
-                else:
-                    sub_type = sub_action.get('type', 'general')
-                    sub_action_text = sub_action.get('action', '')
+                # 流式事件按子行动的原始顺序推送
+                relay = OrderedEventRelay(on_event, len(stage))
                 
-                # 根据子行动类型处理
-                if sub_type == "talk":
-                    sub_result = await self.dialogue_service.process_dialogue(sub_action_text, current_state)
-                elif sub_type == "move":
-                    sub_result = await self.movement_service.process_movement(sub_action_text, current_state)
-                elif sub_type == "explore":
-                    sub_result = await self._process_exploration(sub_action_text, current_state)
-                else:
-                    sub_result = await self._process_general_action(sub_action_text, current_state)
+                # 每个子行动使用各自的状态副本，完成后按原始顺序显式合并，避免并发修改同一个状态对象
+                member_states = [copy.deepcopy(current_state) for _ in stage]
                 
-                if sub_result["success"]:
-                    # 累积消息和时间
-                    all_messages.extend(sub_result.get("messages", []))
-                    total_time_cost += sub_result.get("time_cost", 0)
-                    
-                    # 更新当前状态（为下一个子行动准备）
-                    if "current_time" in sub_result:
-                        current_state.current_time = sub_result["current_time"]
-                    if "player_location" in sub_result:
-                        current_state.player_location = sub_result["player_location"]
-                    if "npc_dialogue_histories" in sub_result:
-                        for npc_name, history in sub_result["npc_dialogue_histories"].items():
-                            current_state.npc_dialogue_histories[npc_name] = history
-                else:
-                    # 子行动失败，中断处理
-                    all_messages.append({
-                        "speaker": "系统",
-                        "message": f"行动中断：{sub_result.get('error', '未知错误')}",
-                        "type": "error",
-                        "timestamp": current_state.current_time
-                    })
+                async def run_member(position: int, i: int) -> Dict[str, Any]:
+                    try:
+                        return await self._run_sub_action(
+                            sub_actions[i], specs[i], member_states[position], relay.callback(position), user_id
+                        )
+                    finally:
+                        await relay.finish(position)
+                
+                sub_results = await asyncio.gather(*(
+                    run_member(position, i) for position, i in enumerate(stage)
+                ), return_exceptions=True)
+                
+                # 按原始顺序合并：阶段内靠后的子行动顺延前面子行动的耗时
+                elapsed = 0
+                interrupted = False
+                stage_start_time = current_state.current_time
+                for member_state, sub_result in zip(member_states, sub_results):
+                    if isinstance(sub_result, BaseException):
+                        raise sub_result
+                    if sub_result["success"]:
+                        self._merge_member_state(current_state, member_state)
+                        # 累积消息和时间
+                        messages = sub_result.get("messages", [])
+                        if elapsed:
+                            messages = [
+                                {**msg, "timestamp": self._advance_game_time(msg["timestamp"], elapsed)}
+                                if msg.get("timestamp") else msg
+                                for msg in messages
+                            ]
+                        all_messages.extend(messages)
+                        total_time_cost += sub_result.get("time_cost", 0)
+                        
+                        # 更新当前状态（为下一个阶段准备）
+                        if "current_time" in sub_result:
+                            current_state.current_time = self._advance_game_time(sub_result["current_time"], elapsed) if elapsed else sub_result["current_time"]
+                        if "player_location" in sub_result:
+                            current_state.player_location = sub_result["player_location"]
+                        if "npc_dialogue_histories" in sub_result:
+                            for npc_name, history in sub_result["npc_dialogue_histories"].items():
+                                current_state.npc_dialogue_histories[npc_name] = history
+                        elapsed += sub_result.get("time_cost", 0)
+                    else:
+                        # 子行动失败，不再执行后续阶段；同一阶段内排在它前面的子行动保留结果，
+                        # 排在后面的（逐个执行时不会执行）丢弃结果
+                        interrupted = True
+                        all_messages.append({
+                            "speaker": "系统",
+                            "message": f"行动中断：{sub_result.get('error', '未知错误')}",
+                            "type": "error",
+                            "timestamp": self._advance_game_time(stage_start_time, elapsed) if elapsed else stage_start_time
+                        })
+                        break
+                if interrupted:
                     break
             
             return {
@@ -320,6 +433,8 @@ class GameService:
                 "time_cost": total_time_cost
             }
             
+        except LLMOverloadedError:
+            raise
         except Exception as e:
             print(f"❌ 复合行动处理失败: {e}")
             return {
@@ -328,6 +443,53 @@ class GameService:
                 "messages": all_messages
             }
     
+    def _merge_member_state(self, current_state: GameStateModel, member_state: GameStateModel):
+        """把子行动在状态副本上的修改合并回当前状态（时间和位置以子行动结果为准，另行合并）"""
+        for field in NPC_STATE_FIELDS:
+            base = getattr(current_state, field)
+            for npc_name, value in getattr(member_state, field).items():
+                if base.get(npc_name) != value:
+                    base[npc_name] = value
+        if member_state.player_location != current_state.player_location:
+            current_state.player_location = member_state.player_location
+    
+    def _sub_action_spec(self, sub_action: Any) -> Tuple[str, str, Optional[str]]:
+        """获取子行动的类型、内容和对话对象（仅talk）"""
+        if hasattr(sub_action, 'type') and hasattr(sub_action, 'action'):
+            sub_type = sub_action.type
+            sub_action_text = sub_action.action
+        else:
+            sub_type = sub_action.get('type', 'general')
+            sub_action_text = sub_action.get('action', '')
+        
+        npc_name = None
+        if sub_type == "talk":
+            npc_name = self._planned(sub_action, "target_npc")
+            if not npc_name:
+                npc_name = (self.dialogue_service.parse_dialogue_action(sub_action_text) or {}).get("npc")
+        return sub_type, sub_action_text, npc_name
+    
+    async def _run_sub_action(self, sub_action: Any, spec: Tuple[str, str, Optional[str]], current_state: GameStateModel,
+                              on_event: EventCallback = None, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """根据子行动类型处理（回合规划的子行动带有处理参数）"""
+        sub_type, sub_action_text, _ = spec
+        if sub_type == "talk":
+            return await self.dialogue_service.process_dialogue(
+                sub_action_text, current_state, on_event,
+                target_npc=self._planned(sub_action, "target_npc"), message=self._planned(sub_action, "message"),
+                user_id=user_id
+            )
+        elif sub_type == "move":
+            return await self.movement_service.process_movement(
+                sub_action_text, current_state, on_event,
+                destination_key=self._planned(sub_action, "destination_key")
+            )
+        elif sub_type == "explore":
+            return await self._process_exploration(
+                sub_action_text, current_state, estimated_minutes=self._planned(sub_action, "estimated_minutes")
+            )
+        return await self._process_general_action(sub_action_text, current_state)
+    
     async def _update_game_state(self, result: Dict, game_state: GameStateModel, session_id: str):
         """更新游戏状态"""
         try:
@@ -344,8 +506,8 @@ class GameService:
                 logger.info(f"  📍 更新位置: {result['player_location']}")
             
             # 更新NPC位置
-            npc_locations = self.npc_service.update_npc_locations_by_time(
-                game_state.current_time, game_state
+            npc_locations = await run_in_db_thread(
+                self.npc_service.update_npc_locations_by_time, game_state.current_time, game_state
             )
             game_state.npc_locations = npc_locations
             
@@ -366,11 +528,37 @@ class GameService:
             raise
     
     async def _calculate_exploration_time(self, action: str, personality: str) -> int:
-        """计算探索耗时"""
+        """
+        计算探索耗时
+        
+        local模式只用本地估算器；shadow模式返回本地结果，同时在后台调用LLM对比；
+        llm模式调用LLM估算，失败时降级到本地估算
+        """
+        if self.time_estimator.mode == "llm":
+            estimated_minutes = await self._estimate_exploration_time_with_llm(action, personality)
+            if estimated_minutes is not None:
+                self.time_estimator.record_sample(action, personality, estimated_minutes)
+                return estimated_minutes
+        
+        estimate = self.time_estimator.estimate(action, personality)
+        print(f"  ⏰ 本地估算结果: {estimate['estimated_minutes']}分钟，理由: {estimate['reason']}")
+        
+        if self.time_estimator.mode == "shadow":
+            task = asyncio.ensure_future(self._compare_exploration_time(action, personality, estimate["estimated_minutes"]))
+            self._shadow_tasks.add(task)
+            task.add_done_callback(self._shadow_tasks.discard)
+        
+        return estimate["estimated_minutes"]
+    
+    async def _compare_exploration_time(self, action: str, personality: str, local_minutes: int):
+        """影子模式：调用LLM估算并与本地结果对比"""
+        llm_minutes = await self._estimate_exploration_time_with_llm(action, personality)
+        if llm_minutes is not None:
+            self.time_estimator.record_comparison(action, personality, local_minutes, llm_minutes)
+    
+    async def _estimate_exploration_time_with_llm(self, action: str, personality: str) -> Optional[int]:
+        """调用LLM估算探索耗时，失败时返回None"""
         try:
-            # 使用LLM智能估算时间
-            llm = self.llm_service.get_llm_instance()
-            
             # 使用prompt_manager获取时间估算提示词
             from ..prompts.prompt_templates import PromptTemplates
             system_prompt = PromptTemplates.get_time_estimation_prompt(
@@ -387,12 +575,11 @@ class GameService:
             print(f"  玩家性格: {personality}")
             print(f"📤 输入 (Human): 请估算行动耗时：{action}")
             
-            # 使用JsonOutputParser来解析LLM响应
-            parser = JsonOutputParser()
-            response = parser.invoke(await llm.ainvoke([
+            # 使用JsonOutputParser来解析LLM响应（时间估算可缓存）
+            response = await self.llm_service.ainvoke_messages([
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=f"请估算行动耗时：{action}")
-            ]))
+            ], task="time_estimation", parser=JsonOutputParser())
             
             print(f"📥 LLM输出: {response}")
             
@@ -406,22 +593,7 @@ class GameService:
         except Exception as e:
             print(f"  ❌ LLM时间估算失败: {e}")
         
-        # 降级到简单估算
-        base_time = 3  # 基础3分钟
-        
-        # 根据行动内容调整
-        if "仔细" in action or "详细" in action:
-            base_time += 2
-        elif "快速" in action or "简单" in action:
-            base_time -= 1
-        
-        # 根据性格调整
-        if "细致" in personality:
-            base_time += 1
-        elif "急躁" in personality:
-            base_time -= 1
-        
-        return max(1, base_time)
+        return None
     
     def _calculate_general_action_time(self, action: str, personality: str) -> int:
         """计算一般行动耗时"""
@@ -448,23 +620,55 @@ class GameService:
             print(f"时间推进失败: {e}")
             return current_time
 
-    async def stream_action(self, action: str, session_id: str = "default"):
+    async def stream_action(self, action: str, session_id: str = "default", story_id: int = None):
         """
         流式处理玩家行动
         
+        处理过程中依次推送route（路由结果）、message（移动步骤/五感反馈）、
+        token（NPC回复增量文本）事件，最后推送state（与process_action相同的完整响应）和done事件
+        
+        客户端断开连接不会取消行动：行动会照常完成并持久化，与非流式接口的结果一致，
+        避免取消在状态写入一半时留下不一致的游戏状态
+        
         Args:
             action: 玩家行动
             session_id: 会话ID
+            story_id: 故事ID
             
         Yields:
-            流式响应数据
+            SSE数据帧
         """
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def on_event(event_type: str, data: Dict[str, Any]):
+            await queue.put((event_type, data))
+        
+        async def run_action():
+            try:
+                result = await self.process_action(action, session_id, story_id, on_event=on_event)
+                if result.get("error"):
+                    await queue.put((EVENT_ERROR, {"error": result["error"]}))
+                await queue.put((EVENT_STATE, {"data": result}))
+            except LLMOverloadedError as e:
+                await queue.put((EVENT_ERROR, {"error": str(e), "retry_after": e.retry_after}))
+            except Exception as e:
+                await queue.put((EVENT_ERROR, {"error": str(e)}))
+            finally:
+                await queue.put((EVENT_DONE, {}))
+        
+        task = asyncio.create_task(run_action())
+        self._stream_tasks.add(task)
+        task.add_done_callback(self._stream_tasks.discard)
         try:
-            # 目前简化实现，直接返回完整结果
-            result = await self.process_action(action, session_id)
-            yield f"data: {result}\n\n"
-        except Exception as e:
-            yield f"data: {self._create_error_response(str(e))}\n\n"
+            while True:
+                event_type, data = await queue.get()
+                yield encode_sse(event_type, data)
+                if event_type == EVENT_DONE:
+                    break
+        finally:
+            # 客户端断开时不中断行动处理，保证结果照常持久化（任务由_stream_tasks持有直到完成）
+            if not task.done():
+                print(f"⚠️ [GameService] 流式连接已断开，行动继续在后台处理")
     
     async def get_game_state(self, session_id: str = "default", story_id: int = None) -> Dict[str, Any]:
         """
@@ -483,13 +687,13 @@ class GameService:
             
             # 获取游戏状态（支持从数据库恢复）
             game_state = await self.state_service.get_game_state(session_id, user_id, story_id)
-            return self._format_game_response(game_state)
+            return await run_in_db_thread(self._format_game_response, game_state)
             
         except Exception as e:
             print(f"❌ [GameService] 获取游戏状态失败: {e}")
             # 降级到默认状态
             game_state = await self.state_service.get_game_state(session_id)
-            return self._format_game_response(game_state, error=str(e))
+            return await run_in_db_thread(self._format_game_response, game_state, error=str(e))
     
     def initialize_game(self, session_id: str = "default") -> Dict[str, Any]:
         """
@@ -671,8 +875,72 @@ class GameService:
         print(f"🔍 [GameService] 获取会话信息: 用户ID={user_id}, 故事ID={story_id}, 会话ID={session_id}")
         return user_id, story_id
 
-    async def _save_action_result(self, action_type: str, result: Dict[str, Any], game_state: GameStateModel, session_id: str, user_id: int, story_id: int):
-        """保存行动处理结果到数据库"""
+    def _job_delivery_callback(self, pending_jobs: List[Dict[str, Any]]) -> Optional[SavedCallback]:
+        """
+        构造回合消息的写入回调：消息写入数据库后把随之写入的后台任务结果标记为已投递，
+        回合移入死信文件时释放预留，留到之后的回合重新投递（写后模式下入队时消息尚未写入）
+        """
+        if not pending_jobs:
+            return None
+        job_ids = [job["job_id"] for job in pending_jobs]
+        
+        async def on_saved(saved: bool):
+            if saved:
+                await run_in_db_thread(self.job_service.mark_delivered, job_ids)
+            else:
+                self.job_service.release(job_ids)
+        
+        return on_saved
+    
+    async def _deliver_job_notifications(self, pending_jobs: List[Dict[str, Any]], saved: bool) -> List[Dict[str, Any]]:
+        """
+        返回本回合投递的后台任务结果（由写入回调标记为已投递）
+        
+        Args:
+            pending_jobs: 随本回合消息一起保存的任务结果（pending_notifications的返回值）
+            saved: 本回合消息是否保存成功（写后模式下为是否已进入写入队列）
+        
+        Returns:
+            本回合投递的任务结果消息（保存失败时为空并释放预留，留到之后的回合重新投递）
+        """
+        if not pending_jobs:
+            return []
+        if not saved:
+            self.job_service.release([job["job_id"] for job in pending_jobs])
+            return []
+        return [msg for job in pending_jobs for msg in job["messages"]]
+    
+    def _notification_message(self, msg: Dict[str, Any], game_state: GameStateModel) -> Dict[str, Any]:
+        """构造后台任务结果的系统信息消息"""
+        from ..utils.time_utils import TimeUtils
+        return {
+            "message_type": 5,  # system_info
+            "sub_type": msg.get("type", "system"),
+            "content": msg.get("message", ""),
+            "location": game_state.player_location,
+            "game_time": TimeUtils.parse_game_time(msg.get("timestamp") or game_state.current_time)
+        }
+    
+    def _user_input_message(self, action: str, game_state: GameStateModel) -> Dict[str, Any]:
+        """构造本回合的用户输入消息（随行动结果一起保存）"""
+        try:
+            game_time = datetime.fromisoformat(game_state.current_time.replace('Z', '+00:00')) if isinstance(game_state.current_time, str) else game_state.current_time
+        except ValueError:
+            game_time = None
+        return {
+            "message_type": 1,  # user_input
+            "sub_type": "player_action",
+            "content": action,
+            "location": game_state.player_location,
+            "game_time": game_time
+        }
+    
+    async def _save_action_result(self, action_type: str, result: Dict[str, Any], game_state: GameStateModel, session_id: str, user_id: int, story_id: int,
+                                  user_input: Optional[Dict[str, Any]] = None,
+                                  notifications: Optional[List[Dict[str, Any]]] = None,
+                                  on_saved: Optional[SavedCallback] = None) -> bool:
+        """保存行动处理结果到数据库（与后台任务结果消息、用户输入在同一个事务中批量写入），返回是否保存成功；
+        on_saved 在消息实际写入数据库后调用（见MessageJournal.save_turn）"""
         try:
             # 使用result中的更新后时间，如果没有则使用当前游戏状态时间
             result_time = result.get("current_time", game_state.current_time)
@@ -680,6 +948,10 @@ class GameService:
             
             # 获取结果中的消息列表
             messages = result.get("messages", [])
+            # 后台任务结果发生在玩家本回合行动之前，排在用户输入前面
+            turn_messages = [self._notification_message(msg, game_state) for msg in notifications or []]
+            if user_input:
+                turn_messages.append(user_input)
             
             for msg in messages:
                 speaker = msg.get("speaker", "系统")
@@ -710,89 +982,83 @@ class GameService:
                 # 根据行动类型和消息类型决定持久化策略
                 if action_type == "talk" and speaker != "系统" and speaker != "玩家":
                     # NPC对话
-                    await self.message_service.save_npc_dialogue(
-                        user_id=user_id,
-                        story_id=story_id,
-                        session_id=session_id,
-                        npc_name=speaker,
-                        dialogue=content,
-                        location=game_state.player_location,
-                        game_time=msg_game_time,
-                        metadata={"action_type": action_type, "original_action": result.get("original_action", "")}
-                    )
+                    turn_messages.append({
+                        "message_type": 2,  # npc_dialogue
+                        "sub_type": "dialogue",
+                        "content": content,
+                        "npc_name": speaker,
+                        "location": game_state.player_location,
+                        "game_time": msg_game_time,
+                        "metadata": {"action_type": action_type, "original_action": result.get("original_action", "")}
+                    })
                 elif action_type == "talk" and msg_type == "sensory_feedback":
                     # 对话场景的五感反馈
-                    await self.message_service.save_sensory_feedback(
-                        user_id=user_id,
-                        story_id=story_id,
-                        session_id=session_id,
-                        feedback=content,
-                        location=game_state.player_location,
-                        game_time=msg_game_time,
-                        structured_data={"action_type": action_type, "dialogue_type": "sensory"}
-                    )
+                    turn_messages.append({
+                        "message_type": 4,  # sensory_feedback
+                        "sub_type": "sensory",
+                        "content": content,
+                        "location": game_state.player_location,
+                        "game_time": msg_game_time,
+                        "structured_data": {"action_type": action_type, "dialogue_type": "sensory"}
+                    })
                 elif action_type == "move":
                     # 移动行动 - 使用移动后的位置
                     new_location = result.get("player_location", game_state.player_location)
-                    await self.message_service.save_system_action(
-                        user_id=user_id,
-                        story_id=story_id,
-                        session_id=session_id,
-                        action_result=content,
-                        location=new_location,  # 使用移动后的位置
-                        game_time=msg_game_time,
-                        sub_type="movement",
-                        metadata={"action_type": action_type, "new_location": new_location}
-                    )
+                    turn_messages.append({
+                        "message_type": 3,  # system_action
+                        "sub_type": "movement",
+                        "content": content,
+                        "location": new_location,  # 使用移动后的位置
+                        "game_time": msg_game_time,
+                        "metadata": {"action_type": action_type, "new_location": new_location}
+                    })
                     
                     # 如果有五感反馈，也要保存 - 同样使用移动后的位置
                     if "sensory_feedback" in result:
                         sensory_data = result["sensory_feedback"]
-                        await self.message_service.save_sensory_feedback(
-                            user_id=user_id,
-                            story_id=story_id,
-                            session_id=session_id,
-                            feedback=sensory_data.get("description", ""),
-                            location=new_location,  # 使用移动后的位置
-                            game_time=msg_game_time,
-                            structured_data=sensory_data
-                        )
+                        turn_messages.append({
+                            "message_type": 4,  # sensory_feedback
+                            "sub_type": "sensory",
+                            "content": sensory_data.get("description", ""),
+                            "location": new_location,  # 使用移动后的位置
+                            "game_time": msg_game_time,
+                            "structured_data": sensory_data
+                        })
                 elif action_type == "explore":
                     # 探索行动 - 主要是五感反馈
                     if msg_type == "exploration":
-                        await self.message_service.save_sensory_feedback(
-                            user_id=user_id,
-                            story_id=story_id,
-                            session_id=session_id,
-                            feedback=content,
-                            location=game_state.player_location,
-                            game_time=msg_game_time,
-                            structured_data={"action_type": action_type, "exploration_type": "sensory"}
-                        )
+                        turn_messages.append({
+                            "message_type": 4,  # sensory_feedback
+                            "sub_type": "sensory",
+                            "content": content,
+                            "location": game_state.player_location,
+                            "game_time": msg_game_time,
+                            "structured_data": {"action_type": action_type, "exploration_type": "sensory"}
+                        })
                     else:
-                        await self.message_service.save_system_info(
-                            user_id=user_id,
-                            story_id=story_id,
-                            session_id=session_id,
-                            info=content,
-                            location=game_state.player_location,
-                            game_time=msg_game_time,
-                            sub_type="exploration"
-                        )
+                        turn_messages.append({
+                            "message_type": 5,  # system_info
+                            "sub_type": "exploration",
+                            "content": content,
+                            "location": game_state.player_location,
+                            "game_time": msg_game_time
+                        })
                 else:
                     # 一般行动或其他类型
-                    await self.message_service.save_system_info(
-                        user_id=user_id,
-                        story_id=story_id,
-                        session_id=session_id,
-                        info=content,
-                        location=game_state.player_location,
-                        game_time=msg_game_time,
-                        sub_type=action_type
-                    )
+                    turn_messages.append({
+                        "message_type": 5,  # system_info
+                        "sub_type": action_type,
+                        "content": content,
+                        "location": game_state.player_location,
+                        "game_time": msg_game_time
+                    })
+            
+            await self.message_journal.save_turn(user_id, story_id, session_id, turn_messages, on_saved=on_saved)
             
             print(f"✅ [GameService] 行动结果持久化完成: {action_type}, 消息数={len(messages)}")
+            return True
             
         except Exception as e:
             print(f"⚠️ [GameService] 行动结果持久化失败: {e}")
-            # 持久化失败不影响游戏流程 
\ No newline at end of file
+            # 持久化失败不影响游戏流程 
+            return False
\ No newline at end of file
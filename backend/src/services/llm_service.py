@@ -3,15 +3,18 @@ LLM服务 - 处理大语言模型相关逻辑
 """
 import os
 import json
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Type, Union
+from pydantic import BaseModel
 from langchain_openai import ChatOpenAI
+from langchain_core.messages import BaseMessage
+
+from ..utils.llm_gateway import llm_gateway
 
 
 class LLMService:
-    """LLM服务类"""
+    """LLM服务类（LLM调用统一经过llm_gateway）"""
     
     def __init__(self):
-        self._llm_instance = None
         self._config = None
     
     def load_config(self) -> Optional[Dict[str, Any]]:
@@ -73,23 +76,9 @@ class LLMService:
             model_name: 模型名称
             
         Returns:
-            LLM实例
+            LLM实例（共享网关的HTTP连接池）
         """
-        if self._llm_instance is None:
-            llm_config = self.get_llm_config(model_name)
-            if not llm_config:
-                raise ValueError("无法获取LLM配置")
-            
-            print(f"🔧 使用LLM配置: {llm_config.get('model', 'unknown')}")
-            
-            self._llm_instance = ChatOpenAI(
-                model_name=llm_config.get("model", "gemini-2.5-flash-preview-05-20"),
-                openai_api_key=llm_config.get("api_key"),
-                openai_api_base=llm_config.get("url"),
-                temperature=0.7,
-            )
-        
-        return self._llm_instance
+        return llm_gateway.get_llm(model_name)
     
     def clean_llm_response(self, response) -> str:
         """
@@ -131,16 +120,47 @@ class LLMService:
             LLM响应
         """
         try:
-            llm = self.get_llm_instance(model_name)
-            response = await llm.ainvoke(prompt)
-            return self.clean_llm_response(response)
+            return await self.ainvoke_messages(prompt, model_name=model_name)
         except Exception as e:
             print(f"调用LLM失败: {e}")
             return f"LLM调用失败: {str(e)}"
     
+    async def ainvoke_messages(self, messages: Union[str, List[BaseMessage]], task: Optional[str] = None,
+                               parser: Any = None, model_name: Optional[str] = None) -> Any:
+        """
+        调用LLM，对可缓存的任务先查询响应缓存
+        
+        Args:
+            messages: 提示词或消息列表
+            task: 任务名（与提示词模板名一致），决定预设参数和缓存时间
+            parser: 可选的输出解析器（如JsonOutputParser），解析失败的响应不会被缓存
+            model_name: 优先使用的提供商，不指定时由提供商池按健康度选择
+            
+        Returns:
+            响应内容，提供parser时返回解析结果
+        """
+        return await llm_gateway.ainvoke(messages, task=task, parser=parser, preferred=model_name)
+    
+    async def ainvoke_structured(self, messages: List[BaseMessage], schema: Type[BaseModel],
+                                 task: Optional[str] = None, model_name: Optional[str] = None) -> BaseModel:
+        """
+        以结构化输出方式调用LLM，对可缓存的任务先查询响应缓存
+        
+        Args:
+            messages: 消息列表
+            schema: 输出的pydantic模型
+            task: 任务名（与提示词模板名一致）
+            model_name: 优先使用的提供商
+            
+        Returns:
+            schema实例
+        """
+        return await llm_gateway.ainvoke_structured(messages, schema, task=task, preferred=model_name)
+    
     def reset_llm_instance(self):
-        """重置LLM实例"""
-        self._llm_instance = None
+        """重置LLM实例（重新读取配置并重建提供商）"""
+        self._config = None
+        llm_gateway.reload()
     
     def get_available_models(self) -> Dict[str, Dict[str, str]]:
         """
@@ -184,6 +204,11 @@ class LLMService:
                 "message": "连接失败"
             }
 
+
+# 创建全局LLM服务实例
+llm_service = LLMService()
+
+
 if __name__ == "__main__":
     # Test the LLM instance
     try:
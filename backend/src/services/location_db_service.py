@@ -2,11 +2,13 @@
 位置数据库服务层 - 处理位置相关的数据库操作
 """
 from typing import List, Optional, Dict, Any
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 
-from ..database.config import get_session
+from ..database.config import get_session, get_async_session
 from ..database.models import Location, Story, Entity
+from .entity_id_cache import entity_id_cache
 
 
 class LocationDBService:
@@ -67,6 +69,7 @@ class LocationDBService:
             )
             session.add(entity)
             session.commit()
+            entity_id_cache.invalidate(story_id)
             
             return {
                 "success": True,
@@ -106,6 +109,28 @@ class LocationDBService:
         finally:
             session.close()
     
+    async def aget_locations_by_story(self, story_id: int) -> Dict[str, Any]:
+        """
+        获取故事的所有位置（异步版本，供async代码路径使用）
+        
+        Args:
+            story_id: 故事ID
+            
+        Returns:
+            位置列表
+        """
+        try:
+            async with get_async_session() as session:
+                locations = (await session.scalars(select(Location).filter_by(story_id=story_id))).all()
+                
+                return {
+                    "success": True,
+                    "data": [location.to_dict() for location in locations]
+                }
+                
+        except Exception as e:
+            return {"success": False, "error": f"获取位置列表失败: {str(e)}"}
+    
     def get_location_by_key(self, story_id: int, key: str) -> Dict[str, Any]:
         """
         根据键名获取位置
@@ -133,6 +158,31 @@ class LocationDBService:
         finally:
             session.close()
     
+    async def aget_location_by_key(self, story_id: int, key: str) -> Dict[str, Any]:
+        """
+        根据键名获取位置（异步版本，供async代码路径使用）
+        
+        Args:
+            story_id: 故事ID
+            key: 位置键名
+            
+        Returns:
+            位置信息
+        """
+        try:
+            async with get_async_session() as session:
+                location = await session.scalar(select(Location).filter_by(story_id=story_id, key=key).limit(1))
+                if not location:
+                    return {"success": False, "error": "位置不存在"}
+                
+                return {
+                    "success": True,
+                    "data": location.to_dict()
+                }
+                
+        except Exception as e:
+            return {"success": False, "error": f"获取位置失败: {str(e)}"}
+    
     def update_location(self, location_id: int, **kwargs) -> Dict[str, Any]:
         """
         更新位置信息
@@ -155,7 +205,9 @@ class LocationDBService:
                 if hasattr(location, key) and key not in ['id', 'story_id', 'created_at']:
                     setattr(location, key, value)
             
+            story_id = location.story_id
             session.commit()
+            entity_id_cache.invalidate(story_id)
             
             return {
                 "success": True,
@@ -195,8 +247,10 @@ class LocationDBService:
                     loc.connections = updated_connections
             
             # 删除位置
+            story_id = location.story_id
             session.delete(location)
             session.commit()
+            entity_id_cache.invalidate(story_id)
             
             return {"success": True, "message": "位置删除成功"}
             
@@ -260,6 +314,7 @@ class LocationDBService:
                     updated_locations.append(location.to_dict())
             
             session.commit()
+            entity_id_cache.invalidate(story_id)
             
             return {
                 "success": True,
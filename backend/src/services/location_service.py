@@ -15,8 +15,8 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(SRC_DIR))
 sys.path.append(PROJECT_ROOT)
 sys.path.append(SRC_DIR)
 
-from .llm_service import LLMService
-from .npc_service import NPCService
+from .llm_service import llm_service
+from .npc_service import npc_service
 from ..prompts.prompt_templates import PromptTemplates
 from ..models.game_state_model import GameStateModel
 import sys
@@ -27,16 +27,16 @@ sys.path.append(PROJECT_ROOT)
 
 from data.locations import all_locations_data, location_connections
 from data.characters import all_actresses
-from ..services.location_db_service import LocationDBService
+from ..services.location_db_service import location_db_service
 
 
 class LocationService:
     """位置服务类"""
     
     def __init__(self):
-        self.llm_service = LLMService()
-        self.npc_service = NPCService()
-        self.location_db_service = LocationDBService()
+        self.llm_service = llm_service
+        self.npc_service = npc_service
+        self.location_db_service = location_db_service
     
     def get_npcs_at_location(self, location_name: str, npc_locations: Dict[str, str], current_time: str, game_state=None) -> List[Dict]:
         """获取指定位置的NPC列表"""
@@ -162,8 +162,6 @@ class LocationService:
         
         # 如果简单匹配失败，使用LLM智能解析
         try:
-            llm = self.llm_service.get_llm_instance()
-            
             # 构建可用位置列表
             available_locations = []
             for key, data in all_locations_data.items():
@@ -188,12 +186,11 @@ class LocationService:
             print(f"  可用位置数量: {len(available_locations)}个")
             print(f"📤 输入 (Human): 玩家行动：{action}")
             
-            # 使用JsonOutputParser来解析LLM响应
-            parser = JsonOutputParser()
-            response = parser.invoke(await llm.ainvoke([
+            # 使用JsonOutputParser来解析LLM响应（目的地识别可缓存）
+            response = await self.llm_service.ainvoke_messages([
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=f"玩家行动：{action}")
-            ]))
+            ], task="move_destination", parser=JsonOutputParser())
             
             print(f"📥 LLM输出: {response}")
             
@@ -254,10 +251,15 @@ class LocationService:
         print(f"  ❌ 无法找到到达路径")
         return []
     
-    async def generate_sensory_feedback(self, action: str, location_info: dict, current_npcs: list, current_time: str, personality: str) -> str:
-        """生成五感反馈"""
-        llm = self.llm_service.get_llm_instance()
+    async def generate_sensory_feedback(self, action: str, location_info: dict, current_npcs: list, current_time: str, personality: str,
+                                        task: str = "sensory_feedback", fallback: bool = True) -> str:
+        """
+        生成五感反馈
         
+        Args:
+            task: LLM任务名（用于选择参数预设和排队优先级）
+            fallback: LLM调用失败时是否返回降级文本，为False时抛出异常
+        """
         npc_info = ""
         if current_npcs:
             npc_descriptions = [f"{npc['name']}正在{npc['event']}" for npc in current_npcs]
@@ -282,11 +284,10 @@ class LocationService:
         
         try:
             # 使用JsonOutputParser来解析LLM响应
-            parser = JsonOutputParser()
-            response = parser.invoke(await llm.ainvoke([
+            response = await self.llm_service.ainvoke_messages([
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=user_input)
-            ]))
+            ], task=task, parser=JsonOutputParser())
             
             print(f"  📥 LLM原始输出: {response}")
             
@@ -301,6 +302,8 @@ class LocationService:
                 
         except Exception as e:
             print(f"  ❌ LLM调用失败: {e}")
+            if not fallback:
+                raise
             # 降级处理
             fallback_response = f"你在{location_info.get('name', '这里')}进行了行动：{action}"
             print(f"  📥 降级输出: {fallback_response}")
@@ -316,4 +319,8 @@ class LocationService:
     
     def is_valid_location(self, location_name: str) -> bool:
         """检查是否为有效位置"""
-        return location_name in all_locations_data 
\ No newline at end of file
+        return location_name in all_locations_data
+
+
+# 创建全局位置服务实例
+location_service = LocationService()
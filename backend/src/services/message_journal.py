@@ -0,0 +1,376 @@
+"""
+消息日志 - 写后持久化模式：回合消息先进入进程内有界队列并追加到本地溢写文件，由后台协程按批写入数据库
+"""
+import os
+import json
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from sqlalchemy.exc import OperationalError, InterfaceError, DisconnectionError
+
+from .message_service import message_service
+from ..utils.config_loader import get_config_section
+from ..utils.time_utils import TimeUtils
+
+logger = logging.getLogger(__name__)
+
+# 队列中最多积压的消息条数，超过时由写入方同步刷写（反压），仍无法写入时直接写入数据库
+DEFAULT_MAX_PENDING = 1000
+# 积压达到该条数时立即刷写，单次刷写最多写入的消息条数
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_FLUSH_INTERVAL_MS = 200
+# 写入失败后按 flush_interval * 2^(n-1) 退避重试，最长间隔
+DEFAULT_MAX_RETRY_INTERVAL_MS = 10000
+# 单个回合因数据错误（非连接错误）写入失败达到该次数后移入死信文件，不再阻塞队列
+DEFAULT_MAX_ATTEMPTS = 5
+# 默认的溢写文件位置（backend/cache/message_journal.jsonl）
+DEFAULT_SPILL_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'cache', 'message_journal.jsonl')
+
+# 回合写入数据库（True）或移入死信文件（False）后调用的回调
+SavedCallback = Callable[[bool], Awaitable[Any]]
+
+# 数据库不可用类的错误：不计入回合的失败次数，只由max_pending限制积压
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, DisconnectionError, ConnectionError, TimeoutError)
+
+
+class MessageJournal:
+    """消息日志 - 关闭时直接写入数据库；开启时写入队列立即返回，按条数或时间间隔成组提交"""
+    
+    def __init__(self, message_service=message_service, spill_path: Optional[str] = None):
+        journal_config = get_config_section("message_journal")
+        self.enabled = journal_config.get("enabled", False)
+        self.max_pending = max(int(journal_config.get("max_pending", DEFAULT_MAX_PENDING)), 1)
+        self.batch_size = max(int(journal_config.get("batch_size", DEFAULT_BATCH_SIZE)), 1)
+        self.flush_interval = float(journal_config.get("flush_interval_ms", DEFAULT_FLUSH_INTERVAL_MS)) / 1000
+        self.max_retry_interval = float(journal_config.get("max_retry_interval_ms", DEFAULT_MAX_RETRY_INTERVAL_MS)) / 1000
+        self.max_attempts = max(int(journal_config.get("max_attempts", DEFAULT_MAX_ATTEMPTS)), 1)
+        self.spill_path = spill_path if spill_path is not None else journal_config.get("spill_path", DEFAULT_SPILL_PATH)
+        # 死信文件默认与溢写文件放在一起
+        self.dead_letter_path = journal_config.get("dead_letter_path") or (f"{self.spill_path}.dead" if self.spill_path else "")
+        self.fsync = journal_config.get("fsync", False)
+        self.message_service = message_service
+        
+        self._pending: deque = deque()
+        self._pending_messages = 0
+        # 队列中回合的写入回调（按回合对象的id索引，不写入溢写文件；重放的回合没有回调）
+        self._callbacks: Dict[int, SavedCallback] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._spill_lock: Optional[asyncio.Lock] = None
+        # 连续写入失败次数（决定重试间隔）和队首回合因数据错误失败的次数（决定是否移入死信文件）
+        self._failures = 0
+        self._head_attempts = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._replayed = False
+        self._stats = {"turns": 0, "messages": 0, "flushed": 0, "batches": 0, "failures": 0, "replayed": 0,
+                       "backpressure": 0, "direct_writes": 0, "dead_lettered": 0}
+    
+    async def save_turn(self, user_id: int, story_id: int, session_id: str, messages: List[Dict[str, Any]],
+                        on_saved: Optional[SavedCallback] = None) -> List[int]:
+        """
+        保存一个回合的消息（参数格式同MessageService.save_turn）
+        
+        Args:
+            on_saved: 回合写入数据库后以True调用、移入死信文件后以False调用；入队时不调用，
+                直接写入失败（抛出异常）时也不调用
+        
+        Returns:
+            直接写入数据库时为写入的消息ID；消息进入队列时返回空列表
+        
+        Raises:
+            直接写入（关闭写后模式，或队列已满且刷写失败）失败时抛出数据库异常，调用方据此判断本回合未保存
+        """
+        if not messages:
+            return []
+        turn = {"user_id": user_id, "story_id": story_id, "session_id": session_id, "messages": messages}
+        if not self.enabled:
+            message_ids = await self.message_service.save_turns([turn], raise_errors=True)
+            await self._notify_saved(on_saved, True)
+            return message_ids
+        
+        self.start()
+        if self._pending_messages + len(messages) > self.max_pending:
+            # 队列已满：由写入方等待刷写完成，避免积压无限增长
+            self._stats["backpressure"] += 1
+            await self.flush()
+            if self._pending_messages + len(messages) > self.max_pending:
+                # 刷写失败（数据库不可用）时不再入队，直接写入，失败时由调用方处理
+                self._stats["direct_writes"] += 1
+                message_ids = await self.message_service.save_turns([turn], raise_errors=True)
+                await self._notify_saved(on_saved, True)
+                return message_ids
+        
+        await self._append_spill(turn)
+        self._pending.append(turn)
+        if on_saved is not None:
+            self._callbacks[id(turn)] = on_saved
+        self._pending_messages += len(messages)
+        self._stats["turns"] += 1
+        self._stats["messages"] += len(messages)
+        if self._pending_messages >= self.batch_size:
+            self._wakeup.set()
+        return []
+    
+    def start(self):
+        """启动后台刷写协程（已启动时不重复启动），并重放溢写文件中上次退出时未写入数据库的消息"""
+        if self._flusher is not None and not self._flusher.done():
+            return
+        
+        self._flush_lock = asyncio.Lock()
+        self._spill_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        # 溢写文件与队列内容一致，只在首次启动时读取
+        replayed = 0 if self._replayed else self._load_spill()
+        self._replayed = True
+        if replayed:
+            self._stats["replayed"] += replayed
+            logger.info(f"🔄 [MessageJournal] 从溢写文件恢复{replayed}个未写入的回合")
+            self._wakeup.set()
+        self._flusher = asyncio.ensure_future(self._flush_loop())
+    
+    async def stop(self):
+        """停止后台刷写协程并写入剩余消息（写入失败的消息保留在溢写文件中，下次启动时重放）"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        if self._pending:
+            await self.flush()
+    
+    async def _flush_loop(self):
+        """按时间间隔或积压条数触发刷写，写入失败后按指数退避延长间隔"""
+        while True:
+            interval = self.flush_interval
+            if self._failures:
+                interval = min(self.flush_interval * (2 ** min(self._failures - 1, 16)), self.max_retry_interval)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._pending:
+                await self.flush()
+    
+    async def flush(self) -> int:
+        """
+        把队列中的消息按批写入数据库，每批一个事务
+        
+        上一批写入失败后只写入队首的一个回合，找出无法写入的回合；
+        队首回合因数据错误失败 max_attempts 次后移入死信文件，后面的回合继续写入
+        
+        Returns:
+            本次写入的消息条数（写入失败时保留剩余消息，等待下次刷写）
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        
+        flushed = 0
+        async with self._flush_lock:
+            removed = False
+            while self._pending:
+                batch = []
+                count = 0
+                for turn in self._pending:
+                    if batch and (self._failures or count + len(turn["messages"]) > self.batch_size):
+                        break
+                    batch.append(turn)
+                    count += len(turn["messages"])
+                
+                try:
+                    await self.message_service.save_turns(batch, raise_errors=True)
+                except Exception as e:
+                    self._failures += 1
+                    self._stats["failures"] += 1
+                    if len(batch) == 1 and not isinstance(e, TRANSIENT_ERRORS):
+                        self._head_attempts += 1
+                        if self._head_attempts >= self.max_attempts:
+                            await self._dead_letter(batch[0], e)
+                            self._pending.popleft()
+                            await self._notify_saved(self._callbacks.pop(id(batch[0]), None), False)
+                            self._pending_messages -= count
+                            self._failures = self._head_attempts = 0
+                            removed = True
+                            continue
+                    logger.error(f"❌ [MessageJournal] 批量写入消息失败，{len(self._pending)}个回合等待重试: {e}")
+                    break
+                
+                for _ in batch:
+                    self._pending.popleft()
+                for turn in batch:
+                    await self._notify_saved(self._callbacks.pop(id(turn), None), True)
+                self._pending_messages -= count
+                self._failures = self._head_attempts = 0
+                flushed += count
+                self._stats["flushed"] += count
+                self._stats["batches"] += 1
+                removed = True
+            if removed:
+                # 已写入数据库的回合从溢写文件中移除（写入后、移除前进程退出时重放会重复写入）
+                await self._rewrite_spill()
+        return flushed
+    
+    async def _notify_saved(self, callback: Optional[SavedCallback], saved: bool):
+        """调用回合的写入回调，回调出错只记录日志，不影响刷写"""
+        if callback is None:
+            return
+        try:
+            await callback(saved)
+        except Exception as e:
+            logger.error(f"❌ [MessageJournal] 回合写入回调失败: {e}")
+    
+    def pending_messages(self, user_id: int, story_id: int, session_id: str) -> List[Dict[str, Any]]:
+        """获取会话中尚未写入数据库的消息（按写入顺序）"""
+        return [
+            msg
+            for turn in self._pending
+            if (turn["user_id"], turn["story_id"], turn["session_id"]) == (user_id, story_id, session_id)
+            for msg in turn["messages"]
+        ]
+    
+    def overlay_latest_state(self, user_id: int, story_id: int, session_id: str, latest_state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        用队列中尚未写入的消息更新从数据库读取的最新游戏状态（读到自己的写入）
+        
+        Args:
+            user_id: 用户ID
+            story_id: 故事ID
+            session_id: 会话ID
+            latest_state: MessageService.get_latest_game_state的结果
+        
+        Returns:
+            更新后的状态字典
+        """
+        pending = self.pending_messages(user_id, story_id, session_id)
+        if not pending:
+            return latest_state
+        
+        result = dict(latest_state)
+        timed = [msg for msg in pending if msg.get("game_time")]
+        if timed:
+            latest_time = max(timed, key=lambda msg: msg["game_time"])["game_time"]
+            result["current_time"] = TimeUtils.format_game_time(latest_time, include_date=True)
+        
+        movements = [msg for msg in pending if msg.get("message_type") == 3 and msg.get("sub_type") == "movement"]
+        if movements:
+            result["player_location"] = (movements[-1].get("metadata") or {}).get("new_location") or movements[-1].get("location")
+        elif not result.get("player_location") and pending[-1].get("location"):
+            result["player_location"] = pending[-1]["location"]
+        return result
+    
+    @staticmethod
+    def _encode_turn(turn: Dict[str, Any]) -> str:
+        messages = [
+            {**msg, "game_time": msg["game_time"].isoformat() if isinstance(msg.get("game_time"), datetime) else msg.get("game_time")}
+            for msg in turn["messages"]
+        ]
+        return json.dumps({**turn, "messages": messages}, ensure_ascii=False, default=str)
+    
+    @staticmethod
+    def _decode_turn(line: str) -> Dict[str, Any]:
+        turn = json.loads(line)
+        for msg in turn["messages"]:
+            if msg.get("game_time"):
+                msg["game_time"] = datetime.fromisoformat(msg["game_time"])
+        return turn
+    
+    def _write_spill(self, turns: List[Dict[str, Any]], mode: str = "a"):
+        """追加（或重写）溢写文件，在线程池中执行"""
+        if not self.spill_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.spill_path)), exist_ok=True)
+            with open(self.spill_path, mode, encoding="utf-8") as f:
+                for turn in turns:
+                    f.write(self._encode_turn(turn) + "\n")
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+        except Exception as e:
+            logger.error(f"❌ [MessageJournal] 写入溢写文件失败: {e}")
+    
+    async def _append_spill(self, turn: Dict[str, Any]):
+        """把新回合追加到溢写文件末尾"""
+        if not self.spill_path:
+            return
+        if self._spill_lock is None:
+            self._spill_lock = asyncio.Lock()
+        async with self._spill_lock:
+            await asyncio.to_thread(self._write_spill, [turn])
+    
+    async def _rewrite_spill(self):
+        """刷写后更新溢写文件：队列已清空时截断文件，否则用剩余的回合重写"""
+        if not self.spill_path:
+            return
+        if self._spill_lock is None:
+            self._spill_lock = asyncio.Lock()
+        async with self._spill_lock:
+            # 在锁内读取队列，正在追加的回合在追加完成后才进入队列，不会丢失
+            remaining = list(self._pending)
+            if remaining or os.path.exists(self.spill_path):
+                await asyncio.to_thread(self._write_spill, remaining, "w")
+    
+    async def _dead_letter(self, turn: Dict[str, Any], error: Exception):
+        """把无法写入数据库的回合追加到死信文件（附带错误信息），需要时可以修复后移回溢写文件重放"""
+        self._stats["dead_lettered"] += 1
+        logger.error(f"❌ [MessageJournal] 回合写入失败{self.max_attempts}次，移入死信文件: "
+                     f"{turn['session_id']}, {len(turn['messages'])}条消息, {error}")
+        if not self.dead_letter_path:
+            return
+        
+        def write():
+            os.makedirs(os.path.dirname(os.path.abspath(self.dead_letter_path)), exist_ok=True)
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                record = json.loads(self._encode_turn(turn))
+                record["error"] = str(error) or type(error).__name__
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+        
+        try:
+            await asyncio.to_thread(write)
+        except Exception as e:
+            logger.error(f"❌ [MessageJournal] 写入死信文件失败: {e}")
+    
+    def _load_spill(self) -> int:
+        """读取溢写文件中的回合放回队列，返回读取的回合数"""
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return 0
+        turns = []
+        try:
+            with open(self.spill_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        turns.append(self._decode_turn(line))
+                    except Exception as e:
+                        # 进程在写入一半时退出，最后一行可能不完整
+                        logger.warning(f"⚠️ [MessageJournal] 跳过无法解析的溢写记录: {e}")
+        except Exception as e:
+            logger.error(f"❌ [MessageJournal] 读取溢写文件失败: {e}")
+            return 0
+        
+        self._pending.extendleft(reversed(turns))
+        self._pending_messages += sum(len(turn["messages"]) for turn in turns)
+        if self._pending:
+            # 丢弃不完整的记录，文件内容与队列保持一致（只在启动时执行一次）
+            self._write_spill(list(self._pending), mode="w")
+        return len(turns)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取消息日志统计"""
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "pending_turns": len(self._pending),
+            "pending_messages": self._pending_messages,
+            "running": self._flusher is not None and not self._flusher.done()
+        }
+
+
+# 创建全局消息日志实例
+message_journal = MessageJournal()
@@ -1,22 +1,62 @@
 """
 消息服务 - 处理游戏消息的数据库持久化
 """
-from typing import Dict, List, Any, Optional
+import base64
+from typing import Dict, List, Any, Optional, Iterable, Tuple
 from datetime import datetime
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import desc
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import desc, func, insert, select, tuple_
+from sqlalchemy.orm import aliased
 
-from ..database.config import get_engine
+from ..database.config import get_async_session
 from ..database.models import Message, Entity, MessageType
+from ..utils.config_loader import get_config_section
+from ..utils.llm_cache import TTLLRUCache
 from ..utils.time_utils import TimeUtils
+from .entity_id_cache import entity_id_cache
+
+# 消息总数缓存的过期时间（消息写入时失效，其他进程写入的消息最多延迟这么久计入总数）
+DEFAULT_COUNT_CACHE_TTL_SECONDS = 30
+DEFAULT_COUNT_CACHE_SIZE = 256
+
+
+def encode_cursor(created_at: datetime, message_id: int) -> str:
+    """把消息的(created_at, id)编码为不透明的分页游标"""
+    raw = f"{created_at.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    解析分页游标
+    
+    Raises:
+        ValueError: 游标格式无效
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, message_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except Exception:
+        raise ValueError(f"无效的分页游标: {cursor}")
 
 
 class MessageService:
     """消息服务 - 负责游戏消息的持久化和查询"""
     
-    def __init__(self):
-        self.engine = get_engine()
-        self.Session = sessionmaker(bind=self.engine)
+    def __init__(self, async_engine=None, entity_id_cache=entity_id_cache):
+        # 消息读写都在async代码路径中，使用异步会话；未指定引擎时使用全局异步引擎
+        self.AsyncSession = async_sessionmaker(bind=async_engine, expire_on_commit=False) if async_engine else None
+        # 位置和NPC的实体ID按故事缓存，关闭时每次保存消息都查询entities表
+        self.entity_id_cache = entity_id_cache
+        # 消息历史的总数按(用户, 故事, 会话)缓存，避免每翻一页都统计全部消息
+        history_config = get_config_section("message_history")
+        self.count_cache_ttl = float(history_config.get("count_cache_ttl_seconds", DEFAULT_COUNT_CACHE_TTL_SECONDS))
+        self._count_cache = TTLLRUCache(int(history_config.get("count_cache_size", DEFAULT_COUNT_CACHE_SIZE)))
+    
+    def _async_session(self) -> AsyncSession:
+        """创建异步数据库会话"""
+        return self.AsyncSession() if self.AsyncSession else get_async_session()
     
     async def save_user_input(
         self, 
@@ -29,7 +69,7 @@ class MessageService:
     ) -> int:
         """保存用户输入消息"""
         try:
-            session = self.Session()
+            session = self._async_session()
             
             # 获取位置实体ID
             location_id = await self._get_location_entity_id(session, story_id, location)
@@ -47,9 +87,10 @@ class MessageService:
             )
             
             session.add(message)
-            session.commit()
+            await session.commit()
+            self._invalidate_count(user_id, story_id, session_id)
             message_id = message.id
-            session.close()
+            await session.close()
             
             print(f"✅ [MessageService] 保存用户输入: ID={message_id}, 内容='{content[:50]}...'")
             return message_id
@@ -57,8 +98,8 @@ class MessageService:
         except Exception as e:
             print(f"❌ [MessageService] 保存用户输入失败: {e}")
             if 'session' in locals():
-                session.rollback()
-                session.close()
+                await session.rollback()
+                await session.close()
             return 0
     
     async def save_npc_dialogue(
@@ -74,7 +115,7 @@ class MessageService:
     ) -> int:
         """保存NPC对话消息"""
         try:
-            session = self.Session()
+            session = self._async_session()
             
             # 获取位置和NPC实体ID
             location_id = await self._get_location_entity_id(session, story_id, location)
@@ -94,9 +135,10 @@ class MessageService:
             )
             
             session.add(message)
-            session.commit()
+            await session.commit()
+            self._invalidate_count(user_id, story_id, session_id)
             message_id = message.id
-            session.close()
+            await session.close()
             
             print(f"✅ [MessageService] 保存NPC对话: ID={message_id}, NPC={npc_name}, 内容='{dialogue[:50]}...'")
             return message_id
@@ -104,8 +146,8 @@ class MessageService:
         except Exception as e:
             print(f"❌ [MessageService] 保存NPC对话失败: {e}")
             if 'session' in locals():
-                session.rollback()
-                session.close()
+                await session.rollback()
+                await session.close()
             return 0
     
     async def save_system_action(
@@ -121,7 +163,7 @@ class MessageService:
     ) -> int:
         """保存系统行动反馈消息"""
         try:
-            session = self.Session()
+            session = self._async_session()
             
             location_id = await self._get_location_entity_id(session, story_id, location)
             
@@ -138,9 +180,10 @@ class MessageService:
             )
             
             session.add(message)
-            session.commit()
+            await session.commit()
+            self._invalidate_count(user_id, story_id, session_id)
             message_id = message.id
-            session.close()
+            await session.close()
             
             print(f"✅ [MessageService] 保存系统行动: ID={message_id}, 类型={sub_type}, 内容='{action_result[:50]}...'")
             return message_id
@@ -148,8 +191,8 @@ class MessageService:
         except Exception as e:
             print(f"❌ [MessageService] 保存系统行动失败: {e}")
             if 'session' in locals():
-                session.rollback()
-                session.close()
+                await session.rollback()
+                await session.close()
             return 0
     
     async def save_sensory_feedback(
@@ -164,7 +207,7 @@ class MessageService:
     ) -> int:
         """保存五感反馈消息"""
         try:
-            session = self.Session()
+            session = self._async_session()
             
             location_id = await self._get_location_entity_id(session, story_id, location)
             
@@ -182,9 +225,10 @@ class MessageService:
             )
             
             session.add(message)
-            session.commit()
+            await session.commit()
+            self._invalidate_count(user_id, story_id, session_id)
             message_id = message.id
-            session.close()
+            await session.close()
             
             print(f"✅ [MessageService] 保存五感反馈: ID={message_id}, 内容='{feedback[:50]}...'")
             return message_id
@@ -192,8 +236,8 @@ class MessageService:
         except Exception as e:
             print(f"❌ [MessageService] 保存五感反馈失败: {e}")
             if 'session' in locals():
-                session.rollback()
-                session.close()
+                await session.rollback()
+                await session.close()
             return 0
     
     async def save_system_info(
@@ -208,7 +252,7 @@ class MessageService:
     ) -> int:
         """保存系统信息消息"""
         try:
-            session = self.Session()
+            session = self._async_session()
             
             location_id = await self._get_location_entity_id(session, story_id, location)
             
@@ -225,9 +269,10 @@ class MessageService:
             )
             
             session.add(message)
-            session.commit()
+            await session.commit()
+            self._invalidate_count(user_id, story_id, session_id)
             message_id = message.id
-            session.close()
+            await session.close()
             
             print(f"✅ [MessageService] 保存系统信息: ID={message_id}, 类型={sub_type}, 内容='{info[:50]}...'")
             return message_id
@@ -235,8 +280,8 @@ class MessageService:
         except Exception as e:
             print(f"❌ [MessageService] 保存系统信息失败: {e}")
             if 'session' in locals():
-                session.rollback()
-                session.close()
+                await session.rollback()
+                await session.close()
             return 0
     
     async def save_error_message(
@@ -250,7 +295,7 @@ class MessageService:
     ) -> int:
         """保存错误消息"""
         try:
-            session = self.Session()
+            session = self._async_session()
             
             location_id = await self._get_location_entity_id(session, story_id, location)
             
@@ -267,9 +312,10 @@ class MessageService:
             )
             
             session.add(message)
-            session.commit()
+            await session.commit()
+            self._invalidate_count(user_id, story_id, session_id)
             message_id = message.id
-            session.close()
+            await session.close()
             
             print(f"✅ [MessageService] 保存错误消息: ID={message_id}, 内容='{error[:50]}...'")
             return message_id
@@ -277,49 +323,147 @@ class MessageService:
         except Exception as e:
             print(f"❌ [MessageService] 保存错误消息失败: {e}")
             if 'session' in locals():
-                session.rollback()
-                session.close()
+                await session.rollback()
+                await session.close()
             return 0
     
-    async def get_session_history(
+    async def save_turn(
         self, 
         user_id: int, 
         story_id: int, 
         session_id: str, 
-        limit: int = 50
-    ) -> List[Dict[str, Any]]:
-        """获取会话历史消息"""
-        try:
-            session = self.Session()
+        messages: List[Dict[str, Any]]
+    ) -> List[int]:
+        """
+        在一个事务中保存一个回合的全部消息（包括用户输入）
+        
+        位置和NPC的实体ID各用一次查询解析，所有消息用一条批量INSERT ... RETURNING写入
+        
+        Args:
+            user_id: 用户ID
+            story_id: 故事ID
+            session_id: 会话ID
+            messages: 按顺序排列的消息，每条包含message_type、sub_type、content、location（位置键名）、game_time，
+                可选npc_name（NPC对话的说话者）、structured_data、metadata
             
-            messages = session.query(Message).filter(
-                Message.user_id == user_id,
-                Message.story_id == story_id,
-                Message.session_id == session_id
-            ).order_by(desc(Message.created_at)).limit(limit).all()
+        Returns:
+            按输入顺序排列的消息ID，保存失败时为空列表
+        """
+        if not messages:
+            return []
+        turn = {"user_id": user_id, "story_id": story_id, "session_id": session_id, "messages": messages}
+        return await self.save_turns([turn]) or []
+    
+    async def save_turns(self, turns: List[Dict[str, Any]], raise_errors: bool = False) -> Optional[List[int]]:
+        """
+        在一个事务中保存多个回合的消息（消息日志批量写入时使用）
+        
+        Args:
+            turns: 回合列表，每个包含user_id、story_id、session_id和messages（格式同save_turn）
+            raise_errors: 保存失败时是否抛出异常（默认记录日志并返回None）
             
-            result = [msg.to_dict() for msg in messages]
-            session.close()
+        Returns:
+            按输入顺序排列的消息ID，保存失败时为None
+        """
+        if not any(turn["messages"] for turn in turns):
+            return []
+        
+        try:
+            session = self._async_session()
+            
+            # 按故事解析实体ID（实体ID缓存命中时不查询，否则每个故事的位置和NPC各查询一次）
+            location_ids = {}
+            npc_ids = {}
+            for story_id in dict.fromkeys(turn["story_id"] for turn in turns):
+                story_messages = [msg for turn in turns if turn["story_id"] == story_id for msg in turn["messages"]]
+                location_ids[story_id] = await self._get_location_entity_ids(
+                    session, story_id, (msg.get("location") for msg in story_messages)
+                )
+                npc_ids[story_id] = await self._get_npc_entity_ids(
+                    session, story_id, (msg.get("npc_name") for msg in story_messages)
+                )
+            
+            rows = [
+                {
+                    "user_id": turn["user_id"],
+                    "story_id": turn["story_id"],
+                    "session_id": turn["session_id"],
+                    "message_type": msg["message_type"],
+                    "sub_type": msg.get("sub_type"),
+                    "content": msg.get("content", ""),
+                    "structured_data": msg.get("structured_data"),
+                    "related_entity": npc_ids[turn["story_id"]].get(msg.get("npc_name")),
+                    "location": location_ids[turn["story_id"]].get(msg.get("location")),
+                    "game_time": msg.get("game_time"),
+                    "message_metadata": msg.get("metadata") or {}
+                }
+                for turn in turns
+                for msg in turn["messages"]
+            ]
+            
+            # render_nulls：空字段也写入NULL，使所有消息落在同一批INSERT中（否则按非空字段分组成多条语句）
+            result = await session.execute(
+                insert(Message).returning(Message.id, sort_by_parameter_order=True).execution_options(render_nulls=True),
+                rows
+            )
+            message_ids = list(result.scalars())
+            await session.commit()
+            for turn in turns:
+                self._invalidate_count(turn["user_id"], turn["story_id"], turn["session_id"])
+            await session.close()
             
-            print(f"✅ [MessageService] 获取会话历史: 用户={user_id}, 会话={session_id}, 消息数={len(result)}")
-            return result
+            print(f"✅ [MessageService] 保存回合消息: 回合数={len(turns)}, 数量={len(message_ids)}, ID={message_ids}")
+            return message_ids
             
         except Exception as e:
-            print(f"❌ [MessageService] 获取会话历史失败: {e}")
+            print(f"❌ [MessageService] 保存回合消息失败: {e}")
             if 'session' in locals():
-                session.close()
-            return []
+                await session.rollback()
+                await session.close()
+            if raise_errors:
+                raise
+            return None
+    
+    async def get_session_history(
+        self, 
+        user_id: int, 
+        story_id: int, 
+        session_id: str, 
+        limit: int = 50,
+        after: Optional[str] = None,
+        before: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        获取会话历史消息，不指定游标时从最新的消息开始向前分页
+        
+        Args:
+            user_id: 用户ID
+            story_id: 故事ID
+            session_id: 会话ID
+            limit: 限制返回数量
+            after: 游标，获取该游标之后（更新）的消息
+            before: 游标，获取该游标之前（更早）的消息
+            
+        Returns:
+            与get_story_messages相同的字典：messages（升序）、has_more、next_cursor、prev_cursor
+        """
+        return await self.get_story_messages(
+            user_id, story_id, session_id, limit=limit, after=after, before=before,
+            latest=True, include_total=False
+        )
     
     async def _get_location_entity_id(self, session, story_id: int, location_key: str) -> Optional[int]:
         """获取位置实体ID"""
         try:
-            entity = session.query(Entity).filter(
-                Entity.story_id == story_id,
-                Entity.entity_type == 2,  # location
-                Entity.key_name == location_key
-            ).first()
-            
-            return entity.id if entity else None
+            if self.entity_id_cache.enabled:
+                return await self.entity_id_cache.get_location_id(session, story_id, location_key)
+            return await session.scalar(
+                select(Entity.id).where(
+                    Entity.story_id == story_id,
+                    Entity.entity_type == 2,  # location
+                    Entity.key_name == location_key
+                ).limit(1)
+            )
             
         except Exception as e:
             print(f"❌ [MessageService] 获取位置实体ID失败: {e}")
@@ -328,89 +472,166 @@ class MessageService:
     async def _get_npc_entity_id(self, session, story_id: int, npc_name: str) -> Optional[int]:
         """获取NPC实体ID"""
         try:
+            if self.entity_id_cache.enabled:
+                return await self.entity_id_cache.get_npc_id(session, story_id, npc_name)
             # 尝试通过名称匹配
-            entity = session.query(Entity).filter(
-                Entity.story_id == story_id,
-                Entity.entity_type == 1,  # npc
-                Entity.name == npc_name
-            ).first()
-            
-            return entity.id if entity else None
+            return await session.scalar(
+                select(Entity.id).where(
+                    Entity.story_id == story_id,
+                    Entity.entity_type == 1,  # npc
+                    Entity.name == npc_name
+                ).limit(1)
+            )
             
         except Exception as e:
             print(f"❌ [MessageService] 获取NPC实体ID失败: {e}")
             return None
     
+    async def _get_location_entity_ids(self, session, story_id: int, location_keys: Iterable[Optional[str]]) -> Dict[str, int]:
+        """批量获取位置实体ID（位置键名 -> 实体ID）"""
+        keys = {key for key in location_keys if key}
+        if not keys:
+            return {}
+        try:
+            if self.entity_id_cache.enabled:
+                locations = (await self.entity_id_cache.get_story_ids(session, story_id))["locations"]
+                return {key: locations[key] for key in keys if key in locations}
+            rows = await session.execute(
+                select(Entity.key_name, Entity.id).where(
+                    Entity.story_id == story_id,
+                    Entity.entity_type == 2,  # location
+                    Entity.key_name.in_(keys)
+                )
+            )
+            return {key_name: entity_id for key_name, entity_id in rows}
+            
+        except Exception as e:
+            print(f"❌ [MessageService] 批量获取位置实体ID失败: {e}")
+            return {}
+    
+    async def _get_npc_entity_ids(self, session, story_id: int, npc_names: Iterable[Optional[str]]) -> Dict[str, int]:
+        """批量获取NPC实体ID（NPC名称 -> 实体ID，同名时取最早创建的实体）"""
+        names = {name for name in npc_names if name}
+        if not names:
+            return {}
+        try:
+            if self.entity_id_cache.enabled:
+                npcs = (await self.entity_id_cache.get_story_ids(session, story_id))["npcs"]
+                return {name: npcs[name] for name in names if name in npcs}
+            rows = await session.execute(
+                select(Entity.name, Entity.id).where(
+                    Entity.story_id == story_id,
+                    Entity.entity_type == 1,  # npc
+                    Entity.name.in_(names)
+                ).order_by(Entity.id)
+            )
+            entity_ids = {}
+            for name, entity_id in rows:
+                entity_ids.setdefault(name, entity_id)
+            return entity_ids
+            
+        except Exception as e:
+            print(f"❌ [MessageService] 批量获取NPC实体ID失败: {e}")
+            return {}
+    
     async def get_story_messages(
         self, 
         user_id: int, 
         story_id: int, 
         session_id: str = None,
         limit: int = 100,
-        offset: int = 0
+        offset: int = 0,
+        after: Optional[str] = None,
+        before: Optional[str] = None,
+        latest: bool = False,
+        include_total: bool = True
     ) -> Dict[str, Any]:
         """
-        获取故事的消息历史
+        获取故事的消息历史（消息按创建时间和ID升序排列）
+        
+        支持两种分页方式：offset偏移分页（页越靠后越慢）；after/before游标分页，任意位置的页查询代价相同。
+        before按(created_at, id)定位；after用于轮询新消息，只按id定位和排序：created_at在写入前生成，
+        较晚提交的消息可能带有更早的created_at，按时间定位会被已前移的游标跳过，而自增id随插入分配
         
         Args:
             user_id: 用户ID
             story_id: 故事ID
             session_id: 会话ID（可选，为None时获取所有会话）
             limit: 限制返回数量
-            offset: 偏移量
+            offset: 偏移量（仅在不使用游标且latest为False时生效）
+            after: 游标，获取该游标之后（更新）的消息
+            before: 游标，获取该游标之前（更早）的消息
+            latest: 不指定游标时从最新的消息开始向前分页
+            include_total: 是否返回总数（总数按会话缓存，消息写入时失效）
             
         Returns:
-            包含消息列表和总数的字典
+            包含消息列表、总数和游标的字典：next_cursor用于获取更新的消息，prev_cursor用于获取更早的消息，
+            has_more表示分页方向上是否还有消息；查询失败时包含error
+        
+        Raises:
+            ValueError: 游标格式无效，或同时指定了after和before（在查询前检查，由调用方作为请求参数错误处理）
         """
+        if after and before:
+            raise ValueError("after和before不能同时指定")
+        after_position = decode_cursor(after) if after else None
+        before_position = decode_cursor(before) if before else None
+        
         try:
-            session = self.Session()
+            session = self._async_session()
             
             # 构建查询条件
-            query = session.query(Message).filter(
-                Message.user_id == user_id,
-                Message.story_id == story_id
-            )
-            
+            conditions = [Message.user_id == user_id, Message.story_id == story_id]
             if session_id:
-                query = query.filter(Message.session_id == session_id)
+                conditions.append(Message.session_id == session_id)
             
             # 获取总数
-            total_count = query.count()
-            
-            # 获取消息列表，按创建时间升序排列
-            messages = query.order_by(Message.created_at.asc()).offset(offset).limit(limit).all()
+            total_count = await self._count_messages(session, conditions, user_id, story_id, session_id) if include_total else None
+            
+            # 游标定位：向后翻页按id升序取游标之后的消息，向前翻页按(created_at, id)降序取游标之前的消息
+            backward = bool(before) or (latest and not after)
+            if after:
+                conditions.append(Message.id > after_position[1])
+                ordering = (Message.id.asc(),)
+            elif backward:
+                if before:
+                    conditions.append(tuple_(Message.created_at, Message.id) < before_position)
+                ordering = (desc(Message.created_at), desc(Message.id))
+            else:
+                ordering = (Message.created_at.asc(), Message.id.asc())
+            
+            # 消息类型、相关实体和位置名称在同一条查询中关联获取
+            related_entity = aliased(Entity)
+            location_entity = aliased(Entity)
+            query = (
+                select(Message, MessageType.type_name, related_entity.name, location_entity.name)
+                .outerjoin(MessageType, MessageType.id == Message.message_type)
+                .outerjoin(related_entity, related_entity.id == Message.related_entity)
+                .outerjoin(location_entity, location_entity.id == Message.location)
+                .where(*conditions)
+                .order_by(*ordering)
+                .limit(limit + 1)  # 多取一条判断是否还有下一页，不依赖总数
+            )
+            if offset and not (after or before or latest):
+                query = query.offset(offset)
+            rows = (await session.execute(query)).all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            if backward:
+                rows.reverse()
             
             # 转换为字典格式，包含关联信息
             result_messages = []
-            for msg in messages:
+            for msg, type_name, related_entity_name, location_name in rows:
                 msg_dict = msg.to_dict()
-                
-                # 添加消息类型名称
-                try:
-                    msg_type = session.query(MessageType).filter(MessageType.id == msg.message_type).first()
-                    msg_dict['message_type_name'] = msg_type.type_name if msg_type else 'unknown'
-                except:
-                    msg_dict['message_type_name'] = 'unknown'
-                
-                # 添加相关实体名称
+                msg_dict['message_type_name'] = type_name or 'unknown'
                 if msg.related_entity:
-                    try:
-                        entity = session.query(Entity).filter(Entity.id == msg.related_entity).first()
-                        msg_dict['related_entity_name'] = entity.name if entity else None
-                    except:
-                        msg_dict['related_entity_name'] = None
-                
-                # 添加位置名称
+                    msg_dict['related_entity_name'] = related_entity_name
                 if msg.location:
-                    try:
-                        location_entity = session.query(Entity).filter(Entity.id == msg.location).first()
-                        msg_dict['location_name'] = location_entity.name if location_entity else None
-                    except:
-                        msg_dict['location_name'] = None
-                
+                    msg_dict['location_name'] = location_name
                 result_messages.append(msg_dict)
             
-            session.close()
+            first_message, last_message = (rows[0][0], rows[-1][0]) if rows else (None, None)
+            await session.close()
             
             print(f"✅ [MessageService] 获取故事消息历史: 用户={user_id}, 故事={story_id}, 会话={session_id or 'ALL'}, 总数={total_count}, 返回={len(result_messages)}")
             
@@ -419,13 +640,16 @@ class MessageService:
                 "total_count": total_count,
                 "limit": limit,
                 "offset": offset,
-                "has_more": (offset + len(result_messages)) < total_count
+                "has_more": has_more,
+                # 没有消息时保留请求的游标，便于继续轮询
+                "next_cursor": encode_cursor(last_message.created_at, last_message.id) if last_message else after,
+                "prev_cursor": encode_cursor(first_message.created_at, first_message.id) if first_message else before
             }
             
         except Exception as e:
             print(f"❌ [MessageService] 获取故事消息历史失败: {e}")
             if 'session' in locals():
-                session.close()
+                await session.close()
             return {
                 "messages": [],
                 "total_count": 0,
@@ -435,6 +659,21 @@ class MessageService:
                 "error": str(e)
             }
     
+    async def _count_messages(self, session, conditions, user_id: int, story_id: int, session_id: Optional[str]) -> int:
+        """统计消息总数（按用户、故事和会话缓存）"""
+        key = f"{user_id}:{story_id}:{session_id or '*'}"
+        hit, count = self._count_cache.get(key)
+        if hit:
+            return count
+        count = await session.scalar(select(func.count(Message.id)).where(*conditions))
+        self._count_cache.set(key, count, self.count_cache_ttl)
+        return count
+    
+    def _invalidate_count(self, user_id: int, story_id: int, session_id: str):
+        """消息写入后清除会话和整个故事的消息总数缓存"""
+        self._count_cache.delete(f"{user_id}:{story_id}:{session_id}")
+        self._count_cache.delete(f"{user_id}:{story_id}:*")
+    
     async def get_latest_game_state(
         self, 
         user_id: int, 
@@ -453,23 +692,27 @@ class MessageService:
             包含最新游戏时间和玩家位置的字典
         """
         try:
-            session = self.Session()
+            session = self._async_session()
             
             # 获取最新的一条消息来确定游戏时间
-            latest_message = session.query(Message).filter(
-                Message.user_id == user_id,
-                Message.story_id == story_id,
-                Message.session_id == session_id
-            ).order_by(desc(Message.game_time)).first()
+            latest_message = await session.scalar(
+                select(Message).where(
+                    Message.user_id == user_id,
+                    Message.story_id == story_id,
+                    Message.session_id == session_id
+                ).order_by(desc(Message.game_time)).limit(1)
+            )
             
             # 获取最新的移动消息来确定玩家位置
-            latest_movement = session.query(Message).filter(
-                Message.user_id == user_id,
-                Message.story_id == story_id,
-                Message.session_id == session_id,
-                Message.message_type == 3,  # system_action
-                Message.sub_type == "movement"
-            ).order_by(desc(Message.game_time)).first()
+            latest_movement = await session.scalar(
+                select(Message).where(
+                    Message.user_id == user_id,
+                    Message.story_id == story_id,
+                    Message.session_id == session_id,
+                    Message.message_type == 3,  # system_action
+                    Message.sub_type == "movement"
+                ).order_by(desc(Message.game_time)).limit(1)
+            )
             
             result = {
                 "current_time": None,
@@ -502,7 +745,7 @@ class MessageService:
                         result["player_location"] = new_location
                     else:
                         # 如果metadata中没有新位置，尝试从location实体中获取
-                        location_entity = session.query(Entity).filter(Entity.id == latest_movement.location).first()
+                        location_entity = await session.get(Entity, latest_movement.location)
                         if location_entity:
                             result["player_location"] = location_entity.key_name
                 except Exception as e:
@@ -511,13 +754,13 @@ class MessageService:
             # 如果没有找到移动记录，尝试从最新的任何消息中获取位置
             if not result["player_location"] and latest_message and latest_message.location:
                 try:
-                    location_entity = session.query(Entity).filter(Entity.id == latest_message.location).first()
+                    location_entity = await session.get(Entity, latest_message.location)
                     if location_entity:
                         result["player_location"] = location_entity.key_name
                 except Exception as e:
                     print(f"⚠️ 解析最新消息位置失败: {e}")
             
-            session.close()
+            await session.close()
             
             print(f"✅ [MessageService] 获取最新游戏状态: 用户={user_id}, 会话={session_id}")
             print(f"    当前时间: {result['current_time']}")
@@ -529,7 +772,7 @@ class MessageService:
         except Exception as e:
             print(f"❌ [MessageService] 获取最新游戏状态失败: {e}")
             if 'session' in locals():
-                session.close()
+                await session.close()
             return {
                 "current_time": None,
                 "player_location": None,
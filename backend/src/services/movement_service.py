@@ -13,44 +13,52 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(SRC_DIR))
 sys.path.append(PROJECT_ROOT)
 sys.path.append(SRC_DIR)
 
-from .location_service import LocationService
-from .llm_service import LLMService
+from .location_service import location_service
+from .llm_service import llm_service
 from ..models.game_state_model import GameStateModel
 from ..prompts.prompt_templates import PromptTemplates
+from ..utils.stream_events import EventCallback, emit_event, EVENT_MESSAGE
 import sys
 import os
 # 添加项目根目录到Python路径
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(PROJECT_ROOT)
 
-from ..services.location_db_service import LocationDBService
-from ..services.npc_db_service import NPCDBService
+from ..services.location_db_service import location_db_service
+from ..services.npc_db_service import npc_db_service
+from .destination_resolver import destination_resolver
+from .arrival_prefetcher import arrival_prefetcher
 
 
 class MovementService:
     """移动服务类"""
     
     def __init__(self):
-        self.location_service = LocationService()
-        self.llm_service = LLMService()
-        self.location_db_service = LocationDBService()
-        self.npc_db_service = NPCDBService()
+        self.location_service = location_service
+        self.llm_service = llm_service
+        self.location_db_service = location_db_service
+        self.npc_db_service = npc_db_service
+        self.destination_resolver = destination_resolver
     
-    async def process_movement(self, action: str, game_state: GameStateModel) -> Dict[str, Any]:
+    async def process_movement(self, action: str, game_state: GameStateModel,
+                               on_event: EventCallback = None,
+                               destination_key: Optional[str] = None) -> Dict[str, Any]:
         """
         处理移动行动
         
         Args:
             action: 玩家行动
             game_state: 游戏状态
+            on_event: 流式事件回调（可选），每生成一步移动描述推送一次
+            destination_key: 回合规划给出的目的地（可选），提供时不再识别目的地
             
         Returns:
             移动处理结果
         """
         print(f"\n🚶 [MovementService] 处理移动: {action}")
         
-        # 使用LLM智能识别目的地
-        target_location_key = await self.llm_extract_destination(action, game_state)
+        # 识别目的地（回合规划已给出时直接使用）
+        target_location_key = destination_key or await self.llm_extract_destination(action, game_state)
         
         if not target_location_key:
             print(f"❌ 无法识别目的地")
@@ -65,7 +73,7 @@ class MovementService:
         # 检查是否已经在目标位置
         if game_state.player_location == target_location_key:
             # 从数据库获取位置名称
-            location_result = self.location_db_service.get_location_by_key(game_state.story_id, target_location_key)
+            location_result = await self.location_db_service.aget_location_by_key(game_state.story_id, target_location_key)
             destination_name = target_location_key
             if location_result.get("success"):
                 location_data = location_result.get("data", {})
@@ -83,7 +91,7 @@ class MovementService:
         
         if not path:
             # 从数据库获取位置名称
-            location_result = self.location_db_service.get_location_by_key(game_state.story_id, target_location_key)
+            location_result = await self.location_db_service.aget_location_by_key(game_state.story_id, target_location_key)
             destination_name = target_location_key
             if location_result.get("success"):
                 location_data = location_result.get("data", {})
@@ -98,31 +106,40 @@ class MovementService:
         print(f"✅ 找到路径: {path}")
         
         # 执行多步移动
-        return await self.execute_multi_step_movement(path, game_state, action)
+        return await self.execute_multi_step_movement(path, game_state, action, on_event)
     
     async def llm_extract_destination(self, action: str, game_state: GameStateModel) -> Optional[str]:
-        """使用LLM智能识别目的地"""
+        """识别目的地：先用本地位置索引解析，无法确定时再交给LLM从候选位置中选择"""
         try:
-            llm = self.llm_service.get_llm_instance()
-            
             # 从数据库获取当前故事的所有位置
-            story_locations_result = self.location_db_service.get_locations_by_story(game_state.story_id)
+            story_locations_result = await self.location_db_service.aget_locations_by_story(game_state.story_id)
             if not story_locations_result.get("success"):
                 print(f"❌ 获取故事位置失败: {story_locations_result.get('error')}")
                 return None
             
             story_locations = story_locations_result.get("data", [])
             
-            # 构建所有可用位置信息
+            # 本地解析，置信时不调用LLM
+            index = self.destination_resolver.get_index(game_state.story_id, story_locations)
+            resolved = self.destination_resolver.resolve(action, index)
+            if resolved["destination_key"]:
+                print(f"  🎯 本地解析目的地: {resolved['query']} -> {resolved['destination_key']}")
+                return resolved["destination_key"]
+            
+            # 只把候选位置交给LLM，没有候选时使用全部位置
+            candidate_keys = self.destination_resolver.candidate_keys(index, resolved["matches"], game_state.player_location)
+            candidate_locations = [index.locations[key] for key in candidate_keys] or story_locations
+            
+            # 构建候选位置信息
             available_locations = []
-            for location in story_locations:
+            for location in candidate_locations:
                 desc = location.get("description") or "无描述"
                 available_locations.append(f"- {location['key']}: {location['name']} - {desc}")
             
             all_location_info = "\n".join(available_locations)
             
             # 获取当前位置名称
-            current_location_result = self.location_db_service.get_location_by_key(game_state.story_id, game_state.player_location)
+            current_location_result = await self.location_db_service.aget_location_by_key(game_state.story_id, game_state.player_location)
             current_location_name = game_state.player_location
             if current_location_result.get("success"):
                 current_location_data = current_location_result.get("data", {})
@@ -146,12 +163,11 @@ class MovementService:
             print(f"  可用位置数量: {len(available_locations)}个")
             print(f"📤 输入 (Human): 玩家行动：{action}")
             
-            # 使用JsonOutputParser来解析LLM响应
-            parser = JsonOutputParser()
-            response = parser.invoke(await llm.ainvoke([
+            # 使用JsonOutputParser来解析LLM响应（目的地识别可缓存）
+            response = await self.llm_service.ainvoke_messages([
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=f"玩家行动：{action}")
-            ]))
+            ], task="move_destination", parser=JsonOutputParser())
             
             print(f"📥 LLM输出: {response}")
             
@@ -184,7 +200,7 @@ class MovementService:
         print(f"\n🗺️ [MovementService] 寻找路径: {start_location} -> {target_location}")
         
         # 从数据库获取所有位置和连接信息
-        story_locations_result = self.location_db_service.get_locations_by_story(story_id)
+        story_locations_result = await self.location_db_service.aget_locations_by_story(story_id)
         if not story_locations_result.get("success"):
             print(f"❌ 获取故事位置失败: {story_locations_result.get('error')}")
             return []
@@ -226,7 +242,8 @@ class MovementService:
         print(f"  ❌ 未找到路径")
         return []
     
-    async def execute_multi_step_movement(self, path: List[str], game_state: GameStateModel, original_action: str) -> Dict[str, Any]:
+    async def execute_multi_step_movement(self, path: List[str], game_state: GameStateModel, original_action: str,
+                                          on_event: EventCallback = None) -> Dict[str, Any]:
         """执行多步移动"""
         print(f"\n🚶‍♂️ 执行多步移动，共{len(path)}步")
         
@@ -238,7 +255,7 @@ class MovementService:
         for i, next_location in enumerate(path):
             step_num = i + 1
             # 从数据库获取位置名称
-            location_result = self.location_db_service.get_location_by_key(game_state.story_id, next_location)
+            location_result = await self.location_db_service.aget_location_by_key(game_state.story_id, next_location)
             location_name = next_location
             if location_result.get("success"):
                 location_data = location_result.get("data", {})
@@ -261,6 +278,7 @@ class MovementService:
                     "type": "movement",
                     "timestamp": current_time
                 })
+                await emit_event(on_event, EVENT_MESSAGE, message=all_messages[-1])
             else:
                 # 多步移动
                 if step_num == 1:
@@ -272,6 +290,7 @@ class MovementService:
                         "type": "movement",
                         "timestamp": current_time
                     })
+                    await emit_event(on_event, EVENT_MESSAGE, message=all_messages[-1])
                 
                 step_description = await self.generate_step_description(current_location, next_location, step_num, len(path), game_state.story_id)
                 all_messages.append({
@@ -280,12 +299,13 @@ class MovementService:
                     "type": "movement",
                     "timestamp": current_time
                 })
+                await emit_event(on_event, EVENT_MESSAGE, message=all_messages[-1])
             
             # 更新当前位置
             current_location = next_location
         
         # 到达最终目的地，生成五感反馈
-        final_location_result = self.location_db_service.get_location_by_key(game_state.story_id, current_location)
+        final_location_result = await self.location_db_service.aget_location_by_key(game_state.story_id, current_location)
         final_location_dict = {
             "name": current_location,
             "description": "无描述"
@@ -297,13 +317,18 @@ class MovementService:
                 "description": final_location_data.get("description", "无描述")
             }
         
-        arrival_feedback = await self.location_service.generate_sensory_feedback(
-            f"到达{final_location_dict['name']}",
-            final_location_dict,
-            [],  # 到达时暂时不考虑NPC，会在后续更新
-            current_time,
-            game_state.player_personality
-        )
+        arrival_prefetcher.record_move(game_state.story_id, game_state.player_location, current_location)
+        # 上一回合结束后可能已在后台预取了到达反馈
+        arrival_feedback = await arrival_prefetcher.get(game_state.story_id, current_location, current_time,
+                                                     game_state.player_personality)
+        if arrival_feedback is None:
+            arrival_feedback = await self.location_service.generate_sensory_feedback(
+                f"到达{final_location_dict['name']}",
+                final_location_dict,
+                [],  # 到达时暂时不考虑NPC，会在后续更新
+                current_time,
+                game_state.player_personality
+            )
         
         all_messages.append({
             "speaker": "系统",
@@ -311,6 +336,7 @@ class MovementService:
             "type": "sensory",
             "timestamp": current_time
         })
+        await emit_event(on_event, EVENT_MESSAGE, message=all_messages[-1])
         
         print(f"  ✅ 移动完成，总耗时: {total_time_cost}分钟")
         
@@ -338,8 +364,8 @@ class MovementService:
     
     async def generate_single_move_description(self, from_location: str, to_location: str, story_id: int) -> str:
         """生成单步移动描述"""
-        from_result = self.location_db_service.get_location_by_key(story_id, from_location)
-        to_result = self.location_db_service.get_location_by_key(story_id, to_location)
+        from_result = await self.location_db_service.aget_location_by_key(story_id, from_location)
+        to_result = await self.location_db_service.aget_location_by_key(story_id, to_location)
         
         from_name = from_location
         to_name = to_location
@@ -356,8 +382,8 @@ class MovementService:
     
     async def generate_step_description(self, from_location: str, to_location: str, step_num: int, total_steps: int, story_id: int) -> str:
         """生成多步移动中的单步描述"""
-        from_result = self.location_db_service.get_location_by_key(story_id, from_location)
-        to_result = self.location_db_service.get_location_by_key(story_id, to_location)
+        from_result = await self.location_db_service.aget_location_by_key(story_id, from_location)
+        to_result = await self.location_db_service.aget_location_by_key(story_id, to_location)
         
         from_name = from_location
         to_name = to_location
@@ -387,7 +413,7 @@ class MovementService:
     async def get_available_destinations(self, current_location: str, story_id: int) -> List[Dict[str, str]]:
         """获取当前位置可到达的目的地"""
         # 从数据库获取当前位置的连接信息
-        location_result = self.location_db_service.get_location_by_key(story_id, current_location)
+        location_result = await self.location_db_service.aget_location_by_key(story_id, current_location)
         if not location_result.get("success"):
             return []
         
@@ -396,7 +422,7 @@ class MovementService:
         
         destinations = []
         for loc_key in connections:
-            loc_result = self.location_db_service.get_location_by_key(story_id, loc_key)
+            loc_result = await self.location_db_service.aget_location_by_key(story_id, loc_key)
             if loc_result.get("success"):
                 loc_data = loc_result.get("data", {})
                 destinations.append({
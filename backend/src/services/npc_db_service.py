@@ -7,6 +7,7 @@ from sqlalchemy.exc import SQLAlchemyError
 
 from ..database.config import get_session
 from ..database.models import NPC, Story, Entity
+from .entity_id_cache import entity_id_cache
 
 
 class NPCDBService:
@@ -72,6 +73,7 @@ class NPCDBService:
             )
             session.add(entity)
             session.commit()
+            entity_id_cache.invalidate(story_id)
             
             return {
                 "success": True,
@@ -178,7 +180,9 @@ class NPCDBService:
                 if hasattr(npc, key) and key not in ['id', 'story_id', 'created_at']:
                     setattr(npc, key, value)
             
+            story_id = npc.story_id
             session.commit()
+            entity_id_cache.invalidate(story_id)
             
             return {
                 "success": True,
@@ -279,8 +283,10 @@ class NPCDBService:
                 return {"success": False, "error": "NPC不存在"}
             
             # 删除NPC
+            story_id = npc.story_id
             session.delete(npc)
             session.commit()
+            entity_id_cache.invalidate(story_id)
             
             return {"success": True, "message": "NPC删除成功"}
             
@@ -346,6 +352,7 @@ class NPCDBService:
                     updated_npcs.append(npc.to_dict())
             
             session.commit()
+            entity_id_cache.invalidate(story_id)
             
             return {
                 "success": True,
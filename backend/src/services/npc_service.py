@@ -20,14 +20,14 @@ import os
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(PROJECT_ROOT)
 
-from ..services.npc_db_service import NPCDBService
+from ..services.npc_db_service import npc_db_service
 
 
 class NPCService:
     """NPC服务类"""
     
     def __init__(self):
-        self.npc_db_service = NPCDBService()
+        self.npc_db_service = npc_db_service
     
     def _get_all_npcs_for_story(self, story_id: int) -> List[Dict[str, Any]]:
         """从数据库获取指定故事的所有NPC数据"""
@@ -271,4 +271,8 @@ class NPCService:
             else:
                 print(f"❌ 持久化计划表失败: {result.get('error')}")
         except Exception as e:
-            print(f"❌ 持久化计划表异常: {e}") 
\ No newline at end of file
+            print(f"❌ 持久化计划表异常: {e}")
+
+
+# 创建全局NPC服务实例
+npc_service = NPCService()
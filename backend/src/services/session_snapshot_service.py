@@ -0,0 +1,128 @@
+"""
+会话快照服务 - 把序列化的游戏状态按(用户, 故事, 会话)保存到game_sessions表，恢复状态时只需读取一行
+"""
+import logging
+from typing import Dict, Any, Optional
+from datetime import datetime
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from ..database.config import get_engine
+from ..database.models import GameSession
+
+logger = logging.getLogger(__name__)
+
+
+class SessionSnapshotService:
+    """会话快照服务 - 读写game_sessions表，按版本号条件写入，发现并发写入时不覆盖"""
+
+    def __init__(self, engine=None):
+        self.engine = engine or get_engine()
+        self.Session = sessionmaker(bind=self.engine)
+        self._stats = {"loads": 0, "found": 0, "saves": 0, "conflicts": 0, "errors": 0}
+
+    def load(self, user_id: int, story_id: int, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        读取会话快照
+
+        Args:
+            user_id: 用户ID
+            story_id: 故事ID
+            session_id: 会话ID
+
+        Returns:
+            {"state": 游戏状态字典, "version": 版本号}，没有快照或读取失败时为None
+        """
+        self._stats["loads"] += 1
+        try:
+            session = self.Session()
+            try:
+                record = session.query(GameSession).filter(
+                    GameSession.user_id == user_id,
+                    GameSession.story_id == story_id,
+                    GameSession.session_id == session_id
+                ).first()
+                if record is None:
+                    return None
+                self._stats["found"] += 1
+                return {"state": record.state or {}, "version": record.version}
+            finally:
+                session.close()
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"❌ [SessionSnapshotService] 读取会话快照失败: {e}")
+            return None
+
+    def save(self, user_id: int, story_id: int, session_id: str, state: Dict[str, Any],
+             expected_version: int = 0) -> Optional[Dict[str, Any]]:
+        """
+        按版本号条件写入会话快照（乐观并发：只有数据库中的版本仍是expected_version时才写入）
+
+        Args:
+            user_id: 用户ID
+            story_id: 故事ID
+            session_id: 会话ID
+            state: 可JSON序列化的游戏状态字典
+            expected_version: 读取状态时的版本号，0表示尚未保存过快照（创建新快照）
+
+        Returns:
+            {"version": 版本号, "conflict": 是否发生并发写入}，失败时为None。
+            conflict为True时没有写入，version为数据库中的当前版本，调用方需要重新读取、合并后再写入
+        """
+        keys = (
+            GameSession.user_id == user_id,
+            GameSession.story_id == story_id,
+            GameSession.session_id == session_id
+        )
+        values = {
+            "state": state,
+            "version": expected_version + 1,
+            "current_time": state.get("current_time"),
+            "player_location": state.get("player_location"),
+            "updated_at": datetime.now()
+        }
+        try:
+            session = self.Session()
+            try:
+                if expected_version:
+                    written = session.execute(
+                        update(GameSession).where(*keys, GameSession.version == expected_version).values(**values)
+                    ).rowcount == 1
+                else:
+                    # 唯一约束冲突说明其他请求已先创建了快照
+                    session.add(GameSession(user_id=user_id, story_id=story_id, session_id=session_id, **values))
+                    try:
+                        session.flush()
+                        written = True
+                    except IntegrityError:
+                        session.rollback()
+                        written = False
+                if not written:
+                    session.rollback()
+                    current_version = session.scalar(select(GameSession.version).where(*keys))
+                    self._stats["conflicts"] += 1
+                    logger.warning(f"⚠️ [SessionSnapshotService] 会话快照并发写入，未写入: {session_id}, "
+                                   f"读取时版本{expected_version}, 当前版本{current_version}")
+                    return {"version": current_version or 0, "conflict": True}
+
+                session.commit()
+                self._stats["saves"] += 1
+                return {"version": values["version"], "conflict": False}
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"❌ [SessionSnapshotService] 保存会话快照失败: {e}")
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取快照读写统计"""
+        return dict(self._stats)
+
+
+# 创建全局会话快照服务实例
+session_snapshot_service = SessionSnapshotService()
@@ -3,6 +3,8 @@
 """
 import sys
 import os
+import copy
+import json
 from typing import Dict, Any, Optional
 
 # 添加路径
@@ -18,6 +20,50 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(_
 sys.path.append(PROJECT_ROOT)
 
 from data.game_config import INITIAL_GAME_STATE
+from ..utils.config_loader import get_config_section
+from ..utils.llm_cache import TTLLRUCache
+from ..database.config import run_in_db_thread
+from .session_snapshot_service import session_snapshot_service
+from .message_journal import message_journal
+
+# 会话状态缓存的默认参数
+DEFAULT_CACHE_TTL = 1800
+DEFAULT_CACHE_MAX_SESSIONS = 256
+# 缓存中每个会话保留的最近消息条数和每个NPC的最近对话条数
+DEFAULT_CACHE_MAX_MESSAGES = 100
+# 发生并发写入时最多合并重试的写入次数
+DEFAULT_MERGE_ATTEMPTS = 3
+
+# 合并时以最新状态为准的字段
+_MERGE_SKIP_FIELDS = {"session_id", "story_id", "version"}
+_MISSING = object()
+
+
+def _merge_value(latest: Any, base: Any, ours: Any) -> Any:
+    """三方合并：本次没有修改时保留最新值；字典按键合并；列表只在本次追加了元素时追加到最新值后面"""
+    if ours == base:
+        return latest
+    if isinstance(ours, dict) and isinstance(base, dict) and isinstance(latest, dict):
+        merged = dict(latest)
+        for key in set(base) | set(ours):
+            value = ours.get(key, _MISSING)
+            if value is _MISSING:
+                merged.pop(key, None)
+            else:
+                merged[key] = _merge_value(latest.get(key), base.get(key, _MISSING), value)
+        return merged
+    if isinstance(ours, list) and isinstance(base, list) and isinstance(latest, list) and ours[:len(base)] == base:
+        return latest + ours[len(base):]
+    return ours
+
+
+def _merge_changes(latest: Dict[str, Any], base: Dict[str, Any], ours: Dict[str, Any]) -> Dict[str, Any]:
+    """把ours相对base的修改合并到latest（均为GameStateModel.to_dict的结果）"""
+    merged = dict(latest)
+    for field, value in ours.items():
+        if field not in _MERGE_SKIP_FIELDS:
+            merged[field] = _merge_value(latest.get(field), base.get(field, _MISSING), value)
+    return merged
 
 
 class StateService:
@@ -35,11 +81,37 @@ class StateService:
         if not hasattr(self, '_initialized'):
             from .message_service import MessageService
             self.message_service = MessageService()
+            self.snapshot_service = session_snapshot_service
+            
+            cache_config = get_config_section("state_cache")
+            self.cache_enabled = cache_config.get("enabled", True)
+            self.cache_ttl = float(cache_config.get("ttl_seconds", DEFAULT_CACHE_TTL))
+            self.cache_max_messages = int(cache_config.get("max_messages", DEFAULT_CACHE_MAX_MESSAGES))
+            self._cache = TTLLRUCache(int(cache_config.get("max_sessions", DEFAULT_CACHE_MAX_SESSIONS)))
+            self._cache_stats = {"hits": 0, "misses": 0, "writes": 0, "invalidations": 0, "write_evictions": 0,
+                                 "merges": 0}
             self._initialized = True
     
+    @staticmethod
+    def _cache_key(session_id: str, user_id: Optional[int], story_id: Optional[int]) -> Optional[str]:
+        """缓存键：会话 + 故事 + 用户，只缓存能从数据库恢复的状态（用户和故事都已知）"""
+        if not user_id or not story_id:
+            return None
+        return f"{session_id}|{story_id}|{user_id}"
+    
+    def _snapshot(self, game_state: GameStateModel) -> Dict[str, Any]:
+        """生成可JSON序列化的状态快照（深拷贝，消息和对话历史只保留最近部分）"""
+        snapshot = json.loads(json.dumps(game_state.to_dict(), ensure_ascii=False, default=str))
+        snapshot["messages"] = snapshot["messages"][-self.cache_max_messages:]
+        snapshot["npc_dialogue_histories"] = {
+            npc_name: history[-self.cache_max_messages:]
+            for npc_name, history in snapshot["npc_dialogue_histories"].items()
+        }
+        return snapshot
+    
     async def get_game_state(self, session_id: str = "default", user_id: int = None, story_id: int = None) -> GameStateModel:
         """
-        获取游戏状态 - 直接从数据库获取
+        获取游戏状态 - 优先读取会话状态缓存，未命中时从数据库恢复
         
         Args:
             session_id: 会话ID
@@ -47,13 +119,24 @@ class StateService:
             story_id: 故事ID
             
         Returns:
-            游戏状态模型
+            游戏状态模型（缓存快照的副本，修改后需调用save_game_state写回）
         """
         try:
+            key = self._cache_key(session_id, user_id, story_id) if self.cache_enabled else None
+            if key:
+                hit, snapshot = self._cache.get(key)
+                if hit:
+                    self._cache_stats["hits"] += 1
+                    return GameStateModel.from_dict(copy.deepcopy(snapshot))
+                self._cache_stats["misses"] += 1
+            
             print(f"🔍 [StateService] 从数据库获取游戏状态: 用户={user_id}, 故事={story_id}, 会话={session_id}")
             
-            # 直接从数据库恢复或创建状态
-            return await self._create_or_restore_state(session_id, user_id, story_id)
+            # 从数据库恢复或创建状态
+            game_state = await self._create_or_restore_state(session_id, user_id, story_id)
+            if key:
+                self._cache.set(key, self._snapshot(game_state), self.cache_ttl)
+            return game_state
             
         except Exception as e:
             print(f"❌ 获取游戏状态失败: {e}")
@@ -74,9 +157,22 @@ class StateService:
         try:
             # 如果有用户ID和故事ID，尝试从数据库恢复状态
             if user_id and story_id:
+                # 优先读取会话快照（一次按唯一键的单行查询）
+                snapshot = await run_in_db_thread(self.snapshot_service.load, user_id, story_id, session_id)
+                if snapshot:
+                    game_state = GameStateModel.from_dict(snapshot["state"])
+                    game_state.session_id = session_id
+                    game_state.story_id = story_id
+                    game_state.version = snapshot["version"]
+                    print(f"✅ [StateService] 从会话快照恢复状态: 版本={game_state.version}, 位置={game_state.player_location}, 时间={game_state.current_time}")
+                    return game_state
+                
+                # 没有快照的旧会话从消息记录推断时间和位置
                 print(f"🔄 [StateService] 从数据库恢复状态: 用户={user_id}, 故事={story_id}, 会话={session_id}")
                 
                 latest_state = await self.message_service.get_latest_game_state(user_id, story_id, session_id)
+                # 写后模式下本会话还有未写入数据库的消息时，以这些消息为准
+                latest_state = message_journal.overlay_latest_state(user_id, story_id, session_id, latest_state)
                 
                 if latest_state.get("current_time") or latest_state.get("player_location"):
                     print(f"✅ [StateService] 从数据库恢复状态成功")
@@ -107,10 +203,9 @@ class StateService:
                     game_state.player_personality = initial_config.get("player_personality", "普通")
                     
                     # 初始化NPC位置
-                    from .npc_service import NPCService
-                    npc_service = NPCService()
-                    game_state.npc_locations = npc_service.update_npc_locations_by_time(
-                        game_state.current_time, game_state
+                    from .npc_service import npc_service
+                    game_state.npc_locations = await run_in_db_thread(
+                        npc_service.update_npc_locations_by_time, game_state.current_time, game_state
                     )
                     
                     # 初始化其他属性
@@ -187,8 +282,7 @@ class StateService:
             game_state.player_personality = initial_config.get("player_personality", "普通")
             
             # 初始化NPC位置
-            from .npc_service import NPCService
-            npc_service = NPCService()
+            from .npc_service import npc_service
             game_state.npc_locations = npc_service.update_npc_locations_by_time(
                 game_state.current_time, game_state
             )
@@ -211,17 +305,82 @@ class StateService:
             # 创建一个简单的默认状态
             return GameStateModel(session_id, story_id)
     
-    def save_game_state(self, session_id: str, game_state: GameStateModel, story_id: int = None):
+    async def save_game_state(self, session_id: str, game_state: GameStateModel, story_id: int = None,
+                              user_id: int = None) -> Optional[Dict[str, Any]]:
+        """
+        保存游戏状态：按版本号条件写入会话快照表，写入成功时同步会话状态缓存（写穿），否则移除缓存
+        
+        Args:
+            session_id: 会话ID
+            game_state: 游戏状态，写入成功后version更新为新版本号
+            story_id: 故事ID
+            user_id: 用户ID
+            
+        Returns:
+            快照写入结果{"version", "conflict"}，conflict为True时没有写入（期间有其他请求写入）；
+            写入失败或状态不可保存（缺少用户或故事）时为None
+        """
+        story_id = story_id or game_state.story_id
+        key = self._cache_key(session_id, user_id, story_id)
+        if not key:
+            return None
+        
+        snapshot = self._snapshot(game_state)
+        result = await run_in_db_thread(
+            self.snapshot_service.save, user_id, story_id, session_id, snapshot, expected_version=game_state.version
+        )
+        written = result is not None and not result["conflict"]
+        if written:
+            game_state.version = snapshot["version"] = result["version"]
+        
+        if not self.cache_enabled:
+            return result
+        if not written:
+            # 写入失败或期间有其他请求写入：缓存不再可信，移除后下次从会话快照恢复
+            self._cache.delete(key)
+            self._cache_stats["write_evictions"] += 1
+            return result
+        self._cache.set(key, snapshot, self.cache_ttl)
+        self._cache_stats["writes"] += 1
+        return result
+    
+    def capture(self, game_state: GameStateModel) -> Dict[str, Any]:
+        """记录读取时的状态（深拷贝），发生并发写入时作为合并的基准"""
+        return json.loads(json.dumps(game_state.to_dict(), ensure_ascii=False, default=str))
+    
+    async def save_merged(self, session_id: str, game_state: GameStateModel, base: Dict[str, Any],
+                          story_id: int = None, user_id: int = None, max_attempts: int = DEFAULT_MERGE_ATTEMPTS) -> bool:
         """
-        保存游戏状态 - 移除缓存功能，仅保留接口兼容性
+        保存游戏状态，发生并发写入时重新读取最新状态，把本次相对base的修改合并进去后重试
         
         Args:
             session_id: 会话ID
-            game_state: 游戏状态
+            game_state: 修改后的游戏状态
+            base: 读取时由capture记录的状态
             story_id: 故事ID
+            user_id: 用户ID
+            max_attempts: 最多写入次数
+            
+        Returns:
+            是否写入成功（成功时game_state为实际写入的状态）
         """
-        print(f"💾 [StateService] 游戏状态保存请求 - 会话ID: {session_id}, 故事ID: {story_id}")
-        # 注意：不再保存到缓存，状态完全依赖数据库持久化
+        for _ in range(max_attempts):
+            result = await self.save_game_state(session_id, game_state, story_id, user_id)
+            if result is None:
+                return False
+            if not result["conflict"]:
+                return True
+            latest = await self.get_game_state(session_id, user_id, story_id or game_state.story_id)
+            merged = GameStateModel.from_dict(
+                _merge_changes(latest.to_dict(), base, self.capture(game_state))
+            )
+            merged.version = latest.version
+            base = self.capture(latest)
+            game_state.__dict__.update(merged.__dict__)
+            self._cache_stats["merges"] += 1
+            print(f"🔀 [StateService] 会话状态并发写入，已合并最新状态后重试: {session_id}")
+        print(f"❌ [StateService] 会话状态多次并发写入，放弃保存: {session_id}")
+        return False
     
     async def update_game_state(self, session_id: str, updates: Dict[str, Any], story_id: int = None) -> GameStateModel:
         """
@@ -291,14 +450,33 @@ class StateService:
     
     def clear_session(self, session_id: str, story_id: int = None):
         """
-        清除会话状态 - 移除缓存功能，仅保留接口兼容性
+        清除会话状态缓存，下次获取时从数据库恢复
         
         Args:
             session_id: 会话ID
-            story_id: 故事ID
+            story_id: 故事ID，为None时清除该会话所有故事的缓存
         """
-        print(f"🗑️ [StateService] 清除会话状态请求 - 会话ID: {session_id}, 故事ID: {story_id}")
-        # 注意：不再操作缓存，如需清除数据应操作数据库
+        prefix = f"{session_id}|{story_id}|" if story_id else f"{session_id}|"
+        removed = self._cache.delete_prefix(prefix)
+        self._cache_stats["invalidations"] += removed
+        print(f"🗑️ [StateService] 清除会话状态缓存 - 会话ID: {session_id}, 故事ID: {story_id}, 清除{removed}条")
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取会话状态缓存统计（内存占用按快照的JSON长度估算）"""
+        lookups = self._cache_stats["hits"] + self._cache_stats["misses"]
+        return {
+            **self._cache_stats,
+            "enabled": self.cache_enabled,
+            "hit_rate": round(self._cache_stats["hits"] / lookups, 4) if lookups else 0.0,
+            "sessions": len(self._cache),
+            "max_sessions": self._cache.max_size,
+            "evictions": self._cache.evictions,
+            "expirations": self._cache.expirations,
+            "approx_bytes": sum(
+                len(json.dumps(snapshot, ensure_ascii=False, default=str).encode("utf-8"))
+                for snapshot in self._cache.values()
+            )
+        }
     
     def get_all_sessions(self) -> Dict[str, GameStateModel]:
         """
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+测试行动路由的规则预分类：移动、对话、复合指令和未知目的地
+"""
+import sys
+import os
+import asyncio
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.services.action_router_service import ActionRouterService
+from src.models.game_state_model import GameStateModel
+
+LOCATIONS = [
+    {"key": "living_room", "name": "客厅", "en_name": "Living Room"},
+    {"key": "kitchen", "name": "厨房", "en_name": "Kitchen"},
+]
+
+
+class FakeLocationService:
+    """返回固定位置列表的位置服务替身（只提供异步接口，预分类不能在事件循环上同步查询）"""
+
+    async def aget_locations_by_story(self, story_id):
+        return {"success": True, "data": LOCATIONS}
+
+
+def test_action_pre_classify():
+    """测试规则预分类的行动类型和置信度"""
+    print("🔧 测试规则预分类")
+    print("=" * 50)
+
+    router = ActionRouterService(location_service=FakeLocationService())
+    game_state = GameStateModel(session_id="s1", story_id=1)
+    game_state.npc_locations = {"林若曦": "kitchen"}
+
+    def classify(action):
+        result = asyncio.run(router.pre_classify(action, game_state))
+        return result["action_type"], result["confidence"]
+
+    # 1. 目的地明确的移动走快速路径
+    print("\n1️⃣ 测试移动...")
+    assert classify("去厨房") == ("move", 0.95)
+    assert classify("前往Living Room") == ("move", 0.95)
+    print("✅ 移动识别正常")
+
+    # 2. 对已知NPC说话走快速路径，未知对象降低置信度
+    print("\n2️⃣ 测试对话...")
+    assert classify("跟林若曦说：早上好") == ("talk", 0.95)
+    assert classify("对陌生人说：你好") == ("talk", 0.8)
+    print("✅ 对话识别正常")
+
+    # 3. 复合指令交给LLM拆分，对话格式开头时也不能只保留第一个行动
+    print("\n3️⃣ 测试复合指令...")
+    assert classify("跟林若曦说：我先走了，然后去客厅") == ("general", 0.0)
+    assert classify("去厨房然后看看冰箱") == ("general", 0.0)
+    print("✅ 复合指令不走快速路径")
+
+    # 4. 目的地不在故事中时置信度不足，交给LLM
+    print("\n4️⃣ 测试未知目的地...")
+    action_type, confidence = classify("去花园")
+    assert action_type == "move" and confidence < router.fast_path_threshold
+    assert classify("发呆") == ("general", 0.0)
+    print("✅ 未知目的地和无法判断的行动交给LLM")
+
+    print("\n🎯 规则预分类测试完成！")
+
+
+if __name__ == "__main__":
+    test_action_pre_classify()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+测试到达反馈预取的位置预测、会话预算、缓存命中和等待进行中的预取
+"""
+import sys
+import os
+import asyncio
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.services.arrival_prefetcher import ArrivalPrefetcher, PREFETCH_TASK
+from src.models.game_state_model import GameStateModel
+
+LOCATIONS = {
+    "living_room": {"name": "客厅", "description": "宽敞明亮", "connections": ["kitchen", "bathroom", "balcony"]},
+    "kitchen": {"name": "厨房", "description": "", "connections": ["living_room"]},
+    "bathroom": {"name": "卫生间", "description": "", "connections": ["living_room"]},
+    "balcony": {"name": "阳台", "description": "", "connections": ["living_room"]},
+}
+
+
+class FakeLocationDB:
+    """按key返回固定位置数据的位置服务替身"""
+
+    def get_location_by_key(self, story_id, key):
+        if key not in LOCATIONS:
+            return {"success": False, "error": "位置不存在"}
+        return {"success": True, "data": {"key": key, **LOCATIONS[key]}}
+
+    async def aget_location_by_key(self, story_id, key):
+        return self.get_location_by_key(story_id, key)
+
+
+class FakeLocationService:
+    """记录调用并按设定延迟返回五感反馈的替身"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = []
+        self.cancelled = 0
+
+    async def generate_sensory_feedback(self, action, location_info, current_npcs, current_time, personality,
+                                        task="sensory_feedback", fallback=True):
+        self.calls.append((location_info["name"], current_time, task, personality))
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"{location_info['name']}@{current_time}"
+
+
+def _make_prefetcher(latency: float = 0.0, **config) -> ArrivalPrefetcher:
+    prefetcher = ArrivalPrefetcher()
+    prefetcher.enabled = True
+    for key, value in config.items():
+        setattr(prefetcher, key, value)
+    prefetcher.location_db_service = FakeLocationDB()
+    prefetcher.location_service = FakeLocationService(latency)
+    return prefetcher
+
+
+def _game_state(location: str = "living_room", current_time: str = "2024-01-15 08:00") -> GameStateModel:
+    game_state = GameStateModel("session-1", story_id=1)
+    game_state.player_location = location
+    game_state.current_time = current_time
+    return game_state
+
+
+async def _run_prefetch_checks():
+    # 1. 去过的位置优先预取，预取结果在同一时间桶内命中且只使用一次
+    print("\n1️⃣ 测试预取命中...")
+    prefetcher = _make_prefetcher()
+    prefetcher.record_move(1, "living_room", "balcony")
+    # 位置查询和预取都在后台任务中进行
+    tasks = await prefetcher.schedule("session-1", _game_state())
+    assert len(tasks) == 2
+    await prefetcher.drain()
+    assert [call[0] for call in prefetcher.location_service.calls] == ["阳台", "厨房"]
+    assert all(call[2] == PREFETCH_TASK for call in prefetcher.location_service.calls)
+    assert await prefetcher.get(1, "balcony", "2024-01-15 08:05", "普通") == "阳台@2024-01-15 08:03"
+    assert await prefetcher.get(1, "balcony", "2024-01-15 08:05", "普通") is None
+    # 不同时间桶不复用
+    assert await prefetcher.get(1, "kitchen", "2024-01-15 09:05", "普通") is None
+    # 使用与实际移动相同的玩家性格生成，性格不同不复用
+    assert all(call[3] == "普通" for call in prefetcher.location_service.calls)
+    assert await prefetcher.get(1, "kitchen", "2024-01-15 08:05", "急躁") is None
+    assert await prefetcher.get(1, "kitchen", "2024-01-15 08:05", "普通") == "厨房@2024-01-15 08:03"
+    print(f"✅ 预取统计: {prefetcher.get_stats()}")
+
+    # 2. 到达时预取仍在进行，等待其完成而不是重复调用
+    print("\n2️⃣ 测试等待进行中的预取...")
+    prefetcher = _make_prefetcher(latency=0.05, top_k=1)
+    await prefetcher.prefetch("session-1", _game_state())
+    # 同一位置、同一时间桶不会重复预取
+    assert await prefetcher.prefetch("session-1", _game_state(current_time="2024-01-15 08:10")) == []
+    assert await prefetcher.get(1, "kitchen", "2024-01-15 08:03", "普通") == "厨房@2024-01-15 08:03"
+    assert len(prefetcher.location_service.calls) == 1
+    assert prefetcher.get_stats()["joined"] == 1
+    print(f"✅ 预取统计: {prefetcher.get_stats()}")
+
+    # 3. 超出会话预算后不再预取，其他会话不受影响
+    print("\n3️⃣ 测试会话预算...")
+    prefetcher = _make_prefetcher(session_budget=3, top_k=2)
+    await prefetcher.prefetch("session-1", _game_state(current_time="2024-01-15 08:00"))
+    assert len(await prefetcher.prefetch("session-1", _game_state(current_time="2024-01-15 12:00"))) == 1
+    assert await prefetcher.prefetch("session-1", _game_state(current_time="2024-01-15 16:00")) == []
+    assert len(await prefetcher.prefetch("session-2", _game_state(current_time="2024-01-15 16:00"))) == 2
+    await prefetcher.drain()
+    stats = prefetcher.get_stats()
+    assert stats["scheduled"] == 5 and stats["budget_exhausted"] == 2
+    print(f"✅ 预取统计: {stats}")
+
+    # 4. 预取迟迟没有完成时只等待有限时间，之后取消预取
+    print("\n4️⃣ 测试等待超时...")
+    prefetcher = _make_prefetcher(latency=5.0, top_k=1, join_timeout=0.05)
+    await prefetcher.prefetch("session-1", _game_state())
+    assert await prefetcher.get(1, "kitchen", "2024-01-15 08:03", "普通") is None
+    await prefetcher.drain()
+    assert prefetcher.get_stats()["join_timeouts"] == 1 and prefetcher.location_service.cancelled == 1
+    assert prefetcher.get_stats()["in_flight"] == 0
+    print("✅ 超时后取消预取")
+
+    # 5. 移动历史和会话预算有数量上限
+    print("\n5️⃣ 测试状态上限...")
+    prefetcher = _make_prefetcher(max_transitions=2, max_sessions=2)
+    for location in ("kitchen", "bathroom", "balcony"):
+        prefetcher.record_move(1, location, "living_room")
+    assert list(prefetcher._transitions) == [(1, "bathroom"), (1, "balcony")]
+    for session in ("session-1", "session-2", "session-3"):
+        prefetcher._consume_budget(session)
+    assert list(prefetcher._spent) == ["session-2", "session-3"]
+    # 预算窗口外的会话不再保留
+    prefetcher._spent["session-2"][0] -= prefetcher.budget_window + 1
+    prefetcher._spent.move_to_end("session-3", last=False)
+    prefetcher._consume_budget("session-3")
+    assert list(prefetcher._spent) == ["session-3"]
+    print("✅ 状态上限正常")
+
+    # 6. 关闭时不预取也不查询
+    print("\n6️⃣ 测试关闭预取...")
+    prefetcher = _make_prefetcher(enabled=False)
+    assert prefetcher.schedule("session-1", _game_state()) is None
+    assert await prefetcher.get(1, "kitchen", "2024-01-15 08:03", "普通") is None
+    print("✅ 关闭时不发起调用")
+
+
+def test_arrival_prefetch():
+    """测试位置预测顺序、时间分桶、会话预算和预取结果的复用"""
+    print("🔧 测试到达反馈预取")
+    print("=" * 50)
+    asyncio.run(_run_prefetch_checks())
+    print("\n🎯 到达反馈预取测试完成！")
+
+
+if __name__ == "__main__":
+    test_arrival_prefetch()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+测试异步依赖图执行器
+"""
+import sys
+import os
+import time
+import asyncio
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.utils.async_dag import AsyncDAGExecutor
+
+
+async def _run_dag_checks():
+    # 1. 无依赖关系的步骤并发执行，依赖结果按参数名传入
+    print("\n1️⃣ 测试并发执行...")
+    
+    async def slow(value):
+        await asyncio.sleep(0.2)
+        return value
+    
+    dag = AsyncDAGExecutor("test")
+    dag.add_step("reply", lambda: slow("你好"))
+    dag.add_step("feedback", lambda reply: slow(f"{reply}!"), depends_on=["reply"])
+    dag.add_step("schedule", lambda reply: slow(True), depends_on=["reply"])
+    started = time.perf_counter()
+    result = await dag.run()
+    elapsed = time.perf_counter() - started
+    assert result.get("feedback") == "你好!"
+    assert result.get("schedule") is True
+    assert result.complete
+    assert elapsed < 0.55, f"步骤未并发执行，耗时{elapsed:.2f}s"
+    print(f"✅ 并发执行正常，总耗时 {elapsed:.2f}s")
+    
+    # 2. 超时和失败的步骤使用默认值，其余步骤结果保留
+    print("\n2️⃣ 测试超时和部分结果...")
+    
+    async def fail():
+        raise RuntimeError("LLM不可用")
+    
+    dag = AsyncDAGExecutor("test")
+    dag.add_step("slow", lambda: slow("太慢"), timeout=0.05, default="默认反馈")
+    dag.add_step("broken", fail, default=3)
+    dag.add_step("fine", lambda: slow("正常"))
+    result = await dag.run()
+    assert result.get("slow") == "默认反馈" and result.timed_out == ["slow"]
+    assert result.get("broken") == 3 and "broken" in result.errors
+    # 保留原始异常，调用方可据此区分需要向上抛出的错误（如LLM过载）
+    assert isinstance(result.exceptions["broken"], RuntimeError) and "slow" not in result.exceptions
+    assert result.ok("fine") and not result.complete
+    print(f"✅ 部分结果: {result.results}")
+    
+    # 3. 必需步骤失败时跳过依赖它的步骤
+    print("\n3️⃣ 测试必需步骤失败...")
+    dag = AsyncDAGExecutor("test")
+    dag.add_step("reply", fail, default="抱歉", required=True)
+    dag.add_step("feedback", lambda reply: slow(reply), depends_on=["reply"], default=None)
+    result = await dag.run()
+    assert result.get("reply") == "抱歉"
+    assert result.skipped == ["feedback"] and result.get("feedback") is None
+    print("✅ 依赖步骤已跳过")
+    
+    # 4. 依赖环和未知依赖
+    print("\n4️⃣ 测试依赖校验...")
+    dag = AsyncDAGExecutor("test")
+    dag.add_step("a", lambda b: slow(1), depends_on=["b"])
+    dag.add_step("b", lambda a: slow(2), depends_on=["a"])
+    try:
+        await dag.run()
+        assert False, "未检测到依赖环"
+    except ValueError as e:
+        print(f"✅ 检测到依赖环: {e}")
+
+
+def test_async_dag():
+    """测试并发执行、超时默认值和依赖跳过"""
+    print("🔧 测试异步依赖图执行器")
+    print("=" * 50)
+    asyncio.run(_run_dag_checks())
+    print("\n🎯 异步依赖图执行器测试完成！")
+
+
+if __name__ == "__main__":
+    test_async_dag()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+测试消息服务的异步读写、回合消息的批量保存、实体ID缓存、游标分页，以及同步数据库调用在有界线程池中执行
+"""
+import sys
+import os
+import time
+import asyncio
+import threading
+from datetime import datetime
+from sqlalchemy import event, update, bindparam
+from sqlalchemy.ext.asyncio import create_async_engine
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.database.config import run_in_db_thread, DB_THREAD_POOL_SIZE
+from src.database.models import Message, Entity, MessageType
+from src.services.message_service import MessageService, encode_cursor, decode_cursor
+from src.services.entity_id_cache import EntityIdCache
+
+
+async def _setup_engine():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Entity.__table__.create)
+        await conn.run_sync(Message.__table__.create)
+        await conn.run_sync(MessageType.__table__.create)
+        await conn.execute(MessageType.__table__.insert(), [
+            {"id": 1, "type_name": "user_input"},
+            {"id": 2, "type_name": "npc_dialogue"},
+            {"id": 3, "type_name": "system_action"},
+        ])
+        await conn.execute(Entity.__table__.insert(), [
+            {"story_id": 1, "entity_type": 2, "name": "客厅", "key_name": "living_room"},
+            {"story_id": 1, "entity_type": 2, "name": "厨房", "key_name": "kitchen"},
+            {"story_id": 1, "entity_type": 1, "name": "林若曦", "key_name": "linruoxi"},
+        ])
+    return engine
+
+
+async def _run_message_checks():
+    engine = await _setup_engine()
+    service = MessageService(async_engine=engine, entity_id_cache=EntityIdCache())
+    try:
+        await _check_messages(service, engine)
+        await _check_save_turn(service, engine)
+        await _check_cursor_pagination(service, engine)
+    finally:
+        # aiosqlite的连接线程需要释放，否则进程无法退出
+        await engine.dispose()
+
+
+async def _check_messages(service: MessageService, engine):
+
+    # 1. 保存各类消息，位置和NPC解析为实体ID
+    print("\n1️⃣ 测试异步保存消息...")
+    user_id = await service.save_user_input(7, 1, "s1", "去厨房", "living_room", datetime(2024, 1, 15, 8, 0))
+    move_id = await service.save_system_action(7, 1, "s1", "你来到了厨房", "kitchen", datetime(2024, 1, 15, 8, 3),
+                                               sub_type="movement", metadata={"new_location": "kitchen"})
+    npc_id = await service.save_npc_dialogue(7, 1, "s1", "林若曦", "早上好", "kitchen", datetime(2024, 1, 15, 8, 5))
+    assert 0 < user_id < move_id < npc_id
+    history = (await service.get_session_history(7, 1, "s1"))["messages"]
+    assert sorted(msg["id"] for msg in history) == [user_id, move_id, npc_id]
+    npc_message = next(msg for msg in history if msg["id"] == npc_id)
+    assert npc_message["related_entity"] == 3 and npc_message["location"] == 2
+    print(f"✅ 已保存{len(history)}条消息")
+
+    # 2. 从消息记录恢复时间和位置
+    print("\n2️⃣ 测试恢复最新游戏状态...")
+    state = await service.get_latest_game_state(7, 1, "s1")
+    assert state["player_location"] == "kitchen"
+    assert state["current_time"].endswith("08:05")
+
+    # 3. 分页查询带消息类型和实体名称，查询次数与页大小无关（总数一次、消息一次）
+    print("\n3️⃣ 测试故事消息分页...")
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine.sync_engine, "before_cursor_execute", listener)
+    try:
+        page = await service.get_story_messages(7, 1, "s1", limit=2, offset=1)
+        full_page = await service.get_story_messages(7, 1, limit=100)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", listener)
+    assert len(statements) == 4
+    assert page["total_count"] == 3 and len(page["messages"]) == 2 and page["has_more"] is False
+    npc_message = next(msg for msg in page["messages"] if msg["id"] == npc_id)
+    assert npc_message["related_entity_name"] == "林若曦" and npc_message["location_name"] == "厨房"
+    assert npc_message["message_type_name"] == "npc_dialogue"
+    messages = {msg["id"]: msg for msg in full_page["messages"]}
+    assert full_page["total_count"] == 3 and set(messages) == {user_id, move_id, npc_id}
+    assert messages[user_id]["message_type_name"] == "user_input" and "related_entity_name" not in messages[user_id]
+    assert messages[user_id]["location_name"] == "客厅"
+    print("✅ 异步读写正常")
+
+
+async def _check_save_turn(service: MessageService, engine):
+    # 4. 一个回合的消息在一个事务中批量写入：实体ID已缓存时不查询实体，所有消息一条INSERT
+    print("\n4️⃣ 测试批量保存回合消息...")
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement.split()[0].upper())
+    event.listen(engine.sync_engine, "before_cursor_execute", listener)
+    game_time = datetime(2024, 1, 15, 9, 0)
+    try:
+        message_ids = await service.save_turn(7, 1, "s2", [
+            {"message_type": 1, "sub_type": "player_action", "content": "和林若曦打招呼", "location": "kitchen",
+             "game_time": game_time},
+            {"message_type": 2, "sub_type": "dialogue", "content": "你好呀", "npc_name": "林若曦",
+             "location": "kitchen", "game_time": game_time, "metadata": {"action_type": "talk"}},
+            {"message_type": 4, "sub_type": "sensory", "content": "她笑了笑", "location": "kitchen",
+             "game_time": game_time, "structured_data": {"dialogue_type": "sensory"}},
+            {"message_type": 5, "sub_type": "system", "content": "未知地点", "location": "attic", "game_time": game_time},
+        ])
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", listener)
+    assert len(message_ids) == 4 and message_ids == sorted(message_ids)
+    # PostgreSQL上所有消息为一条INSERT，SQLite按参数顺序返回ID时逐行插入
+    assert statements.count("SELECT") == 0 and statements.count("INSERT") >= 1
+
+    history = {msg["id"]: msg for msg in (await service.get_session_history(7, 1, "s2"))["messages"]}
+    assert [history[i]["content"] for i in message_ids] == ["和林若曦打招呼", "你好呀", "她笑了笑", "未知地点"]
+    assert history[message_ids[1]]["related_entity"] == 3 and history[message_ids[1]]["metadata"] == {"action_type": "talk"}
+    assert history[message_ids[2]]["structured_data"] == {"dialogue_type": "sensory"}
+    assert history[message_ids[0]]["location"] == 2 and history[message_ids[3]]["location"] is None
+    # 没有消息时不访问数据库
+    assert await service.save_turn(7, 1, "s2", []) == []
+    print(f"✅ 回合消息ID: {message_ids}, 语句: {statements}")
+
+    # 5. 位置或NPC变化后失效，下次保存时用一次查询重新加载整个故事
+    print("\n5️⃣ 测试实体ID缓存失效...")
+    async with engine.begin() as conn:
+        await conn.execute(Entity.__table__.insert(), [{"story_id": 1, "entity_type": 2, "name": "阁楼", "key_name": "attic"}])
+    service.entity_id_cache.invalidate(1)
+    statements.clear()
+    event.listen(engine.sync_engine, "before_cursor_execute", listener)
+    try:
+        attic_id, = await service.save_turn(7, 1, "s2", [
+            {"message_type": 5, "sub_type": "system", "content": "阁楼", "location": "attic", "game_time": game_time}
+        ])
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", listener)
+    assert statements.count("SELECT") == 1
+    history = (await service.get_session_history(7, 1, "s2"))["messages"]
+    assert next(msg for msg in history if msg["id"] == attic_id)["location"] == 4
+    stats = service.entity_id_cache.get_stats()
+    assert stats["loads"] == 2 and stats["invalidations"] == 1 and stats["stories"] == 1 and stats["entries"] == 4
+    print(f"✅ 实体ID缓存统计: {stats}")
+
+
+async def _check_cursor_pagination(service: MessageService, engine):
+    # 6. 按(created_at, id)游标向前、向后翻页，同一时间创建的消息按ID排序
+    print("\n6️⃣ 测试游标分页...")
+    message_ids = await service.save_turn(7, 1, "s3", [
+        {"message_type": 5, "sub_type": "system", "content": f"消息{i}", "location": "kitchen", "game_time": None}
+        for i in range(7)
+    ])
+    # 固定创建时间（含相同时间），不依赖插入时的秒级时间戳
+    created = [datetime(2024, 1, 15, 10, minute) for minute in (0, 1, 1, 1, 2, 3, 3)]
+    async with engine.begin() as conn:
+        await conn.execute(
+            update(Message.__table__).where(Message.__table__.c.id == bindparam("message_id")).values(created_at=bindparam("created")),
+            [{"message_id": mid, "created": at} for mid, at in zip(message_ids, created)]
+        )
+
+    def contents(page):
+        return [msg["content"] for msg in page["messages"]]
+
+    # 从最新的消息开始向前翻页
+    page = await service.get_story_messages(7, 1, "s3", limit=3, latest=True)
+    assert contents(page) == ["消息4", "消息5", "消息6"] and page["has_more"] is True
+    assert page["total_count"] == 7 and decode_cursor(page["prev_cursor"]) == (created[4], message_ids[4])
+    page = await service.get_story_messages(7, 1, "s3", limit=3, before=page["prev_cursor"])
+    assert contents(page) == ["消息1", "消息2", "消息3"] and page["has_more"] is True
+    page = await service.get_story_messages(7, 1, "s3", limit=3, before=page["prev_cursor"])
+    assert contents(page) == ["消息0"] and page["has_more"] is False
+
+    # 从最早的消息开始向后翻页，游标落在相同创建时间的中间
+    page = await service.get_story_messages(7, 1, "s3", limit=2)
+    assert contents(page) == ["消息0", "消息1"] and page["has_more"] is True
+    page = await service.get_story_messages(7, 1, "s3", limit=2, after=page["next_cursor"])
+    assert contents(page) == ["消息2", "消息3"]
+    page = await service.get_story_messages(7, 1, "s3", limit=5, after=page["next_cursor"], include_total=False)
+    assert contents(page) == ["消息4", "消息5", "消息6"] and page["has_more"] is False
+    assert page["total_count"] is None
+    tail_cursor = page["next_cursor"]
+    page = await service.get_story_messages(7, 1, "s3", after=tail_cursor)
+    assert page["messages"] == [] and page["next_cursor"] == tail_cursor
+
+    # 会话历史返回同样的游标，从最新的消息开始向前翻页
+    history = await service.get_session_history(7, 1, "s3", limit=4)
+    assert contents(history) == ["消息3", "消息4", "消息5", "消息6"] and history["has_more"] is True
+    assert history["next_cursor"] == tail_cursor
+    oldest = history["messages"][0]
+    assert history["prev_cursor"] == encode_cursor(datetime.fromisoformat(oldest["created_at"]), oldest["id"])
+    history = await service.get_session_history(7, 1, "s3", limit=4, before=history["prev_cursor"])
+    assert contents(history) == ["消息0", "消息1", "消息2"] and history["has_more"] is False
+
+    # 总数缓存在写入消息时失效
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine.sync_engine, "before_cursor_execute", listener)
+    try:
+        await service.get_story_messages(7, 1, "s3", limit=1)
+        assert not any("count(" in statement for statement in statements)
+        await service.save_turn(7, 1, "s3", [{"message_type": 5, "content": "消息7", "location": None, "game_time": None}])
+        assert (await service.get_story_messages(7, 1, "s3", limit=1))["total_count"] == 8
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", listener)
+
+    # 轮询新消息只按id定位：较晚提交、created_at却更早的消息不会被已前移的游标跳过
+    history = await service.get_session_history(7, 1, "s3", after=tail_cursor)
+    assert contents(history) == ["消息7"] and history["has_more"] is False
+    late_id, = await service.save_turn(7, 1, "s3", [{"message_type": 5, "content": "消息8", "location": None, "game_time": None}])
+    async with engine.begin() as conn:
+        await conn.execute(update(Message.__table__).where(Message.__table__.c.id == late_id).values(created_at=created[0]))
+    history = await service.get_session_history(7, 1, "s3", after=history["next_cursor"])
+    assert contents(history) == ["消息8"] and decode_cursor(history["next_cursor"])[1] == late_id
+
+    # 无效游标在查询前抛出ValueError，由接口返回400
+    for cursor in ("not-a-cursor", "!!", encode_cursor(created[0], 1)[:-3]):
+        try:
+            await service.get_story_messages(7, 1, "s3", after=cursor)
+            raise AssertionError(f"无效游标应抛出ValueError: {cursor}")
+        except ValueError:
+            pass
+    print("✅ 游标分页正常")
+
+
+async def _run_thread_pool_checks():
+    # 6. 同步调用在线程池中执行，不阻塞事件循环，并发数不超过线程池大小
+    print("\n7️⃣ 测试数据库线程池...")
+    lock = threading.Lock()
+    running = {"now": 0, "max": 0}
+
+    def blocking_query(value):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.02)
+        with lock:
+            running["now"] -= 1
+        return value * 2
+
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.005)
+            ticks += 1
+
+    tick_task = asyncio.ensure_future(ticker())
+    results = await asyncio.gather(*[run_in_db_thread(blocking_query, i) for i in range(DB_THREAD_POOL_SIZE * 2)])
+    tick_task.cancel()
+    assert results == [i * 2 for i in range(DB_THREAD_POOL_SIZE * 2)]
+    assert running["max"] <= DB_THREAD_POOL_SIZE
+    # 事件循环在等待期间仍在调度其他协程
+    assert ticks > 0
+    print(f"✅ 最大并发: {running['max']}/{DB_THREAD_POOL_SIZE}")
+
+
+def test_async_message_service():
+    """测试MessageService使用异步会话读写消息，同步调用通过有界线程池执行"""
+    print("🔧 测试异步数据库访问")
+    print("=" * 50)
+    asyncio.run(_run_message_checks())
+    asyncio.run(_run_thread_pool_checks())
+    print("\n🎯 异步数据库访问测试完成！")
+
+
+if __name__ == "__main__":
+    test_async_message_service()
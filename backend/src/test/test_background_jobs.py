@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+测试后台任务队列的执行、失败重试、结果投递、租约和重启恢复
+"""
+import sys
+import os
+import asyncio
+import tempfile
+from sqlalchemy import create_engine
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.database.models import BackgroundJob
+from src.services.background_job_service import BackgroundJobService
+
+
+class FlakyHandler:
+    """前fail_times次调用抛错，之后返回计划表变化消息的任务处理函数替身"""
+
+    def __init__(self, fail_times: int = 0, latency: float = 0.01):
+        self.fail_times = fail_times
+        self.latency = latency
+        self.calls = []
+
+    async def __call__(self, payload):
+        self.calls.append(payload)
+        await asyncio.sleep(self.latency)
+        if len(self.calls) <= self.fail_times:
+            raise RuntimeError("LLM不可用")
+        if not payload.get("changed"):
+            return None
+        return {"messages": [{"speaker": "系统", "message": f"{payload['npc_name']}的计划发生了变化。", "type": "system"}]}
+
+
+def _take_notifications(service: BackgroundJobService, session_id: str, story_id: int):
+    """读取并确认投递会话中的任务结果消息"""
+    pending = service.pending_notifications(session_id, story_id)
+    service.mark_delivered([job["job_id"] for job in pending])
+    return [msg for job in pending for msg in job["messages"]]
+
+
+def _make_service(engine, handler: FlakyHandler) -> BackgroundJobService:
+    service = BackgroundJobService(engine=engine)
+    service.retry_backoff = 0
+    service.poll_interval = 0.01
+    service.register("schedule_update", handler)
+    return service
+
+
+async def _run_queue_checks(engine):
+    # 1. 任务写入后由工作协程执行，结果只投递一次
+    print("\n1️⃣ 测试执行和投递...")
+    handler = FlakyHandler()
+    service = _make_service(engine, handler)
+    await service.enqueue("schedule_update", {"npc_name": "林若曦", "changed": True}, session_id="s1", story_id=1)
+    await service.enqueue("schedule_update", {"npc_name": "林凯", "changed": False}, session_id="s1", story_id=1)
+    await service.drain()
+    # 未确认投递（消息保存失败）的结果在下一回合仍可读取
+    assert sorted(len(job["messages"]) for job in service.pending_notifications("s1", 1)) == [0, 1]
+    # 预留的结果（随回合消息进入写入队列）不再返回给之后的回合，释放后重新可读
+    reserved = service.pending_notifications("s1", 1, reserve=True)
+    assert len(reserved) == 2 and service.pending_notifications("s1", 1) == []
+    service.release([job["job_id"] for job in reserved])
+    messages = _take_notifications(service, "s1", 1)
+    assert [msg["message"] for msg in messages] == ["林若曦的计划发生了变化。"]
+    assert _take_notifications(service, "s1", 1) == []
+    assert _take_notifications(service, "s2", 1) == []
+    assert service.get_stats()["delivered"] == 2
+    print(f"✅ 任务统计: {service.get_stats()}")
+
+    # 2. 失败后重试，超过最大尝试次数后标记为失败
+    print("\n2️⃣ 测试失败重试...")
+    flaky = FlakyHandler(fail_times=2)
+    service.register("schedule_update", flaky)
+    await service.enqueue("schedule_update", {"npc_name": "林若曦", "changed": True}, session_id="s2", story_id=1)
+    await service.drain()
+    assert len(flaky.calls) == 3
+    assert len(_take_notifications(service, "s2", 1)) == 1
+    broken = FlakyHandler(fail_times=10)
+    service.register("schedule_update", broken)
+    job_id = await service.enqueue("schedule_update", {"npc_name": "林若曦"}, session_id="s3", story_id=1, max_attempts=2)
+    await service.drain()
+    assert len(broken.calls) == 2
+    stats = service.get_stats()
+    assert stats["retried"] == 3 and stats["failed"] == 1
+    await service.stop()
+    print(f"✅ 任务统计: {stats}")
+    return job_id
+
+
+async def _run_recovery_checks(engine):
+    # 3. 其他进程正在执行（租约未过期）的任务不会被领取
+    print("\n3️⃣ 测试租约...")
+    slow = FlakyHandler(latency=10)
+    service = _make_service(engine, slow)
+    await service.enqueue("schedule_update", {"npc_name": "林若曦", "changed": True}, session_id="s4", story_id=1)
+    await asyncio.sleep(0.05)
+    assert len(slow.calls) == 1
+
+    handler = FlakyHandler()
+    other = _make_service(engine, handler)
+    other.start()
+    await other.drain()
+    await asyncio.sleep(0.05)
+    await other.stop()
+    assert handler.calls == [] and other.get_stats()["reclaimed"] == 0
+    await service.stop()
+
+    # 4. 进程退出时未完成的任务在租约过期后由其他进程重新执行
+    print("\n4️⃣ 测试重启恢复...")
+    restarted = _make_service(engine, handler)
+    restarted.lease_seconds = 0.05
+    restarted.start()
+    await restarted.drain()
+    await restarted.stop()
+    assert len(handler.calls) == 1 and restarted.get_stats()["reclaimed"] == 1
+    assert len(_take_notifications(restarted, "s4", 1)) == 1
+    print(f"✅ 任务统计: {restarted.get_stats()}")
+
+
+def test_background_jobs():
+    """测试后台任务的持久化执行、指数退避重试、下一回合投递和重启恢复"""
+    print("🔧 测试后台任务队列")
+    print("=" * 50)
+
+    # 数据库调用在线程池中执行，使用文件数据库让各线程的连接看到同一份数据
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'jobs.db')}")
+        BackgroundJob.__table__.create(engine)
+        failed_job_id = asyncio.run(_run_queue_checks(engine))
+        asyncio.run(_run_recovery_checks(engine))
+
+        with engine.connect() as connection:
+            statuses = dict(connection.execute(BackgroundJob.__table__.select().with_only_columns(
+                BackgroundJob.id, BackgroundJob.status)).fetchall())
+        assert statuses[failed_job_id] == "failed"
+        assert list(statuses.values()).count("done") == 4
+        engine.dispose()
+        print(f"✅ 任务状态: {statuses}")
+
+    print("\n🎯 后台任务队列测试完成！")
+
+
+if __name__ == "__main__":
+    test_background_jobs()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+测试复合行动的阶段划分、并发执行和按原始顺序合并结果
+"""
+import sys
+import os
+import time
+import asyncio
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.utils.compound_planner import plan_stages, get_access, SUB_ACTION_ACCESS
+from src.utils.stream_events import OrderedEventRelay, EVENT_MESSAGE
+from src.services.game_service import GameService
+from src.models.game_state_model import GameStateModel
+from src.utils.time_utils import TimeUtils
+
+
+def _stages(*specs):
+    return plan_stages([get_access(*spec) for spec in specs])
+
+
+class FakeDialogueService:
+    """按设定延迟返回NPC回复的对话服务替身，像真实服务一样直接修改传入状态中的对话历史"""
+
+    def __init__(self):
+        self.seen_times = []
+        self.fail_npcs = set()
+
+    def parse_dialogue_action(self, action):
+        npc, _, message = action.partition("：")
+        return {"npc": npc.replace("和", "").replace("说", ""), "message": message}
+
+    async def process_dialogue(self, action, game_state, on_event=None, target_npc=None, message=None, user_id=None):
+        npc = self.parse_dialogue_action(action)["npc"]
+        # 按对话开始时的游戏时间判断NPC是否在场
+        self.seen_times.append(game_state.current_time)
+        if on_event:
+            await on_event(EVENT_MESSAGE, {"message": {"speaker": npc}})
+        await asyncio.sleep(0.2)
+        if npc in self.fail_npcs:
+            return {"success": False, "error": f"{npc}不在这里，无法与其对话", "messages": []}
+        game_state.npc_dialogue_histories.setdefault(npc, []).append({"speaker": npc, "message": "早"})
+        new_time = TimeUtils.add_minutes(game_state.current_time, 2)
+        return {"success": True, "current_time": new_time, "time_cost": 2,
+                "messages": [{"speaker": npc, "message": "早", "type": "dialogue", "timestamp": new_time}]}
+
+
+async def _fake_exploration(action, game_state, estimated_minutes=None):
+    await asyncio.sleep(0.2)
+    new_time = TimeUtils.add_minutes(game_state.current_time, 10)
+    return {"success": True, "current_time": new_time, "time_cost": 10,
+            "messages": [{"speaker": "系统", "message": "四周很安静", "type": "exploration", "timestamp": new_time}]}
+
+
+async def _fake_movement(action, game_state, on_event=None, destination_key=None):
+    return {"success": False, "error": "无法到达", "messages": []}
+
+
+async def _run_compound_checks():
+    service = GameService()
+    service.dialogue_service = FakeDialogueService()
+    service._process_exploration = _fake_exploration
+    service.movement_service.process_movement = _fake_movement
+    game_state = GameStateModel("s1", 1)
+    game_state.current_time = "2024-01-15 08:00"
+
+    # 1. 对话推进时间，之后的对话按前一段对话结束的时间判断NPC是否在场，顺序执行
+    events = []
+
+    async def on_event(event_type, data):
+        events.append(data["message"]["speaker"])
+
+    started = time.perf_counter()
+    result = await service._process_compound_action("和林若曦说：早然后和张雨晴说：早", {"sub_actions": [
+        {"type": "talk", "action": "和林若曦说：早"},
+        {"type": "talk", "action": "和张雨晴说：早"}
+    ]}, game_state, on_event)
+    assert time.perf_counter() - started >= 0.4
+    assert service.dialogue_service.seen_times == ["2024-01-15 08:00", "2024-01-15 08:02"]
+    assert [msg["timestamp"] for msg in result["messages"]] == ["2024-01-15 08:02", "2024-01-15 08:04"]
+    assert result["current_time"] == "2024-01-15 08:04" and result["time_cost"] == 4
+    assert set(result["npc_dialogue_histories"]) == {"林若曦", "张雨晴"}
+    assert events == ["林若曦", "张雨晴"]
+
+    # 探索推进时间，之后的对话按探索结束的时间判断NPC是否在场，必须顺序执行
+    game_state = GameStateModel("s1", 1)
+    game_state.current_time = "2024-01-15 08:00"
+    service.dialogue_service.seen_times = []
+    started = time.perf_counter()
+    result = await service._process_compound_action("看看四周然后和林若曦说：早", {"sub_actions": [
+        {"type": "explore", "action": "看看四周"},
+        {"type": "talk", "action": "和林若曦说：早"}
+    ]}, game_state)
+    assert time.perf_counter() - started >= 0.4
+    assert service.dialogue_service.seen_times == ["2024-01-15 08:10"]
+    assert [msg["timestamp"] for msg in result["messages"]] == ["2024-01-15 08:10", "2024-01-15 08:12"]
+    assert result["current_time"] == "2024-01-15 08:12" and result["time_cost"] == 12
+    assert result["npc_dialogue_histories"] == {"林若曦": [{"speaker": "林若曦", "message": "早"}]}
+
+    # 对话后的探索按对话结束的时间计算
+    game_state = GameStateModel("s1", 1)
+    game_state.current_time = "2024-01-15 08:00"
+    result = await service._process_compound_action("和林若曦说：早然后看看四周", {"sub_actions": [
+        {"type": "talk", "action": "和林若曦说：早"},
+        {"type": "explore", "action": "看看四周"}
+    ]}, game_state)
+    assert [msg["timestamp"] for msg in result["messages"]] == ["2024-01-15 08:02", "2024-01-15 08:12"]
+
+    # 2. 移动失败时中断，后续阶段不再执行
+    result = await service._process_compound_action("去厨房然后看看四周", {"sub_actions": [
+        {"type": "move", "action": "去厨房"},
+        {"type": "explore", "action": "看看四周"}
+    ]}, game_state)
+    assert [msg["type"] for msg in result["messages"]] == ["error"]
+    assert result["time_cost"] == 0
+
+
+async def _run_concurrent_checks():
+    # 3. 阶段内并发执行的子行动各自修改状态副本，按原始顺序合并；第一个失败的子行动之后的结果丢弃
+    service = GameService()
+    service.dialogue_service = FakeDialogueService()
+    service.dialogue_service.fail_npcs = {"张雨晴"}
+    game_state = GameStateModel("s1", 1)
+    game_state.current_time = "2024-01-15 08:00"
+    started = time.perf_counter()
+    result = await service._process_compound_action("和三个人打招呼", {"sub_actions": [
+        {"type": "talk", "action": "和林若曦说：早"},
+        {"type": "talk", "action": "和张雨晴说：早"},
+        {"type": "talk", "action": "和王浩说：早"}
+    ]}, game_state)
+    elapsed = time.perf_counter() - started
+    assert elapsed < 0.35, f"子行动未并发执行，耗时{elapsed:.2f}s"
+    assert [msg["type"] for msg in result["messages"]] == ["dialogue", "error"]
+    assert result["messages"][1]["timestamp"] == "2024-01-15 08:02"
+    assert set(result["npc_dialogue_histories"]) == {"林若曦"}
+    assert result["current_time"] == "2024-01-15 08:02" and result["time_cost"] == 2
+
+
+async def _run_relay_checks():
+    events = []
+
+    async def on_event(event_type, data):
+        events.append(data["step"])
+
+    relay = OrderedEventRelay(on_event, 3)
+    await relay.callback(2)(EVENT_MESSAGE, {"step": "c1"})
+    await relay.callback(1)(EVENT_MESSAGE, {"step": "b1"})
+    await relay.callback(0)(EVENT_MESSAGE, {"step": "a1"})
+    await relay.finish(2)
+    await relay.finish(0)
+    # 前面的任务完成后，第二个任务切换为实时转发
+    await relay.callback(1)(EVENT_MESSAGE, {"step": "b2"})
+    await relay.finish(1)
+    assert events == ["a1", "b1", "b2", "c1"], events
+
+
+def test_compound_planner():
+    """测试子行动读写冲突的判断、阶段划分、流式事件顺序和并发执行结果的合并"""
+    print("🔧 测试复合行动规划")
+    print("=" * 50)
+
+    # 1. 阶段划分：移动和探索推进时间，之后读取时间的子行动必须等待；与同一NPC的两次对话保持顺序
+    print("\n1️⃣ 测试阶段划分...")
+    assert _stages(("explore",), ("talk", "林若曦")) == [[0], [1]]
+    assert _stages(("talk", "林若曦"), ("explore",)) == [[0], [1]]
+    assert _stages(("move",), ("talk", "林若曦"), ("talk", "张雨晴")) == [[0], [1], [2]]
+    assert _stages(("explore",), ("move",), ("explore",)) == [[0], [1], [2]]
+    assert _stages(("talk", "林若曦"), ("talk", "林若曦"), ("talk", "张雨晴")) == [[0], [1], [2]]
+    assert _stages(("talk", None), ("talk", "张雨晴")) == [[0], [1]]
+    assert _stages(("explore",), ("general",), ("explore",)) == [[0], [1], [2]]
+    print("✅ 阶段划分正常")
+
+    # 2. 并发任务的事件按原始顺序转发
+    print("\n2️⃣ 测试事件顺序...")
+    asyncio.run(_run_relay_checks())
+    print("✅ 事件顺序正常")
+
+    # 3. 复合行动按阶段执行并按顺序合并
+    print("\n3️⃣ 测试复合行动执行...")
+    asyncio.run(_run_compound_checks())
+    # 对话只读取时间时（不推进时间），与不同NPC的对话可以并发执行
+    talk_access = SUB_ACTION_ACCESS["talk"]
+    SUB_ACTION_ACCESS["talk"] = ({"player_location", "current_time", "dialogue"}, {"dialogue"})
+    try:
+        assert _stages(("talk", "林若曦"), ("talk", "张雨晴")) == [[0, 1]]
+        asyncio.run(_run_concurrent_checks())
+    finally:
+        SUB_ACTION_ACCESS["talk"] = talk_access
+    print("✅ 复合行动合并正常")
+
+    print("\n🎯 复合行动规划测试完成！")
+
+
+if __name__ == "__main__":
+    test_compound_planner()
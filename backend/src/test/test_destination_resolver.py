@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+测试移动目的地的本地解析和候选位置筛选
+"""
+import sys
+import os
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.services.destination_resolver import DestinationResolver, extract_destination_text
+
+LOCATIONS = [
+    {"key": "linkai_room", "name": "林凯房间", "en_name": "Linkai's Room", "connections": ["living_room"]},
+    {"key": "linruoxi_room", "name": "林若曦房间", "en_name": "Linruoxi's Room", "connections": ["living_room"]},
+    {"key": "living_room", "name": "客厅", "en_name": "Living Room", "connections": ["linkai_room", "linruoxi_room", "kitchen", "bathroom"]},
+    {"key": "kitchen", "name": "厨房", "en_name": "Kitchen", "connections": ["living_room"]},
+    {"key": "bathroom", "name": "卫生间", "en_name": "Bathroom", "connections": ["living_room"]},
+    {"key": "school_library", "name": "学校图书馆", "en_name": "School Library", "connections": ["school_gate"]},
+    {"key": "city_library", "name": "市图书馆", "en_name": "City Library", "connections": []},
+    {"key": "school_gate", "name": "学校大门", "en_name": "School Gate", "connections": ["school_library"]},
+]
+
+
+def test_destination_resolver():
+    """测试精确、子串、n-gram匹配，以及不确定时的候选位置"""
+    print("🔧 测试目的地解析")
+    print("=" * 50)
+    
+    resolver = DestinationResolver()
+    resolver.aliases = {"bathroom": ["厕所", "洗手间"]}
+    index = resolver.get_index(1, LOCATIONS)
+    
+    # 1. 提取目的地文本
+    print("\n1️⃣ 测试目的地提取...")
+    assert extract_destination_text("我要去客厅看看。") == "客厅"
+    assert extract_destination_text("前往 Living Room") == "livingroom"
+    print("✅ 目的地提取正常")
+    
+    # 2. 置信匹配直接在本地解析
+    print("\n2️⃣ 测试本地解析...")
+    cases = {
+        "去厨房": "kitchen",
+        "回我的房间": "linkai_room",
+        "回家": "linkai_room",
+        "去林若曦的房间": "linruoxi_room",
+        "去洗手间": "bathroom",
+        "前往Living Room": "living_room",
+        "去学校图书馆吧": "school_library",
+    }
+    for action, expected in cases.items():
+        result = resolver.resolve(action, index)
+        assert result["destination_key"] == expected, (action, result)
+    print("✅ 本地解析正常")
+    
+    # 3. 有歧义时交给LLM，只提供候选位置和相邻位置
+    print("\n3️⃣ 测试候选位置...")
+    result = resolver.resolve("去图书馆", index)
+    assert result["destination_key"] is None
+    candidates = resolver.candidate_keys(index, result["matches"], "living_room")
+    assert {"school_library", "city_library", "kitchen"} <= set(candidates)
+    assert "living_room" not in candidates
+    print(f"✅ 候选位置: {candidates}")
+    
+    # 4. 位置数据变化时重建索引
+    print("\n4️⃣ 测试索引重建...")
+    assert resolver.get_index(1, LOCATIONS) is index
+    changed = LOCATIONS + [{"key": "garden", "name": "花园", "en_name": "Garden", "connections": []}]
+    assert resolver.get_index(1, changed) is not index
+    print(f"✅ 解析统计: {resolver.get_stats()}")
+    
+    print("\n🎯 目的地解析测试完成！")
+
+
+if __name__ == "__main__":
+    test_destination_resolver()
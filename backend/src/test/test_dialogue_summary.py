@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+测试NPC对话滚动摘要
+"""
+import sys
+import os
+import asyncio
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.database.models import DialogueSummary
+from src.services.dialogue_summary_service import DialogueSummaryService
+
+
+class FakeSummaryGateway:
+    """记录提示词并返回固定摘要的LLM网关替身，fail为True时抛错"""
+
+    def __init__(self):
+        self.prompts = []
+        self.fail = False
+
+    async def ainvoke(self, prompt, task=None, **kwargs):
+        self.prompts.append(prompt)
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise RuntimeError("LLM服务不可用")
+        return f"第{len(self.prompts)}次摘要"
+
+
+async def _run_summary_checks(service: DialogueSummaryService, client: FakeSummaryGateway):
+    history = []
+    for turn in range(5):
+        new_entries = [
+            {"speaker": "玩家", "message": f"第{turn}句"},
+            {"speaker": "林若曦", "message": f"回复{turn}"}
+        ]
+        history.extend(new_entries)
+        evicted = service.split_history(history, len(new_entries))
+        # 前3轮仍在最近窗口内，之后每轮移出最早的一轮
+        assert len(evicted) == (0 if turn < 3 else 2)
+        service.schedule_fold("s1", 1, "林若曦", evicted)
+
+    await service.drain()
+    assert len(client.prompts) == 2
+    assert "第0句" in client.prompts[0] and "回复0" in client.prompts[0]
+    # 第二次合并基于第一次的摘要
+    assert "第1次摘要" in client.prompts[1] and "第1句" in client.prompts[1]
+    assert await service.get_summary("s1", 1, "林若曦") == "第2次摘要"
+
+
+async def _run_failure_checks(service: DialogueSummaryService, client: FakeSummaryGateway):
+    # 生成失败时保留原摘要，移出窗口的对话留到下次合并
+    client.fail = True
+    summary = await service.fold("s1", 1, "林若曦", [{"speaker": "玩家", "message": "第5句"}])
+    assert summary == "第2次摘要" and await service.get_summary("s1", 1, "林若曦") == "第2次摘要"
+    assert service.get_stats()["pending_entries"] == 1
+    client.fail = False
+    summary = await service.fold("s1", 1, "林若曦", [{"speaker": "玩家", "message": "第6句"}])
+    assert "第5句" in client.prompts[-1] and "第6句" in client.prompts[-1]
+    assert summary == f"第{len(client.prompts)}次摘要" and service.get_stats()["pending_entries"] == 0
+
+
+def test_dialogue_summary():
+    """测试窗口外对话的滚动合并、持久化和提示词片段"""
+    print("🔧 测试NPC对话摘要")
+    print("=" * 50)
+
+    # 摘要读写在数据库线程池中执行，内存数据库需要跨线程共享同一连接
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    DialogueSummary.__table__.create(engine)
+    client = FakeSummaryGateway()
+    service = DialogueSummaryService(engine=engine)
+    service.llm_gateway = client
+
+    # 1. 移出窗口的对话按顺序合并为摘要
+    print("\n1️⃣ 测试滚动合并...")
+    asyncio.run(_run_summary_checks(service, client))
+    print(f"✅ 摘要统计: {service.get_stats()}")
+
+    # 2. 摘要生成失败时不覆盖原摘要，对话并入下次合并
+    print("\n2️⃣ 测试生成失败...")
+    asyncio.run(_run_failure_checks(service, client))
+    latest = asyncio.run(service.get_summary("s1", 1, "林若曦"))
+    print("✅ 生成失败时保留原摘要")
+
+    # 3. 摘要持久化，新实例从数据库读取；内存中的摘要按最近使用淘汰
+    print("\n3️⃣ 测试持久化...")
+    reloaded = DialogueSummaryService(engine=engine)
+    reloaded.max_entries = 1
+    assert asyncio.run(reloaded.get_summary("s1", 1, "林若曦")) == latest
+    assert asyncio.run(reloaded.get_summary("s2", 1, "林若曦")) == ""
+    assert reloaded.get_stats()["cached"] == 1 and reloaded.get_stats()["evicted"] == 1
+    assert asyncio.run(reloaded.get_summary("s1", 1, "林若曦")) == latest
+    print("✅ 摘要持久化正常")
+
+    # 4. 提示词片段
+    print("\n4️⃣ 测试提示词片段...")
+    assert reloaded.format_for_prompt("") == ""
+    assert "第2次摘要" in reloaded.format_for_prompt("第2次摘要")
+    print("✅ 提示词片段正常")
+
+    print("\n🎯 NPC对话摘要测试完成！")
+
+
+if __name__ == "__main__":
+    test_dialogue_summary()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+测试启动时为已存在的表补建模型中新增的索引（create_all不会为已存在的表创建索引）
+"""
+import sys
+import os
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.pool import StaticPool
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.database.models import Message
+from src.database.init_db import ensure_indexes
+
+NEW_INDEXES = {"idx_messages_user_story_created", "idx_messages_session_created"}
+
+
+def _index_names(engine, table_name: str):
+    return {index["name"] for index in inspect(engine).get_indexes(table_name)}
+
+
+def test_ensure_indexes():
+    """测试补建缺失的消息分页索引，重复执行时不再创建"""
+    print("🔧 测试补建索引")
+    print("=" * 50)
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    # 模拟旧版本部署：消息表已存在，但没有游标分页索引
+    Message.__table__.create(bind=engine)
+    with engine.begin() as conn:
+        for name in NEW_INDEXES:
+            conn.execute(text(f"DROP INDEX {name}"))
+    assert not NEW_INDEXES & _index_names(engine, "messages")
+
+    # 1. 只为已存在的表补建缺失的索引
+    print("\n1️⃣ 测试补建...")
+    assert ensure_indexes(engine) == len(NEW_INDEXES)
+    assert NEW_INDEXES <= _index_names(engine, "messages")
+    assert _index_names(engine, "messages") == {index.name for index in Message.__table__.indexes}
+    assert "users" not in inspect(engine).get_table_names()
+    print("✅ 消息表索引已补建")
+
+    # 2. 索引已存在时不重复创建
+    print("\n2️⃣ 测试重复执行...")
+    assert ensure_indexes(engine) == 0
+    print("✅ 重复执行不创建索引")
+
+    engine.dispose()
+    print("\n🎯 补建索引测试完成！")
+
+
+if __name__ == "__main__":
+    test_ensure_indexes()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+测试离线LLM服务的模拟响应、流式输出和录制回放
+"""
+import sys
+import os
+import json
+import asyncio
+import tempfile
+import httpx
+import openai
+from langchain_openai import ChatOpenAI
+from langchain_core.messages import SystemMessage, HumanMessage
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.utils.fake_llm_server import create_app, MODE_RECORD, MODE_REPLAY
+from src.prompts.prompt_templates import PromptTemplates
+from src.services.action_router_service import ActionRouter, TurnPlan
+
+LOCATION_INFO = "- linkai_room: 林凯房间 - 卧室\n- living_room: 客厅 - 宽敞明亮"
+
+
+def _client(app) -> httpx.AsyncClient:
+    """通过ASGI传输层直接调用服务，不占用端口"""
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://fake-llm")
+
+
+async def _chat(client: httpx.AsyncClient, system_prompt: str, user: str, **extra) -> dict:
+    response = await client.post("/v1/chat/completions", json={
+        "model": "fake-llm",
+        "messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": user}],
+        **extra
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["choices"][0]["message"]
+
+
+async def _tool_call(client: httpx.AsyncClient, schema, system_prompt: str, user: str) -> dict:
+    tool = {"name": schema.__name__, "description": "", "parameters": schema.model_json_schema()}
+    message = await _chat(client, system_prompt, user, tools=[{"type": "function", "function": tool}],
+                          tool_choice={"type": "function", "function": {"name": schema.__name__}})
+    return json.loads(message["tool_calls"][0]["function"]["arguments"])
+
+
+def _chat_openai(app) -> ChatOpenAI:
+    params = {"api_key": "test", "base_url": "http://fake-llm/v1", "max_retries": 0}
+    return ChatOpenAI(
+        model_name="fake-llm", openai_api_key="test", openai_api_base="http://fake-llm/v1",
+        async_client=openai.AsyncOpenAI(http_client=_client(app), **params).chat.completions,
+        client=openai.OpenAI(**params).chat.completions
+    )
+
+
+async def _run_server_checks():
+    app = create_app(latency_scale=0, seed=1)
+    client = _client(app)
+
+    # 1. JSON类提示词返回可解析且字段完整的响应
+    print("\n1️⃣ 测试JSON响应...")
+    sensory = json.loads((await _chat(client, PromptTemplates.get_sensory_feedback_prompt(
+        location_name="客厅", location_description="", current_time="08:00", npc_info="无", action="看看四周"
+    ), "看看四周"))["content"])
+    assert set(sensory) == {"vision", "hearing", "smell", "touch"}
+    destination = json.loads((await _chat(client, PromptTemplates.get_move_destination_prompt(
+        player_name="林凯", current_location="林凯房间", all_location_info=LOCATION_INFO, action="去客厅"
+    ), "去客厅"))["content"])
+    assert destination["destination_key"] == "living_room"
+    schedule = json.loads((await _chat(client, PromptTemplates.get_schedule_update_prompt(
+        available_locations="", npc_name="林若曦", player_message="一起吃饭吧", npc_reply="好呀",
+        current_time="08:00", current_schedule="[]"
+    ), "分析"))["content"])
+    assert schedule["needs_schedule_update"] is False and "new_complete_schedule" in schedule
+    print(f"✅ 任务统计: {(await client.get('/stats')).json()['by_task']}")
+
+    # 2. 结构化输出按函数的JSON Schema生成参数
+    print("\n2️⃣ 测试结构化输出...")
+    router_prompt = PromptTemplates.get_action_router_prompt(
+        player_location="客厅", current_time="08:00", player_personality="普通"
+    )
+    route = ActionRouter.model_validate(await _tool_call(client, ActionRouter, router_prompt, "起床，去卫生间洗漱"))
+    assert route.action_type == "compound" and len(route.sub_actions) == 2
+    plan = TurnPlan.model_validate(await _tool_call(client, TurnPlan, PromptTemplates.get_turn_planner_prompt(
+        player_name="林凯", player_location="linkai_room", current_time="08:00", player_personality="普通",
+        location_info=LOCATION_INFO, npc_info="无"
+    ), "玩家行动：去客厅"))
+    assert plan.action_type == "move" and plan.destination_key == "living_room"
+    print(f"✅ 路由: {route.action_type}, 规划: {plan.destination_key}")
+
+    # 3. ChatOpenAI的普通调用和流式调用得到相同文本
+    print("\n3️⃣ 测试ChatOpenAI调用...")
+    llm = _chat_openai(app)
+    messages = [
+        SystemMessage(content=PromptTemplates.get_npc_dialogue_prompt(
+            npc_name="林若曦", personality="温柔", background="", relations="", mood="平静", npc_location="客厅",
+            npc_event="看书", player_name="林凯", current_time="08:00", location_details="客厅",
+            location_description="", other_npcs_info="", player_personality="普通", history_str="",
+            dialogue_summary="", message="早上好"
+        )),
+        HumanMessage(content="早上好")
+    ]
+    content = (await llm.ainvoke(messages)).content
+    streamed = "".join([chunk.content async for chunk in llm.astream(messages)])
+    assert content and content == streamed
+    print(f"✅ NPC回复: {content}")
+
+    # 4. 录制上游响应后可以确定性回放
+    print("\n4️⃣ 测试录制回放...")
+    tape_path = os.path.join(tempfile.mkdtemp(), "tape.jsonl")
+    recorder = _client(create_app(MODE_RECORD, tape_path, upstream_url="http://fake-llm/v1", http_client=client))
+    recorded = await _chat(recorder, router_prompt, "看看四周")
+    replayer = _client(create_app(MODE_REPLAY, tape_path))
+    assert await _chat(replayer, router_prompt, "看看四周") == recorded
+    assert await _chat(replayer, router_prompt, "看看四周", stream=False) == recorded
+    missing = await replayer.post("/v1/chat/completions", json={"model": "fake-llm", "messages": []})
+    assert missing.status_code == 404
+    print(f"✅ 回放统计: {(await replayer.get('/stats')).json()}")
+
+
+def test_fake_llm_server():
+    """测试按提示词类型生成响应、结构化输出、流式输出和录制回放"""
+    print("🔧 测试离线LLM服务")
+    print("=" * 50)
+    asyncio.run(_run_server_checks())
+    print("\n🎯 离线LLM服务测试完成！")
+
+
+if __name__ == "__main__":
+    test_fake_llm_server()
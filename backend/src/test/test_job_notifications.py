@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+测试后台任务结果随本回合消息一起保存，消息写入数据库后才标记为已投递
+"""
+import sys
+import os
+import asyncio
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.models.game_state_model import GameStateModel
+from src.services.game_service import GameService
+
+
+class FakeJournal:
+    """记录每次save_turn写入的消息，fail为True时抛错；deferred为True时模拟写后模式，回调留到flush时调用"""
+
+    def __init__(self, fail: bool = False, deferred: bool = False):
+        self.fail = fail
+        self.deferred = deferred
+        self.turns = []
+        self.callbacks = []
+
+    async def save_turn(self, user_id, story_id, session_id, messages, on_saved=None):
+        if self.fail:
+            raise RuntimeError("数据库不可用")
+        self.turns.append(messages)
+        if on_saved is not None:
+            if self.deferred:
+                self.callbacks.append(on_saved)
+            else:
+                await on_saved(True)
+        return []
+
+    async def flush(self, saved: bool = True):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            await callback(saved)
+
+
+class FakeJobService:
+    """返回固定的待投递任务结果，记录被标记为已投递的任务"""
+
+    def __init__(self):
+        self.delivered = []
+        self.reserved = set()
+
+    def pending_notifications(self, session_id, story_id=None, reserve=False):
+        if 3 in self.delivered or 3 in self.reserved:
+            return []
+        if reserve:
+            self.reserved.add(3)
+        return [{"job_id": 3, "messages": [
+            {"speaker": "系统", "message": "林若曦的计划发生了变化。", "type": "system", "timestamp": "2024-01-15 08:05"}
+        ]}]
+
+    def mark_delivered(self, job_ids):
+        self.release(job_ids)
+        self.delivered.extend(job_ids)
+        return len(job_ids)
+
+    def release(self, job_ids):
+        self.reserved.difference_update(job_ids)
+
+
+async def _run_turn(service: GameService, game_state: GameStateModel):
+    """按process_action的顺序保存回合消息并投递任务结果"""
+    pending_jobs = service.job_service.pending_notifications(game_state.session_id, game_state.story_id, reserve=True)
+    notifications = [msg for job in pending_jobs for msg in job["messages"]]
+    result = {"success": True, "current_time": "2024-01-15 08:20",
+              "messages": [{"speaker": "系统", "message": "你仔细观察了厨房。", "type": "general"}]}
+    user_input = {"message_type": 1, "sub_type": "player_action", "content": "观察四周",
+                  "location": "kitchen", "game_time": None}
+    saved = await service._save_action_result("general", result, game_state, "s1", 1, 1, user_input, notifications,
+                                              on_saved=service._job_delivery_callback(pending_jobs))
+    return await service._deliver_job_notifications(pending_jobs, saved)
+
+
+def test_job_notifications():
+    """测试任务结果消息与回合消息同批写入，以及保存失败时不标记投递"""
+    print("🔧 测试后台任务结果投递")
+    print("=" * 50)
+
+    game_state = GameStateModel("s1", 1)
+    game_state.player_location = "kitchen"
+    game_state.current_time = "2024-01-15 08:10"
+    service = GameService()
+    service.job_service = FakeJobService()
+
+    # 1. 任务结果排在用户输入前面，和本回合消息在同一批写入
+    print("\n1️⃣ 测试同批写入...")
+    service.message_journal = FakeJournal()
+    delivered = asyncio.run(_run_turn(service, game_state))
+    turn, = service.message_journal.turns
+    assert [msg["content"] for msg in turn] == ["林若曦的计划发生了变化。", "观察四周", "你仔细观察了厨房。"]
+    assert turn[0]["message_type"] == 5 and turn[0]["game_time"].minute == 5
+    assert [msg["message"] for msg in delivered] == ["林若曦的计划发生了变化。"]
+    assert service.job_service.delivered == [3]
+    print("✅ 任务结果随回合消息写入")
+
+    # 2. 回合消息保存失败时任务结果不标记为已投递，也不返回给玩家
+    print("\n2️⃣ 测试保存失败...")
+    service.job_service = FakeJobService()
+    service.message_journal = FakeJournal(fail=True)
+    assert asyncio.run(_run_turn(service, game_state)) == []
+    assert service.job_service.delivered == [] and service.job_service.reserved == set()
+    print("✅ 保存失败的任务结果留到之后的回合投递")
+
+    # 3. 写后模式下入队时不标记投递，之后的回合也不重复投递；写入数据库后才标记为已投递
+    print("\n3️⃣ 测试写后模式...")
+    journal = service.message_journal = FakeJournal(deferred=True)
+    assert len(asyncio.run(_run_turn(service, game_state))) == 1
+    assert service.job_service.delivered == [] and service.job_service.reserved == {3}
+    assert asyncio.run(_run_turn(service, game_state)) == []
+    asyncio.run(journal.flush())
+    assert service.job_service.delivered == [3] and service.job_service.reserved == set()
+    print("✅ 消息写入数据库后标记为已投递")
+
+    # 4. 回合移入死信文件时释放预留，之后的回合重新投递
+    print("\n4️⃣ 测试死信...")
+    service.job_service = FakeJobService()
+    journal = service.message_journal = FakeJournal(deferred=True)
+    asyncio.run(_run_turn(service, game_state))
+    asyncio.run(journal.flush(saved=False))
+    assert service.job_service.delivered == [] and service.job_service.reserved == set()
+    assert len(asyncio.run(_run_turn(service, game_state))) == 1
+    print("✅ 移入死信文件的任务结果留到之后的回合投递")
+
+    print("\n🎯 后台任务结果投递测试完成！")
+
+
+if __name__ == "__main__":
+    test_job_notifications()
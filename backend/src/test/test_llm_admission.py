@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+测试LLM准入队列的优先级排队、背压和过载故障转移
+"""
+import sys
+import os
+import asyncio
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.utils.llm_admission import AdmissionQueue, LLMOverloadedError
+from src.utils.llm_provider_pool import LLMProviderPool
+from src.utils.llm_gateway import llm_gateway
+from src.utils.llm_client import llm_client
+
+
+class SlowLLM:
+    """固定延迟返回自身名称的LLM替身"""
+
+    def __init__(self, name: str, latency: float = 0.05):
+        self.name = name
+        self.latency = latency
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.latency)
+        return self.name
+
+
+async def _hold_slot(queue: AdmissionQueue, hold: float):
+    async with queue.slot():
+        await asyncio.sleep(hold)
+
+
+async def _run_admission_checks():
+    # 1. 名额释放时优先分配给优先级更高的等待者
+    print("\n1️⃣ 测试优先级排队...")
+    queue = AdmissionQueue("gemini", max_concurrency=1, max_queue=8)
+    order = []
+
+    async def worker(label: str, priority: int):
+        async with queue.slot(priority, task=label):
+            order.append(label)
+            await asyncio.sleep(0.01)
+
+    first = asyncio.create_task(worker("first", 5))
+    await asyncio.sleep(0)
+    waiters = [asyncio.create_task(worker(label, priority))
+               for label, priority in [("summary", 5), ("schedule", 4), ("dialogue", 0)]]
+    await asyncio.sleep(0)
+    assert queue.queue_length == 3
+    await asyncio.gather(first, *waiters)
+    assert order == ["first", "dialogue", "schedule", "summary"], order
+    assert queue.active == 0 and queue.queue_length == 0
+    assert queue.get_stats()["queue_time_by_task"]["summary"]["count"] == 1
+    print(f"✅ 执行顺序: {order}")
+
+    # 2. 队列已满时立即拒绝，等待超时时抛出过载
+    print("\n2️⃣ 测试背压...")
+    queue = AdmissionQueue("qwen", max_concurrency=1, max_queue=1, max_wait=0.05)
+    holder = asyncio.create_task(_hold_slot(queue, 0.2))
+    await asyncio.sleep(0)
+    waiting = asyncio.create_task(_hold_slot(queue, 0))
+    await asyncio.sleep(0)
+    assert queue.is_full
+    try:
+        await _hold_slot(queue, 0)
+        assert False, "应当拒绝"
+    except LLMOverloadedError as e:
+        assert e.retry_after >= 1
+    try:
+        await waiting
+        assert False, "应当排队超时"
+    except LLMOverloadedError:
+        pass
+    await holder
+    stats = queue.get_stats()
+    assert stats["rejected"] == 1 and stats["wait_timeouts"] == 1 and stats["active"] == 0
+    print(f"✅ 准入统计: {stats}")
+
+    # 3. 提供商过载时切换到下一个，不计入失败；全部过载时抛出
+    print("\n3️⃣ 测试过载故障转移...")
+    fakes = {"gemini": SlowLLM("gemini", latency=0.5), "qwen": SlowLLM("qwen", latency=0.2)}
+    llm_configs = {name: {"model": f"{name}-model", "url": "", "api_key": ""} for name in fakes}
+    pool = LLMProviderPool(llm_configs, {
+        "explore_ratio": 0,
+        "max_queue": 0,
+        "providers": {"gemini": {"max_concurrency": 1}, "qwen": {"max_concurrency": 1}}
+    }, llm_factory=lambda name, config, timeout: fakes[name])
+    busy = asyncio.create_task(pool.invoke(lambda llm: llm.ainvoke("你好"), preferred="gemini"))
+    await asyncio.sleep(0)
+    assert await pool.invoke(lambda llm: llm.ainvoke("你好"), preferred="gemini") == "qwen"
+    assert pool.providers["gemini"].consecutive_failures == 0
+
+    # gemini仍在处理第一个请求，再占用qwen后两个提供商都没有余量
+    other = asyncio.create_task(pool.invoke(lambda llm: llm.ainvoke("你好")))
+    await asyncio.sleep(0)
+    assert pool.is_overloaded()
+    try:
+        await pool.invoke(lambda llm: llm.ainvoke("你好"))
+        assert False, "应当抛出过载"
+    except LLMOverloadedError:
+        pass
+    await asyncio.gather(busy, other)
+    assert not pool.is_overloaded() and pool.overloaded == 1
+    print("✅ 过载故障转移正常")
+
+    # 4. 对话等经过chat_completion的调用过载时抛出异常（由上层返回503），其他错误仍返回兜底文本
+    print("\n4️⃣ 测试chat_completion过载...")
+    original_pool = llm_gateway.pool
+
+    async def overloaded(messages, task=None):
+        raise LLMOverloadedError("LLM服务繁忙，请稍后重试", 3)
+
+    async def broken(messages, task=None):
+        raise RuntimeError("连接失败")
+
+    llm_gateway.pool = pool
+    try:
+        llm_gateway.ainvoke = overloaded
+        try:
+            await llm_client.chat_completion("你好", task="npc_dialogue")
+            assert False, "应当抛出过载"
+        except LLMOverloadedError as e:
+            assert e.retry_after == 3
+        llm_gateway.ainvoke = broken
+        assert await llm_client.chat_completion("你好", task="npc_dialogue") == "抱歉，LLM服务暂时不可用。"
+    finally:
+        llm_gateway.pool = original_pool
+        del llm_gateway.ainvoke
+    print("✅ 过载时不返回兜底文本")
+
+
+def test_llm_admission():
+    """测试优先级排队、队列满拒绝、排队超时、过载故障转移和chat_completion过载时抛出"""
+    print("🔧 测试LLM准入队列")
+    print("=" * 50)
+    asyncio.run(_run_admission_checks())
+    print("\n🎯 LLM准入队列测试完成！")
+
+
+if __name__ == "__main__":
+    test_llm_admission()
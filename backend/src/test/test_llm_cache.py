@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+测试LLM响应缓存
+"""
+import sys
+import os
+import asyncio
+import tempfile
+import threading
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.utils.llm_cache import LLMResponseCache
+from src.prompts.prompt_templates import PromptTemplates
+
+
+def test_llm_cache():
+    """测试缓存键归一化、LRU淘汰和本地持久化"""
+    print("🔧 测试LLM响应缓存")
+    print("=" * 50)
+
+    db_path = os.path.join(tempfile.mkdtemp(), "llm_cache.sqlite3")
+    cache = LLMResponseCache(max_memory_entries=2, db_path=db_path)
+
+    # 1. 空白差异不影响缓存键，模型和温度不同则键不同
+    print("\n1️⃣ 测试缓存键...")
+    key = cache.make_key([("system", "估算  耗时\n"), ("human", "看手机")], "gemini", 0.7)
+    assert key == cache.make_key([("system", "估算 耗时"), ("human", " 看手机 ")], "gemini", 0.7)
+    assert key != cache.make_key([("system", "估算 耗时"), ("human", "看手机")], "qwen", 0.7)
+    assert key != cache.make_key([("system", "估算 耗时"), ("human", "看手机")], "gemini", 0.2)
+    print("✅ 缓存键归一化正常")
+
+    # 2. 可缓存任务命中，不可缓存任务不写入
+    print("\n2️⃣ 测试任务缓存策略...")
+    assert cache.get("time_estimation", key) is None
+    cache.set("time_estimation", key, '{"estimated_minutes": 5}')
+    assert cache.get("time_estimation", key) == '{"estimated_minutes": 5}'
+    cache.set("npc_dialogue", "dialogue_key", "你好")
+    assert cache.get("npc_dialogue", "dialogue_key") is None
+    print("✅ 任务缓存策略正常")
+
+    # 3. 超出容量时淘汰最久未使用的条目，本地层仍可命中
+    print("\n3️⃣ 测试LRU淘汰和本地层...")
+    cache.set("time_estimation", "k2", "v2")
+    cache.set("time_estimation", "k3", "v3")
+    assert cache.memory.evictions == 1
+    assert cache.get("time_estimation", key) == '{"estimated_minutes": 5}'
+    assert cache.get_stats()["disk_hits"] == 1
+
+    # 重新打开缓存文件，模拟服务重启
+    restarted = LLMResponseCache(db_path=db_path)
+    assert restarted.get("time_estimation", "k3") == "v3"
+    print(f"✅ 缓存统计: {cache.get_stats()}")
+
+    # 4. 异步读写的本地层IO在线程中执行
+    print("\n4️⃣ 测试异步读写...")
+    disk_threads = []
+    read_from_disk = restarted._get_from_disk
+
+    def tracking_read(key):
+        disk_threads.append(threading.get_ident())
+        return read_from_disk(key)
+
+    restarted._get_from_disk = tracking_read
+
+    async def run_async():
+        await restarted.aset("time_estimation", "k4", "v4")
+        restarted.memory.clear()
+        return await restarted.aget("time_estimation", "k4"), threading.get_ident()
+
+    value, loop_thread = asyncio.run(run_async())
+    assert value == "v4" and disk_threads and loop_thread not in disk_threads
+    print("✅ 本地层读写不在事件循环线程中执行")
+
+    # 5. 可缓存任务的回答所依赖的游戏状态都在提示词中，进而在缓存键中
+    print("\n5️⃣ 测试缓存键覆盖游戏状态...")
+
+    def destination_key(current_location, all_location_info):
+        prompt = PromptTemplates.get_move_destination_prompt("林凯", current_location, all_location_info, "回去")
+        return cache.make_key([("system", prompt), ("human", "玩家行动：回去")], "gemini", 0.7)
+
+    assert destination_key("客厅", "客厅, 厨房") != destination_key("厨房", "客厅, 厨房")
+    assert destination_key("客厅", "客厅, 厨房") != destination_key("客厅", "客厅, 厨房, 花园")
+
+    def time_key(personality):
+        prompt = PromptTemplates.get_time_estimation_prompt("看手机", personality)
+        return cache.make_key([("system", prompt), ("human", "请估算行动耗时：看手机")], "gemini", 0.7)
+
+    assert time_key("急躁") != time_key("悠闲")
+    print("✅ 位置、可选位置和性格不同时缓存键不同")
+
+    print("\n🎯 LLM响应缓存测试完成！")
+
+
+if __name__ == "__main__":
+    test_llm_cache()
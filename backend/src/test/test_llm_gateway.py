@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+测试LLM网关的共享连接池和任务预设
+"""
+import sys
+import os
+import asyncio
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.utils.llm_gateway import LLMGateway, DEFAULT_PRESET
+
+LLM_CONFIGS = {
+    "gemini": {"model": "gemini-test", "url": "http://127.0.0.1:9/v1", "api_key": "test"},
+    "qwen": {"model": "qwen-test", "url": "http://127.0.0.1:9/v1", "api_key": "test"},
+}
+
+
+async def _run_singleflight_checks(gateway: LLMGateway):
+    calls = {"count": 0}
+    
+    async def upstream():
+        calls["count"] += 1
+        await asyncio.sleep(0.05)
+        return "你走进了客厅。"
+    
+    results = await asyncio.gather(*(
+        gateway._singleflight("sensory_feedback", "same_prompt", upstream) for _ in range(5)
+    ))
+    assert results == ["你走进了客厅。"] * 5
+    assert calls["count"] == 1
+    assert gateway.get_stats()["singleflight"]["coalesced"] == 4
+    
+    # 请求完成后不再合并
+    await gateway._singleflight("sensory_feedback", "same_prompt", upstream)
+    assert calls["count"] == 2
+    
+    # 发起者被取消时，等待者仍能拿到结果
+    leader = asyncio.ensure_future(gateway._singleflight("sensory_feedback", "other_prompt", upstream))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(gateway._singleflight("sensory_feedback", "other_prompt", upstream))
+    await asyncio.sleep(0)
+    leader.cancel()
+    assert await follower == "你走进了客厅。"
+    assert calls["count"] == 3
+    
+    # 上游失败时所有等待者都收到异常
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("上游失败")
+    
+    outcomes = await asyncio.gather(*(
+        gateway._singleflight("sensory_feedback", "failing_prompt", failing) for _ in range(3)
+    ), return_exceptions=True)
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+
+
+def test_llm_gateway():
+    """测试所有提供商共用HTTP连接池、按任务应用预设、合并相同的并发请求"""
+    print("🔧 测试LLM网关")
+    print("=" * 50)
+    
+    gateway = LLMGateway(LLM_CONFIGS, {"presets": {"npc_dialogue": {"temperature": 0.9}}})
+    
+    # 1. 所有提供商和预设实例共用同一个HTTP连接池
+    print("\n1️⃣ 测试共享连接池...")
+    gemini = gateway.pool.providers["gemini"].llm
+    qwen = gateway.pool.providers["qwen"].llm
+    assert gemini.async_client._client._client is gateway.async_http_client
+    assert qwen.async_client._client._client is gateway.async_http_client
+    router_llm = gateway.get_llm("gemini", task="action_router")
+    assert router_llm.async_client is gemini.async_client
+    assert gateway.get_llm("gemini", task="action_router") is router_llm
+    print("✅ 连接池共享正常")
+    
+    # 2. 任务预设和配置覆盖
+    print("\n2️⃣ 测试任务预设...")
+    assert router_llm.temperature == 0.0
+    assert gateway.get_preset("npc_dialogue")["temperature"] == 0.9
+    assert gateway.get_preset("npc_dialogue")["max_tokens"] == 800
+    assert gateway.get_preset("unknown_task") == DEFAULT_PRESET
+    print(f"✅ 网关统计: {gateway.get_stats()['providers']}")
+    
+    # 3. 相同的并发请求只发起一次上游调用
+    print("\n3️⃣ 测试请求合并...")
+    asyncio.run(_run_singleflight_checks(gateway))
+    print(f"✅ 合并统计: {gateway.get_stats()['singleflight']}")
+    
+    asyncio.run(gateway.aclose())
+    print("\n🎯 LLM网关测试完成！")
+
+
+if __name__ == "__main__":
+    test_llm_gateway()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+测试LLM提供商池的健康路由、熔断和故障转移
+"""
+import sys
+import os
+import asyncio
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.utils.llm_provider_pool import LLMProviderPool
+
+
+class FakeLLM:
+    """按设定延迟返回或抛错的LLM替身"""
+    
+    def __init__(self, name: str, latency: float = 0.01, fail: bool = False):
+        self.name = name
+        self.latency = latency
+        self.fail = fail
+    
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError(f"{self.name} 不可用")
+        return self.name
+
+
+def _make_pool(fakes, pool_config=None):
+    llm_configs = {name: {"model": f"{name}-model", "url": "", "api_key": ""} for name in fakes}
+    pool_config = {"explore_ratio": 0, **(pool_config or {})}
+    return LLMProviderPool(llm_configs, pool_config, llm_factory=lambda name, config, timeout: fakes[name])
+
+
+async def _run_pool_checks():
+    # 1. 优先选择更快的提供商
+    print("\n1️⃣ 测试健康路由...")
+    fakes = {"gemini": FakeLLM("gemini", latency=0.08), "qwen": FakeLLM("qwen", latency=0.01)}
+    pool = _make_pool(fakes)
+    for _ in range(3):
+        await pool.invoke(lambda llm: llm.ainvoke("你好"))
+    assert pool.rank_providers()[0].name == "qwen", pool.get_stats()
+    print(f"✅ 排序: {pool.get_stats()['ranking']}")
+    
+    # 2. 失败时故障转移，连续失败后熔断
+    print("\n2️⃣ 测试故障转移和熔断...")
+    fakes = {"gemini": FakeLLM("gemini", fail=True), "qwen": FakeLLM("qwen")}
+    pool = _make_pool(fakes, {"failure_threshold": 2, "cooldown_seconds": 60})
+    for _ in range(2):
+        assert await pool.invoke(lambda llm: llm.ainvoke("你好"), preferred="gemini") == "qwen"
+    assert pool.providers["gemini"].circuit_state == "open"
+    assert pool.failovers == 2
+    # 熔断后不再尝试gemini
+    assert await pool.invoke(lambda llm: llm.ainvoke("你好"), preferred="gemini") == "qwen"
+    assert pool.providers["gemini"].total_requests == 2
+    print("✅ 故障转移和熔断正常")
+    
+    # 3. 半开状态下探测成功后恢复
+    print("\n3️⃣ 测试熔断恢复...")
+    pool.providers["gemini"].circuit_open_until = 1.0
+    fakes["gemini"].fail = False
+    assert pool.providers["gemini"].circuit_state == "half_open"
+    assert await pool.invoke(lambda llm: llm.ainvoke("你好"), preferred="gemini") == "gemini"
+    assert pool.providers["gemini"].circuit_state == "closed"
+    print("✅ 熔断器已关闭")
+    
+    # 半开状态下并发请求只有一个成为探测请求，其余转到其他提供商
+    pool.providers["gemini"].circuit_open_until = 1.0
+    fakes["gemini"].latency = 0.05
+    fakes["gemini"].fail = True
+    before = pool.providers["gemini"].total_requests
+    results = await asyncio.gather(*(pool.invoke(lambda llm: llm.ainvoke("你好"), preferred="gemini") for _ in range(3)))
+    assert results == ["qwen"] * 3
+    assert pool.providers["gemini"].total_requests == before + 1
+    assert pool.providers["gemini"].circuit_state == "open" and not pool.providers["gemini"].half_open_trial
+    print("✅ 半开时只放行一个探测请求")
+    
+    # 4. 超时触发故障转移；不允许故障转移时直接抛出
+    print("\n4️⃣ 测试超时...")
+    fakes = {"gemini": FakeLLM("gemini", latency=1.0), "qwen": FakeLLM("qwen")}
+    pool = _make_pool(fakes, {"providers": {"gemini": {"timeout": 0.05}}})
+    assert await pool.invoke(lambda llm: llm.ainvoke("你好"), preferred="gemini") == "qwen"
+    try:
+        await pool.invoke(lambda llm: llm.ainvoke("你好"), preferred="gemini", can_failover=lambda: False)
+        assert False, "应当抛出超时"
+    except asyncio.TimeoutError:
+        pass
+    print("✅ 超时处理正常")
+    
+    # 5. 并发上限
+    print("\n5️⃣ 测试并发上限...")
+    peak = {"current": 0, "max": 0}
+    
+    async def tracked(llm):
+        peak["current"] += 1
+        peak["max"] = max(peak["max"], peak["current"])
+        await asyncio.sleep(0.02)
+        peak["current"] -= 1
+        return llm.name
+    
+    pool = _make_pool({"gemini": FakeLLM("gemini")}, {"providers": {"gemini": {"max_concurrency": 2}}})
+    await asyncio.gather(*(pool.invoke(tracked) for _ in range(6)))
+    assert peak["max"] == 2
+    print("✅ 并发上限正常")
+
+
+def test_llm_provider_pool():
+    """测试健康路由、熔断、超时和并发上限"""
+    print("🔧 测试LLM提供商池")
+    print("=" * 50)
+    asyncio.run(_run_pool_checks())
+    print("\n🎯 LLM提供商池测试完成！")
+
+
+if __name__ == "__main__":
+    test_llm_provider_pool()
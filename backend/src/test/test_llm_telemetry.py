@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+测试LLM调用遥测的按模板汇总、token用量和单次请求明细
+"""
+import sys
+import os
+import asyncio
+from langchain_core.outputs import LLMResult, Generation
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.utils.llm_telemetry import LLMTelemetry, TokenUsageHandler, Histogram
+from src.utils.llm_provider_pool import LLMProviderPool
+
+
+class FakeLLM:
+    """按设定延迟返回或抛错的LLM替身"""
+
+    def __init__(self, name: str, latency: float = 0.01, fail: bool = False):
+        self.name = name
+        self.latency = latency
+        self.fail = fail
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError(f"{self.name} 不可用")
+        return self.name
+
+
+async def _run_pool_checks(telemetry: LLMTelemetry):
+    fakes = {"gemini": FakeLLM("gemini", fail=True), "qwen": FakeLLM("qwen")}
+    llm_configs = {name: {"model": f"{name}-model", "url": "", "api_key": ""} for name in fakes}
+    pool = LLMProviderPool(llm_configs, {"explore_ratio": 0}, llm_factory=lambda name, config, timeout: fakes[name])
+
+    def on_attempt(task):
+        return lambda attempt: telemetry.record(task, **attempt, prompt_tokens=None, completion_tokens=None)
+
+    with telemetry.capture() as calls:
+        # 在请求内创建的任务中发起的调用也计入明细
+        await asyncio.gather(*(
+            pool.invoke(lambda llm: llm.ainvoke("你好"), preferred="gemini", task="npc_dialogue",
+                        on_attempt=on_attempt("npc_dialogue"))
+            for _ in range(2)
+        ))
+    await pool.invoke(lambda llm: llm.ainvoke("你好"), preferred="qwen", task="action_router",
+                      on_attempt=on_attempt("action_router"))
+    return calls
+
+
+def test_llm_telemetry():
+    """测试直方图、token用量解析、按模板/模型/提供商汇总和请求明细"""
+    print("🔧 测试LLM调用遥测")
+    print("=" * 50)
+
+    # 1. 直方图分位数按桶上界估算
+    print("\n1️⃣ 测试直方图...")
+    histogram = Histogram([0.5, 1, 2])
+    for value in [0.1, 0.2, 0.3, 0.8, 5.0]:
+        histogram.observe(value)
+    stats = histogram.get_stats()
+    assert stats["p50"] == 0.5 and stats["p95"] == 5.0
+    assert stats["buckets"] == {"<=0.5": 3, "<=1": 1, "<=2": 0, ">2": 1}
+    print(f"✅ 直方图: {stats}")
+
+    # 2. 从LLM回调中读取token用量
+    print("\n2️⃣ 测试token用量...")
+    usage = TokenUsageHandler()
+    usage.on_llm_end(LLMResult(generations=[[Generation(text="好")]],
+                               llm_output={"token_usage": {"prompt_tokens": 120, "completion_tokens": 30}}))
+    assert usage.take() == {"prompt_tokens": 120, "completion_tokens": 30}
+    usage.on_llm_end(LLMResult(generations=[[Generation(text="好")]], llm_output=None))
+    assert usage.take() == {"prompt_tokens": None, "completion_tokens": None}
+    print("✅ token用量解析正常")
+
+    # 3. 提供商池的每次尝试都记录结果、排队时间和延迟
+    print("\n3️⃣ 测试调用汇总...")
+    telemetry = LLMTelemetry({"latency_buckets": [0.005, 0.05, 1]})
+    calls = asyncio.run(_run_pool_checks(telemetry))
+    telemetry.record("npc_dialogue", "cache_hit")
+    telemetry.record("npc_dialogue", "success", provider="qwen", model="qwen-model", latency=0.02,
+                     prompt_tokens=100, completion_tokens=20)
+
+    stats = telemetry.get_stats()
+    dialogue = stats["templates"]["npc_dialogue"]
+    # 两次请求各失败一次后切换到qwen，另有一次缓存命中和一次带用量的成功调用
+    assert dialogue["outcomes"] == {"error": 2, "success": 3, "cache_hit": 1}, dialogue
+    assert dialogue["latency"]["count"] == 5
+    assert dialogue["prompt_tokens"] == 100 and dialogue["tokens_reported"] == 1
+    assert stats["templates"]["action_router"]["outcomes"] == {"success": 1}
+    assert stats["providers"]["gemini"]["error_rate"] == 1.0
+    assert stats["models"]["qwen-model"]["calls"] == 4
+    print(f"✅ 模板汇总: {list(stats['templates'])}")
+
+    # 4. 请求明细只包含范围内的调用
+    print("\n4️⃣ 测试请求明细...")
+    assert len(calls) == 4
+    summary = telemetry.summarize_calls(calls)
+    assert [call["outcome"] for call in summary["calls"]].count("error") == 2
+    assert all(call["template"] == "npc_dialogue" for call in summary["calls"])
+    assert summary["total_latency"] > 0
+    telemetry.reset()
+    assert telemetry.get_stats()["templates"] == {}
+    print(f"✅ 请求明细: {summary['total_latency']}s")
+
+    print("\n🎯 LLM调用遥测测试完成！")
+
+
+if __name__ == "__main__":
+    test_llm_telemetry()
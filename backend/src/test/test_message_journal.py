@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+测试消息日志写后模式的按批刷写、失败重试、溢写文件重放、反压、死信和读到自己的写入
+"""
+import sys
+import os
+import json
+import asyncio
+import tempfile
+from datetime import datetime
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.services.message_journal import MessageJournal
+
+
+class FakeMessageService:
+    """记录每次批量写入的消息服务替身，可设置为数据库不可用，包含poison内容的批次写入失败"""
+
+    def __init__(self, poison: str = None):
+        self.batches = []
+        self.failing = False
+        self.poison = poison
+
+    async def save_turns(self, turns, raise_errors=False):
+        if self.failing:
+            raise ConnectionError("数据库不可用")
+        if self.poison and any(msg["content"] == self.poison for turn in turns for msg in turn["messages"]):
+            raise ValueError("无法写入的数据")
+        self.batches.append([msg["content"] for turn in turns for msg in turn["messages"]])
+        return list(range(sum(len(turn["messages"]) for turn in turns)))
+
+
+def _turn(index: int, location: str = "living_room"):
+    game_time = datetime(2024, 1, 15, 8, index)
+    return [
+        {"message_type": 1, "sub_type": "player_action", "content": f"行动{index}", "location": location,
+         "game_time": game_time},
+        {"message_type": 3, "sub_type": "movement", "content": f"移动{index}", "location": location,
+         "game_time": game_time, "metadata": {"new_location": location}},
+    ]
+
+
+def _make_journal(spill_path: str, service: FakeMessageService = None, **config) -> MessageJournal:
+    journal = MessageJournal(message_service=service or FakeMessageService(), spill_path=spill_path)
+    journal.enabled = True
+    journal.flush_interval = 0.02
+    for key, value in config.items():
+        setattr(journal, key, value)
+    return journal
+
+
+async def _run_journal_checks(spill_path: str):
+    # 1. 写入立即返回，积压达到批量大小或到达时间间隔时成组写入
+    print("\n1️⃣ 测试按批刷写...")
+    journal = _make_journal(spill_path, batch_size=4)
+    service = journal.message_service
+    assert await journal.save_turn(7, 1, "s1", _turn(1)) == []
+    assert service.batches == [] and journal.get_stats()["pending_messages"] == 2
+    await journal.save_turn(7, 1, "s1", _turn(2))
+    await asyncio.sleep(0.01)
+    assert service.batches == [["行动1", "移动1", "行动2", "移动2"]]
+    await journal.save_turn(7, 1, "s1", _turn(3))
+    await asyncio.sleep(0.05)
+    assert service.batches[-1] == ["行动3", "移动3"]
+    assert os.path.getsize(spill_path) == 0
+    print(f"✅ 日志统计: {journal.get_stats()}")
+
+    # 2. 写入失败时保留在队列和溢写文件中，未写入的消息可以被读到
+    print("\n2️⃣ 测试写入失败和读到自己的写入...")
+    service.failing = True
+    await journal.save_turn(7, 1, "s1", _turn(4, "kitchen"))
+    await journal.save_turn(7, 1, "s2", _turn(5, "balcony"))
+    await asyncio.sleep(0.05)
+    assert journal.get_stats()["failures"] >= 1 and journal.get_stats()["pending_turns"] == 2
+    latest = journal.overlay_latest_state(7, 1, "s1", {"current_time": "2024-01-15 08:03", "player_location": "living_room"})
+    assert latest == {"current_time": "2024-01-15 08:04", "player_location": "kitchen"}
+    assert journal.overlay_latest_state(7, 1, "s3", {"player_location": None}) == {"player_location": None}
+    await journal.stop()
+    with open(spill_path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 2
+
+    # 3. 重启后从溢写文件重放未写入的消息（忽略写入一半的记录）
+    print("\n3️⃣ 测试溢写文件重放...")
+    with open(spill_path, "a", encoding="utf-8") as f:
+        f.write('{"user_id": 7, "story_id"')
+    journal = _make_journal(spill_path)
+    journal.start()
+    await asyncio.sleep(0.05)
+    assert journal.message_service.batches == [["行动4", "移动4", "行动5", "移动5"]]
+    assert journal.get_stats()["replayed"] == 2 and journal.get_stats()["pending_turns"] == 0
+    assert os.path.getsize(spill_path) == 0
+    await journal.stop()
+    print(f"✅ 日志统计: {journal.get_stats()}")
+
+    # 4. 队列已满时由写入方等待刷写；数据库不可用时不再入队，直接写入并把失败交给调用方
+    print("\n4️⃣ 测试反压...")
+    journal = _make_journal(spill_path, max_pending=3, flush_interval=60)
+    service = journal.message_service
+    await journal.save_turn(7, 1, "s1", _turn(6))
+    await journal.save_turn(7, 1, "s1", _turn(7))
+    assert journal.get_stats()["backpressure"] == 1 and journal.get_stats()["pending_messages"] == 2
+    assert service.batches == [["行动6", "移动6"]]
+    service.failing = True
+    try:
+        await journal.save_turn(7, 1, "s1", _turn(8))
+        assert False, "队列已满且数据库不可用时应抛出异常"
+    except ConnectionError:
+        pass
+    stats = journal.get_stats()
+    assert stats["direct_writes"] == 1 and stats["pending_messages"] == 2 and stats["dead_lettered"] == 0
+    service.failing = False
+    await journal.stop()
+    assert service.batches[-1] == ["行动7", "移动7"]
+    print(f"✅ 日志统计: {journal.get_stats()}")
+
+    # 5. 无法写入的回合失败max_attempts次后移入死信文件，不阻塞后面的回合
+    print("\n5️⃣ 测试死信...")
+    journal = _make_journal(spill_path, FakeMessageService(poison="行动10"), max_attempts=2, flush_interval=60)
+    service = journal.message_service
+    results = []
+    for index in (9, 10, 11):
+        async def on_saved(saved, index=index):
+            results.append((index, saved))
+        await journal.save_turn(7, 1, "s1", _turn(index), on_saved=on_saved)
+    # 入队时不调用写入回调
+    # 整批失败后逐个回合写入：先写入第9回合，第10回合失败两次后移入死信文件，再写入第11回合
+    assert results == []
+    await journal.flush()
+    assert journal.get_stats()["pending_turns"] == 3
+    for _ in range(3):
+        await journal.flush()
+    assert journal.get_stats()["pending_turns"] == 0
+    assert [content for batch in service.batches for content in batch] == ["行动9", "移动9", "行动11", "移动11"]
+    assert journal.get_stats()["dead_lettered"] == 1 and os.path.getsize(spill_path) == 0
+    # 写入数据库的回合以True、移入死信文件的回合以False调用写入回调
+    assert results == [(9, True), (10, False), (11, True)]
+    with open(journal.dead_letter_path, encoding="utf-8") as f:
+        dead, = [json.loads(line) for line in f]
+    assert dead["messages"][0]["content"] == "行动10" and dead["error"] == "无法写入的数据"
+    await journal.stop()
+    print(f"✅ 日志统计: {journal.get_stats()}")
+
+    # 6. 关闭时直接写入，失败时抛出异常
+    print("\n6️⃣ 测试关闭写后模式...")
+    journal = _make_journal(spill_path)
+    journal.enabled = False
+    assert await journal.save_turn(7, 1, "s1", _turn(12)) == [0, 1]
+    assert journal.message_service.batches == [["行动12", "移动12"]]
+    print("✅ 关闭时直接写入数据库")
+
+
+def test_message_journal():
+    """测试消息写入队列后按批写入数据库，失败时保留在溢写文件中并在重启后重放"""
+    print("🔧 测试消息日志")
+    print("=" * 50)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(_run_journal_checks(os.path.join(tmp_dir, "message_journal.jsonl")))
+    print("\n🎯 消息日志测试完成！")
+
+
+if __name__ == "__main__":
+    test_message_journal()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+测试后台计划表任务读写会话的游戏状态，LLM调用或解析失败时抛出异常以便重试
+"""
+import sys
+import os
+import json
+import asyncio
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.models.game_state_model import GameStateModel
+from src.services.dialogue_service import DialogueService
+from src.services.npc_service import npc_service
+
+SCHEDULE = [{"start_time": "08:00", "end_time": "12:00", "location": "kitchen", "event": "做早餐"}]
+NEW_SCHEDULE = [{"start_time": "08:00", "end_time": "12:00", "location": "garden", "event": "浇花"}]
+
+
+class FakeGateway:
+    """返回固定响应的LLM网关替身，response为异常时抛出"""
+
+    def __init__(self, response):
+        self.response = response
+        self.prompts = []
+
+    async def ainvoke(self, prompt, task=None, **kwargs):
+        self.prompts.append(prompt)
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+class FakeStateService:
+    """记录读取和合并保存的会话状态服务替身"""
+
+    def __init__(self, game_state: GameStateModel):
+        self.game_state = game_state
+        self.loads = []
+        self.saved = []
+
+    async def get_game_state(self, session_id, user_id=None, story_id=None):
+        self.loads.append((session_id, user_id, story_id))
+        return GameStateModel.from_dict(json.loads(json.dumps(self.game_state.to_dict())))
+
+    def capture(self, game_state):
+        return json.loads(json.dumps(game_state.to_dict()))
+
+    async def save_merged(self, session_id, game_state, base, story_id=None, user_id=None):
+        self.saved.append((session_id, story_id, user_id, game_state.npc_dynamic_schedules))
+        return True
+
+
+class FakeNPCDBService:
+    """计划表持久化时找不到NPC记录，不访问数据库"""
+
+    def get_npc_by_name(self, story_id, npc_name):
+        return {"success": False, "error": "测试中不持久化"}
+
+
+def _payload():
+    return {
+        "session_id": "s1", "story_id": 1, "user_id": 7, "npc_name": "林若曦",
+        "player_message": "下午一起去花园吧", "npc_response": "好呀", "current_time": "2024-01-15 08:10",
+        "message_time": "2024-01-15 08:12"
+    }
+
+
+async def _run_job_checks(service: DialogueService, state_service: FakeStateService):
+    # 1. 计划表有变化时写入该会话的状态并返回下一回合投递的消息
+    print("\n1️⃣ 测试更新会话计划表...")
+    service.llm_gateway = FakeGateway(json.dumps({"needs_schedule_update": True, "new_complete_schedule": NEW_SCHEDULE}))
+    result = await service.run_schedule_update_job(_payload())
+    assert state_service.loads == [("s1", 7, 1)]
+    assert state_service.saved == [("s1", 1, 7, {"林若曦": NEW_SCHEDULE})]
+    assert result["messages"][0]["message"] == "林若曦的计划发生了变化。"
+    assert result["messages"][0]["timestamp"] == "2024-01-15 08:12"
+    # 提示词基于会话当前的计划表和对话发生时的时间
+    assert "做早餐" in service.llm_gateway.prompts[0] and "2024-01-15 08:10" in service.llm_gateway.prompts[0]
+    print("✅ 计划表写入会话状态")
+
+    # 2. 不需要更新时不保存
+    print("\n2️⃣ 测试无需更新...")
+    service.llm_gateway = FakeGateway(json.dumps({"needs_schedule_update": False}))
+    assert await service.run_schedule_update_job(_payload()) is None
+    assert len(state_service.saved) == 1
+
+    # 3. LLM调用失败和响应无法解析时抛出异常，由后台任务服务退避重试
+    print("\n3️⃣ 测试失败重试...")
+    for response in (RuntimeError("LLM服务不可用"), "不是JSON"):
+        service.llm_gateway = FakeGateway(response)
+        try:
+            await service.run_schedule_update_job(_payload())
+            raise AssertionError("应抛出异常")
+        except AssertionError:
+            raise
+        except Exception as e:
+            print(f"  ⚠️ 任务失败: {e}")
+    assert len(state_service.saved) == 1
+    print("✅ 失败时抛出异常")
+
+
+def test_schedule_update_job():
+    """测试计划表任务读取并合并保存会话状态、传入故事ID以及失败时抛出异常"""
+    print("🔧 测试后台计划表任务")
+    print("=" * 50)
+
+    game_state = GameStateModel("s1", 1)
+    game_state.current_time = "2024-01-15 09:30"
+    game_state.npc_dynamic_schedules = {"林若曦": SCHEDULE}
+    service = DialogueService()
+    state_service = FakeStateService(game_state)
+    service.state_service = state_service
+    original_db_service = npc_service.npc_db_service
+    npc_service.npc_db_service = FakeNPCDBService()
+    try:
+        asyncio.run(_run_job_checks(service, state_service))
+    finally:
+        npc_service.npc_db_service = original_db_service
+
+    print("\n🎯 后台计划表任务测试完成！")
+
+
+if __name__ == "__main__":
+    test_schedule_update_job()
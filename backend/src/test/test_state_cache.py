@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+测试会话状态缓存的命中、写穿、副本隔离和失效，以及会话快照的保存和恢复
+"""
+import sys
+import os
+import asyncio
+import copy
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.services.state_service import StateService
+from src.models.game_state_model import GameStateModel
+from src.utils.llm_cache import TTLLRUCache
+from src.database.models import GameSession
+from src.services.session_snapshot_service import SessionSnapshotService
+
+
+async def _run_cache_checks(service: StateService, restores: list):
+    # 1. 第一次从数据库恢复，之后命中缓存
+    print("\n1️⃣ 测试缓存命中...")
+    state = await service.get_game_state("s1", 7, 1)
+    await service.get_game_state("s1", 7, 1)
+    assert restores == [("s1", 7, 1)]
+    # 没有用户或故事时不缓存
+    await service.get_game_state("s1")
+    await service.get_game_state("s1")
+    assert len(restores) == 3
+    print(f"✅ 缓存统计: {service.get_cache_stats()}")
+
+    # 2. 返回副本，修改后只有写回才生效；写回后对话历史在回合之间保留
+    print("\n2️⃣ 测试写穿和副本隔离...")
+    state.current_time = "2024-01-15 09:00"
+    assert (await service.get_game_state("s1", 7, 1)).current_time == "2024-01-15 08:00"
+    state.npc_dialogue_histories["林若曦"] = [{"speaker": "玩家", "message": f"第{i}句"} for i in range(5)]
+    await service.save_game_state("s1", state, 1, 7)
+    cached = await service.get_game_state("s1", 7, 1)
+    assert cached.current_time == "2024-01-15 09:00"
+    # 对话历史只保留最近max_messages条
+    assert [entry["message"] for entry in cached.npc_dialogue_histories["林若曦"]] == ["第2句", "第3句", "第4句"]
+    assert len(restores) == 3
+
+    # 3. 清除会话后重新从数据库恢复
+    print("\n3️⃣ 测试失效...")
+    await service.get_game_state("s1", 7, 2)
+    await service.get_game_state("s2", 7, 1)
+    service.clear_session("s1", 1)
+    assert len(service._cache) == 2
+    service.clear_session("s1")
+    assert len(service._cache) == 1
+    await service.get_game_state("s1", 7, 1)
+    assert restores[-1] == ("s1", 7, 1)
+    stats = service.get_cache_stats()
+    assert stats["invalidations"] == 2 and stats["approx_bytes"] > 0
+    print(f"✅ 缓存统计: {stats}")
+
+
+async def _run_snapshot_checks(service: StateService):
+    # 4. 缓存失效后从会话快照恢复完整状态（包括对话历史），版本号随每次写入递增
+    print("\n4️⃣ 测试会话快照...")
+    service.clear_session("s1")
+    restored = await service.get_game_state("s1", 7, 1)
+    assert restored.version == 1 and restored.current_time == "2024-01-15 09:00"
+    assert len(restored.npc_dialogue_histories["林若曦"]) == 3
+    restored.npc_moods["林若曦"] = "开心"
+    await service.save_game_state("s1", restored, 1, 7)
+    assert restored.version == 2
+
+    # 另一个请求基于旧版本写入：不覆盖已写入的状态，记录冲突并移除缓存
+    stale = GameStateModel.from_dict({**restored.to_dict(), "version": 1, "npc_moods": {}})
+    result = await service.save_game_state("s1", stale, 1, 7)
+    assert result == {"version": 2, "conflict": True} and stale.version == 1
+    assert not service._cache.get(service._cache_key("s1", 7, 1))[0]
+    assert service.get_cache_stats()["write_evictions"] == 1
+    restored = await service.get_game_state("s1", 7, 1)
+    assert restored.version == 2 and restored.npc_moods == {"林若曦": "开心"}
+
+    # 合并保存：重新读取最新状态，只合并本次的修改（追加的对话、新的计划表）后重试
+    base = {**service.capture(restored), "version": 1, "npc_moods": {}}
+    stale = GameStateModel.from_dict(copy.deepcopy(base))
+    stale.npc_dialogue_histories["林若曦"].append({"speaker": "林若曦", "message": "新回复"})
+    stale.npc_dynamic_schedules["林若曦"] = [{"start_time": "09:00", "location": "kitchen"}]
+    assert await service.save_merged("s1", stale, base, 1, 7) is True
+    restored = await service.get_game_state("s1", 7, 1)
+    assert restored.version == 3 and restored.npc_moods == {"林若曦": "开心"}
+    assert restored.npc_dialogue_histories["林若曦"][-1]["message"] == "新回复"
+    assert restored.npc_dynamic_schedules == stale.npc_dynamic_schedules
+    stats = service.snapshot_service.get_stats()
+    assert stats["conflicts"] == 2 and stats["saves"] == 3 and service.get_cache_stats()["merges"] == 1
+    print(f"✅ 快照统计: {stats}")
+
+    # 5. 快照写入失败时不更新缓存，之后从数据库中的快照恢复
+    print("\n5️⃣ 测试写入失败...")
+    snapshot_service = service.snapshot_service
+    service.snapshot_service = type("FailingSnapshots", (), {"save": lambda self, *args, **kwargs: None})()
+    restored.current_time = "2024-01-15 10:00"
+    try:
+        await service.save_game_state("s1", restored, 1, 7)
+    finally:
+        service.snapshot_service = snapshot_service
+    assert restored.version == 3
+    assert (await service.get_game_state("s1", 7, 1)).current_time == "2024-01-15 09:00"
+    assert service.get_cache_stats()["write_evictions"] == 3
+    print(f"✅ 缓存统计: {service.get_cache_stats()}")
+
+
+def test_state_cache():
+    """测试按(会话, 故事, 用户)缓存游戏状态、写穿更新、清除和从会话快照恢复"""
+    print("🔧 测试会话状态缓存")
+    print("=" * 50)
+
+    service = StateService()
+    restores = []
+
+    async def fake_restore(session_id, user_id=None, story_id=None):
+        restores.append((session_id, user_id, story_id))
+        game_state = GameStateModel(session_id, story_id)
+        game_state.current_time = "2024-01-15 08:00"
+        return game_state
+
+    # 快照读写在数据库线程池中执行，内存数据库需要在线程间共享同一个连接
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    GameSession.__table__.create(engine)
+    original = service._cache, service.cache_max_messages, service.snapshot_service
+    service._create_or_restore_state = fake_restore
+    service._cache = TTLLRUCache(8)
+    service.cache_max_messages = 3
+    service.snapshot_service = SessionSnapshotService(engine=engine)
+    try:
+        asyncio.run(_run_cache_checks(service, restores))
+        # 使用真实的恢复逻辑，从会话快照读取
+        del service._create_or_restore_state
+        asyncio.run(_run_snapshot_checks(service))
+    finally:
+        # StateService是单例，恢复原始设置
+        service.__dict__.pop("_create_or_restore_state", None)
+        service._cache, service.cache_max_messages, service.snapshot_service = original
+
+    print("\n🎯 会话状态缓存测试完成！")
+
+
+if __name__ == "__main__":
+    test_state_cache()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+测试流式事件的SSE编码、事件顺序，以及客户端断开后行动继续完成
+"""
+import sys
+import os
+import json
+import asyncio
+from datetime import datetime
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.utils.stream_events import (
+    encode_sse, emit_event, EVENT_ROUTE, EVENT_MESSAGE, EVENT_TOKEN, EVENT_STATE, EVENT_DONE
+)
+from src.services.game_service import GameService
+
+
+def _decode(frame: str):
+    event_line, data_line = frame.rstrip("\n").split("\n")
+    assert event_line.startswith("event: ") and data_line.startswith("data: ")
+    return event_line[len("event: "):], json.loads(data_line[len("data: "):])
+
+
+def _make_service(finished: list, release: asyncio.Event = None) -> GameService:
+    service = GameService()
+
+    async def fake_process_action(action, session_id="default", story_id=None, on_event=None):
+        await emit_event(on_event, EVENT_ROUTE, action_type="talk")
+        await emit_event(on_event, EVENT_MESSAGE, message={"speaker": "系统", "message": "你走向林若曦"})
+        for token in ("早", "上好"):
+            await emit_event(on_event, EVENT_TOKEN, npc="林若曦", text=token)
+        if release is not None:
+            await release.wait()
+        finished.append(action)
+        return {"player_location": "kitchen", "dialogue_history": []}
+
+    service.process_action = fake_process_action
+    return service
+
+
+async def _run_stream_checks():
+    # 2. 事件按产生顺序推送，最后是state和done
+    print("\n2️⃣ 测试事件顺序...")
+    finished = []
+    service = _make_service(finished)
+    frames = [_decode(frame) async for frame in service.stream_action("和林若曦说：早", "s1", 1)]
+    assert [event for event, _ in frames] == [EVENT_ROUTE, EVENT_MESSAGE, EVENT_TOKEN, EVENT_TOKEN, EVENT_STATE, EVENT_DONE]
+    assert "".join(data["text"] for event, data in frames if event == EVENT_TOKEN) == "早上好"
+    assert frames[-2][1]["data"]["player_location"] == "kitchen"
+    print("✅ 事件顺序正常")
+
+    # 3. 客户端断开后不取消行动，行动在后台完成
+    print("\n3️⃣ 测试客户端断开...")
+    finished = []
+    release = asyncio.Event()
+    service = _make_service(finished, release)
+    stream = service.stream_action("和林若曦说：早", "s1", 1)
+    event, _ = _decode(await stream.__anext__())
+    assert event == EVENT_ROUTE
+    await stream.aclose()
+    assert len(service._stream_tasks) == 1 and finished == []
+    release.set()
+    await asyncio.sleep(0.05)
+    assert finished == ["和林若曦说：早"] and not service._stream_tasks
+    print("✅ 断开连接后行动照常完成")
+
+
+def test_stream_events():
+    """测试SSE编码、流式事件顺序和断开连接的处理"""
+    print("🔧 测试流式事件")
+    print("=" * 50)
+
+    # 1. SSE帧：event行和JSON data行，事件类型同时写入type字段，中文不转义
+    print("\n1️⃣ 测试SSE编码...")
+    frame = encode_sse(EVENT_TOKEN, {"npc": "林若曦", "text": "早"})
+    assert frame == 'event: token\ndata: {"type": "token", "npc": "林若曦", "text": "早"}\n\n'
+    # 无法直接序列化的值（如datetime）转为字符串
+    event, data = _decode(encode_sse(EVENT_STATE, {"data": {"time": datetime(2024, 1, 15, 8, 0)}}))
+    assert event == EVENT_STATE and data["data"]["time"] == "2024-01-15 08:00:00"
+    print("✅ SSE编码正常")
+
+    asyncio.run(_run_stream_checks())
+    print("\n🎯 流式事件测试完成！")
+
+
+if __name__ == "__main__":
+    test_stream_events()
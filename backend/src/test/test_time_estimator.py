@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+测试本地行动耗时估算器
+"""
+import sys
+import os
+import time
+import tempfile
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.utils.time_estimator import TimeEstimator, parse_explicit_minutes
+
+
+def test_time_estimator():
+    """测试指定时间解析、词表估算、性格系数和样本学习"""
+    print("🔧 测试本地时间估算器")
+    print("=" * 50)
+
+    # 1. 玩家明确指定的时间优先
+    print("\n1️⃣ 测试指定时间解析...")
+    assert parse_explicit_minutes("玩十分钟手机") == 10
+    assert parse_explicit_minutes("看5分钟书") == 5
+    assert parse_explicit_minutes("睡半小时") == 30
+    assert parse_explicit_minutes("学习一个半小时") == 90
+    assert parse_explicit_minutes("打两个小时游戏") == 120
+    assert parse_explicit_minutes("看看四周") is None
+    print("✅ 指定时间解析正常")
+
+    # 2. 词表、修饰词和性格系数
+    print("\n2️⃣ 测试词表估算...")
+    estimator = TimeEstimator(samples_path=None)
+    assert estimator.estimate("去吃饭", "普通")["estimated_minutes"] == 20
+    assert estimator.estimate("玩十分钟手机", "急躁")["estimated_minutes"] == 10
+    assert estimator.estimate("仔细观察房间", "普通")["estimated_minutes"] == 7
+    assert estimator.estimate("洗澡", "急躁")["estimated_minutes"] == 12
+    assert estimator.estimate("洗澡", "慢性子")["estimated_minutes"] == 18
+    assert estimator.estimate("随便看看", "普通")["estimated_minutes"] == 2
+    assert estimator.estimate("发一条朋友圈", "普通")["source"] == "default"
+    print(f"✅ 估算统计: {estimator.get_stats()}")
+
+    # 3. 从样本文件中学习，影子对比会追加新样本
+    print("\n3️⃣ 测试样本学习...")
+    samples_path = os.path.join(tempfile.mkdtemp(), "samples.jsonl")
+    estimator = TimeEstimator(samples_path=samples_path, min_samples=2)
+    estimator.record_sample("去吃饭", "普通", 30)
+    assert estimator.estimate("去吃饭", "普通")["source"] == "lexicon"
+    estimator.record_comparison("吃饭", "普通", 20, 30)
+    result = estimator.estimate("去吃饭", "普通")
+    assert result["estimated_minutes"] == 30 and result["source"] == "learned"
+    # 同一关键词组的其他行动也使用学习值
+    assert estimator.estimate("吃午饭", "普通")["estimated_minutes"] == 30
+    estimator.record_sample("发一条朋友圈", "普通", 4)
+    estimator.record_sample("发一条朋友圈", "普通", 6)
+    assert estimator.estimate("发一条朋友圈", "普通")["reason"] == "与已学习的行动相同"
+    stats = estimator.get_stats()
+    assert stats["comparisons"] == 1 and stats["mean_abs_error"] == 10
+
+    reloaded = TimeEstimator(samples_path=samples_path, min_samples=2)
+    assert reloaded.estimate("去吃饭", "普通")["estimated_minutes"] == 30
+    print(f"✅ 学习统计: {reloaded.get_stats()}")
+
+    # 4. 本地估算足够快
+    print("\n4️⃣ 测试估算速度...")
+    started = time.perf_counter()
+    for _ in range(1000):
+        reloaded.estimate("仔细观察房间里的书架", "细致")
+    per_call = (time.perf_counter() - started) / 1000
+    assert per_call < 0.001, per_call
+    print(f"✅ 单次估算耗时: {per_call * 1e6:.1f}微秒")
+
+    print("\n🎯 本地时间估算器测试完成！")
+
+
+if __name__ == "__main__":
+    test_time_estimator()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+测试回合规划的结构化输出校验
+"""
+import sys
+import os
+
+# 添加backend目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.services.action_router_service import ActionRouterService, TurnPlan
+
+LOCATION_KEYS = {"linkai_room", "living_room", "kitchen"}
+KNOWN_NPCS = {"林若曦", "张雨晴"}
+
+
+def _validate(data):
+    plan = TurnPlan(**data)
+    return plan, ActionRouterService.validate_plan(plan, LOCATION_KEYS, KNOWN_NPCS)
+
+
+def test_turn_planner():
+    """测试回合规划的目的地、对话对象、耗时和子行动校验"""
+    print("🔧 测试回合规划校验")
+    print("=" * 50)
+    
+    # 1. 有效的单一行动规划
+    print("\n1️⃣ 测试有效规划...")
+    _, error = _validate({"action_type": "move", "confidence": 0.9, "reason": "移动", "destination_key": "kitchen"})
+    assert error is None
+    _, error = _validate({"action_type": "talk", "confidence": 0.9, "reason": "对话",
+                          "target_npc": "林若曦", "message": "早啊"})
+    assert error is None
+    plan, error = _validate({"action_type": "explore", "confidence": 0.9, "reason": "探索", "estimated_minutes": 5})
+    assert error is None and plan.estimated_minutes == 5
+    print("✅ 有效规划通过校验")
+    
+    # 2. 参数不存在时回退到逐步调用
+    print("\n2️⃣ 测试无效规划...")
+    _, error = _validate({"action_type": "move", "confidence": 0.9, "reason": "移动", "destination_key": "garden"})
+    assert error and "garden" in error
+    _, error = _validate({"action_type": "move", "confidence": 0.9, "reason": "移动"})
+    assert error
+    _, error = _validate({"action_type": "talk", "confidence": 0.9, "reason": "对话", "target_npc": "陌生人", "message": "你好"})
+    assert error
+    _, error = _validate({"action_type": "compound", "confidence": 0.9, "reason": "复合"})
+    assert error
+    print("✅ 无效规划被拒绝")
+    
+    # 3. 不合理的耗时只丢弃该字段
+    print("\n3️⃣ 测试耗时校验...")
+    plan, error = _validate({"action_type": "explore", "confidence": 0.9, "reason": "探索", "estimated_minutes": -3})
+    assert error is None and plan.estimated_minutes is None
+    print("✅ 不合理耗时被丢弃")
+    
+    # 4. 复合指令逐个校验子行动
+    print("\n4️⃣ 测试复合规划...")
+    plan, error = _validate({
+        "action_type": "compound", "confidence": 0.9, "reason": "复合",
+        "sub_actions": [
+            {"type": "talk", "action": "和林若曦告别", "target_npc": "林若曦", "message": "我先走了"},
+            {"type": "move", "action": "去客厅", "destination_key": "living_room"},
+            {"type": "explore", "action": "看看电视", "estimated_minutes": 10000}
+        ]
+    })
+    assert error is None
+    assert plan.sub_actions[1].destination_key == "living_room"
+    assert plan.sub_actions[2].estimated_minutes is None
+    _, error = _validate({
+        "action_type": "compound", "confidence": 0.9, "reason": "复合",
+        "sub_actions": [{"type": "move", "action": "去花园", "destination_key": "garden"}]
+    })
+    assert error
+    print("✅ 复合规划校验正常")
+    
+    print("\n🎯 回合规划校验测试完成！")
+
+
+if __name__ == "__main__":
+    test_turn_planner()
@@ -5,7 +5,15 @@ Utils层 - 工具类，提供通用功能
 from .response_utils import ResponseUtils
 from .validation_utils import ValidationUtils
 from .logger_utils import LoggerUtils
-from .llm_client import LLMClient
+
+
+def __getattr__(name):
+    # LLMClient按需导入：模型层以utils.config_loader的形式导入本包时，
+    # 不会再以另一个模块名创建一份LLM网关（HTTP连接池）和响应缓存
+    if name == "LLMClient":
+        from .llm_client import LLMClient
+        return LLMClient
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 __all__ = [
     "ResponseUtils",
@@ -0,0 +1,170 @@
+"""
+异步依赖图执行器 - 并发执行单个行动中相互独立的LLM/数据库步骤
+"""
+import time
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+from .config_loader import get_config_section
+
+logger = logging.getLogger(__name__)
+
+# 单个步骤的默认超时时间（秒）
+DEFAULT_STEP_TIMEOUT = 60.0
+
+
+class DAGStep:
+    """依赖图中的一个步骤"""
+    
+    def __init__(self, name: str, func: Callable[..., Awaitable[Any]], depends_on: Optional[List[str]] = None,
+                 timeout: Optional[float] = None, default: Any = None, required: bool = False):
+        """
+        Args:
+            name: 步骤名
+            func: 异步函数，依赖步骤的结果以同名关键字参数传入
+            depends_on: 依赖的步骤名列表
+            timeout: 超时时间（秒）
+            default: 步骤失败或超时时使用的结果
+            required: 为True时，步骤失败会跳过所有依赖它的步骤
+        """
+        self.name = name
+        self.func = func
+        self.depends_on = depends_on or []
+        self.timeout = timeout
+        self.default = default
+        self.required = required
+
+
+class DAGResult:
+    """依赖图执行结果，失败的步骤以默认值填充"""
+    
+    def __init__(self):
+        self.results: Dict[str, Any] = {}
+        self.errors: Dict[str, str] = {}
+        self.exceptions: Dict[str, Exception] = {}
+        self.timed_out: List[str] = []
+        self.skipped: List[str] = []
+        self.durations: Dict[str, float] = {}
+        self.total_duration = 0.0
+    
+    def get(self, name: str, default: Any = None) -> Any:
+        """获取步骤结果"""
+        return self.results.get(name, default)
+    
+    def ok(self, name: str) -> bool:
+        """步骤是否成功完成"""
+        return name in self.results and name not in self.errors and name not in self.skipped
+    
+    @property
+    def complete(self) -> bool:
+        """所有步骤是否都成功完成"""
+        return not self.errors and not self.skipped
+
+
+class AsyncDAGExecutor:
+    """异步依赖图执行器，依赖已满足的步骤会并发执行"""
+    
+    def __init__(self, name: str = "dag"):
+        self.name = name
+        self.steps: Dict[str, DAGStep] = {}
+        self._configured_timeouts = get_config_section("step_timeouts")
+    
+    def add_step(self, name: str, func: Callable[..., Awaitable[Any]], depends_on: Optional[List[str]] = None,
+                 timeout: Optional[float] = None, default: Any = None, required: bool = False) -> "AsyncDAGExecutor":
+        """
+        添加步骤
+        
+        Args:
+            name: 步骤名
+            func: 异步函数
+            depends_on: 依赖的步骤名列表
+            timeout: 超时时间（秒），未指定时读取config.json的step_timeouts["<图名>.<步骤名>"]
+            default: 失败或超时时使用的结果
+            required: 失败时是否跳过依赖它的步骤
+        
+        Returns:
+            执行器本身，便于链式调用
+        """
+        if name in self.steps:
+            raise ValueError(f"步骤重复: {name}")
+        if timeout is None:
+            timeout = float(self._configured_timeouts.get(f"{self.name}.{name}", DEFAULT_STEP_TIMEOUT))
+        self.steps[name] = DAGStep(name, func, depends_on, timeout, default, required)
+        return self
+    
+    def _validate(self) -> List[str]:
+        """校验依赖关系并返回拓扑顺序"""
+        for step in self.steps.values():
+            for dep in step.depends_on:
+                if dep not in self.steps:
+                    raise ValueError(f"步骤 {step.name} 依赖未知步骤: {dep}")
+        
+        order = []
+        visiting, visited = set(), set()
+        
+        def visit(name: str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"依赖图存在环: {name}")
+            visiting.add(name)
+            for dep in self.steps[name].depends_on:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+        
+        for name in self.steps:
+            visit(name)
+        return order
+    
+    async def run(self) -> DAGResult:
+        """
+        执行依赖图
+        
+        Returns:
+            执行结果，包含各步骤结果、错误、超时和耗时
+        """
+        order = self._validate()
+        result = DAGResult()
+        tasks: Dict[str, asyncio.Task] = {}
+        started = time.perf_counter()
+        
+        async def run_step(step: DAGStep):
+            if step.depends_on:
+                await asyncio.gather(*(tasks[dep] for dep in step.depends_on))
+            
+            for dep in step.depends_on:
+                dep_step = self.steps[dep]
+                if dep in result.skipped or (dep_step.required and dep in result.errors):
+                    result.skipped.append(step.name)
+                    result.results[step.name] = step.default
+                    return
+            
+            kwargs = {dep: result.results.get(dep) for dep in step.depends_on}
+            step_started = time.perf_counter()
+            try:
+                value = await asyncio.wait_for(step.func(**kwargs), timeout=step.timeout)
+                result.results[step.name] = value
+            except asyncio.TimeoutError:
+                logger.warning(f"⏱️ [{self.name}] 步骤 {step.name} 超时 ({step.timeout}s)，使用默认值")
+                result.timed_out.append(step.name)
+                result.errors[step.name] = f"超时 ({step.timeout}s)"
+                result.results[step.name] = step.default
+            except Exception as e:
+                logger.error(f"❌ [{self.name}] 步骤 {step.name} 失败: {e}")
+                result.errors[step.name] = str(e)
+                result.exceptions[step.name] = e
+                result.results[step.name] = step.default
+            finally:
+                result.durations[step.name] = round(time.perf_counter() - step_started, 3)
+        
+        # 按拓扑顺序创建任务，保证依赖的任务先存在
+        for name in order:
+            tasks[name] = asyncio.create_task(run_step(self.steps[name]))
+        await asyncio.gather(*tasks.values())
+        
+        result.total_duration = round(time.perf_counter() - started, 3)
+        logger.info(f"⚙️ [{self.name}] 依赖图执行完成，总耗时 {result.total_duration}s，各步骤耗时: {result.durations}")
+        return result
@@ -0,0 +1,80 @@
+"""
+复合行动规划 - 按子行动读写的游戏状态把子行动划分为执行阶段，同一阶段内的子行动互不依赖、可以并发执行
+"""
+from typing import List, Optional, Set, Tuple
+
+# 任意状态（未知类型的子行动读写全部状态，不与其他子行动并发）
+ANY_STATE = "*"
+
+# 各类子行动读取和修改的游戏状态
+# 移动、探索和对话都推进游戏时间；对话按当前时间判断NPC是否在场，探索按当前时间计算耗时，
+# 都必须等前面推进时间的子行动完成。对话历史按NPC区分
+SUB_ACTION_ACCESS = {
+    "move": ({"player_location", "current_time"}, {"player_location", "current_time"}),
+    "talk": ({"player_location", "current_time", "dialogue"}, {"current_time", "dialogue"}),
+    "explore": ({"player_location", "current_time"}, {"current_time"}),
+}
+
+# 子行动直接修改的按NPC区分的游戏状态，并发执行的子行动各自修改状态副本，完成后逐个NPC合并
+NPC_STATE_FIELDS = ("npc_dialogue_histories", "npc_moods", "npc_dynamic_schedules", "npc_dynamic_data")
+
+Access = Tuple[Set[str], Set[str]]
+
+
+def get_access(sub_type: str, npc_name: Optional[str] = None) -> Access:
+    """
+    获取子行动读写的状态
+
+    Args:
+        sub_type: 子行动类型
+        npc_name: 对话对象（仅talk），未知时与所有对话冲突
+
+    Returns:
+        (读取的状态, 修改的状态)
+    """
+    if sub_type not in SUB_ACTION_ACCESS:
+        return {ANY_STATE}, {ANY_STATE}
+
+    def resolve(states: Set[str]) -> Set[str]:
+        return {f"dialogue:{npc_name or ANY_STATE}" if state == "dialogue" else state for state in states}
+
+    reads, writes = SUB_ACTION_ACCESS[sub_type]
+    return resolve(reads), resolve(writes)
+
+
+def _same_state(a: str, b: str) -> bool:
+    if a == b or ANY_STATE in (a, b):
+        return True
+    prefix_a, _, key_a = a.partition(":")
+    prefix_b, _, key_b = b.partition(":")
+    return prefix_a == prefix_b and ANY_STATE in (key_a, key_b)
+
+
+def _overlaps(states_a: Set[str], states_b: Set[str]) -> bool:
+    return any(_same_state(a, b) for a in states_a for b in states_b)
+
+
+def conflicts(earlier: Access, later: Access) -> bool:
+    """两个子行动是否必须按顺序执行（一个修改了另一个读取或修改的状态）"""
+    earlier_reads, earlier_writes = earlier
+    later_reads, later_writes = later
+    return _overlaps(earlier_writes, later_reads | later_writes) or _overlaps(later_writes, earlier_reads)
+
+
+def plan_stages(accesses: List[Access]) -> List[List[int]]:
+    """
+    按原始顺序把子行动划分为执行阶段：与当前阶段内任一子行动冲突时开始新阶段
+
+    Args:
+        accesses: 每个子行动读写的状态
+
+    Returns:
+        各阶段的子行动下标，阶段之间顺序执行，阶段内并发执行
+    """
+    stages: List[List[int]] = []
+    for index, access in enumerate(accesses):
+        if stages and not any(conflicts(accesses[member], access) for member in stages[-1]):
+            stages[-1].append(index)
+        else:
+            stages.append([index])
+    return stages
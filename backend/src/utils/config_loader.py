@@ -68,4 +68,18 @@ def get_init_time() -> str:
         游戏初始时间
     """
     game_config = get_game_config()
-    return game_config.get('init_time', '2024-01-15 07:00') 
\ No newline at end of file
+    return game_config.get('init_time', '2024-01-15 07:00') 
+
+def get_config_section(section: str) -> Dict[str, Any]:
+    """
+    获取配置文件中的指定配置段
+    
+    Args:
+        section: 配置段名称，如 "action_router"
+        
+    Returns:
+        配置段字典，不存在时返回空字典
+    """
+    config = load_config()
+    section_config = config.get(section, {})
+    return section_config if isinstance(section_config, dict) else {}
@@ -0,0 +1,465 @@
+"""
+离线LLM服务 - 兼容OpenAI chat completions接口的本地替身，用于压测和无网络的CI
+
+三种模式：
+- fake：按提示词模板生成符合格式的响应（路由、目的地、五感、计划表JSON或自由文本），延迟按配置的分布采样
+- record：把请求转发给真实的OpenAI兼容服务，并把请求和响应写入录制文件
+- replay：按请求指纹从录制文件中确定性地返回响应
+"""
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from ..prompts.prompt_manager import prompt_manager
+
+logger = logging.getLogger(__name__)
+
+MODE_FAKE = "fake"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+FAKE_MODEL = "fake-llm"
+# 模板中第一个变量之前的固定文本至少这么长才用于识别提示词类型
+MIN_SIGNATURE_LENGTH = 6
+STREAM_CHUNK_CHARS = 8
+# 计算请求指纹时忽略的字段（流式与否不影响响应内容）
+FINGERPRINT_IGNORED_FIELDS = ("stream", "stream_options", "user")
+
+# 各任务的默认延迟分布（秒）
+DEFAULT_LATENCY = {
+    "default": {"distribution": "lognormal", "median": 0.8, "sigma": 0.4},
+    "action_router": {"distribution": "lognormal", "median": 0.5, "sigma": 0.3},
+    "turn_planner": {"distribution": "lognormal", "median": 0.7, "sigma": 0.3},
+    "move_destination": {"distribution": "lognormal", "median": 0.4, "sigma": 0.3},
+    "time_estimation": {"distribution": "lognormal", "median": 0.3, "sigma": 0.3},
+    "npc_dialogue": {"distribution": "lognormal", "median": 1.5, "sigma": 0.4},
+    "schedule_update": {"distribution": "lognormal", "median": 1.2, "sigma": 0.4},
+}
+
+VARIABLE_PATTERN = re.compile(r"\{[a-zA-Z_]+\}")
+LOCATION_LINE_PATTERN = re.compile(r"^-\s*([A-Za-z0-9_]+)\s*:\s*([^-\n]+?)(?:\s+-\s+.*)?$", re.MULTILINE)
+NPC_SECTION_PATTERN = re.compile(r"【当前位置的NPC】\n(.+)")
+
+
+class LatencyModel:
+    """按分布采样响应延迟：fixed、uniform、normal、lognormal"""
+    
+    def __init__(self, spec: Dict[str, Any], scale: float = 1.0):
+        self.distribution = spec.get("distribution", "fixed")
+        self.spec = spec
+        self.scale = scale
+    
+    def sample(self, rng: random.Random) -> float:
+        spec = self.spec
+        if self.distribution == "uniform":
+            value = rng.uniform(spec.get("min", 0.0), spec.get("max", 1.0))
+        elif self.distribution == "normal":
+            value = rng.gauss(spec.get("mean", 1.0), spec.get("stddev", 0.2))
+        elif self.distribution == "lognormal":
+            value = spec.get("median", 1.0) * rng.lognormvariate(0.0, spec.get("sigma", 0.4))
+        else:
+            value = spec.get("value", 0.0)
+        return max(value, 0.0) * self.scale
+
+
+def fingerprint_request(body: Dict[str, Any]) -> str:
+    """请求指纹：去掉与响应内容无关的字段后的规范化JSON摘要"""
+    canonical = {key: value for key, value in body.items() if key not in FINGERPRINT_IGNORED_FIELDS}
+    raw = json.dumps(canonical, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        # 多段内容只取文本部分
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content)
+
+
+def template_signatures() -> List[Tuple[str, str]]:
+    """
+    各提示词模板第一个变量之前的固定文本
+    
+    Returns:
+        [(模板名, 固定文本)]，按固定文本长度从长到短排列
+    """
+    signatures = []
+    for name, template in prompt_manager.templates.items():
+        prefix = VARIABLE_PATTERN.split(template.get("prompt", ""), 1)[0].strip()
+        if len(prefix) >= MIN_SIGNATURE_LENGTH:
+            signatures.append((name, prefix))
+    signatures.sort(key=lambda item: -len(item[1]))
+    return signatures
+
+
+def sample_from_schema(schema: Dict[str, Any], definitions: Optional[Dict[str, Any]] = None) -> Any:
+    """按JSON Schema生成最简的合法值（优先使用default和enum的第一个值）"""
+    definitions = definitions if definitions is not None else {**schema.get("definitions", {}), **schema.get("$defs", {})}
+    if "$ref" in schema:
+        return sample_from_schema(definitions.get(schema["$ref"].split("/")[-1], {}), definitions)
+    for key in ("allOf", "anyOf", "oneOf"):
+        if schema.get(key):
+            options = [option for option in schema[key] if option.get("type") != "null"] or schema[key]
+            return sample_from_schema(options[0], definitions)
+    if "default" in schema:
+        return schema["default"]
+    if schema.get("enum"):
+        return schema["enum"][0]
+    schema_type = schema.get("type", "object")
+    if schema_type == "object":
+        return {
+            name: sample_from_schema(property_schema, definitions)
+            for name, property_schema in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        return []
+    if schema_type == "integer":
+        return max(int(schema.get("minimum", 1)), 1)
+    if schema_type == "number":
+        return float(schema.get("minimum", 0.9))
+    if schema_type == "boolean":
+        return False
+    if schema_type == "null":
+        return None
+    return ""
+
+
+class FakeResponder:
+    """按提示词类型生成符合格式的响应"""
+    
+    def __init__(self):
+        self.signatures = template_signatures()
+    
+    def detect_task(self, messages: List[Dict[str, Any]]) -> str:
+        """根据消息内容识别提示词模板，无法识别时为default"""
+        text = "\n".join(message_text(message) for message in messages)
+        for name, prefix in self.signatures:
+            if prefix in text:
+                return name
+        return "default"
+    
+    def respond(self, body: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """
+        生成响应消息
+        
+        Args:
+            body: chat completions请求体
+        
+        Returns:
+            (任务名, assistant消息)
+        """
+        messages = body.get("messages", [])
+        task = self.detect_task(messages)
+        prompt = "\n".join(message_text(message) for message in messages)
+        user_text = next((message_text(m) for m in reversed(messages) if m.get("role") == "user"), "")
+        
+        tool = self._requested_tool(body)
+        if tool:
+            arguments = sample_from_schema(tool.get("parameters", {}))
+            arguments.update(self._structured_overrides(task, prompt, user_text, arguments))
+            return task, {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {"name": tool["name"], "arguments": json.dumps(arguments, ensure_ascii=False)}
+                }]
+            }
+        return task, {"role": "assistant", "content": self._text_response(task, prompt, user_text)}
+    
+    @staticmethod
+    def _requested_tool(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """结构化输出请求的函数定义（tools或旧版functions）"""
+        tools = [tool.get("function", {}) for tool in body.get("tools") or []]
+        tools += body.get("functions") or []
+        if not tools:
+            return None
+        choice = body.get("tool_choice") or body.get("function_call")
+        if isinstance(choice, dict):
+            name = (choice.get("function") or choice).get("name")
+            for tool in tools:
+                if tool.get("name") == name:
+                    return tool
+        return tools[0]
+    
+    @staticmethod
+    def _classify(action: str) -> str:
+        """粗略判断行动类型，保证路由类响应有合理的分布"""
+        if re.search(r"[说问告诉聊]", action):
+            return "talk"
+        if re.search(r"然后|接着|，", action):
+            return "compound"
+        if re.search(r"^(我要|我想)?(去|到|回|前往)", action):
+            return "move"
+        return "explore"
+    
+    @staticmethod
+    def _locations(prompt: str) -> List[Tuple[str, str]]:
+        return [(key, name.strip()) for key, name in LOCATION_LINE_PATTERN.findall(prompt)]
+    
+    def _pick_location(self, prompt: str, user_text: str) -> Tuple[str, str]:
+        locations = self._locations(prompt)
+        for key, name in locations:
+            if name and name in user_text:
+                return key, name
+        return locations[0] if locations else ("", "")
+    
+    def _plan_fields(self, action_type: str, action: str, prompt: str) -> Dict[str, Any]:
+        """回合规划中各行动类型需要的处理参数，缺少NPC时改为general"""
+        if action_type == "move":
+            return {"type": action_type, "destination_key": self._pick_location(prompt, action)[0] or None}
+        if action_type == "talk":
+            npc_match = NPC_SECTION_PATTERN.search(prompt)
+            npcs = [npc for npc in (npc_match.group(1).split("、") if npc_match else []) if npc and npc != "无"]
+            if npcs:
+                return {"type": action_type, "target_npc": npcs[0], "message": action}
+            return {"type": "general"}
+        if action_type == "explore":
+            return {"type": action_type, "estimated_minutes": 5}
+        return {"type": action_type}
+    
+    def _structured_overrides(self, task: str, prompt: str, user_text: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """路由和回合规划的结构化输出：按行动文本给出合理的类型和参数"""
+        if "action_type" not in arguments:
+            return {}
+        action = user_text.split("：", 1)[-1]
+        action_type = self._classify(action)
+        overrides: Dict[str, Any] = {"action_type": action_type, "confidence": 0.9, "reason": "离线模拟判断"}
+        if action_type == "compound":
+            parts = [part for part in re.split(r"然后|接着|，", action) if part]
+            sub_actions = [{"type": self._classify(part), "action": part} for part in parts]
+            if task == "turn_planner":
+                sub_actions = [{**sub_action, **self._plan_fields(sub_action["type"], sub_action["action"], prompt)}
+                               for sub_action in sub_actions]
+            overrides["sub_actions"] = sub_actions
+        elif task == "turn_planner":
+            fields = self._plan_fields(action_type, action, prompt)
+            overrides["action_type"] = fields.pop("type")
+            overrides.update(fields)
+        return overrides
+    
+    def _text_response(self, task: str, prompt: str, user_text: str) -> str:
+        if task in ("sensory_feedback", "dialogue_sensory_feedback"):
+            return json.dumps({
+                "vision": "你看到四周一切如常，光线柔和。",
+                "hearing": "你听到远处隐约的车流声。",
+                "smell": "你闻到淡淡的咖啡香。",
+                "touch": "你感到空气微凉。"
+            }, ensure_ascii=False)
+        if task == "move_destination":
+            key, name = self._pick_location(prompt, user_text)
+            return json.dumps({"destination_key": key, "destination_name": name, "reason": "离线模拟解析"}, ensure_ascii=False)
+        if task == "time_estimation":
+            return json.dumps({"estimated_minutes": 5, "reason": "离线模拟估算"}, ensure_ascii=False)
+        if task == "schedule_update":
+            return json.dumps({
+                "has_invitation": False,
+                "npc_agreed": False,
+                "needs_schedule_update": False,
+                "new_complete_schedule": [],
+                "reason": "离线模拟：对话中没有邀请"
+            }, ensure_ascii=False)
+        if task == "dialogue_summary":
+            return "玩家与NPC进行了几轮日常交谈，没有做出新的约定。"
+        if task == "npc_dialogue":
+            return "（抬起头笑了笑）嗯，我听着呢，你继续说。"
+        return "你完成了这个行动，周围没有什么变化。"
+
+
+class ReplayTape:
+    """录制文件：每行一条 {key, request, response, latency}，同一指纹按录制顺序循环返回"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        self.load()
+    
+    def load(self):
+        self.entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries.setdefault(entry["key"], []).append(entry)
+        except FileNotFoundError:
+            pass
+    
+    def append(self, body: Dict[str, Any], response: Dict[str, Any], latency: float):
+        entry = {"key": fingerprint_request(body), "request": body, "response": response, "latency": round(latency, 4)}
+        self.entries.setdefault(entry["key"], []).append(entry)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    
+    def lookup(self, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = fingerprint_request(body)
+        entries = self.entries.get(key)
+        if not entries:
+            return None
+        cursor = self._cursor.get(key, 0)
+        self._cursor[key] = cursor + 1
+        return entries[cursor % len(entries)]
+    
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self.entries.values())
+
+
+def build_completion(message: Dict[str, Any], model: str, prompt: str = "") -> Dict[str, Any]:
+    """组装chat.completion响应（token数按字符粗略估算）"""
+    content = message.get("content") or json.dumps(message.get("tool_calls", []), ensure_ascii=False)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"
+        }],
+        "usage": {
+            "prompt_tokens": len(prompt),
+            "completion_tokens": len(content),
+            "total_tokens": len(prompt) + len(content)
+        }
+    }
+
+
+def completion_chunks(completion: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """把完整响应拆成chat.completion.chunk序列"""
+    choice = completion["choices"][0]
+    message = choice["message"]
+    base = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"], "model": completion["model"]}
+    chunks = [{**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}]
+    if message.get("tool_calls"):
+        tool_calls = [{**call, "index": i} for i, call in enumerate(message["tool_calls"])]
+        chunks.append({**base, "choices": [{"index": 0, "delta": {"tool_calls": tool_calls}, "finish_reason": None}]})
+    else:
+        content = message.get("content") or ""
+        for start in range(0, len(content), STREAM_CHUNK_CHARS):
+            piece = content[start:start + STREAM_CHUNK_CHARS]
+            chunks.append({**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+    chunks.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": choice.get("finish_reason", "stop")}]})
+    return chunks
+
+
+def create_app(mode: str = MODE_FAKE, tape_path: Optional[str] = None, upstream_url: Optional[str] = None,
+               upstream_api_key: Optional[str] = None, latency: Optional[Dict[str, Dict[str, Any]]] = None,
+               latency_scale: float = 1.0, seed: Optional[int] = None, replay_latency: bool = True,
+               http_client: Optional[httpx.AsyncClient] = None) -> FastAPI:
+    """
+    创建离线LLM服务
+    
+    Args:
+        mode: fake、record或replay
+        tape_path: 录制文件路径（record和replay模式必填）
+        upstream_url: record模式转发的OpenAI兼容服务地址（如 https://api.openai.com/v1）
+        upstream_api_key: 上游服务的API Key
+        latency: 任务名 -> 延迟分布，覆盖默认值
+        latency_scale: 延迟缩放系数，0表示不等待
+        seed: 随机种子，固定后fake模式的延迟序列可复现
+        replay_latency: replay模式是否按录制时的延迟等待
+        http_client: record模式转发请求使用的HTTP客户端，不提供时自动创建
+    
+    Returns:
+        FastAPI应用
+    """
+    if mode not in (MODE_FAKE, MODE_RECORD, MODE_REPLAY):
+        raise ValueError(f"未知模式: {mode}")
+    if mode in (MODE_RECORD, MODE_REPLAY) and not tape_path:
+        raise ValueError(f"{mode}模式需要录制文件路径")
+    if mode == MODE_RECORD and not upstream_url:
+        raise ValueError("record模式需要上游服务地址")
+    
+    app = FastAPI(title="离线LLM服务")
+    responder = FakeResponder()
+    tape = ReplayTape(tape_path) if tape_path else None
+    rng = random.Random(seed)
+    latency_models = {
+        task: LatencyModel(spec, latency_scale) for task, spec in {**DEFAULT_LATENCY, **(latency or {})}.items()
+    }
+    stats = {"requests": 0, "by_task": {}, "replay_misses": 0}
+    app.state.stats = stats
+    app.state.tape = tape
+    
+    clients = {"upstream": http_client}
+    
+    async def upstream_completion(body: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+        if clients["upstream"] is None:
+            clients["upstream"] = httpx.AsyncClient(timeout=120)
+        started = time.perf_counter()
+        # 上游统一使用非流式调用，回放时再按需要拆成分片
+        response = await clients["upstream"].post(
+            f"{upstream_url.rstrip('/')}/chat/completions",
+            json={**body, "stream": False},
+            headers={"Authorization": f"Bearer {upstream_api_key or ''}"}
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=response.text)
+        return response.json(), time.perf_counter() - started
+    
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": FAKE_MODEL, "object": "model", "owned_by": "local"}]}
+    
+    @app.get("/stats")
+    async def get_stats():
+        return {"mode": mode, **stats, "tape_entries": len(tape) if tape else 0}
+    
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        task = responder.detect_task(body.get("messages", []))
+        stats["by_task"][task] = stats["by_task"].get(task, 0) + 1
+        
+        if mode == MODE_REPLAY:
+            entry = tape.lookup(body)
+            if entry is None:
+                stats["replay_misses"] += 1
+                logger.warning(f"⚠️ 录制文件中没有该请求: {task}")
+                return JSONResponse(status_code=404, content={"error": {"message": "录制文件中没有该请求", "type": "replay_miss"}})
+            completion, delay = entry["response"], (entry.get("latency", 0.0) if replay_latency else 0.0)
+        elif mode == MODE_RECORD:
+            completion, delay = await upstream_completion(body)
+            tape.append(body, completion, delay)
+            delay = 0.0  # 已经等待过上游
+        else:
+            _, message = responder.respond(body)
+            prompt = "\n".join(message_text(m) for m in body.get("messages", []))
+            completion = build_completion(message, body.get("model", FAKE_MODEL), prompt)
+            model = latency_models.get(task) or latency_models["default"]
+            delay = model.sample(rng)
+        
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            return completion
+        
+        chunks = completion_chunks(completion)
+        
+        async def generate():
+            # 首个分片前等待约三成延迟，其余延迟均摊到各分片之间
+            await asyncio.sleep(delay * 0.3)
+            interval = delay * 0.7 / max(len(chunks) - 1, 1)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(interval)
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+        
+        return StreamingResponse(generate(), media_type="text/event-stream")
+    
+    return app
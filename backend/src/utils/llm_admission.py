@@ -0,0 +1,161 @@
+"""
+LLM准入控制 - 每个提供商的并发上限、按优先级排队的有界等待队列和排队时间统计
+"""
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_MAX_QUEUE_WAIT = 10.0
+DEFAULT_PRIORITY = 5
+DEFAULT_WINDOW_SIZE = 200
+
+# 各任务的默认优先级，数值越小越先获得并发名额（任务名与提示词模板名一致）
+DEFAULT_TASK_PRIORITIES = {
+    "npc_dialogue": 0,
+    "action_router": 1,
+    "turn_planner": 1,
+    "move_destination": 1,
+    "sensory_feedback": 2,
+    "dialogue_sensory_feedback": 2,
+    "general_response": 2,
+    "time_estimation": 3,
+    "schedule_update": 4,
+    "dialogue_summary": 5,
+    "sensory_prefetch": 6,
+}
+
+
+class LLMOverloadedError(Exception):
+    """LLM请求排队已满或等待超时"""
+    
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = max(float(retry_after), 1.0)
+
+
+class AdmissionQueue:
+    """单个提供商的准入队列：并发名额用完时按优先级排队，队列满时直接拒绝"""
+    
+    def __init__(self, name: str, max_concurrency: int, max_queue: int = DEFAULT_MAX_QUEUE,
+                 max_wait: float = DEFAULT_MAX_QUEUE_WAIT, window_size: int = DEFAULT_WINDOW_SIZE):
+        self.name = name
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.max_queue = max(int(max_queue), 0)
+        self.max_wait = float(max_wait)
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self.queue_times: deque = deque(maxlen=window_size)
+        self.queue_times_by_task: Dict[str, deque] = {}
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.wait_timeouts = 0
+    
+    @property
+    def queue_length(self) -> int:
+        return sum(1 for _, _, waiter in self._waiters if not waiter.done())
+    
+    @property
+    def is_full(self) -> bool:
+        """并发名额和等待队列都已用完"""
+        return self.active >= self.max_concurrency and self.queue_length >= self.max_queue
+    
+    def estimate_wait(self, avg_latency: float) -> float:
+        """按当前排队长度和平均延迟估算需要等待的秒数"""
+        return (self.queue_length + 1) * max(avg_latency, 1.0) / self.max_concurrency
+    
+    @asynccontextmanager
+    async def slot(self, priority: int = DEFAULT_PRIORITY, task: Optional[str] = None,
+                   avg_latency: float = 1.0):
+        """
+        获取一个并发名额，退出时释放
+        
+        Args:
+            priority: 优先级，数值越小越先获得名额
+            task: 任务名，用于按任务统计排队时间
+            avg_latency: 提供商平均延迟，用于估算Retry-After
+        """
+        await self._acquire(priority, task, avg_latency)
+        try:
+            yield
+        finally:
+            self._release()
+    
+    async def _acquire(self, priority: int, task: Optional[str], avg_latency: float):
+        started = time.perf_counter()
+        if self.active < self.max_concurrency and not self.queue_length:
+            self.active += 1
+            self._record_admission(task, 0.0)
+            return
+        
+        if self.queue_length >= self.max_queue:
+            self.rejected += 1
+            raise LLMOverloadedError(f"{self.name} 排队已满", self.estimate_wait(avg_latency))
+        
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        self.queued += 1
+        try:
+            # 释放名额时会直接把名额转交给等待者（active不变）
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # 超时的同时拿到了名额，归还给下一个等待者
+                self._release()
+            else:
+                waiter.cancel()
+            self.wait_timeouts += 1
+            raise LLMOverloadedError(f"{self.name} 排队超时 ({self.max_wait}s)", self.estimate_wait(avg_latency))
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            else:
+                waiter.cancel()
+            raise
+        self._record_admission(task, time.perf_counter() - started)
+    
+    def _release(self):
+        """释放名额：优先转交给优先级最高的等待者"""
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+    
+    def _record_admission(self, task: Optional[str], waited: float):
+        self.admitted += 1
+        self.queue_times.append(waited)
+        if task:
+            self.queue_times_by_task.setdefault(task, deque(maxlen=self.queue_times.maxlen)).append(waited)
+    
+    @staticmethod
+    def _summarize(samples: deque) -> Dict[str, Any]:
+        if not samples:
+            return {"count": 0, "avg": None, "p95": None}
+        ordered = sorted(samples)
+        return {
+            "count": len(ordered),
+            "avg": round(sum(ordered) / len(ordered), 4),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4)
+        }
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "queue_length": self.queue_length,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "wait_timeouts": self.wait_timeouts,
+            "queue_time": self._summarize(self.queue_times),
+            "queue_time_by_task": {task: self._summarize(samples) for task, samples in self.queue_times_by_task.items()}
+        }
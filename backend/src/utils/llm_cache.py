@@ -0,0 +1,352 @@
+"""
+LLM响应缓存 - 内存LRU + 本地SQLite两级缓存
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from .config_loader import get_config_section
+
+logger = logging.getLogger(__name__)
+
+# 默认的本地缓存文件位置（backend/cache/llm_cache.sqlite3）
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'cache', 'llm_cache.sqlite3')
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# 各任务的默认缓存时间（秒），0表示不缓存
+# 任务名与提示词模板名保持一致
+# 缓存键包含完整的提示词，只有回答完全由提示词决定的任务才能缓存：move_destination的提示词包含当前位置和
+# 全部位置信息，time_estimation包含行动和玩家性格，路由和规划包含各自用到的游戏状态；依赖提示词之外状态的任务不缓存
+DEFAULT_TASK_TTLS = {
+    "action_router": 3600,
+    "turn_planner": 3600,
+    "move_destination": 86400,
+    "time_estimation": 86400,
+    "sensory_feedback": 0,
+    "dialogue_sensory_feedback": 0,
+    "sensory_prefetch": 0,
+    "npc_dialogue": 0,
+    "schedule_update": 0,
+    "general_response": 0,
+}
+
+
+def to_message_pairs(messages: Any) -> List[Tuple[str, str]]:
+    """
+    将提示词转换为(角色, 内容)列表，用于生成缓存键
+    
+    Args:
+        messages: 字符串提示词或LangChain消息列表
+        
+    Returns:
+        (角色, 内容)列表
+    """
+    if isinstance(messages, str):
+        return [("human", messages)]
+    pairs = []
+    for message in messages:
+        if isinstance(message, (tuple, list)):
+            pairs.append((str(message[0]), str(message[1])))
+        else:
+            pairs.append((getattr(message, "type", "human"), str(getattr(message, "content", message))))
+    return pairs
+
+
+class TTLLRUCache:
+    """带过期时间的有界LRU缓存"""
+    
+    def __init__(self, max_size: int = 512):
+        self.max_size = max_size
+        self._data: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        获取缓存值
+        
+        Returns:
+            (是否命中, 缓存值)
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return False, None
+            
+            value, expires_at = item
+            if expires_at and expires_at < time.time():
+                del self._data[key]
+                self.expirations += 1
+                return False, None
+            
+            self._data.move_to_end(key)
+            return True, value
+    
+    def set(self, key: str, value: Any, ttl: float):
+        """写入缓存值，超出容量时淘汰最久未使用的条目"""
+        expires_at = time.time() + ttl if ttl else 0
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+    
+    def delete(self, key: str):
+        """删除缓存值"""
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def delete_prefix(self, prefix: str) -> int:
+        """删除键以prefix开头的缓存值，返回删除的条数"""
+        with self._lock:
+            keys = [key for key in self._data if key.startswith(prefix)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+    
+    def values(self) -> List[Any]:
+        """获取所有未过期的缓存值"""
+        now = time.time()
+        with self._lock:
+            return [value for value, expires_at in self._data.values() if not expires_at or expires_at >= now]
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class LLMResponseCache:
+    """LLM响应缓存，按归一化提示词、模型和温度作为缓存键"""
+    
+    def __init__(self, enabled: bool = True, max_memory_entries: int = 512,
+                 db_path: Optional[str] = DEFAULT_DB_PATH, task_ttls: Optional[Dict[str, int]] = None):
+        self.enabled = enabled
+        self.memory = TTLLRUCache(max_memory_entries)
+        self.task_ttls = dict(DEFAULT_TASK_TTLS)
+        self.task_ttls.update(task_ttls or {})
+        self.db_path = db_path
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "disk_errors": 0
+        }
+        self._task_stats: Dict[str, Dict[str, int]] = {}
+        
+        if self.enabled and self.db_path:
+            self._init_db()
+    
+    @classmethod
+    def from_config(cls) -> "LLMResponseCache":
+        """根据config.json中的llm_cache配置创建缓存"""
+        cache_config = get_config_section("llm_cache")
+        return cls(
+            enabled=cache_config.get("enabled", True),
+            max_memory_entries=int(cache_config.get("max_memory_entries", 512)),
+            db_path=cache_config.get("db_path", DEFAULT_DB_PATH),
+            task_ttls=cache_config.get("task_ttls", {})
+        )
+    
+    def _init_db(self):
+        """初始化本地SQLite缓存层"""
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, task TEXT, value TEXT, expires_at REAL, created_at REAL)"
+            )
+            self._db.execute("DELETE FROM llm_cache WHERE expires_at > 0 AND expires_at < ?", (time.time(),))
+            self._db.commit()
+            logger.info(f"✅ LLM本地缓存已启用: {os.path.abspath(self.db_path)}")
+        except Exception as e:
+            logger.error(f"❌ LLM本地缓存初始化失败，仅使用内存缓存: {e}")
+            self._db = None
+    
+    @staticmethod
+    def normalize_prompt(messages: List[Tuple[str, str]]) -> str:
+        """归一化提示词：合并空白字符，保留消息角色"""
+        return "\n".join(f"{role}:{WHITESPACE_PATTERN.sub(' ', content or '').strip()}" for role, content in messages)
+    
+    def make_key(self, messages: Any, model: str, temperature: float) -> str:
+        """生成缓存键"""
+        raw = json.dumps([self.normalize_prompt(to_message_pairs(messages)), model, round(float(temperature), 3)], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def get_ttl(self, task: Optional[str]) -> int:
+        """获取任务的缓存时间，未配置的任务不缓存"""
+        if not task:
+            return 0
+        return int(self.task_ttls.get(task, 0))
+    
+    def is_cacheable(self, task: Optional[str]) -> bool:
+        """判断任务是否启用缓存"""
+        return self.enabled and self.get_ttl(task) > 0
+    
+    def get(self, task: str, key: str) -> Optional[str]:
+        """
+        查询缓存，依次查询内存层和本地层
+        
+        Args:
+            task: 任务名
+            key: 缓存键
+        
+        Returns:
+            缓存的响应内容，未命中返回None
+        """
+        if not self.is_cacheable(task):
+            return None
+        
+        hit, value = self.memory.get(key)
+        if hit:
+            self._record(task, "memory_hits")
+            return value
+        
+        value, expires_at = self._get_from_disk(key)
+        if value is not None:
+            self._record(task, "disk_hits")
+            ttl = expires_at - time.time() if expires_at else 0
+            self.memory.set(key, value, ttl)
+            return value
+        
+        self._record(task, "misses")
+        return None
+    
+    async def aget(self, task: str, key: str) -> Optional[str]:
+        """查询缓存（异步调用方使用，本地层的SQLite读取在线程中执行，不阻塞事件循环）"""
+        if not self.is_cacheable(task):
+            return None
+        
+        hit, value = self.memory.get(key)
+        if hit:
+            self._record(task, "memory_hits")
+            return value
+        
+        if self._db is not None:
+            value, expires_at = await asyncio.to_thread(self._get_from_disk, key)
+            if value is not None:
+                self._record(task, "disk_hits")
+                ttl = expires_at - time.time() if expires_at else 0
+                self.memory.set(key, value, ttl)
+                return value
+        
+        self._record(task, "misses")
+        return None
+    
+    def set(self, task: str, key: str, value: str):
+        """写入缓存（内存层和本地层）"""
+        ttl = self.get_ttl(task)
+        if not self.enabled or ttl <= 0 or value is None:
+            return
+        
+        self.memory.set(key, value, ttl)
+        self._record(task, "sets")
+        self._write_to_disk(task, key, value, ttl)
+    
+    async def aset(self, task: str, key: str, value: str):
+        """写入缓存（异步调用方使用，本地层的SQLite写入在线程中执行）"""
+        ttl = self.get_ttl(task)
+        if not self.enabled or ttl <= 0 or value is None:
+            return
+        
+        self.memory.set(key, value, ttl)
+        self._record(task, "sets")
+        if self._db is not None:
+            await asyncio.to_thread(self._write_to_disk, task, key, value, ttl)
+    
+    def _write_to_disk(self, task: str, key: str, value: str, ttl: int):
+        """写入本地层"""
+        if self._db is None:
+            return
+        try:
+            now = time.time()
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, task, value, expires_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, task, value, now + ttl, now)
+                )
+                self._db.commit()
+        except Exception as e:
+            self._stats["disk_errors"] += 1
+            logger.warning(f"⚠️ LLM本地缓存写入失败: {e}")
+    
+    def _get_from_disk(self, key: str) -> Tuple[Optional[str], float]:
+        """从本地层读取缓存"""
+        if self._db is None:
+            return None, 0
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if not row:
+                    return None, 0
+                value, expires_at = row
+                if expires_at and expires_at < time.time():
+                    self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                    return None, 0
+                return value, expires_at
+        except Exception as e:
+            self._stats["disk_errors"] += 1
+            logger.warning(f"⚠️ LLM本地缓存读取失败: {e}")
+            return None, 0
+    
+    def _record(self, task: str, counter: str):
+        """记录统计"""
+        self._stats[counter] += 1
+        task_stats = self._task_stats.setdefault(task, {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0})
+        task_stats[counter] += 1
+    
+    def clear(self):
+        """清空所有缓存"""
+        self.memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计
+        
+        Returns:
+            命中、未命中、淘汰等计数
+        """
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            "enabled": self.enabled,
+            "disk_enabled": self._db is not None,
+            **self._stats,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.memory.evictions,
+            "expirations": self.memory.expirations,
+            "memory_entries": len(self.memory),
+            "max_memory_entries": self.memory.max_size,
+            "task_ttls": dict(self.task_ttls),
+            "by_task": {task: dict(stats) for task, stats in self._task_stats.items()}
+        }
+
+
+# 全局缓存实例，LLMService和LLMClient共用
+llm_cache = LLMResponseCache.from_config()
@@ -4,21 +4,21 @@ LLM客户端工具类 - 统一管理LLM调用
 import os
 import json
 import logging
-from typing import Optional, Dict, Any
-from langchain_openai import ChatOpenAI
+from typing import Optional, Dict, Any, Callable, Awaitable
 from langchain_core.messages import SystemMessage, HumanMessage
 
+from .llm_gateway import llm_gateway
+from .llm_admission import LLMOverloadedError
+
 logger = logging.getLogger(__name__)
 
 
 class LLMClient:
-    """LLM客户端类"""
+    """LLM客户端类（LLM调用统一经过llm_gateway）"""
     
     def __init__(self):
-        self._llm_instance = None
         self._config = None
         self._load_config()
-        self._initialize_llm()
     
     def _load_config(self):
         """加载配置文件"""
@@ -31,60 +31,33 @@ class LLMClient:
             logger.error(f"❌ 配置文件加载失败: {e}")
             self._config = {}
     
-    def _initialize_llm(self):
-        """初始化LLM实例"""
-        try:
-            if not self._config or 'llm' not in self._config:
-                logger.error("❌ 配置文件中未找到LLM配置")
-                return
-            
-            # 默认使用gemini配置
-            llm_configs = self._config['llm']
-            
-            # 按优先级选择可用的LLM
-            for provider in ['gemini', 'qwen', 'doubao', 'xai']:
-                if provider in llm_configs:
-                    config = llm_configs[provider]
-                    logger.info(f"🔧 使用LLM配置: {provider}")
-                    
-                    self._llm_instance = ChatOpenAI(
-                        api_key=config['api_key'],
-                        base_url=config['url'],
-                        model=config['model'],
-                        temperature=0.7,
-                        max_tokens=2000,
-                        timeout=30
-                    )
-                    
-                    logger.info(f"✅ LLM客户端初始化成功 - 提供商: {provider}, 模型: {config['model']}")
-                    return
-            
-            logger.error("❌ 未找到可用的LLM配置")
-            
-        except Exception as e:
-            logger.error(f"❌ LLM客户端初始化失败: {e}")
-            self._llm_instance = None
-    
     def get_llm_instance(self):
         """获取LLM实例"""
-        if self._llm_instance is None:
-            self._initialize_llm()
-        return self._llm_instance
+        try:
+            return llm_gateway.get_llm()
+        except ValueError:
+            return None
     
-    async def chat_completion(self, prompt: str, system_message: Optional[str] = None) -> str:
+    async def chat_completion(self, prompt: str, system_message: Optional[str] = None,
+                              task: Optional[str] = None,
+                              on_token: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
         """
         调用LLM进行对话完成
         
         Args:
             prompt: 用户提示词
             system_message: 系统消息（可选）
+            task: 任务名（与提示词模板名一致），可缓存的任务会先查询响应缓存
+            on_token: 增量文本回调（可选），设置后以流式方式调用LLM
             
         Returns:
-            LLM响应
+            LLM完整响应，调用失败时返回兜底文本
+        
+        Raises:
+            LLMOverloadedError: LLM服务过载，由上层返回503
         """
         try:
-            llm = self.get_llm_instance()
-            if llm is None:
+            if not llm_gateway.pool.providers:
                 return "抱歉，LLM服务暂时不可用。"
             
             messages = []
@@ -92,9 +65,13 @@ class LLMClient:
                 messages.append(SystemMessage(content=system_message))
             messages.append(HumanMessage(content=prompt))
             
-            response = await llm.ainvoke(messages)
-            return response.content
+            if on_token:
+                return await llm_gateway.astream(messages, on_token, task=task)
+            return await llm_gateway.ainvoke(messages, task=task)
             
+        except LLMOverloadedError:
+            # 过载时不降级为兜底文本，由上层直接返回503
+            raise
         except Exception as e:
             logger.error(f"❌ LLM调用失败: {e}")
             return "抱歉，LLM服务暂时不可用。"
@@ -117,4 +94,8 @@ class LLMClient:
 
     def is_available(self) -> bool:
         """检查LLM是否可用"""
-        return self._llm_instance is not None 
\ No newline at end of file
+        return bool(llm_gateway.pool.providers)
+
+
+# 创建全局LLM客户端实例
+llm_client = LLMClient()
@@ -0,0 +1,384 @@
+"""
+LLM网关 - 进程内唯一的LLM入口，统一管理HTTP连接池、提供商池、任务预设和响应缓存
+"""
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Type, Union, Callable, Awaitable
+
+import httpx
+from pydantic import BaseModel
+from langchain_core.messages import BaseMessage
+
+from .config_loader import load_config, get_config_section
+from .llm_cache import llm_cache
+from .llm_provider_pool import LLMProviderPool
+from .llm_admission import DEFAULT_TASK_PRIORITIES, DEFAULT_PRIORITY
+from .llm_telemetry import llm_telemetry, TokenUsageHandler
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  安装h2后启用HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# 未配置预设的任务使用的参数
+DEFAULT_PRESET = {"temperature": 0.7, "max_tokens": 2000, "timeout": 30}
+
+# 各任务的默认预设（任务名与提示词模板名一致）
+# 分类、抽取类任务使用低温度和较小的max_tokens，生成类任务保留随机性
+DEFAULT_TASK_PRESETS = {
+    "action_router": {"temperature": 0.0, "max_tokens": 500, "timeout": 15},
+    "turn_planner": {"temperature": 0.0, "max_tokens": 800, "timeout": 20},
+    "move_destination": {"temperature": 0.0, "max_tokens": 300, "timeout": 15},
+    "time_estimation": {"temperature": 0.0, "max_tokens": 200, "timeout": 10},
+    "schedule_update": {"temperature": 0.2, "max_tokens": 1000, "timeout": 30},
+    "npc_dialogue": {"temperature": 0.8, "max_tokens": 800, "timeout": 45},
+    "dialogue_summary": {"temperature": 0.3, "max_tokens": 400, "timeout": 30},
+    "sensory_feedback": {"temperature": 0.7, "max_tokens": 600, "timeout": 30},
+    "dialogue_sensory_feedback": {"temperature": 0.7, "max_tokens": 600, "timeout": 30},
+    "sensory_prefetch": {"temperature": 0.7, "max_tokens": 600, "timeout": 30},
+    "general_response": {"temperature": 0.7, "max_tokens": 800, "timeout": 30},
+}
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+
+
+class LLMGateway:
+    """LLM网关，所有服务共用同一组HTTP连接和LLM实例"""
+    
+    def __init__(self, llm_configs: Dict[str, Dict[str, Any]], gateway_config: Optional[Dict[str, Any]] = None,
+                 pool_config: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            llm_configs: config.json中的llm配置段
+            gateway_config: config.json中的llm_gateway配置段
+            pool_config: config.json中的llm_pool配置段
+        """
+        gateway_config = gateway_config or {}
+        self.presets: Dict[str, Dict[str, Any]] = {
+            task: {**DEFAULT_PRESET, **preset} for task, preset in DEFAULT_TASK_PRESETS.items()
+        }
+        for task, preset in gateway_config.get("presets", {}).items():
+            self.presets[task] = {**self.presets.get(task, DEFAULT_PRESET), **preset}
+        self.priorities: Dict[str, int] = {**DEFAULT_TASK_PRIORITIES, **gateway_config.get("priorities", {})}
+        
+        http2_configured = bool(gateway_config.get("http2", True))
+        if http2_configured and not HTTP2_AVAILABLE:
+            logger.warning("⚠️ LLM网关配置了http2但未安装h2（pip install 'httpx[http2]'），连接池使用HTTP/1.1")
+        self.http2 = http2_configured and HTTP2_AVAILABLE
+        limits = httpx.Limits(
+            max_connections=int(gateway_config.get("max_connections", DEFAULT_MAX_CONNECTIONS)),
+            max_keepalive_connections=int(gateway_config.get("max_keepalive_connections", DEFAULT_MAX_KEEPALIVE_CONNECTIONS)),
+            keepalive_expiry=float(gateway_config.get("keepalive_expiry", DEFAULT_KEEPALIVE_EXPIRY))
+        )
+        timeout = httpx.Timeout(DEFAULT_PRESET["timeout"], connect=DEFAULT_CONNECT_TIMEOUT)
+        self.limits = limits
+        self.async_http_client = httpx.AsyncClient(http2=self.http2, limits=limits, timeout=timeout)
+        self.http_client = httpx.Client(http2=self.http2, limits=limits, timeout=timeout)
+        
+        self._variants: Dict[tuple, Any] = {}
+        self._build_pool(llm_configs, pool_config)
+        
+        # 进行中的请求（按提示词指纹），相同的并发请求共享同一次上游调用
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._singleflight_stats = {"upstream_calls": 0, "coalesced": 0}
+        self._singleflight_by_task: Dict[str, Dict[str, int]] = {}
+    
+    @classmethod
+    def from_config(cls) -> "LLMGateway":
+        """根据config.json创建网关"""
+        return cls(load_config().get("llm", {}), get_config_section("llm_gateway"), get_config_section("llm_pool"))
+    
+    def _build_pool(self, llm_configs: Dict[str, Dict[str, Any]], pool_config: Optional[Dict[str, Any]]):
+        self.pool = LLMProviderPool(llm_configs, pool_config, llm_factory=self._create_chat_openai)
+        self._variants = {}
+        if self.pool.providers:
+            logger.info(f"✅ LLM网关初始化完成 - 提供商: {list(self.pool.providers)}, HTTP/2: {self.http2}")
+        else:
+            logger.error("❌ LLM网关未找到可用的LLM配置")
+    
+    def reload(self):
+        """重新读取配置并重建提供商，HTTP连接池保持不变"""
+        self._build_pool(load_config().get("llm", {}), get_config_section("llm_pool"))
+    
+    def _create_chat_openai(self, name: str, config: Dict[str, Any], timeout: float) -> Any:
+        """创建使用共享HTTP连接池的ChatOpenAI实例"""
+        import openai
+        from langchain_openai import ChatOpenAI
+        
+        client_params = {
+            "api_key": config.get("api_key"),
+            "base_url": config.get("url"),
+            "timeout": timeout,
+            "max_retries": 0  # 重试由提供商池的故障转移负责
+        }
+        return ChatOpenAI(
+            model_name=config.get("model"),
+            openai_api_key=config.get("api_key"),
+            openai_api_base=config.get("url"),
+            temperature=DEFAULT_PRESET["temperature"],
+            max_tokens=DEFAULT_PRESET["max_tokens"],
+            request_timeout=timeout,
+            max_retries=0,
+            client=openai.OpenAI(http_client=self.http_client, **client_params).chat.completions,
+            async_client=openai.AsyncOpenAI(http_client=self.async_http_client, **client_params).chat.completions
+        )
+    
+    def get_preset(self, task: Optional[str]) -> Dict[str, Any]:
+        """获取任务预设（temperature、max_tokens、timeout）"""
+        return self.presets.get(task, DEFAULT_PRESET) if task else DEFAULT_PRESET
+    
+    def get_priority(self, task: Optional[str]) -> int:
+        """获取任务的排队优先级，数值越小越先获得提供商并发名额"""
+        return int(self.priorities.get(task, DEFAULT_PRIORITY)) if task else DEFAULT_PRIORITY
+    
+    def is_overloaded(self) -> bool:
+        """所有可用提供商的并发名额和等待队列都已用完"""
+        return self.pool.is_overloaded()
+    
+    def _variant(self, llm: Any, task: Optional[str]) -> Any:
+        """获取应用了任务预设的LLM实例，复用底层客户端"""
+        preset = self.get_preset(task)
+        key = (id(llm), preset["temperature"], preset["max_tokens"])
+        variant = self._variants.get(key)
+        if variant is None:
+            # copy()会丢弃client字段，因此用同一组客户端重新构造
+            variant = type(llm)(
+                model_name=llm.model_name,
+                openai_api_key=llm.openai_api_key,
+                openai_api_base=llm.openai_api_base,
+                temperature=preset["temperature"],
+                max_tokens=preset["max_tokens"],
+                request_timeout=llm.request_timeout,
+                max_retries=llm.max_retries,
+                client=llm.client,
+                async_client=llm.async_client
+            )
+            self._variants[key] = variant
+        return variant
+    
+    def get_llm(self, preferred: Optional[str] = None, task: Optional[str] = None) -> Any:
+        """
+        获取LLM实例（用于同步调用或自定义调用链）
+        
+        Args:
+            preferred: 优先使用的提供商
+            task: 任务名，决定预设参数
+        
+        Returns:
+            当前最健康的提供商的LLM实例
+        """
+        candidates = self.pool.rank_providers(preferred) or list(self.pool.providers.values())
+        if not candidates:
+            raise ValueError("没有可用的LLM提供商配置")
+        return self._variant(candidates[0].llm, task)
+    
+    def _cache_key(self, messages: Any, task: Optional[str], suffix: str = "") -> str:
+        return llm_cache.make_key(messages, self.pool.model_signature + suffix, self.get_preset(task)["temperature"])
+    
+    @staticmethod
+    def _telemetry(task: Optional[str]) -> tuple:
+        """
+        为一次网关调用创建遥测钩子
+        
+        Returns:
+            (token用量回调, 提供商池每次尝试结束后的回调)
+        """
+        usage = TokenUsageHandler()
+        
+        def on_attempt(attempt: Dict[str, Any]):
+            llm_telemetry.record(task, **attempt, **usage.take())
+        
+        return usage, on_attempt
+    
+    async def _singleflight(self, task: Optional[str], key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        合并相同的进行中请求：第一个请求发起上游调用，其余请求等待并共享其结果
+        
+        上游调用在独立的任务中执行，发起者被取消时不影响其他等待者
+        
+        Args:
+            task: 任务名（用于统计）
+            key: 请求指纹
+            factory: 发起上游调用的函数
+            
+        Returns:
+            上游调用结果
+        """
+        task_stats = self._singleflight_by_task.setdefault(task or "default", {"upstream_calls": 0, "coalesced": 0})
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self._singleflight_stats["coalesced"] += 1
+            task_stats["coalesced"] += 1
+            logger.info(f"🔗 合并进行中的LLM请求: {task}")
+            return await asyncio.shield(in_flight)
+        
+        self._singleflight_stats["upstream_calls"] += 1
+        task_stats["upstream_calls"] += 1
+        in_flight = asyncio.ensure_future(factory())
+        self._in_flight[key] = in_flight
+        
+        def on_done(done: asyncio.Task):
+            if self._in_flight.get(key) is done:
+                del self._in_flight[key]
+            if not done.cancelled():
+                done.exception()  # 标记异常已读取，避免无人等待时告警
+        
+        in_flight.add_done_callback(on_done)
+        return await asyncio.shield(in_flight)
+    
+    async def ainvoke(self, messages: Union[str, List[BaseMessage]], task: Optional[str] = None,
+                      parser: Any = None, preferred: Optional[str] = None) -> Any:
+        """
+        调用LLM，对可缓存的任务先查询响应缓存
+        
+        Args:
+            messages: 提示词或消息列表
+            task: 任务名（与提示词模板名一致），决定预设参数和缓存时间
+            parser: 可选的输出解析器（如JsonOutputParser），解析失败的响应不会被缓存
+            preferred: 优先使用的提供商
+        
+        Returns:
+            响应内容，提供parser时返回解析结果
+        """
+        cache_key = self._cache_key(messages, task)
+        cached = await llm_cache.aget(task, cache_key)
+        if cached is not None:
+            logger.info(f"💾 LLM缓存命中: {task}")
+            llm_telemetry.record(task, "cache_hit")
+            return parser.parse(cached) if parser else cached
+        
+        async def call_upstream() -> str:
+            usage, on_attempt = self._telemetry(task)
+            response = await self.pool.invoke(
+                lambda llm: self._variant(llm, task).ainvoke(messages, config={"callbacks": [usage]}),
+                preferred=preferred,
+                timeout=self.get_preset(task)["timeout"],
+                priority=self.get_priority(task),
+                task=task,
+                on_attempt=on_attempt
+            )
+            return response.content if hasattr(response, "content") else str(response)
+        
+        content = await self._singleflight(task, f"{task}:{cache_key}", call_upstream)
+        result = parser.parse(content) if parser else content
+        await llm_cache.aset(task, cache_key, content)
+        return result
+    
+    async def ainvoke_structured(self, messages: List[BaseMessage], schema: Type[BaseModel],
+                                 task: Optional[str] = None, preferred: Optional[str] = None) -> BaseModel:
+        """
+        以结构化输出方式调用LLM，对可缓存的任务先查询响应缓存
+        
+        Args:
+            messages: 消息列表
+            schema: 输出的pydantic模型
+            task: 任务名
+            preferred: 优先使用的提供商
+        
+        Returns:
+            schema实例
+        """
+        cache_key = self._cache_key(messages, task, f":{schema.__name__}")
+        cached = await llm_cache.aget(task, cache_key)
+        if cached is not None:
+            logger.info(f"💾 LLM缓存命中: {task}")
+            llm_telemetry.record(task, "cache_hit")
+            return schema.model_validate_json(cached)
+        
+        usage, on_attempt = self._telemetry(task)
+        result = await self._singleflight(task, f"{task}:{cache_key}", lambda: self.pool.invoke(
+            lambda llm: self._variant(llm, task).with_structured_output(schema).ainvoke(
+                messages, config={"callbacks": [usage]}
+            ),
+            preferred=preferred,
+            timeout=self.get_preset(task)["timeout"],
+            priority=self.get_priority(task),
+            task=task,
+            on_attempt=on_attempt
+        ))
+        await llm_cache.aset(task, cache_key, result.model_dump_json())
+        return result
+    
+    async def astream(self, messages: List[BaseMessage], on_token: Callable[[str], Awaitable[None]],
+                      task: Optional[str] = None, preferred: Optional[str] = None) -> str:
+        """
+        流式调用LLM，每收到一段文本调用一次on_token（每个调用方需要自己的增量文本，流式请求不做合并）
+        
+        Args:
+            messages: 消息列表
+            on_token: 增量文本回调
+            task: 任务名
+            preferred: 优先使用的提供商
+        
+        Returns:
+            完整响应文本
+        """
+        cache_key = self._cache_key(messages, task)
+        cached = await llm_cache.aget(task, cache_key)
+        if cached is not None:
+            logger.info(f"💾 LLM缓存命中: {task}")
+            llm_telemetry.record(task, "cache_hit")
+            await on_token(cached)
+            return cached
+        
+        chunks = []
+        usage, on_attempt = self._telemetry(task)
+        
+        async def call(llm) -> str:
+            async for chunk in self._variant(llm, task).astream(messages, config={"callbacks": [usage]}):
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    await on_token(chunk.content)
+            return "".join(chunks)
+        
+        # 已经推送了部分内容时不能再切换提供商重新生成
+        content = await self.pool.invoke(
+            call,
+            preferred=preferred,
+            can_failover=lambda: not chunks,
+            timeout=self.get_preset(task)["timeout"],
+            priority=self.get_priority(task),
+            task=task,
+            on_attempt=on_attempt
+        )
+        await llm_cache.aset(task, cache_key, content)
+        return content
+    
+    async def aclose(self):
+        """关闭共享的HTTP连接池"""
+        await self.async_http_client.aclose()
+        self.http_client.close()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取网关统计
+        
+        Returns:
+            连接池配置、HTTP/2状态、请求合并计数、任务预设和排队优先级
+        """
+        return {
+            "http2": self.http2,
+            "http2_available": HTTP2_AVAILABLE,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "providers": list(self.pool.providers),
+            "llm_variants": len(self._variants),
+            "singleflight": {
+                **self._singleflight_stats,
+                "in_flight": len(self._in_flight),
+                "by_task": {task: dict(stats) for task, stats in self._singleflight_by_task.items()}
+            },
+            "presets": {task: dict(preset) for task, preset in self.presets.items()},
+            "priorities": dict(self.priorities)
+        }
+
+
+# 全局LLM网关，所有服务通过它调用LLM
+llm_gateway = LLMGateway.from_config()
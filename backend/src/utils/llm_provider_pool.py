@@ -0,0 +1,359 @@
+"""
+LLM提供商池 - 按健康度路由请求，熔断连续失败的提供商并自动故障转移
+"""
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+from .llm_admission import AdmissionQueue, LLMOverloadedError, DEFAULT_MAX_QUEUE, DEFAULT_MAX_QUEUE_WAIT, DEFAULT_PRIORITY
+
+logger = logging.getLogger(__name__)
+
+# 提供商默认优先级（与config.json中llm配置的键一致）
+DEFAULT_PROVIDER_ORDER = ['gemini', 'qwen', 'doubao', 'xai']
+
+DEFAULT_WEIGHT = 1.0
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_REQUEST_TIMEOUT = 60.0
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN_SECONDS = 30.0
+DEFAULT_WINDOW_SIZE = 50
+# 随机探测其他提供商的比例，让变慢后恢复的提供商能重新获得延迟样本
+DEFAULT_EXPLORE_RATIO = 0.05
+
+
+class LLMProvider:
+    """单个LLM提供商及其滚动健康统计"""
+    
+    def __init__(self, name: str, config: Dict[str, Any], llm: Any, weight: float = DEFAULT_WEIGHT,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                 window_size: int = DEFAULT_WINDOW_SIZE, max_queue: int = DEFAULT_MAX_QUEUE,
+                 max_queue_wait: float = DEFAULT_MAX_QUEUE_WAIT):
+        self.name = name
+        self.model = config.get("model", name)
+        self.llm = llm
+        self.weight = max(float(weight), 0.01)
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.timeout = float(timeout)
+        self.admission = AdmissionQueue(name, self.max_concurrency, max_queue, max_queue_wait)
+        self.latencies: deque = deque(maxlen=window_size)
+        self.outcomes: deque = deque(maxlen=window_size)
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.circuit_open_until = 0.0
+        self.half_open_trial = False
+        self.total_requests = 0
+        self.total_failures = 0
+        self.circuit_trips = 0
+    
+    @property
+    def avg_latency(self) -> float:
+        """窗口内平均延迟（秒），没有样本时为0，保证新提供商会先被尝试"""
+        if not self.latencies:
+            return 0.0
+        return sum(self.latencies) / len(self.latencies)
+    
+    @property
+    def p95_latency(self) -> float:
+        """窗口内P95延迟（秒）"""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    
+    @property
+    def error_rate(self) -> float:
+        """窗口内错误率"""
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+    
+    @property
+    def circuit_state(self) -> str:
+        """熔断器状态：closed / open / half_open"""
+        if self.circuit_open_until == 0:
+            return "closed"
+        if time.monotonic() < self.circuit_open_until:
+            return "open"
+        return "half_open"
+    
+    def is_available(self) -> bool:
+        """是否可以接收请求（熔断打开时不可用，半开时只放行一个探测请求）"""
+        state = self.circuit_state
+        if state == "open":
+            return False
+        if state == "half_open":
+            return not self.half_open_trial
+        return True
+    
+    def score(self) -> float:
+        """健康度评分，越小越优先：延迟×错误率惩罚×负载惩罚÷权重"""
+        load = 1 + self.in_flight / self.max_concurrency
+        return self.avg_latency * (1 + 4 * self.error_rate) * load / self.weight
+    
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        if self.circuit_open_until:
+            logger.info(f"✅ LLM提供商 {self.name} 恢复，熔断器关闭")
+        self.circuit_open_until = 0.0
+    
+    def record_failure(self, failure_threshold: int, cooldown_seconds: float):
+        self.outcomes.append(False)
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        if self.circuit_state == "half_open" or self.consecutive_failures >= failure_threshold:
+            self.circuit_open_until = time.monotonic() + cooldown_seconds
+            self.circuit_trips += 1
+            logger.warning(f"⚡ LLM提供商 {self.name} 连续失败{self.consecutive_failures}次，熔断{cooldown_seconds}秒")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "weight": self.weight,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "admission": self.admission.get_stats(),
+            "circuit_state": self.circuit_state,
+            "consecutive_failures": self.consecutive_failures,
+            "circuit_trips": self.circuit_trips,
+            "avg_latency": round(self.avg_latency, 3) if self.latencies else None,
+            "p95_latency": round(self.p95_latency, 3) if self.latencies else None,
+            "error_rate": round(self.error_rate, 4),
+            "total_requests": self.total_requests,
+            "total_failures": self.total_failures,
+            "score": round(self.score(), 4)
+        }
+
+
+class LLMProviderPool:
+    """LLM提供商池，按健康度选择提供商并在失败时故障转移"""
+    
+    def __init__(self, llm_configs: Dict[str, Dict[str, Any]], pool_config: Optional[Dict[str, Any]],
+                 llm_factory: Callable[[str, Dict[str, Any], float], Any]):
+        """
+        Args:
+            llm_configs: config.json中的llm配置段
+            pool_config: config.json中的llm_pool配置段
+            llm_factory: 创建LLM实例的函数(提供商名, 配置, 超时)
+        """
+        pool_config = pool_config or {}
+        self.failure_threshold = int(pool_config.get("failure_threshold", DEFAULT_FAILURE_THRESHOLD))
+        self.cooldown_seconds = float(pool_config.get("cooldown_seconds", DEFAULT_COOLDOWN_SECONDS))
+        self.explore_ratio = float(pool_config.get("explore_ratio", DEFAULT_EXPLORE_RATIO))
+        self.llm_factory = llm_factory
+        self.failovers = 0
+        self.exhausted = 0
+        self.overloaded = 0
+        
+        provider_settings = pool_config.get("providers", {})
+        default_timeout = float(pool_config.get("request_timeout", DEFAULT_REQUEST_TIMEOUT))
+        window_size = int(pool_config.get("window_size", DEFAULT_WINDOW_SIZE))
+        default_max_queue = int(pool_config.get("max_queue", DEFAULT_MAX_QUEUE))
+        max_queue_wait = float(pool_config.get("max_queue_wait", DEFAULT_MAX_QUEUE_WAIT))
+        
+        # 先按默认优先级，再按配置顺序排列，评分相同时靠前的优先
+        names = [name for name in DEFAULT_PROVIDER_ORDER if name in llm_configs]
+        names += [name for name in llm_configs if name not in names]
+        
+        self.providers: Dict[str, LLMProvider] = {}
+        for name in names:
+            settings = provider_settings.get(name, {})
+            if settings.get("enabled", True) is False:
+                continue
+            timeout = float(settings.get("timeout", default_timeout))
+            try:
+                llm = self.llm_factory(name, llm_configs[name], timeout)
+            except Exception as e:
+                logger.error(f"❌ LLM提供商 {name} 初始化失败: {e}")
+                continue
+            self.providers[name] = LLMProvider(
+                name, llm_configs[name], llm,
+                weight=settings.get("weight", DEFAULT_WEIGHT),
+                max_concurrency=settings.get("max_concurrency", DEFAULT_MAX_CONCURRENCY),
+                timeout=timeout,
+                window_size=window_size,
+                max_queue=settings.get("max_queue", default_max_queue),
+                max_queue_wait=max_queue_wait
+            )
+    
+    @property
+    def model_signature(self) -> str:
+        """池中所有模型的标识，用作响应缓存键的一部分"""
+        return "pool:" + "|".join(provider.model for provider in self.providers.values())
+    
+    def rank_providers(self, preferred: Optional[str] = None) -> List[LLMProvider]:
+        """
+        按健康度排序可用的提供商
+        
+        Args:
+            preferred: 优先尝试的提供商（可用时排在最前）
+        
+        Returns:
+            排序后的提供商列表，未饱和的排在饱和的前面
+        """
+        available = [provider for provider in self.providers.values() if provider.is_available()]
+        available.sort(key=lambda provider: (provider.admission.is_full, provider.in_flight >= provider.max_concurrency,
+                                             provider.score()))
+        if preferred and preferred in self.providers:
+            preferred_provider = self.providers[preferred]
+            if preferred_provider in available:
+                available.remove(preferred_provider)
+                available.insert(0, preferred_provider)
+        return available
+    
+    def is_overloaded(self) -> bool:
+        """所有可用提供商的并发名额和等待队列都已用完"""
+        candidates = self.rank_providers()
+        return bool(candidates) and all(provider.admission.is_full for provider in candidates)
+    
+    def retry_after(self) -> float:
+        """过载时建议客户端等待的秒数"""
+        estimates = [provider.admission.estimate_wait(provider.avg_latency) for provider in self.providers.values()]
+        return max(min(estimates), 1.0) if estimates else 1.0
+    
+    async def invoke(self, call: Callable[[Any], Awaitable[Any]], preferred: Optional[str] = None,
+                     can_failover: Optional[Callable[[], bool]] = None, timeout: Optional[float] = None,
+                     priority: int = DEFAULT_PRIORITY, task: Optional[str] = None,
+                     on_attempt: Optional[Callable[[Dict[str, Any]], None]] = None) -> Any:
+        """
+        在最健康的提供商上执行调用，失败时依次故障转移
+        
+        Args:
+            call: 接收LLM实例并返回结果的异步函数
+            preferred: 优先尝试的提供商
+            can_failover: 失败后是否允许切换提供商（如流式输出已推送部分内容时不允许）
+            timeout: 单次调用超时（秒），不超过提供商的超时配置
+            priority: 排队优先级，数值越小越先获得并发名额
+            task: 任务名，用于统计排队时间
+            on_attempt: 每次尝试结束后的回调，参数包含provider、model、outcome、latency、queue_time、error
+        
+        Returns:
+            调用结果
+        
+        Raises:
+            LLMOverloadedError: 所有尝试的提供商都排队已满或等待超时
+        """
+        if not self.providers:
+            raise ValueError("没有可用的LLM提供商配置")
+        
+        candidates = self.rank_providers(preferred)
+        if not preferred and len(candidates) > 1 and random.random() < self.explore_ratio:
+            candidates.insert(0, candidates.pop(random.randrange(1, len(candidates))))
+        if not candidates:
+            # 全部熔断时，仍尝试最早恢复的提供商，避免请求直接失败
+            candidates = sorted(self.providers.values(), key=lambda provider: provider.circuit_open_until)[:1]
+        
+        last_error: Optional[Exception] = None
+        overload_errors: List[LLMOverloadedError] = []
+        for attempt, provider in enumerate(candidates):
+            if attempt > 0:
+                self.failovers += 1
+                logger.warning(f"🔀 LLM故障转移: {candidates[attempt - 1].name} -> {provider.name}")
+            try:
+                return await self._invoke_provider(provider, call, timeout, priority, task, on_attempt)
+            except LLMOverloadedError as e:
+                # 排队已满不代表提供商不健康，不计入失败，直接尝试下一个
+                overload_errors.append(e)
+                logger.warning(f"🚦 LLM提供商 {provider.name} 过载: {e}")
+            except Exception as e:
+                last_error = e
+                logger.warning(f"⚠️ LLM提供商 {provider.name} 调用失败: {e}")
+                if can_failover and not can_failover():
+                    raise
+        
+        if last_error is None and overload_errors:
+            self.overloaded += 1
+            raise LLMOverloadedError("所有LLM提供商都已过载", min(e.retry_after for e in overload_errors))
+        self.exhausted += 1
+        raise last_error
+    
+    async def _invoke_provider(self, provider: LLMProvider, call: Callable[[Any], Awaitable[Any]],
+                               timeout: Optional[float] = None, priority: int = DEFAULT_PRIORITY,
+                               task: Optional[str] = None,
+                               on_attempt: Optional[Callable[[Dict[str, Any]], None]] = None) -> Any:
+        """在指定提供商上执行一次调用并记录健康统计"""
+        timeout = min(timeout, provider.timeout) if timeout else provider.timeout
+        queued_at = time.perf_counter()
+        queue_time: Optional[float] = None
+        is_trial = False
+        
+        try:
+            # 半开时在排队之前认领唯一的探测名额：检查和认领之间没有await，并发请求不会同时成为探测请求
+            if provider.circuit_state == "half_open":
+                if provider.half_open_trial:
+                    raise LLMOverloadedError(f"{provider.name} 熔断恢复探测中", provider.avg_latency)
+                provider.half_open_trial = True
+                is_trial = True
+            
+            async with provider.admission.slot(priority, task, provider.avg_latency):
+                queue_time = time.perf_counter() - queued_at
+                provider.in_flight += 1
+                provider.total_requests += 1
+                started = time.perf_counter()
+                try:
+                    result = await asyncio.wait_for(call(provider.llm), timeout=timeout)
+                    latency = time.perf_counter() - started
+                    provider.record_success(latency)
+                    self._report_attempt(on_attempt, provider, "success", latency, queue_time)
+                    return result
+                except asyncio.CancelledError:
+                    self._report_attempt(on_attempt, provider, "cancelled", time.perf_counter() - started, queue_time)
+                    raise
+                except Exception as e:
+                    provider.record_failure(self.failure_threshold, self.cooldown_seconds)
+                    is_timeout = isinstance(e, asyncio.TimeoutError)
+                    self._report_attempt(on_attempt, provider, "timeout" if is_timeout else "error",
+                                         time.perf_counter() - started, queue_time, e)
+                    if is_timeout:
+                        raise asyncio.TimeoutError(f"{provider.name} 超时 ({timeout}s)")
+                    raise
+                finally:
+                    provider.in_flight -= 1
+        except LLMOverloadedError as e:
+            if queue_time is None:
+                # 未获得并发名额：排队已满、等待超时或探测名额已被占用
+                self._report_attempt(on_attempt, provider, "overloaded", 0.0, time.perf_counter() - queued_at, e)
+            raise
+        finally:
+            if is_trial:
+                provider.half_open_trial = False
+    
+    @staticmethod
+    def _report_attempt(on_attempt: Optional[Callable[[Dict[str, Any]], None]], provider: LLMProvider, outcome: str,
+                        latency: float, queue_time: float, error: Optional[Exception] = None):
+        if on_attempt is None:
+            return
+        try:
+            on_attempt({
+                "provider": provider.name,
+                "model": provider.model,
+                "outcome": outcome,
+                "latency": latency,
+                "queue_time": queue_time,
+                "error": str(error) if error else None
+            })
+        except Exception as e:
+            logger.warning(f"⚠️ LLM调用回调失败: {e}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取提供商池统计
+        
+        Returns:
+            各提供商的延迟、错误率、熔断状态和故障转移次数
+        """
+        return {
+            "providers": {name: provider.get_stats() for name, provider in self.providers.items()},
+            "ranking": [provider.name for provider in self.rank_providers()],
+            "failovers": self.failovers,
+            "exhausted": self.exhausted,
+            "overloaded": self.overloaded,
+            "failure_threshold": self.failure_threshold,
+            "cooldown_seconds": self.cooldown_seconds
+        }
+
@@ -0,0 +1,257 @@
+"""
+LLM调用遥测 - 按提示词模板、模型和提供商汇总延迟、排队时间、token用量和调用结果
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Sequence
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .config_loader import get_config_section
+
+# 延迟和排队时间直方图的桶上界（秒）
+DEFAULT_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+DEFAULT_RECENT_CALLS = 200
+# 没有任务名的调用归入的模板名
+UNTAGGED_TEMPLATE = "untagged"
+
+# 当前请求的调用明细（仅在capture()范围内收集）
+_request_calls: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("llm_request_calls", default=None)
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """从LLM回调中读取提供商返回的token用量（流式调用通常不返回用量）"""
+    
+    def __init__(self):
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+    
+    def on_llm_end(self, response: Any, **kwargs: Any):
+        usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        if prompt_tokens is None:
+            # 新版本langchain把用量放在消息的usage_metadata中
+            for generations in getattr(response, "generations", None) or []:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    if metadata:
+                        prompt_tokens = (prompt_tokens or 0) + metadata.get("input_tokens", 0)
+                        completion_tokens = (completion_tokens or 0) + metadata.get("output_tokens", 0)
+        if prompt_tokens is not None:
+            self.prompt_tokens = (self.prompt_tokens or 0) + int(prompt_tokens)
+            self.completion_tokens = (self.completion_tokens or 0) + int(completion_tokens or 0)
+    
+    def take(self) -> Dict[str, Optional[int]]:
+        """取出已记录的用量并清零（每次尝试单独计数）"""
+        usage = {"prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens}
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        return usage
+
+
+class Histogram:
+    """固定桶直方图，分位数按桶上界估算"""
+    
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = sorted(float(bound) for bound in buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+    
+    def quantile(self, q: float) -> Optional[float]:
+        """估算分位数：返回累计数量达到q的桶的上界，落在最后一个桶时返回最大值"""
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for i, bound in enumerate(self.buckets):
+            cumulative += self.counts[i]
+            if cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+    
+    def get_stats(self) -> Dict[str, Any]:
+        labels = [f"<={bound:g}" for bound in self.buckets] + [f">{self.buckets[-1]:g}" if self.buckets else "all"]
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 4),
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+
+class CallAggregate:
+    """一组调用（同一模板、模型或提供商）的汇总"""
+    
+    def __init__(self, buckets: Sequence[float]):
+        self.calls = 0
+        self.outcomes: Dict[str, int] = {}
+        self.latency = Histogram(buckets)
+        self.queue_time = Histogram(buckets)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.tokens_reported = 0
+    
+    def add(self, record: Dict[str, Any]):
+        self.calls += 1
+        self.outcomes[record["outcome"]] = self.outcomes.get(record["outcome"], 0) + 1
+        if record["outcome"] == "cache_hit":
+            return
+        self.latency.observe(record["latency"])
+        self.queue_time.observe(record["queue_time"])
+        if record.get("prompt_tokens") is not None:
+            self.tokens_reported += 1
+            self.prompt_tokens += record["prompt_tokens"]
+            self.completion_tokens += record.get("completion_tokens") or 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        errors = sum(count for outcome, count in self.outcomes.items() if outcome not in ("success", "cache_hit"))
+        return {
+            "calls": self.calls,
+            "outcomes": dict(self.outcomes),
+            "error_rate": round(errors / self.calls, 4) if self.calls else 0.0,
+            "latency": self.latency.get_stats(),
+            "queue_time": self.queue_time.get_stats(),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "tokens_reported": self.tokens_reported
+        }
+
+
+class LLMTelemetry:
+    """进程内LLM调用遥测，每次提供商尝试和缓存命中都记录一条"""
+    
+    def __init__(self, telemetry_config: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            telemetry_config: config.json中的llm_telemetry配置段，不提供时读取配置文件
+        """
+        if telemetry_config is None:
+            telemetry_config = get_config_section("llm_telemetry")
+        self.enabled = telemetry_config.get("enabled", True)
+        # 开启后 /api/process_action 的响应附带本次行动的LLM调用明细
+        self.debug = telemetry_config.get("debug", False)
+        self.buckets = tuple(telemetry_config.get("latency_buckets", DEFAULT_LATENCY_BUCKETS))
+        self.recent: deque = deque(maxlen=int(telemetry_config.get("recent_calls", DEFAULT_RECENT_CALLS)))
+        self.reset()
+    
+    def reset(self):
+        """清空所有汇总"""
+        self.started_at = time.time()
+        self.by_template: Dict[str, CallAggregate] = {}
+        self.by_model: Dict[str, CallAggregate] = {}
+        self.by_provider: Dict[str, CallAggregate] = {}
+        self.recent.clear()
+    
+    def record(self, task: Optional[str], outcome: str, provider: Optional[str] = None, model: Optional[str] = None,
+               latency: float = 0.0, queue_time: float = 0.0, prompt_tokens: Optional[int] = None,
+               completion_tokens: Optional[int] = None, error: Optional[str] = None):
+        """
+        记录一次LLM调用
+        
+        Args:
+            task: 任务名（与提示词模板名一致）
+            outcome: success、error、timeout、overloaded、cancelled或cache_hit
+            provider: 提供商名称
+            model: 模型名称
+            latency: 上游调用耗时（秒，不含排队）
+            queue_time: 等待并发名额的时间（秒）
+            prompt_tokens: 提示词token数（提供商未返回时为None）
+            completion_tokens: 生成token数
+            error: 错误信息
+        """
+        if not self.enabled:
+            return
+        record = {
+            "template": task or UNTAGGED_TEMPLATE,
+            "provider": provider,
+            "model": model,
+            "outcome": outcome,
+            "latency": round(latency, 4),
+            "queue_time": round(queue_time, 4),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "error": error,
+            "timestamp": time.time()
+        }
+        self._aggregate(self.by_template, record["template"]).add(record)
+        if model:
+            self._aggregate(self.by_model, model).add(record)
+        if provider:
+            self._aggregate(self.by_provider, provider).add(record)
+        self.recent.append(record)
+        
+        calls = _request_calls.get()
+        if calls is not None:
+            calls.append(record)
+    
+    def _aggregate(self, groups: Dict[str, CallAggregate], key: str) -> CallAggregate:
+        aggregate = groups.get(key)
+        if aggregate is None:
+            aggregate = groups[key] = CallAggregate(self.buckets)
+        return aggregate
+    
+    @contextmanager
+    def capture(self):
+        """
+        收集当前请求（包括其中创建的异步任务）发起的LLM调用
+        
+        Yields:
+            调用记录列表，范围结束后不再追加
+        """
+        calls: List[Dict[str, Any]] = []
+        token = _request_calls.set(calls)
+        try:
+            yield calls
+        finally:
+            _request_calls.reset(token)
+    
+    @staticmethod
+    def summarize_calls(calls: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """单次请求的调用明细和合计"""
+        return {
+            "calls": [{key: value for key, value in call.items() if key != "timestamp"} for call in calls],
+            "total_latency": round(sum(call["latency"] for call in calls), 4),
+            "total_queue_time": round(sum(call["queue_time"] for call in calls), 4),
+            "prompt_tokens": sum(call["prompt_tokens"] or 0 for call in calls),
+            "completion_tokens": sum(call["completion_tokens"] or 0 for call in calls)
+        }
+    
+    def get_stats(self, recent: int = 20) -> Dict[str, Any]:
+        """
+        获取遥测汇总
+        
+        Args:
+            recent: 附带的最近调用条数
+        
+        Returns:
+            按模板、模型、提供商汇总的统计和最近的调用记录
+        """
+        return {
+            "enabled": self.enabled,
+            "since": self.started_at,
+            "templates": {name: aggregate.get_stats() for name, aggregate in self.by_template.items()},
+            "models": {name: aggregate.get_stats() for name, aggregate in self.by_model.items()},
+            "providers": {name: aggregate.get_stats() for name, aggregate in self.by_provider.items()},
+            "recent": list(self.recent)[-recent:] if recent > 0 else []
+        }
+
+
+# 创建全局LLM遥测实例
+llm_telemetry = LLMTelemetry()
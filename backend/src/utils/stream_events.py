@@ -0,0 +1,88 @@
+"""
+流式事件工具 - 行动处理过程中的增量事件回调和SSE编码
+"""
+import json
+import logging
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+# 事件回调：on_event(事件类型, 事件数据)
+EventCallback = Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]]
+
+# 事件类型
+EVENT_ROUTE = "route"        # 行动路由结果
+EVENT_TOKEN = "token"        # NPC回复的增量文本
+EVENT_MESSAGE = "message"    # 一条完整的游戏消息（移动步骤、五感反馈等）
+EVENT_STATE = "state"        # 最终游戏状态，格式与非流式接口一致
+EVENT_ERROR = "error"        # 处理失败
+EVENT_DONE = "done"          # 流结束
+
+
+async def emit_event(on_event: EventCallback, event_type: str, **data):
+    """
+    发送流式事件，未设置回调时忽略；回调异常不影响行动处理
+    
+    Args:
+        on_event: 事件回调
+        event_type: 事件类型
+        **data: 事件数据
+    """
+    if on_event is None:
+        return
+    try:
+        await on_event(event_type, data)
+    except Exception as e:
+        logger.warning(f"⚠️ 流式事件发送失败 ({event_type}): {e}")
+
+
+def encode_sse(event_type: str, data: Dict[str, Any]) -> str:
+    """
+    编码为SSE数据帧，事件类型放在JSON的type字段中
+    
+    Args:
+        event_type: 事件类型
+        data: 事件数据
+    
+    Returns:
+        SSE数据帧
+    """
+    payload = json.dumps({"type": event_type, **data}, ensure_ascii=False, default=str)
+    return f"event: {event_type}\ndata: {payload}\n\n"
+
+
+class OrderedEventRelay:
+    """
+    按原始顺序转发多个并发任务的事件：排在最前的未完成任务的事件实时转发，
+    其余任务的事件先缓存，前面的任务都完成后再依次转发
+    """
+    
+    def __init__(self, on_event: EventCallback, count: int):
+        self.on_event = on_event
+        self._buffers = [[] for _ in range(count)]
+        self._done = [False] * count
+        self._live = 0
+    
+    def callback(self, index: int) -> EventCallback:
+        """获取第index个任务使用的事件回调"""
+        if self.on_event is None:
+            return None
+        
+        async def relay(event_type: str, data: Dict[str, Any]):
+            if index == self._live:
+                await emit_event(self.on_event, event_type, **data)
+            else:
+                self._buffers[index].append((event_type, data))
+        return relay
+    
+    async def finish(self, index: int):
+        """标记第index个任务完成，并转发已轮到的任务缓存的事件"""
+        self._done[index] = True
+        while self._live < len(self._done) and self._done[self._live]:
+            following = self._live + 1
+            if following < len(self._done):
+                # 转发过程中新到的事件继续进入缓存，全部转发后再切换为实时转发
+                while self._buffers[following]:
+                    event_type, data = self._buffers[following].pop(0)
+                    await emit_event(self.on_event, event_type, **data)
+            self._live = following
@@ -0,0 +1,369 @@
+"""
+本地行动耗时估算器 - 用关键词词表和性格系数估算探索耗时，可从LLM估算样本中学习
+"""
+import os
+import re
+import json
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from .config_loader import get_config_section
+
+logger = logging.getLogger(__name__)
+
+# 默认的估算样本文件位置（backend/cache/time_estimation_samples.jsonl）
+DEFAULT_SAMPLES_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'cache', 'time_estimation_samples.jsonl')
+
+# 估算模式：local只用本地估算；shadow返回本地结果，同时在后台调用LLM对比并记录样本；llm沿用LLM估算
+ESTIMATION_MODES = ("local", "shadow", "llm")
+
+DEFAULT_MINUTES = 3
+DEFAULT_MIN_SAMPLES = 2
+DEFAULT_MAX_OBSERVATIONS = 200
+# 本地结果与LLM结果相差不超过该比例（或1分钟）视为一致
+AGREEMENT_TOLERANCE = 0.2
+
+# 行动关键词词表：(关键词, 基础分钟数)，命中多个时取最长的关键词
+ACTION_LEXICON: List[Tuple[Tuple[str, ...], int]] = [
+    (("看手机", "玩手机", "刷手机", "回消息", "发消息"), 5),
+    (("吃饭", "吃早饭", "吃午饭", "吃晚饭", "吃早餐", "吃午餐", "吃晚餐", "用餐"), 20),
+    (("吃零食", "喝水", "喝茶", "喝咖啡", "喝饮料"), 3),
+    (("洗澡", "淋浴", "冲澡"), 15),
+    (("泡澡",), 30),
+    (("洗脸", "刷牙", "洗漱", "洗手"), 5),
+    (("上厕所",), 5),
+    (("换衣服", "穿衣服", "换鞋"), 5),
+    (("午睡", "小睡", "打盹", "眯一会"), 30),
+    (("睡觉", "睡一觉"), 480),
+    (("休息", "躺一会", "坐一会"), 10),
+    (("发呆",), 5),
+    (("看书", "读书", "阅读"), 20),
+    (("学习", "写作业", "做作业", "复习"), 40),
+    (("玩游戏", "打游戏"), 30),
+    (("看电视",), 30),
+    (("看电影",), 90),
+    (("听音乐", "听歌"), 15),
+    (("做饭", "煮饭", "烹饪", "做菜"), 30),
+    (("打扫", "收拾", "整理"), 15),
+    (("运动", "锻炼", "跑步", "健身"), 30),
+    (("仔细观察", "仔细查看", "仔细检查", "搜索", "翻找"), 7),
+    (("观察", "查看", "检查", "看看", "环顾", "四处看", "打量"), 3),
+    (("快速浏览", "扫视", "瞥"), 1),
+]
+
+# 行动修饰词系数
+ACTION_MODIFIERS: List[Tuple[Tuple[str, ...], float]] = [
+    (("仔细", "详细", "认真", "慢慢"), 1.5),
+    (("快速", "简单", "随便", "匆匆", "稍微"), 0.6),
+]
+
+# 性格系数（与时间估算提示词中的性格影响一致）
+PERSONALITY_FACTORS: List[Tuple[Tuple[str, ...], float]] = [
+    (("急躁", "急性子"), 0.8),
+    (("慢性子", "悠闲"), 1.2),
+    (("细致", "认真"), 1.1),
+]
+
+CHINESE_DIGITS = {"零": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+NUMBER = r"(\d+|[零一二两三四五六七八九十百]+)"
+EXPLICIT_PATTERNS = [
+    (re.compile(NUMBER + r"个半(?:小时|钟头)"), lambda n: n * 60 + 30),
+    (re.compile(r"半(?:个)?(?:小时|钟头)"), lambda n: 30),
+    (re.compile(NUMBER + r"(?:个)?(?:小时|钟头)"), lambda n: n * 60),
+    (re.compile(NUMBER + r"刻钟"), lambda n: n * 15),
+    (re.compile(NUMBER + r"分钟"), lambda n: n),
+]
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def parse_chinese_number(text: str) -> Optional[int]:
+    """解析阿拉伯数字或一百以内的中文数字"""
+    if text.isdigit():
+        return int(text)
+    if "百" in text:
+        hundreds, _, rest = text.partition("百")
+        base = (CHINESE_DIGITS.get(hundreds, 1) if hundreds else 1) * 100
+        rest_value = parse_chinese_number(rest.lstrip("零")) if rest else 0
+        return base + (rest_value or 0)
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        if (tens and tens not in CHINESE_DIGITS) or (ones and ones not in CHINESE_DIGITS):
+            return None
+        return (CHINESE_DIGITS[tens] if tens else 1) * 10 + (CHINESE_DIGITS[ones] if ones else 0)
+    if len(text) == 1 and text in CHINESE_DIGITS:
+        return CHINESE_DIGITS[text]
+    return None
+
+
+def parse_explicit_minutes(action: str) -> Optional[int]:
+    """
+    解析行动中玩家明确指定的时长
+    
+    Args:
+        action: 玩家行动
+    
+    Returns:
+        指定的分钟数，未指定时为None
+    """
+    for pattern, to_minutes in EXPLICIT_PATTERNS:
+        match = pattern.search(action)
+        if not match:
+            continue
+        number = parse_chinese_number(match.group(1)) if match.groups() else 0
+        if number is None:
+            continue
+        return max(1, to_minutes(number))
+    return None
+
+
+def _factor(text: str, table: List[Tuple[Tuple[str, ...], float]], exclude: str = "") -> float:
+    """按词表计算系数，exclude中已包含的词不重复计算"""
+    for words, factor in table:
+        if any(word in text and word not in exclude for word in words):
+            return factor
+    return 1.0
+
+
+def _median(values) -> float:
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return float(ordered[middle])
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+class TimeEstimator:
+    """本地行动耗时估算器"""
+    
+    def __init__(self, mode: str = "local", samples_path: Optional[str] = DEFAULT_SAMPLES_PATH,
+                 learn: bool = True, min_samples: int = DEFAULT_MIN_SAMPLES):
+        """
+        Args:
+            mode: 估算模式（local / shadow / llm）
+            samples_path: LLM估算样本文件，启动时从中学习，为None时不读写样本
+            learn: 是否根据新样本更新估算
+            min_samples: 关键词的学习值生效所需的最少样本数
+        """
+        if mode not in ESTIMATION_MODES:
+            logger.warning(f"⚠️ 未知的时间估算模式 {mode}，使用local")
+            mode = "local"
+        self.mode = mode
+        self.samples_path = samples_path
+        self.learn = learn
+        self.min_samples = max(int(min_samples), 1)
+        self._lock = threading.Lock()
+        # 按关键词组（取第一个关键词为名）和完整行动分别记录去除性格影响后的分钟数
+        self._keyword_observations: Dict[str, deque] = {}
+        self._action_observations: Dict[str, deque] = {}
+        self._stats = {
+            "estimates": 0,
+            "explicit": 0,
+            "learned": 0,
+            "lexicon": 0,
+            "default": 0,
+            "samples": 0,
+            "comparisons": 0,
+            "agreements": 0,
+            "abs_error_total": 0.0
+        }
+        
+        if self.samples_path:
+            self.train(self.load_samples(self.samples_path))
+    
+    @classmethod
+    def from_config(cls) -> "TimeEstimator":
+        """根据config.json中的time_estimation配置创建估算器"""
+        estimation_config = get_config_section("time_estimation")
+        return cls(
+            mode=estimation_config.get("mode", "local"),
+            samples_path=estimation_config.get("samples_path", DEFAULT_SAMPLES_PATH),
+            learn=estimation_config.get("learn", True),
+            min_samples=int(estimation_config.get("min_samples", DEFAULT_MIN_SAMPLES))
+        )
+    
+    @staticmethod
+    def normalize_action(action: str) -> str:
+        return WHITESPACE_PATTERN.sub("", action or "")
+    
+    @staticmethod
+    def personality_factor(personality: str) -> float:
+        return _factor(personality or "", PERSONALITY_FACTORS)
+    
+    @staticmethod
+    def match_lexicon(action: str) -> Optional[Tuple[str, str, int]]:
+        """
+        在词表中查找行动关键词
+        
+        Returns:
+            (关键词组名, 命中的关键词, 基础分钟数)，未命中时为None
+        """
+        best = None
+        for words, minutes in ACTION_LEXICON:
+            for word in words:
+                if word in action and (best is None or len(word) > len(best[1])):
+                    best = (words[0], word, minutes)
+        return best
+    
+    def estimate(self, action: str, personality: str = "") -> Dict[str, Any]:
+        """
+        估算行动耗时
+        
+        Args:
+            action: 玩家行动
+            personality: 玩家性格
+        
+        Returns:
+            {"estimated_minutes": 分钟数, "reason": 估算理由, "source": explicit/learned/lexicon/default}
+        """
+        self._stats["estimates"] += 1
+        action = self.normalize_action(action)
+        
+        # 玩家明确指定的时间优先，不受性格影响
+        explicit = parse_explicit_minutes(action)
+        if explicit is not None:
+            return self._result(explicit, "玩家指定了时间", "explicit")
+        
+        personality_factor = self.personality_factor(personality)
+        learned = self._learned_value(self._action_observations.get(action))
+        if learned is not None:
+            return self._result(learned * personality_factor, "与已学习的行动相同", "learned")
+        
+        matched = self.match_lexicon(action)
+        if matched:
+            group, word, base = matched
+            learned = self._learned_value(self._keyword_observations.get(group))
+            source = "learned" if learned is not None else "lexicon"
+            minutes = (learned if learned is not None else base) * _factor(action, ACTION_MODIFIERS, exclude=word)
+            return self._result(minutes * personality_factor, f"行动包含「{word}」", source)
+        
+        minutes = DEFAULT_MINUTES * _factor(action, ACTION_MODIFIERS)
+        return self._result(minutes * personality_factor, "默认估算", "default")
+    
+    def _result(self, minutes: float, reason: str, source: str) -> Dict[str, Any]:
+        self._stats[source] += 1
+        return {"estimated_minutes": max(1, int(round(minutes))), "reason": reason, "source": source}
+    
+    def _learned_value(self, observations: Optional[deque]) -> Optional[float]:
+        if not observations or len(observations) < self.min_samples:
+            return None
+        return _median(observations)
+    
+    def train(self, samples: List[Dict[str, Any]]) -> int:
+        """
+        从LLM估算样本中学习
+        
+        Args:
+            samples: [{"action": 行动, "personality": 性格, "minutes": LLM估算的分钟数}]
+        
+        Returns:
+            参与学习的样本数
+        """
+        used = 0
+        for sample in samples:
+            if self._observe(sample.get("action", ""), sample.get("personality", ""), sample.get("minutes")):
+                used += 1
+        return used
+    
+    def _observe(self, action: str, personality: str, minutes: Any) -> bool:
+        """记录一个样本（去除性格影响后按完整行动和关键词组分别记录）"""
+        action = self.normalize_action(action)
+        try:
+            minutes = float(minutes)
+        except (TypeError, ValueError):
+            return False
+        if not action or minutes <= 0 or parse_explicit_minutes(action) is not None:
+            return False
+        
+        base = minutes / self.personality_factor(personality)
+        with self._lock:
+            self._action_observations.setdefault(action, deque(maxlen=DEFAULT_MAX_OBSERVATIONS)).append(base)
+            matched = self.match_lexicon(action)
+            if matched:
+                group, word, _ = matched
+                # 关键词组的学习值不含修饰词影响，与词表基础值口径一致
+                self._keyword_observations.setdefault(group, deque(maxlen=DEFAULT_MAX_OBSERVATIONS)).append(
+                    base / _factor(action, ACTION_MODIFIERS, exclude=word)
+                )
+        return True
+    
+    def record_sample(self, action: str, personality: str, minutes: int, source: str = "llm"):
+        """
+        记录一个LLM估算样本：追加到样本文件，并在开启学习时更新估算
+        
+        Args:
+            action: 玩家行动
+            personality: 玩家性格
+            minutes: LLM估算的分钟数
+            source: 样本来源
+        """
+        self._stats["samples"] += 1
+        if self.learn:
+            self._observe(action, personality, minutes)
+        if not self.samples_path:
+            return
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(os.path.abspath(self.samples_path)), exist_ok=True)
+                with open(self.samples_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"action": action, "personality": personality, "minutes": minutes,
+                                        "source": source}, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.error(f"❌ 写入时间估算样本失败: {e}")
+    
+    def record_comparison(self, action: str, personality: str, local_minutes: int, llm_minutes: int):
+        """
+        记录影子模式下本地估算与LLM估算的对比结果
+        
+        Args:
+            action: 玩家行动
+            personality: 玩家性格
+            local_minutes: 本地估算的分钟数
+            llm_minutes: LLM估算的分钟数
+        """
+        error = abs(local_minutes - llm_minutes)
+        self._stats["comparisons"] += 1
+        self._stats["abs_error_total"] += error
+        if error <= max(1, llm_minutes * AGREEMENT_TOLERANCE):
+            self._stats["agreements"] += 1
+        logger.info(f"⏱️ 时间估算对比: {action} 本地={local_minutes}分钟 LLM={llm_minutes}分钟")
+        self.record_sample(action, personality, llm_minutes, source="shadow")
+    
+    @staticmethod
+    def load_samples(samples_path: str) -> List[Dict[str, Any]]:
+        """读取样本文件，文件不存在或行格式错误时跳过"""
+        if not samples_path or not os.path.exists(samples_path):
+            return []
+        samples = []
+        try:
+            with open(samples_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        samples.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        except Exception as e:
+            logger.error(f"❌ 读取时间估算样本失败: {e}")
+        return samples
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取估算统计
+        
+        Returns:
+            各来源的估算次数，以及影子模式下与LLM的平均误差和一致率
+        """
+        comparisons = self._stats["comparisons"]
+        return {
+            "mode": self.mode,
+            **{key: value for key, value in self._stats.items() if key != "abs_error_total"},
+            "mean_abs_error": round(self._stats["abs_error_total"] / comparisons, 2) if comparisons else None,
+            "agreement_rate": round(self._stats["agreements"] / comparisons, 4) if comparisons else None,
+            "learned_actions": len(self._action_observations),
+            "learned_keywords": len(self._keyword_observations)
+        }
+
+
+# 创建全局时间估算器实例
+time_estimator = TimeEstimator.from_config()
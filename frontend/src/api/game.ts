@@ -23,10 +23,12 @@ export interface GameMessage {
 // 消息历史响应
 export interface MessageHistoryResponse {
   messages: GameMessage[];
-  total_count: number;
+  total_count: number | null;  // includeTotal为false时为null
   limit: number;
   offset: number;
-  has_more: boolean;
+  has_more: boolean;           // 分页方向上是否还有消息
+  next_cursor: string | null;  // 获取更新的消息
+  prev_cursor: string | null;  // 获取更早的消息
 }
 
 // 获取故事消息历史的参数
@@ -35,6 +37,10 @@ export interface GetStoryMessagesParams {
   sessionId?: string;
   limit?: number;
   offset?: number;
+  after?: string;          // 游标：获取该游标之后（更新）的消息
+  before?: string;         // 游标：获取该游标之前（更早）的消息
+  latest?: boolean;        // 不指定游标时从最新的消息开始向前分页
+  includeTotal?: boolean;  // 是否返回消息总数，默认返回
 }
 
 // 游戏API类
@@ -51,7 +57,10 @@ export class GameApi {
       storyId: params.storyId,
       sessionId: params.sessionId || 'ALL',
       limit: params.limit || 100,
-      offset: params.offset || 0
+      offset: params.offset || 0,
+      after: params.after,
+      before: params.before,
+      latest: params.latest || false
     });
     
     // 验证token
@@ -71,6 +80,18 @@ export class GameApi {
     if (params.offset) {
       searchParams.append('offset', params.offset.toString());
     }
+    if (params.after) {
+      searchParams.append('after', params.after);
+    }
+    if (params.before) {
+      searchParams.append('before', params.before);
+    }
+    if (params.latest) {
+      searchParams.append('latest', 'true');
+    }
+    if (params.includeTotal === false) {
+      searchParams.append('include_total', 'false');
+    }
     
     const queryString = searchParams.toString();
     const endpoint = `/stories/${params.storyId}/messages${queryString ? `?${queryString}` : ''}`;
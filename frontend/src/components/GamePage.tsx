@@ -69,6 +69,13 @@ export function GamePage() {
   // 使用 useRef 来跟踪是否正在合并，避免重复合并
   const isMergingRef = useRef(false);
 
+  // 消息历史游标：prev用于加载更早的消息，next用于获取行动后新增的消息
+  const historyCursorRef = useRef<{ prev: string | null; next: string | null }>({ prev: null, next: null });
+  // 已加载的历史消息（按时间顺序），行动后只追加新增的消息
+  const historyDialoguesRef = useRef<DialogueEntry[]>([]);
+  const [hasEarlierMessages, setHasEarlierMessages] = useState(false);
+  const [earlierMessagesLoading, setEarlierMessagesLoading] = useState(false);
+
   // 新增：侧边栏宽度控制
   const [sidebarWidth, setSidebarWidth] = useState(280); // 默认280px，比原来的1/3更小
   const [isResizing, setIsResizing] = useState(false);
@@ -201,6 +208,72 @@ export function GamePage() {
     return entries;
   };
 
+  // 获取上次加载之后新增的消息（按游标向后翻页直到没有更多消息），返回已加载的完整历史
+  const fetchNewHistoryDialogues = async (storyId: number, token: string): Promise<DialogueEntry[]> => {
+    let hasMore = true;
+    while (hasMore) {
+      const cursor = historyCursorRef.current.next;
+      // 还没有加载过历史时从最新的消息开始
+      const messagesResponse = await GameApi.getStoryMessages({
+        storyId: storyId,
+        sessionId: undefined,
+        limit: 100,
+        after: cursor || undefined,
+        latest: !cursor,
+        includeTotal: false
+      }, token);
+      
+      messagesResponse.messages.forEach(message => {
+        historyDialoguesRef.current.push(...convertGameMessageToDialogue(message));
+      });
+      historyCursorRef.current = {
+        prev: historyCursorRef.current.prev || messagesResponse.prev_cursor,
+        next: messagesResponse.next_cursor
+      };
+      if (!cursor) {
+        setHasEarlierMessages(messagesResponse.has_more);
+      }
+      hasMore = !!cursor && messagesResponse.has_more;
+    }
+    return [...historyDialoguesRef.current];
+  };
+
+  // 加载更早的消息，插入到对话历史开头
+  const loadEarlierMessages = async () => {
+    const cursor = historyCursorRef.current.prev;
+    const token = localStorage.getItem('token');
+    if (!selectedStoryId || !cursor || !token || earlierMessagesLoading) return;
+    
+    setEarlierMessagesLoading(true);
+    try {
+      const messagesResponse = await GameApi.getStoryMessages({
+        storyId: selectedStoryId,
+        sessionId: undefined,
+        limit: 100,
+        before: cursor,
+        includeTotal: false
+      }, token);
+      
+      const earlierDialogues: DialogueEntry[] = [];
+      messagesResponse.messages.forEach(message => {
+        earlierDialogues.push(...convertGameMessageToDialogue(message));
+      });
+      historyDialoguesRef.current = [...earlierDialogues, ...historyDialoguesRef.current];
+      historyCursorRef.current = { ...historyCursorRef.current, prev: messagesResponse.prev_cursor };
+      setHasEarlierMessages(messagesResponse.has_more);
+      setGameState(prevState => prevState ? {
+        ...prevState,
+        dialogue_history: [...earlierDialogues, ...prevState.dialogue_history]
+      } : null);
+      console.log('✅ [GamePage] 加载更早的消息:', messagesResponse.messages.length);
+    } catch (e: any) {
+      console.error('❌ [GamePage] 加载更早的消息失败:', e);
+      setMessagesError(e.message || '加载更早的消息失败');
+    } finally {
+      setEarlierMessagesLoading(false);
+    }
+  };
+
   // 处理故事按钮点击 - 修改以加载消息历史到主聊天框
   const handleStoryButtonClick = async (story: Story) => {
     console.log('🎮 [GamePage] 选择故事:', story);
@@ -209,6 +282,9 @@ export function GamePage() {
     setMessagesError(null);
     setPendingHistoryDialogues([]);
     setMessageHistory([]);
+    historyCursorRef.current = { prev: null, next: null };
+    historyDialoguesRef.current = [];
+    setHasEarlierMessages(false);
     
     // 先设置故事ID，触发useEffect重新获取游戏状态
     setSelectedStoryId(story.id);
@@ -226,14 +302,20 @@ export function GamePage() {
     
     try {
       console.log('📚 [GamePage] 开始加载故事消息历史...');
+      // 只加载最新的一页，更早的消息按游标分页加载
       const messagesResponse = await GameApi.getStoryMessages({
         storyId: story.id,
         sessionId: undefined, // 获取所有会话的消息
         limit: 100,
-        offset: 0
+        latest: true
       }, token);
       
       setMessageHistory(messagesResponse.messages);
+      historyCursorRef.current = {
+        prev: messagesResponse.prev_cursor,
+        next: messagesResponse.next_cursor
+      };
+      setHasEarlierMessages(messagesResponse.has_more);
       console.log('✅ [GamePage] 消息历史加载成功:', {
         count: messagesResponse.messages.length,
         totalCount: messagesResponse.total_count
@@ -248,6 +330,7 @@ export function GamePage() {
         });
         
         console.log('✅ [GamePage] 历史消息已准备好:', historyDialogues.length);
+        historyDialoguesRef.current = [...historyDialogues];
         
         // 使用一个状态来存储待合并的历史消息
         // 当游戏状态更新后，这些消息会被合并进去
@@ -417,20 +500,9 @@ export function GamePage() {
         try {
           const token = localStorage.getItem('token');
           if (token) {
-            console.log('🔄 [前端] 重新获取完整消息历史...');
-            const messagesResponse = await GameApi.getStoryMessages({
-              storyId: selectedStoryId,
-              sessionId: undefined,
-              limit: 100,
-              offset: 0
-            }, token);
-            
-            // 转换消息为对话格式
-            const fullDialogueHistory: DialogueEntry[] = [];
-            messagesResponse.messages.forEach(message => {
-              const dialogues = convertGameMessageToDialogue(message);
-              fullDialogueHistory.push(...dialogues);
-            });
+            console.log('🔄 [前端] 获取新增的消息...');
+            // 按游标只获取上次加载之后的消息，追加到已加载的历史
+            const fullDialogueHistory = await fetchNewHistoryDialogues(selectedStoryId, token);
             
             // 更新完整的对话历史
             setGameState(prevState => prevState ? {
@@ -534,20 +606,9 @@ export function GamePage() {
         try {
           const token = localStorage.getItem('token');
           if (token) {
-            console.log('🔄 [前端] 重新获取完整消息历史...');
-            const messagesResponse = await GameApi.getStoryMessages({
-              storyId: selectedStoryId,
-              sessionId: undefined,
-              limit: 100,
-              offset: 0
-            }, token);
-            
-            // 转换消息为对话格式
-            const fullDialogueHistory: DialogueEntry[] = [];
-            messagesResponse.messages.forEach(message => {
-              const dialogues = convertGameMessageToDialogue(message);
-              fullDialogueHistory.push(...dialogues);
-            });
+            console.log('🔄 [前端] 获取新增的消息...');
+            // 按游标只获取上次加载之后的消息，追加到已加载的历史
+            const fullDialogueHistory = await fetchNewHistoryDialogues(selectedStoryId, token);
             
             // 更新完整的对话历史
             setGameState(prevState => {
@@ -978,6 +1039,17 @@ export function GamePage() {
           {/* 对话历史区域 - 独立滚动 */}
           <div className="flex-1 overflow-y-auto p-6 pt-4">
             <div className="space-y-3">
+              {hasEarlierMessages && (
+                <div className="text-center">
+                  <button
+                    onClick={loadEarlierMessages}
+                    disabled={earlierMessagesLoading}
+                    className="px-2 py-1 text-blue-600 hover:text-blue-800 text-sm disabled:text-gray-400"
+                  >
+                    {earlierMessagesLoading ? '加载中...' : '加载更早的消息'}
+                  </button>
+                </div>
+              )}
               {gameState && gameState.dialogue_history.length > 0 ? (
                 gameState.dialogue_history.map((entry, index) => renderDialogueEntry(entry, index))
               ) : (